@@ -14,12 +14,17 @@
 ║     [ai]                                                             ║
 ║     ENABLED = true                                                   ║
 ║     GEMINI_API_KEY = "..."                                           ║
-║     MODEL = "gemini-1.5-flash"   # facoltativo                       ║
+║     GEMINI_MODEL = "gemini-1.5-flash"   # facoltativo                ║
+║                                                                      ║
+║  Le chiamate passano da ai_gateway (client riusato, cache delle      ║
+║  risposte, streaming, limite di concorrenza, metriche).              ║
 ╚══════════════════════════════════════════════════════════════════════╝
 """
 
 import streamlit as st
 
+from . import ai_gateway as gateway
+
 _PROMPT = (
     "Sei un assistente clinico per uno studio di optometria comportamentale "
     "e psicologia (metodo PNEV). Ti viene fornito un documento clinico di un "
@@ -38,6 +43,10 @@ _PROMPT = (
 )
 
 
+_NON_CONFIGURATA = ("⚠️ AI non configurata. Aggiungi una chiave nei Secrets sotto [ai] "
+                    "(OPENAI_API_KEY oppure GEMINI_API_KEY).")
+
+
 def ai_disponibile() -> bool:
     try:
         a = st.secrets.get("ai", {})
@@ -50,55 +59,7 @@ def ai_disponibile() -> bool:
 
 def _provider() -> str:
     """Sceglie il motore: Gemini se c'è la sua chiave, altrimenti OpenAI."""
-    a = st.secrets.get("ai", {})
-    if a.get("GEMINI_API_KEY"):
-        return "gemini"
-    if a.get("OPENAI_API_KEY"):
-        return "openai"
-    return ""
-
-
-def _modello() -> str:
-    return str(st.secrets.get("ai", {}).get("MODEL", "gemini-2.0-flash"))
-
-
-# Nomi modello provati in ordine (il primo è quello dei Secrets, se presente).
-# Robusto ai cambi di nome lato Google: prova i candidati finché uno risponde.
-_CANDIDATI = [
-    "gemini-2.0-flash", "gemini-2.5-flash", "gemini-flash-latest",
-    "gemini-1.5-flash-latest", "gemini-1.5-flash", "gemini-2.0-flash-001",
-]
-
-
-def _genera(genai, parts):
-    """Chiama generate_content provando più nomi di modello (gestisce i 404)."""
-    nomi = []
-    scelto = _modello()
-    if scelto:
-        nomi.append(scelto)
-    for n in _CANDIDATI:
-        if n not in nomi:
-            nomi.append(n)
-    ultimo_err = None
-    for nome in nomi:
-        try:
-            model = genai.GenerativeModel(nome)
-            resp = model.generate_content(parts)
-            return (resp.text or "").strip()
-        except Exception as e:
-            ultimo_err = e
-            if "404" in str(e) or "not found" in str(e).lower() \
-                    or "not supported" in str(e).lower():
-                continue
-            raise
-    raise ultimo_err or RuntimeError("Nessun modello Gemini disponibile.")
-
-
-def _configura():
-    import google.generativeai as genai
-    key = st.secrets.get("ai", {}).get("GEMINI_API_KEY", "")
-    genai.configure(api_key=key)
-    return genai
+    return gateway.provider()
 
 
 def _testo_da_pdf(dati: bytes) -> str:
@@ -131,32 +92,33 @@ def genera_testo(prompt: str, sistema: str = "") -> str:
     """Generazione di testo libero (per la diagnosi assistita). Ritorna il testo
     o un messaggio d'errore leggibile (prefissato con '⚠️')."""
     if not ai_disponibile():
-        return ("⚠️ AI non configurata. Aggiungi una chiave nei Secrets sotto [ai] "
-                "(OPENAI_API_KEY oppure GEMINI_API_KEY).")
-    prov = _provider()
+        return _NON_CONFIGURATA
     try:
-        if prov == "openai":
-            from openai import OpenAI
-            a = st.secrets.get("ai", {})
-            client = OpenAI(api_key=a.get("OPENAI_API_KEY", ""))
-            modello = str(a.get("OPENAI_MODEL", "gpt-4o-mini"))
-            msgs = []
-            if sistema:
-                msgs.append({"role": "system", "content": sistema})
-            msgs.append({"role": "user", "content": prompt})
-            resp = client.chat.completions.create(model=modello, messages=msgs,
-                                                  max_tokens=1200)
-            return (resp.choices[0].message.content or "").strip()
-        genai = _configura()
-        parti = ([sistema, prompt] if sistema else [prompt])
-        return _genera(genai, parti)
+        return gateway.completa(prompt, sistema=sistema, max_tokens=1200)
     except Exception as e:
         return f"⚠️ Errore durante la generazione AI: {e}"
 
 
+def genera_testo_stream(prompt: str, sistema: str = "", esito: dict | None = None):
+    """Come genera_testo, ma a pezzi man mano che il modello scrive (da
+    passare a st.write_stream). Gli errori arrivano come ultimo pezzo '⚠️'
+    e, se si passa `esito`, in esito["errore"]: il testo già arrivato è
+    parziale e non va trattato come una risposta completa."""
+    if not ai_disponibile():
+        if esito is not None:
+            esito["errore"] = "AI non configurata"
+        yield _NON_CONFIGURATA
+        return
+    try:
+        yield from gateway.stream(prompt, sistema=sistema, max_tokens=1200)
+    except Exception as e:
+        if esito is not None:
+            esito["errore"] = f"{type(e).__name__}: {e}"
+        yield f"\n\n⚠️ Errore durante la generazione AI: {e}"
+
+
 def _estrai_gemini(dati: bytes, mime: str, nome: str) -> str:
     mime = (mime or "").lower()
-    genai = _configura()
     if mime.startswith("image/") or "pdf" in mime or nome.lower().endswith(".pdf"):
         tipo_mime = mime if mime else ("application/pdf"
                                        if nome.lower().endswith(".pdf") else "image/jpeg")
@@ -165,37 +127,19 @@ def _estrai_gemini(dati: bytes, mime: str, nome: str) -> str:
             if len(testo) < 40:
                 return ("⚠️ PDF troppo grande e senza testo leggibile. "
                         "Ricaricalo come foto della pagina.")
-            return _genera(genai, [_PROMPT, testo[:12000]])
-        return _genera(genai, [_PROMPT, {"mime_type": tipo_mime, "data": dati}])
+            return gateway.completa(testo[:12000], sistema=_PROMPT, max_tokens=900)
+        return gateway.completa(_PROMPT, allegato=(dati, tipo_mime), max_tokens=900)
     return "⚠️ Formato non supportato per l'analisi AI (usa PDF o foto)."
 
 
 def _estrai_openai(dati: bytes, mime: str, nome: str) -> str:
-    import base64
-    from openai import OpenAI
-    a = st.secrets.get("ai", {})
-    client = OpenAI(api_key=a.get("OPENAI_API_KEY", ""))
-    modello = str(a.get("OPENAI_MODEL", "gpt-4o-mini"))
     mime = (mime or "").lower()
     if mime.startswith("image/"):
-        b64 = base64.b64encode(dati).decode()
-        resp = client.chat.completions.create(
-            model=modello,
-            messages=[{"role": "user", "content": [
-                {"type": "text", "text": _PROMPT},
-                {"type": "image_url",
-                 "image_url": {"url": f"data:{mime};base64,{b64}"}}]}],
-            max_tokens=900)
-        return (resp.choices[0].message.content or "").strip()
+        return gateway.completa(_PROMPT, allegato=(dati, mime), max_tokens=900)
     if "pdf" in mime or nome.lower().endswith(".pdf"):
         testo = _testo_da_pdf(dati)
         if len(testo) < 40:
             return ("⚠️ Questo PDF sembra una scansione (nessun testo leggibile). "
                     "Ricaricalo come foto/immagine della pagina.")
-        resp = client.chat.completions.create(
-            model=modello,
-            messages=[{"role": "system", "content": _PROMPT},
-                      {"role": "user", "content": testo[:12000]}],
-            max_tokens=900)
-        return (resp.choices[0].message.content or "").strip()
+        return gateway.completa(testo[:12000], sistema=_PROMPT, max_tokens=900)
     return "⚠️ Formato non supportato per l'analisi AI (usa PDF o foto)."
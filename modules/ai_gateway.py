@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Gateway unico verso i modelli AI (OpenAI, Gemini) per ai_estrazione e
+assistant_ai.
+
+- Client riusato: un OpenAI() per (chiave, base_url) per processo, con il suo
+  pool HTTP; Gemini configurato una volta per chiave.
+- Cache delle risposte: chiave = sha256 di (provider, modello, prompt di
+  sistema, sha256 del prompt, eventuale allegato, max_tokens), con TTL e
+  numero massimo di voci. Un secondo clic sullo stesso quadro non rimanda
+  la richiesta. Gli errori non entrano in cache.
+- Streaming: stream() restituisce i pezzi di testo man mano che arrivano
+  (per st.write_stream); la risposta completa entra in cache alla fine.
+- Concorrenza: al massimo AI_MAX_CONCORRENTI chiamate in corso per processo
+  (le sessioni Streamlit sono thread dello stesso processo).
+- Metriche per chiamata (latenza, primo token, token in/out, cache, errore)
+  in memoria: metriche() / riepilogo().
+
+Config (sezione [ai] dei Secrets, le variabili d'ambiente hanno la precedenza):
+  OPENAI_API_KEY, OPENAI_MODEL (default gpt-4o-mini), OPENAI_BASE_URL
+  (proxy o endpoint compatibile, anche locale per i test), GEMINI_API_KEY,
+  GEMINI_MODEL (nei Secrets vale ancora il vecchio MODEL), AI_CACHE_TTL_S (default 21600), AI_CACHE_MAX (default 200),
+  AI_MAX_CONCORRENTI (default 4), AI_TIMEOUT_S (default 120).
+
+Usage:
+    testo = completa(prompt, sistema=SISTEMA)
+    testo = st.write_stream(stream(prompt, sistema=SISTEMA))
+    dati = risposta_json(modello, istruzioni, prompt, schema)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+_CHIAVI = ("OPENAI_API_KEY", "OPENAI_MODEL", "OPENAI_BASE_URL", "GEMINI_API_KEY", "GEMINI_MODEL",
+           "AI_CACHE_TTL_S", "AI_CACHE_MAX", "AI_MAX_CONCORRENTI", "AI_TIMEOUT_S")
+
+# Nomi modello Gemini provati in ordine (il primo è quello dei Secrets, se
+# presente): robusto ai cambi di nome lato Google.
+_CANDIDATI_GEMINI = [
+    "gemini-2.0-flash", "gemini-2.5-flash", "gemini-flash-latest",
+    "gemini-1.5-flash-latest", "gemini-1.5-flash", "gemini-2.0-flash-001",
+]
+
+_ATTESA_SLOT_S = 90.0
+
+
+def _config() -> Dict[str, Any]:
+    cfg: Dict[str, Any] = {}
+    try:
+        import streamlit as st
+        cfg.update(dict(st.secrets.get("ai", {})))
+    except Exception:
+        pass
+    for k in _CHIAVI:
+        v = os.getenv(k)
+        if v:
+            cfg[k] = v
+    return cfg
+
+
+def _num(cfg: Dict[str, Any], k: str, default: float) -> float:
+    try:
+        return float(cfg.get(k, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def provider(cfg: Optional[Dict[str, Any]] = None) -> str:
+    """Gemini se c'è la sua chiave, altrimenti OpenAI ("" se nessuna)."""
+    cfg = _config() if cfg is None else cfg
+    if cfg.get("GEMINI_API_KEY"):
+        return "gemini"
+    if cfg.get("OPENAI_API_KEY"):
+        return "openai"
+    return ""
+
+
+def _modello(prov: str, cfg: Dict[str, Any]) -> str:
+    if prov == "openai":
+        return str(cfg.get("OPENAI_MODEL", "gpt-4o-mini"))
+    # MODEL senza prefisso solo dai Secrets [ai] (configurazioni esistenti):
+    # dall'ambiente si legge GEMINI_MODEL, per non prendere variabili altrui
+    return str(cfg.get("GEMINI_MODEL") or cfg.get("MODEL") or "gemini-2.0-flash")
+
+
+# --- client riusati -----------------------------------------------------------
+
+_client_lock = threading.Lock()
+_client_openai: Dict[Tuple[str, str], Any] = {}
+_gemini_chiave: Optional[str] = None
+
+
+def _openai(cfg: Dict[str, Any]):
+    chiave = (str(cfg.get("OPENAI_API_KEY") or ""), str(cfg.get("OPENAI_BASE_URL") or ""))
+    with _client_lock:
+        c = _client_openai.get(chiave)
+        if c is None:
+            from openai import OpenAI
+            c = OpenAI(api_key=chiave[0] or None, base_url=chiave[1] or None,
+                       timeout=_num(cfg, "AI_TIMEOUT_S", 120.0), max_retries=2)
+            _client_openai[chiave] = c
+        return c
+
+
+def _gemini(cfg: Dict[str, Any]):
+    global _gemini_chiave
+    import google.generativeai as genai
+    key = str(cfg.get("GEMINI_API_KEY", ""))
+    with _client_lock:
+        if _gemini_chiave != key:
+            genai.configure(api_key=key)
+            _gemini_chiave = key
+    return genai
+
+
+# --- cache --------------------------------------------------------------------
+
+_cache_lock = threading.Lock()
+_cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+
+def chiave_cache(prov: str, modello: str, sistema: str, prompt: str, **extra: Any) -> str:
+    payload = {
+        "p": prov, "m": modello, "s": sistema,
+        "h": hashlib.sha256(prompt.encode("utf-8")).hexdigest(), **extra,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str)
+                          .encode("utf-8")).hexdigest()
+
+
+def _cache_get(k: str):
+    with _cache_lock:
+        hit = _cache.get(k)
+        if hit is None:
+            return None
+        scade, valore = hit
+        if scade < time.time():
+            del _cache[k]
+            return None
+        _cache.move_to_end(k)
+        return valore
+
+
+def _cache_put(k: str, valore: Any, cfg: Dict[str, Any]) -> None:
+    ttl = _num(cfg, "AI_CACHE_TTL_S", 21600.0)
+    massimo = int(_num(cfg, "AI_CACHE_MAX", 200))
+    if ttl <= 0 or massimo <= 0:
+        return
+    with _cache_lock:
+        _cache[k] = (time.time() + ttl, valore)
+        _cache.move_to_end(k)
+        while len(_cache) > massimo:
+            _cache.popitem(last=False)
+
+
+def svuota_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+# --- concorrenza ----------------------------------------------------------------
+
+_sem_lock = threading.Lock()
+_sem: Optional[threading.BoundedSemaphore] = None
+
+
+def _slot(cfg: Dict[str, Any]) -> threading.BoundedSemaphore:
+    global _sem
+    with _sem_lock:
+        if _sem is None:
+            _sem = threading.BoundedSemaphore(max(1, int(_num(cfg, "AI_MAX_CONCORRENTI", 4))))
+        return _sem
+
+
+def _acquisisci(cfg: Dict[str, Any]) -> threading.BoundedSemaphore:
+    sem = _slot(cfg)
+    if not sem.acquire(timeout=_ATTESA_SLOT_S):
+        raise RuntimeError("Troppe richieste AI in corso, riprova tra poco.")
+    return sem
+
+
+# --- metriche -------------------------------------------------------------------
+
+@dataclass
+class Metrica:
+    provider: str
+    modello: str
+    operazione: str
+    latenza_s: float
+    primo_token_s: Optional[float] = None
+    token_in: Optional[int] = None
+    token_out: Optional[int] = None
+    cache: bool = False
+    errore: str = ""
+    quando: float = field(default_factory=time.time)
+
+
+_metriche_lock = threading.Lock()
+_metriche: "deque[Metrica]" = deque(maxlen=500)
+
+
+def _registra(m: Metrica) -> None:
+    with _metriche_lock:
+        _metriche.append(m)
+
+
+def metriche() -> List[Dict[str, Any]]:
+    """Ultime chiamate (più recenti in fondo)."""
+    with _metriche_lock:
+        return [asdict(m) for m in _metriche]
+
+
+def riepilogo() -> Dict[str, Any]:
+    with _metriche_lock:
+        ms = list(_metriche)
+    reali = sorted(m.latenza_s for m in ms if not m.cache and not m.errore)
+    return {
+        "chiamate": len(ms),
+        "cache_hit": sum(1 for m in ms if m.cache),
+        "errori": sum(1 for m in ms if m.errore),
+        "latenza_media_s": round(sum(reali) / len(reali), 3) if reali else None,
+        "latenza_p95_s": round(reali[min(len(reali) - 1, int(0.95 * len(reali)))], 3) if reali else None,
+        "token_in": sum(m.token_in or 0 for m in ms),
+        "token_out": sum(m.token_out or 0 for m in ms),
+    }
+
+
+# --- chiamate -------------------------------------------------------------------
+
+def _messaggi(prompt: str, sistema: str, allegato) -> List[Dict[str, Any]]:
+    msgs: List[Dict[str, Any]] = []
+    if sistema:
+        msgs.append({"role": "system", "content": sistema})
+    if allegato is None:
+        msgs.append({"role": "user", "content": prompt})
+    else:
+        import base64
+        dati, mime = allegato
+        b64 = base64.b64encode(dati).decode()
+        msgs.append({"role": "user", "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}}]})
+    return msgs
+
+
+def _parti_gemini(prompt: str, sistema: str, allegato) -> list:
+    parti: list = [sistema, prompt] if sistema else [prompt]
+    if allegato is not None:
+        parti.append({"mime_type": allegato[1], "data": allegato[0]})
+    return parti
+
+
+def _gemini_risposta(genai, modello: str, parti: list, stream: bool):
+    """generate_content provando più nomi di modello (gestisce i 404)."""
+    nomi = [modello] + [n for n in _CANDIDATI_GEMINI if n != modello]
+    ultimo_err = None
+    for nome in nomi:
+        try:
+            return genai.GenerativeModel(nome).generate_content(parti, stream=stream)
+        except Exception as e:
+            ultimo_err = e
+            if "404" in str(e) or "not found" in str(e).lower() \
+                    or "not supported" in str(e).lower():
+                continue
+            raise
+    raise ultimo_err or RuntimeError("Nessun modello Gemini disponibile.")
+
+
+def _usage_gemini(resp) -> Tuple[Optional[int], Optional[int]]:
+    u = getattr(resp, "usage_metadata", None)
+    if u is None:
+        return None, None
+    return getattr(u, "prompt_token_count", None), getattr(u, "candidates_token_count", None)
+
+
+def _chiave_richiesta(prov, modello, prompt, sistema, allegato, max_tokens) -> str:
+    extra: Dict[str, Any] = {"max_tokens": max_tokens}
+    if allegato is not None:
+        extra["allegato"] = hashlib.sha256(allegato[0]).hexdigest()
+        extra["mime"] = allegato[1]
+    return chiave_cache(prov, modello, sistema, prompt, **extra)
+
+
+def completa(prompt: str, sistema: str = "", *, max_tokens: int = 1200,
+             allegato: Optional[Tuple[bytes, str]] = None, usa_cache: bool = True) -> str:
+    """Testo completo della risposta. `allegato` = (bytes, mime) di
+    un'immagine (o PDF per Gemini). Solleva eccezione in caso di errore."""
+    cfg = _config()
+    prov = provider(cfg)
+    if not prov:
+        raise RuntimeError("AI non configurata (OPENAI_API_KEY o GEMINI_API_KEY).")
+    modello = _modello(prov, cfg)
+    k = _chiave_richiesta(prov, modello, prompt, sistema, allegato, max_tokens)
+    t0 = time.perf_counter()
+    if usa_cache:
+        hit = _cache_get(k)
+        if hit is not None:
+            _registra(Metrica(prov, modello, "testo", time.perf_counter() - t0, cache=True))
+            return hit
+    m = Metrica(prov, modello, "testo", 0.0)
+    sem = _acquisisci(cfg)
+    try:
+        if prov == "openai":
+            resp = _openai(cfg).chat.completions.create(
+                model=modello, messages=_messaggi(prompt, sistema, allegato), max_tokens=max_tokens)
+            testo = (resp.choices[0].message.content or "").strip()
+            u = getattr(resp, "usage", None)
+            m.token_in = getattr(u, "prompt_tokens", None)
+            m.token_out = getattr(u, "completion_tokens", None)
+        else:
+            resp = _gemini_risposta(_gemini(cfg), modello,
+                                    _parti_gemini(prompt, sistema, allegato), stream=False)
+            testo = (resp.text or "").strip()
+            m.token_in, m.token_out = _usage_gemini(resp)
+    except Exception as e:
+        m.errore = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sem.release()
+        m.latenza_s = time.perf_counter() - t0
+        _registra(m)
+    if usa_cache and testo:
+        _cache_put(k, testo, cfg)
+    return testo
+
+
+def stream(prompt: str, sistema: str = "", *, max_tokens: int = 1200,
+           allegato: Optional[Tuple[bytes, str]] = None, usa_cache: bool = True) -> Iterator[str]:
+    """Pezzi di testo man mano che il modello li produce (per st.write_stream).
+    Da cache arriva tutto in un pezzo. Solleva eccezione in caso di errore."""
+    cfg = _config()
+    prov = provider(cfg)
+    if not prov:
+        raise RuntimeError("AI non configurata (OPENAI_API_KEY o GEMINI_API_KEY).")
+    modello = _modello(prov, cfg)
+    k = _chiave_richiesta(prov, modello, prompt, sistema, allegato, max_tokens)
+    t0 = time.perf_counter()
+    if usa_cache:
+        hit = _cache_get(k)
+        if hit is not None:
+            _registra(Metrica(prov, modello, "stream", time.perf_counter() - t0, cache=True))
+            yield hit
+            return
+    m = Metrica(prov, modello, "stream", 0.0)
+    pezzi: List[str] = []
+    completo = False
+    sem = _acquisisci(cfg)
+    try:
+        if prov == "openai":
+            # il "with" chiude la risposta anche se lo stream è interrotto
+            # (rerun Streamlit): la connessione torna subito al pool
+            with _openai(cfg).chat.completions.create(
+                    model=modello, messages=_messaggi(prompt, sistema, allegato),
+                    max_tokens=max_tokens, stream=True,
+                    stream_options={"include_usage": True}) as eventi:
+                for ev in eventi:
+                    u = getattr(ev, "usage", None)
+                    if u is not None:
+                        m.token_in = getattr(u, "prompt_tokens", None)
+                        m.token_out = getattr(u, "completion_tokens", None)
+                    if not getattr(ev, "choices", None):
+                        continue
+                    pezzo = ev.choices[0].delta.content
+                    if pezzo:
+                        if m.primo_token_s is None:
+                            m.primo_token_s = time.perf_counter() - t0
+                        pezzi.append(pezzo)
+                        yield pezzo
+        else:
+            resp = _gemini_risposta(_gemini(cfg), modello,
+                                    _parti_gemini(prompt, sistema, allegato), stream=True)
+            for ch in resp:
+                pezzo = getattr(ch, "text", "") or ""
+                if pezzo:
+                    if m.primo_token_s is None:
+                        m.primo_token_s = time.perf_counter() - t0
+                    pezzi.append(pezzo)
+                    yield pezzo
+            m.token_in, m.token_out = _usage_gemini(resp)
+        completo = True
+    except GeneratorExit:
+        m.errore = "interrotto"
+        raise
+    except Exception as e:
+        m.errore = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sem.release()
+        m.latenza_s = time.perf_counter() - t0
+        _registra(m)
+    testo = "".join(pezzi).strip()
+    if usa_cache and completo and testo:
+        _cache_put(k, testo, cfg)
+
+
+def risposta_json(modello: str, istruzioni: str, prompt: str,
+                  response_schema: Optional[Dict[str, Any]] = None,
+                  usa_cache: bool = True) -> Dict[str, Any]:
+    """Responses API di OpenAI con output JSON (assistant_ai)."""
+    cfg = _config()
+    k = chiave_cache("openai-responses", modello, istruzioni, prompt,
+                     schema=json.dumps(response_schema, sort_keys=True) if response_schema else "")
+    t0 = time.perf_counter()
+    if usa_cache:
+        hit = _cache_get(k)
+        if hit is not None:
+            _registra(Metrica("openai", modello, "json", time.perf_counter() - t0, cache=True))
+            return json.loads(hit)
+    kwargs: Dict[str, Any] = {"model": modello, "instructions": istruzioni, "input": prompt}
+    if response_schema:
+        kwargs["response_format"] = {"type": "json_schema", "json_schema": response_schema}
+    m = Metrica("openai", modello, "json", 0.0)
+    sem = _acquisisci(cfg)
+    try:
+        resp = _openai(cfg).responses.create(**kwargs)
+        txt = getattr(resp, "output_text", None) or ""
+        if not txt:
+            try:
+                txt = resp.output[0].content[0].text
+            except Exception:
+                txt = "{}"
+        u = getattr(resp, "usage", None)
+        m.token_in = getattr(u, "input_tokens", None)
+        m.token_out = getattr(u, "output_tokens", None)
+        dati = json.loads(txt)
+    except Exception as e:
+        m.errore = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sem.release()
+        m.latenza_s = time.perf_counter() - t0
+        _registra(m)
+    if usa_cache:
+        _cache_put(k, txt, cfg)
+    return dati
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Anteprime delle immagini salvate nel database (documenti clinici, catture
+Photoref): una MINIATURA per gli elenchi e un'ANTEPRIMA media per la
+visualizzazione, generate una volta sola al caricamento (Pillow) e salvate
+accanto all'originale insieme alle dimensioni.
+
+Ogni tabella è descritta da una Sorgente (colonna dell'originale, colonne
+di miniatura/anteprima/dimensioni). La lettura passa da una LRU di processo
+limitata in byte: riaprire un paziente con 50 scansioni trasferisce qualche
+KB la prima volta e nulla ai rerun. Le righe caricate prima di questo modulo
+ricevono le anteprime alla prima visualizzazione; per i file che non sono
+immagini (o formati che Pillow non apre) la miniatura resta b"" e non si
+riprova.
+
+Config: ANTEPRIME_CACHE_MB (default 32).
+
+Usage:
+    extra = colonne_anteprime(DOCUMENTI, dati)   # {colonna: valore} per l'INSERT
+    mini = miniature(conn, DOCUMENTI, [3, 5, 8]) # {id: bytes | None}
+    img = anteprima(conn, DOCUMENTI, 5)
+"""
+from __future__ import annotations
+
+import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    from .blob_store import conserva, risolvi
+except Exception:
+    def conserva(data, store=None):
+        return data
+    def risolvi(v, store=None):
+        return bytes(v) if v is not None else None
+
+MINI_PX = 256
+MEDIA_PX = 1280
+_QUALITA = 82
+
+
+@dataclass(frozen=True)
+class Sorgente:
+    tabella: str
+    originale: str
+    mini: str
+    media: str
+    larghezza: Optional[str] = None
+    altezza: Optional[str] = None
+    chiave: str = "id"
+
+
+DOCUMENTI = Sorgente("documenti_clinici", "dati", "anteprima_mini", "anteprima",
+                     "larghezza", "altezza")
+PHOTOREF = Sorgente("photoref_captures", "image_bytes", "image_thumb", "image_preview",
+                    "image_width", "image_height")
+PHOTOREF_ANNOTATA = Sorgente("photoref_captures", "annotated_image_bytes",
+                             "annotated_thumb", "annotated_preview")
+
+
+@dataclass(frozen=True)
+class Anteprime:
+    mini: bytes
+    media: bytes
+    larghezza: int
+    altezza: int
+
+
+def _jpeg(img, lato: int) -> bytes:
+    img = img.copy()
+    img.thumbnail((lato, lato))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=_QUALITA, optimize=True)
+    return buf.getvalue()
+
+
+def genera_anteprime(dati) -> Optional[Anteprime]:
+    """Miniatura e anteprima JPEG (orientamento EXIF applicato, trasparenze
+    su bianco). None se i bytes non sono un'immagine leggibile."""
+    if not dati:
+        return None
+    try:
+        from PIL import Image, ImageOps
+        img = Image.open(io.BytesIO(dati))
+        larghezza, altezza = img.size
+        if img.getexif().get(0x0112) in (5, 6, 7, 8):   # foto ruotate di 90°
+            larghezza, altezza = altezza, larghezza
+        img.draft("RGB", (MEDIA_PX, MEDIA_PX))   # JPEG: decode già ridotto
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        media = _jpeg(img, MEDIA_PX)
+        mini = _jpeg(img, MINI_PX)
+    except Exception:
+        return None
+    return Anteprime(mini, media, int(larghezza), int(altezza))
+
+
+def colonne_anteprime(src: Sorgente, dati) -> Dict[str, Any]:
+    """Valori da scrivere accanto all'originale (vuoto se non è un'immagine:
+    la miniatura b"" segna "niente anteprima")."""
+    a = genera_anteprime(dati)
+    if a is None:
+        return {src.mini: b""} if dati else {}
+    out = {src.mini: a.mini, src.media: conserva(a.media)}
+    if src.larghezza:
+        out[src.larghezza] = a.larghezza
+    if src.altezza:
+        out[src.altezza] = a.altezza
+    return out
+
+
+# --- LRU di processo ----------------------------------------------------------
+
+_lock = threading.Lock()
+_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_cache_bytes = 0
+_MAX_BYTES = int(float(os.getenv("ANTEPRIME_CACHE_MB", "32")) * 1024 * 1024)
+
+
+def _get(k: tuple) -> Optional[bytes]:
+    with _lock:
+        v = _cache.get(k)
+        if v is not None:
+            _cache.move_to_end(k)
+        return v
+
+
+def _put(k: tuple, v: bytes) -> None:
+    global _cache_bytes
+    if len(v) > _MAX_BYTES // 4:
+        return
+    with _lock:
+        old = _cache.pop(k, None)
+        if old is not None:
+            _cache_bytes -= len(old)
+        _cache[k] = v
+        _cache_bytes += len(v)
+        while _cache_bytes > _MAX_BYTES and _cache:
+            _, o = _cache.popitem(last=False)
+            _cache_bytes -= len(o)
+
+
+def dimentica(src: Sorgente, chiave) -> None:
+    """Da chiamare quando la riga viene cancellata o l'immagine cambia."""
+    global _cache_bytes
+    with _lock:
+        for k in ((src.tabella, src.mini, chiave), (src.tabella, src.media, chiave)):
+            o = _cache.pop(k, None)
+            if o is not None:
+                _cache_bytes -= len(o)
+
+
+# --- lettura -----------------------------------------------------------------
+
+def _rigenera(conn, src: Sorgente, chiave) -> Dict[str, Any]:
+    """Anteprime di una riga caricata prima del modulo: legge l'originale
+    una volta e le salva."""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {src.originale} FROM {src.tabella} WHERE {src.chiave}=%s", (chiave,))
+        r = cur.fetchone()
+        if r is None or r[0] is None:
+            conn.commit()
+            return {}
+        valori = colonne_anteprime(src, risolvi(r[0]))
+        if valori:
+            cols = list(valori)
+            cur.execute(
+                f"UPDATE {src.tabella} SET " + ", ".join(f"{c}=%s" for c in cols)
+                + f" WHERE {src.chiave}=%s",
+                [valori[c] for c in cols] + [chiave],
+            )
+        conn.commit()
+        return valori
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        return {}
+    finally:
+        try: cur.close()
+        except Exception: pass
+
+
+def miniature(conn, src: Sorgente, chiavi: Iterable) -> Dict[Any, Optional[bytes]]:
+    """Miniature di più righe: LRU, poi UNA query per le mancanti."""
+    chiavi = list(chiavi)
+    out: Dict[Any, Optional[bytes]] = {}
+    mancanti = []
+    for k in chiavi:
+        v = _get((src.tabella, src.mini, k))
+        if v is None:
+            mancanti.append(k)
+        else:
+            out[k] = v or None
+    if not mancanti:
+        return out
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"SELECT {src.chiave}, {src.mini}, {src.originale} IS NOT NULL FROM {src.tabella} "
+            f"WHERE {src.chiave} = ANY(%s)",
+            (mancanti,),
+        )
+        righe = cur.fetchall()
+        conn.commit()
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        return out
+    finally:
+        try: cur.close()
+        except Exception: pass
+    for k, mini, ha_originale in righe:
+        if mini is None and ha_originale:
+            mini = _rigenera(conn, src, k).get(src.mini)
+        if mini is None:
+            continue
+        mini = bytes(mini)
+        _put((src.tabella, src.mini, k), mini)
+        out[k] = mini or None
+    return out
+
+
+def anteprima(conn, src: Sorgente, chiave) -> Optional[bytes]:
+    """Anteprima media di una riga (LRU, poi database)."""
+    k = (src.tabella, src.media, chiave)
+    v = _get(k)
+    if v is not None:
+        return v
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {src.media}, {src.mini} FROM {src.tabella} WHERE {src.chiave}=%s",
+                    (chiave,))
+        r = cur.fetchone()
+        conn.commit()
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        return None
+    finally:
+        try: cur.close()
+        except Exception: pass
+    if r is None:
+        return None
+    media, mini = r
+    if media is None and mini is None:
+        media = _rigenera(conn, src, chiave).get(src.media)
+    if media is None:
+        return None
+    try:
+        v = risolvi(media)
+    except Exception:
+        return None
+    _put(k, v)
+    return v
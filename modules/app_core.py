@@ -8,6 +8,11 @@ import json
 import secrets
 import hashlib
 import textwrap
+import re
+import threading
+import time
+import weakref
+import collections
 import urllib.parse
 from functools import lru_cache
 from datetime import timedelta, timezone
@@ -15,6 +20,9 @@ from datetime import timedelta, timezone
 import streamlit as st
 from modules.app_menu import build_sections
 from modules.app_main_router import dispatch_main_section
+from modules.riepilogo_paziente import invalida_riepilogo_paziente
+from modules.ricerca_pazienti import invalida_ricerca_pazienti
+from modules.blob_store import conserva as _blob_conserva, risolvi as _blob_risolvi
 from modules.app_sections import (
     SECTION_DASHBOARD,
     SECTION_PAZIENTI,
@@ -66,11 +74,12 @@ PSYCOPG2_AVAILABLE = False
 try:
     import psycopg2  # type: ignore
     import psycopg2.extras  # type: ignore
+    import psycopg2.pool  # type: ignore
     PSYCOPG2_AVAILABLE = True
 except Exception:
     PSYCOPG2_AVAILABLE = False
 
-USE_S3 = False  # Disabilitato: archiviamo su Postgres (BYTEA) e/o altri canali
+USE_S3 = False  # Disabilitato: i binari vanno nel blob store (modules/blob_store) se configurato, altrimenti in BYTEA
 
 
 
@@ -162,38 +171,96 @@ def _get_columns(conn, table_name: str):
     except Exception:
         return []
 
-def _detect_patient_table_and_cols(conn):
-    """Rileva tabella pazienti — cache 5min session_state."""
-    import time
-    _ck = "_detect_table_cache"; _tk = "_detect_table_ts"
-    now = time.time()
-    if _ck in st.session_state and _tk in st.session_state and now - st.session_state[_tk] < 300:
-        return st.session_state[_ck]
-    table_candidates = [
-        'pazienti','Pazienti','patients','Patients','patienti','Patienti',
-        'anagrafica_pazienti','Anagrafica_Pazienti','tbl_pazienti','Tbl_Pazienti'
-    ]
-    id_cols = ['id','id','paziente_id','paziente_id','id_paziente','id_Paziente','idPaziente']
-    cogn_cols = ['cognome','Cognome','last_name','LastName','lastname','cognome_paziente','Cognome_Paziente']
-    nome_cols = ['nome','Nome','first_name','FirstName','firstname','nome_paziente','Nome_Paziente']
-    dn_cols = ['data_nascita','Data_Nascita','birth_date','BirthDate','dataNascita','DataNascita','data_n']
-    scuola_cols = ['scuola','Scuola','istituto','Istituto','classe_scuola','Classe_Scuola']
-    eta_cols = ['eta','Eta','age','Age']
+# Introspezione dello schema condivisa da tutte le sessioni del processo:
+# {versione_schema: {"tabelle": [...], "colonne": {tabella: [...]}, "pazienti": (tabella, colmap)}}.
+# La chiave è la versione del runner delle migrazioni: il catalogo si rilegge
+# solo quando una migrazione cambia lo schema, non a ogni login.
+_SCHEMA_INTROSPEZIONE = {}
+_SCHEMA_INTROSPEZIONE_LOCK = threading.Lock()
 
+_PAZ_TABLE_CANDIDATES = (
+    'pazienti','Pazienti','patients','Patients','patienti','Patienti',
+    'anagrafica_pazienti','Anagrafica_Pazienti','tbl_pazienti','Tbl_Pazienti'
+)
+
+
+def _catalogo_tabelle_colonne(conn, extra_tables=()):
+    """(tabelle pubbliche, {tabella: [colonne]}) per le tabelle paziente-simili.
+
+    Su Postgres: due query al catalogo in tutto, le colonne di tutte le
+    candidate arrivano insieme (table_name = ANY(...)).
+    """
     cur = conn.cursor()
-    discovered = []
     try:
         cur.execute("""
             SELECT table_name FROM information_schema.tables
             WHERE table_schema='public'
         """)
-        discovered = [r[0] for r in cur.fetchall()]
+        tabelle = [r[0] for r in cur.fetchall()]
     except Exception:
         try:
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            discovered = [r[0] for r in cur.fetchall()]
+            conn.rollback()
+        except Exception:
+            pass
+        tabelle = None
+
+    if tabelle is not None:
+        nomi = list(dict.fromkeys(list(_PAZ_TABLE_CANDIDATES) + list(extra_tables)
+                                  + [t for t in tabelle if 'paz' in str(t).lower()
+                                     or 'patient' in str(t).lower()]))
+        colonne = {}
+        try:
+            cur.execute("""
+                SELECT table_name, column_name
+                FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = ANY(%s)
+                ORDER BY table_name, ordinal_position
+            """, (nomi,))
+            for t, c in cur.fetchall():
+                colonne.setdefault(t, []).append(c)
         except Exception:
-            discovered = []
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        return tabelle, colonne
+
+    # SQLite (locale): PRAGMA per tabella
+    try:
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tabelle = [r[0] for r in cur.fetchall()]
+    except Exception:
+        tabelle = []
+    colonne = {}
+    for t in tabelle:
+        tl = str(t).lower()
+        if t in _PAZ_TABLE_CANDIDATES or 'paz' in tl or 'patient' in tl:
+            try:
+                cur.execute(f"PRAGMA table_info({_qident(t)})")
+                colonne[t] = [r[1] for r in cur.fetchall()]
+            except Exception:
+                pass
+    return tabelle, colonne
+
+
+def _detect_patient_table_and_cols(conn):
+    """Rileva tabella pazienti — cache di processo per versione di schema."""
+    from modules.schema_migrations import versione_schema
+    _ver = (_DB_BACKEND, versione_schema())
+    with _SCHEMA_INTROSPEZIONE_LOCK:
+        hit = _SCHEMA_INTROSPEZIONE.get(_ver)
+    if hit is not None:
+        return hit["pazienti"]
+
+    table_candidates = list(_PAZ_TABLE_CANDIDATES)
+    id_cols = ['id','id','paziente_id','paziente_id','id_paziente','id_Paziente','idPaziente']
+    cogn_cols = ['cognome','Cognome','last_name','LastName','lastname','cognome_paziente','Cognome_Paziente']
+    nome_cols = ['nome','Nome','first_name','FirstName','firstname','nome_paziente','Nome_Paziente']
+    dn_cols = ['data_nascita','Data_Nascita','birth_date','BirthDate','dataNascita','DataNascita','data_n']
+    scuola_cols = ['scuola','Scuola','istituto','Istituto','classe_scuola','Classe_Scuola']
+    eta_cols = ['eta','Eta','age','Age']
+
+    discovered, colonne = _catalogo_tabelle_colonne(conn)
 
     # Tabelle "paziente-simili" scoperte dinamicamente: vengono aggiunte
     # SOLO in coda (append), così le tabelle canoniche ('pazienti'/'Pazienti')
@@ -219,8 +286,9 @@ def _detect_patient_table_and_cols(conn):
                 return lower_map[c.lower()]
         return None
 
+    result = None, {}
     for table in table_candidates:
-        cols = _get_columns(conn, table)
+        cols = colonne.get(table) or []
         if not cols:
             continue
         idc = pick(cols, id_cols)
@@ -231,20 +299,50 @@ def _detect_patient_table_and_cols(conn):
         dnc = pick(cols, dn_cols)
         sc  = pick(cols, scuola_cols)
         ec  = pick(cols, eta_cols)
-        _r2 = table, {'id': idc, 'cognome': cc, 'nome': nc, 'data_nascita': dnc, 'scuola': sc, 'eta': ec}
-        st.session_state[_ck] = _r2; st.session_state[_tk] = time.time()
-        return _r2
-    _r = None, {}
-    st.session_state[_ck] = _r; st.session_state[_tk] = time.time()
-    return _r
+        result = table, {'id': idc, 'cognome': cc, 'nome': nc, 'data_nascita': dnc, 'scuola': sc, 'eta': ec}
+        break
+
+    if result[0] is None:
+        # catalogo non leggibile o tabella non ancora creata: si riprova al prossimo giro
+        return result
+    with _SCHEMA_INTROSPEZIONE_LOCK:
+        # una sola versione viva: le precedenti non servono più
+        _SCHEMA_INTROSPEZIONE.clear()
+        _SCHEMA_INTROSPEZIONE[_ver] = {"tabelle": discovered, "colonne": colonne, "pazienti": result}
+    return result
+
+
+def schema_introspezione() -> dict:
+    """Ultima introspezione in cache (tabelle, colonne, mappa pazienti) — diagnostica."""
+    with _SCHEMA_INTROSPEZIONE_LOCK:
+        for ver, dati in _SCHEMA_INTROSPEZIONE.items():
+            return {"versione": ver[1], "backend": ver[0], **dati}
+    return {}
+
+# Lista pazienti condivisa fra le sessioni: {(studio_id, limit): (generazione, ts, risultato)}.
+# Si rinnova quando l'anagrafica cambia (invalida_ricerca_pazienti) o dopo 5 minuti.
+_PAZIENTI_SELECT_CACHE = {}
+_PAZIENTI_SELECT_LOCK = threading.Lock()
+_PAZIENTI_SELECT_TTL_S = 300
+
 
 def fetch_pazienti_for_select(conn, limit=5000):
-    """Lista pazienti con cache 30s in session_state — evita query ripetute ad ogni click."""
+    """Lista pazienti per i selettori legacy, in cache di processo condivisa.
+
+    Per i selettori nuovi usare modules.ricerca_pazienti (ricerca lato server a pagine).
+    """
     import time
-    _ck2 = "_pazienti_cache"; _tk2 = "_pazienti_ts"
-    now = time.time()
-    if _ck2 in st.session_state and _tk2 in st.session_state and now - st.session_state[_tk2] < 30:
-        return st.session_state[_ck2]
+    from modules.ricerca_pazienti import generazione_pazienti
+    try:
+        _sid = int(st.session_state.get("studio_id", 1) or 1)
+    except Exception:
+        _sid = 1
+    _key = (_sid, int(limit))
+    gen = generazione_pazienti()
+    with _PAZIENTI_SELECT_LOCK:
+        hit = _PAZIENTI_SELECT_CACHE.get(_key)
+    if hit is not None and hit[0] == gen and time.time() - hit[1] < _PAZIENTI_SELECT_TTL_S:
+        return hit[2]
     table, colmap = _detect_patient_table_and_cols(conn)
     if not table:
         return [], None, None
@@ -278,7 +376,8 @@ def fetch_pazienti_for_select(conn, limit=5000):
             r.append('')
         out.append(tuple(r[:6]))
     result2 = out, table, colmap
-    st.session_state[_ck2] = result2; st.session_state[_tk2] = time.time()
+    with _PAZIENTI_SELECT_LOCK:
+        _PAZIENTI_SELECT_CACHE[_key] = (gen, time.time(), result2)
     return result2
 
 
@@ -287,19 +386,11 @@ def fetch_pazienti_for_select(conn, limit=5000):
 
 def _select_paziente_minimal(conn):
     """
-    Selector paziente minimal riusando fetch_pazienti_for_select del gestionale.
+    Selector paziente minimal con ricerca lato server (modules.ricerca_pazienti).
     Ritorna (paziente_id, label).
     """
-    rows, _, _ = fetch_pazienti_for_select(conn, limit=5000)
-    if not rows:
-        return None, ""
-    options = []
-    for r in rows:
-        pid, cogn, nome, dn, scuola, eta = r
-        label = f"{cogn} {nome} • {dn or ''} • id {pid}"
-        options.append((int(pid), label))
-    sel = st.selectbox("Paziente", options=options, format_func=lambda x: x[1], key="paz_sel_minimal")
-    return sel[0], sel[1]
+    from modules.ricerca_pazienti import selettore_paziente
+    return selettore_paziente(conn, key="paz_sel_minimal", label="Paziente")
 def _debug_list_tables(conn, limit=200):
     """Ritorna lista di tuple (schema, table). Gestisce cursor che ritorna dict/RealDictRow."""
     cur = conn.cursor()
@@ -659,6 +750,7 @@ def maybe_handle_public_questionario(get_conn) -> bool:
 
             mark_token_used(cur, int(link.get("id") if hasattr(link, "get") else link["id"]))
             conn.commit()
+            invalida_riepilogo_paziente(paziente_id)
             st.success("✅ Grazie! Questionario inviato correttamente. Puoi chiudere questa pagina.")
             st.balloons()
         except Exception as e:
@@ -982,18 +1074,17 @@ def _safe_str(x) -> str:
     return s
 
 def _blob_to_bytes(v):
-    """Converte BLOB/bytea da SQLite/Postgres in bytes."""
+    """Converte BLOB/bytea da SQLite/Postgres in bytes (risolvendo i
+    riferimenti al blob store)."""
     if v is None:
         return None
-    if isinstance(v, (bytes, bytearray)):
-        return bytes(v)
     # psycopg2 può restituire memoryview
+    if not isinstance(v, (bytes, bytearray, memoryview)):
+        return None
     try:
-        if isinstance(v, memoryview):
-            return v.tobytes()
+        return _blob_risolvi(v)
     except Exception:
-        pass
-    return None
+        return None
 
 
 def _fmt_num(x) -> str:
@@ -1792,8 +1883,11 @@ def login(get_conn) -> bool:
     except Exception:
         pass
     # ensure_auth_schema: eseguita solo una volta per sessione (non ad ogni click)
+    # e saltata del tutto se il runner delle migrazioni l'ha già verificata
     if not st.session_state.get("_auth_schema_ok"):
-        ensure_auth_schema(conn)
+        from modules.schema_migrations import schema_verificato
+        if not schema_verificato(_DB_BACKEND):
+            ensure_auth_schema(conn)
         st.session_state["_auth_schema_ok"] = True
 
     # bootstrap primo admin se non ci sono utenti
@@ -2058,6 +2152,20 @@ def _is_streamlit_cloud() -> bool:
 
 
 
+@lru_cache(maxsize=512)
+def _column_index(names: tuple) -> dict:
+    """Mappa nome colonna -> posizione, calcolata UNA volta per result set.
+
+    Contiene i nomi originali (a parità di nome vince l'ultima colonna, come
+    DictRow) e le loro forme minuscole, così la ricerca case-insensitive
+    costa al massimo due probe e un solo lower() sulla chiave cercata.
+    """
+    pos = {n: i for i, n in enumerate(names)}
+    for i, n in enumerate(names):
+        pos.setdefault(n.lower(), i)
+    return pos
+
+
 class _RowCI(dict):
     """Case-insensitive dict for row access, but also behaves like a sequence.
 
@@ -2065,14 +2173,32 @@ class _RowCI(dict):
     - row['id'] style access (case-insensitive) for legacy SQLite-style code
     - row[0] / list(row) sequence-style access for code paths that expect tuples
 
-    psycopg2 DictRow supports both, but we wrap it to make key access case-insensitive.
+    La riga tiene la tupla restituita da psycopg2 così com'è per l'accesso
+    posizionale e condivide con le altre righe dello stesso result set nomi e
+    indice delle colonne (_column_index). Lo storage dict è riempito alla
+    costruzione (un dict(zip()) in C, l'unica copia per riga): non può essere
+    pigro perché json.dumps (st.json/st.write) legge lo storage nativo senza
+    passare da items(). pop, setdefault, copy e gli altri metodi nativi di
+    dict vedono le colonne. Le chiavi in maiuscolo/minuscolo diverso vengono
+    ricondotte al nome reale. Misure: scripts/bench_righe_pg.py.
     """
-    def __init__(self, mapping, seq=None):
-        super().__init__(mapping or {})
-        # Preserve column order so row[0] works and list(row) returns values (not keys)
-        if seq is None:
-            seq = list((mapping or {}).values())
-        self._seq = list(seq)
+    __slots__ = ("_seq", "_names", "_idx")
+
+    def __init__(self, seq, names, idx):
+        dict.__init__(self, zip(names, seq))
+        self._seq = seq
+        self._names = names
+        self._idx = idx
+
+    def _key(self, key):
+        """Nome reale della colonna per `key` (qualsiasi maiuscolo/minuscolo)."""
+        if isinstance(key, str) and not dict.__contains__(self, key):
+            i = self._idx.get(key)
+            if i is None:
+                i = self._idx.get(key.lower())
+            if i is not None:
+                return self._names[i]
+        return key
 
     def __iter__(self):
         # Iterate VALUES (not keys) so list(row) behaves like a tuple row
@@ -2085,19 +2211,22 @@ class _RowCI(dict):
         # Numeric / slice access -> sequence behaviour
         if isinstance(key, (int, slice)):
             return self._seq[key]
+        return dict.__getitem__(self, self._key(key))
+
+    def __setitem__(self, key, value):
+        key = self._key(key)
+        dict.__setitem__(self, key, value)
+        i = self._idx.get(key) if isinstance(key, str) else None
+        if i is not None and self._names[i] == key:
+            if not isinstance(self._seq, list):
+                self._seq = list(self._seq)
+            self._seq[i] = value
 
-        # Case-insensitive string key access
-        if isinstance(key, str):
-            if dict.__contains__(self, key):
-                return dict.__getitem__(self, key)
-            lk = key.lower()
-            if dict.__contains__(self, lk):
-                return dict.__getitem__(self, lk)
-            uk = key.upper()
-            if dict.__contains__(self, uk):
-                return dict.__getitem__(self, uk)
+    def __delitem__(self, key):
+        dict.__delitem__(self, self._key(key))
 
-        return dict.__getitem__(self, key)
+    def __contains__(self, key):
+        return dict.__contains__(self, self._key(key))
 
     def get(self, key, default=None):
         try:
@@ -2105,19 +2234,172 @@ class _RowCI(dict):
         except Exception:
             return default
 
+    def pop(self, key, *default):
+        return dict.pop(self, self._key(key), *default)
+
+    def setdefault(self, key, default=None):
+        key = self._key(key)
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        self[key] = default
+        return default
+
+    def copy(self):
+        return dict(dict.items(self))
+
+    def __reduce__(self):
+        # pickle (st.cache_data) / deepcopy: ricostruisce dalla tupla, poi
+        # ripristina lo storage così com'è (chiavi aggiunte, modificate, tolte)
+        return (self.__class__, (self._seq, self._names, self._idx), dict(dict.items(self)))
+
+    def __setstate__(self, state):
+        dict.clear(self)
+        dict.update(self, state)
+
+# Contatori della strategia di liveness (vedi _PgConn._ensure_alive):
+# "avoided" = cursori serviti senza ping, "performed" = ping SELECT 1 fatti,
+# "retries" = statement ripetuti dopo una riconnessione trasparente.
+_LIVENESS_STATS = {"performed": 0, "avoided": 0, "reconnects": 0, "retries": 0}
+
+
+@lru_cache(maxsize=2048)
+def _adapt_sql_cached(sql: str) -> str:
+    # naive but effective for this app: replace all '?' placeholders
+    return sql.replace("?", "%s")
+
+
+# --- PREPARE/EXECUTE lato server per le query "calde" -----------------------
+# Opzionale: [db] PREPARE_HOT_AFTER = N (0 = disattivo, default). Una SELECT
+# parametrizzata eseguita almeno N volte nel processo viene preparata con
+# PREPARE su ogni connessione che la usa, e poi lanciata con EXECUTE: Postgres
+# salta parsing e pianificazione. I prepared statement vivono nella sessione
+# del server, quindi il registro è per connessione psycopg2 (weakref: sparisce
+# con la connessione, una riconnessione riparte da zero).
+_PREPARED_MAX_PER_CONN = 64
+_HOT_SQL_MAX = 1024
+_SQL_STATS = {"prepared": 0, "prepared_exec": 0, "prepare_failed": 0}
+_HOT_SQL = collections.OrderedDict()   # sql -> numero di esecuzioni (LRU limitato)
+_PREPARED = weakref.WeakKeyDictionary()  # conn psycopg2 -> {"names": {sql: nome}, "bad": set(), "seq": n}
+_PREPARED_LOCK = threading.Lock()
+_PLACEHOLDER_RE = re.compile(r"%%|%s|%")
+
+
+@lru_cache(maxsize=1)
+def _prepare_hot_after() -> int:
+    return int(_pool_settings().get("prepare_hot_after", 0) or 0)
+
+
+def _to_server_placeholders(sql: str):
+    """'%s' -> '$1, $2, ...' e '%%' -> '%'. None se la query usa altri segnaposto."""
+    n = 0
+    bad = False
+
+    def _sub(m):
+        nonlocal n, bad
+        tok = m.group(0)
+        if tok == "%%":
+            return "%"
+        if tok == "%s":
+            n += 1
+            return f"${n}"
+        bad = True
+        return tok
+
+    out = _PLACEHOLDER_RE.sub(_sub, sql)
+    return (None, 0) if bad else (out, n)
+
+
+def _prepared_statement(conn, sql: str, params):
+    """SQL da eseguire al posto di `sql` (EXECUTE ...) oppure None."""
+    threshold = _prepare_hot_after()
+    if threshold <= 0 or not params or not isinstance(params, (tuple, list)):
+        return None
+    head = sql.lstrip()[:6].lower()
+    if not (head.startswith("select") or head.startswith("with")):
+        return None
+    with _PREPARED_LOCK:
+        state = _PREPARED.get(conn)
+        if state is None:
+            state = {"names": {}, "bad": set(), "seq": 0}
+            _PREPARED[conn] = state
+        name = state["names"].get(sql)
+        if name is None:
+            uses = _HOT_SQL.pop(sql, 0) + 1
+            _HOT_SQL[sql] = uses
+            while len(_HOT_SQL) > _HOT_SQL_MAX:
+                _HOT_SQL.popitem(last=False)
+    args = "(" + ", ".join(["%s"] * len(params)) + ")"
+    if name is not None:
+        _SQL_STATS["prepared_exec"] += 1
+        return f"EXECUTE {name} {args}"
+    if uses < threshold or sql in state["bad"] or len(state["names"]) >= _PREPARED_MAX_PER_CONN:
+        return None
+    # PREPARE solo a connessione inattiva: se fallisce, il rollback non perde nulla
+    try:
+        if conn.get_transaction_status() != 0:
+            return None
+    except Exception:
+        return None
+    pg_sql, n = _to_server_placeholders(sql)
+    if pg_sql is None or n != len(params):
+        state["bad"].add(sql)
+        return None
+    state["seq"] += 1
+    name = f"hot_{state['seq']}"
+    try:
+        c = conn.cursor()
+        c.execute(f"PREPARE {name} AS {pg_sql}")
+        c.close()
+    except Exception:
+        _SQL_STATS["prepare_failed"] += 1
+        state["bad"].add(sql)
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return None
+    state["names"][sql] = name
+    _SQL_STATS["prepared"] += 1
+    _SQL_STATS["prepared_exec"] += 1
+    return f"EXECUTE {name} {args}"
+
+
+def _forget_prepared(conn, sql: str):
+    with _PREPARED_LOCK:
+        state = _PREPARED.get(conn)
+        if state is not None:
+            state["names"].pop(sql, None)
+            state["bad"].add(sql)
+
+
 class _PgCursor:
 
     """Cursor wrapper to:
     - translate SQLite '?' placeholders -> psycopg2 '%s'
-    - return psycopg2 DictRow (supports both dict and index access)
+    - return _RowCI rows (both dict and index access) over psycopg2 tuples
+    - ripetere UNA volta lo statement se il socket era morto e non c'era
+      una transazione in corso (nessun lavoro non committato da perdere)
     """
-    def __init__(self, cur):
+    def __init__(self, cur, owner=None):
         self._cur = cur
+        self._owner = owner
+        self._desc = None
+        self._names = ()
+        self._idx = {}
+
+    def _columns(self):
+        # description cambia a ogni execute: l'indice si ricalcola solo allora
+        desc = self._cur.description
+        if desc is not self._desc:
+            self._desc = desc
+            self._names = tuple(d[0] for d in desc) if desc else ()
+            self._idx = _column_index(self._names)
+        return self._names, self._idx
 
     @staticmethod
     def _adapt_sql(sql: str) -> str:
-        # naive but effective for this app: replace all '?' placeholders
-        return sql.replace("?", "%s")
+        # stessa query = stessa traduzione: cache LRU (vedi sql_cache_stats)
+        return _adapt_sql_cached(sql)
 
     def _clear_if_aborted(self):
         # ANTI-CASCATA: se un errore precedente ha lasciato la transazione
@@ -2132,13 +2414,43 @@ class _PgCursor:
         except Exception:
             pass
 
-    def execute(self, sql, params=None):
-        sql2 = self._adapt_sql(str(sql))
-        self._clear_if_aborted()
+    def _idle_before(self) -> bool:
         try:
-            if params is None:
-                return self._cur.execute(sql2)
-            return self._cur.execute(sql2, params)
+            return self._cur.connection.get_transaction_status() == 0
+        except Exception:
+            return False
+
+    def _retry_after_disconnect(self, was_idle: bool) -> bool:
+        """True se il socket è caduto con la connessione a riposo: in quel caso
+        riconnette e sostituisce il cursore, così lo statement si può ripetere."""
+        if self._owner is None or not was_idle:
+            return False
+        try:
+            if not self._cur.connection.closed:
+                return False
+        except Exception:
+            pass
+        try:
+            self._owner._reconnect()
+            self._cur = self._owner._conn.cursor()
+        except Exception:
+            return False
+        _LIVENESS_STATS["retries"] += 1
+        return True
+
+    def _run(self, method, sql2, params):
+        was_idle = self._idle_before()
+        try:
+            try:
+                if params is None:
+                    return getattr(self._cur, method)(sql2)
+                return getattr(self._cur, method)(sql2, params)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if not self._retry_after_disconnect(was_idle):
+                    raise
+                if params is None:
+                    return getattr(self._cur, method)(sql2)
+                return getattr(self._cur, method)(sql2, params)
         except Exception:
             # If a statement fails, PostgreSQL marks the transaction as aborted.
             # Roll back so subsequent statements don't hit InFailedSqlTransaction.
@@ -2147,37 +2459,44 @@ class _PgCursor:
             except Exception:
                 pass
             raise
+        finally:
+            if self._owner is not None:
+                self._owner._touch()
 
-    def executemany(self, sql, seq_of_params):
+    def execute(self, sql, params=None):
         sql2 = self._adapt_sql(str(sql))
         self._clear_if_aborted()
-        try:
-            return self._cur.executemany(sql2, seq_of_params)
-        except Exception:
+        conn = self._cur.connection
+        stmt = _prepared_statement(conn, sql2, params)
+        if stmt is not None:
+            was_idle = self._idle_before()
             try:
-                self._cur.connection.rollback()
-            except Exception:
-                pass
-            raise
+                return self._run("execute", stmt, params)
+            except psycopg2.Error:
+                # es. "cached plan must not change result type" dopo un ALTER
+                # TABLE: si torna alla query normale (solo se non c'era una
+                # transazione in corso da preservare)
+                _forget_prepared(conn, sql2)
+                if not was_idle:
+                    raise
+        return self._run("execute", sql2, params)
+
+    def executemany(self, sql, seq_of_params):
+        sql2 = self._adapt_sql(str(sql))
+        self._clear_if_aborted()
+        return self._run("executemany", sql2, seq_of_params)
 
     def fetchone(self):
         row = self._cur.fetchone()
         if row is None:
             return None
-        try:
-            return _RowCI(dict(row), list(row))
-        except Exception:
-            return row
+        names, idx = self._columns()
+        return _RowCI(row, names, idx)
 
     def fetchall(self):
         rows = self._cur.fetchall()
-        out = []
-        for r in rows:
-            try:
-                out.append(_RowCI(dict(r), list(r)))
-            except Exception:
-                out.append(r)
-        return out
+        names, idx = self._columns()
+        return [_RowCI(r, names, idx) for r in rows]
 
     @property
     def rowcount(self):
@@ -2194,48 +2513,73 @@ class _PgCursor:
             return None
 
 
+def _pg_connect(db_url: str, options: str):
+    """Apre una connessione psycopg2 con keepalive TCP e timeout di connessione."""
+    return psycopg2.connect(
+        db_url,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=5,
+        connect_timeout=10,
+        options=options,
+    )
+
+
 class _PgConn:
     """Connection wrapper to emulate the minimal sqlite3 API used by the app.
     
     Aggiunge keepalive automatico: se la connessione Postgres è scaduta/ibernata,
     la ricrea trasparentemente prima di restituire il cursore.
+
+    Se creato da un `_PgPool` la connessione è "in prestito" per la durata di
+    un run dello script: `close()` annulla solo la transazione aperta (molti
+    moduli chiamano conn.close() a fine funzione) e la restituzione vera al
+    pool avviene con `release()`.
     """
-    def __init__(self, conn, options="-c statement_timeout=30000"):
+    # marcatore esplicito del backend per i moduli che scrivono SQL diverso
+    # per Postgres e SQLite (la connessione sqlite3 non ha l'attributo)
+    backend = "postgres"
+
+    def __init__(self, conn, options="-c statement_timeout=30000", pool=None, idle_ping_s: float = 300.0,
+                 last_used: float | None = None):
         self._conn = conn
         self._db_url = _DB_URL  # salvato per reconnect
         self._options = options  # include app.current_studio: va riusato a ogni riconnessione
-        self._last_ping = 0.0    # throttle del ping di rete (vedi _ensure_alive)
+        self._pool = pool
+        self._idle_ping_s = float(idle_ping_s)
+        # ultimo momento in cui il server ci ha risposto (query, commit, ping)
+        self._last_used = time.monotonic() if last_used is None else last_used
+
+    def _touch(self):
+        self._last_used = time.monotonic()
 
     def _reconnect(self):
-        import time
         try:
             self._conn.close()
         except Exception:
             pass
-        self._conn = psycopg2.connect(
-            self._db_url,
-            keepalives=1,
-            keepalives_idle=30,
-            keepalives_interval=10,
-            keepalives_count=5,
-            connect_timeout=10,
-            options=self._options,
-        )
-        self._last_ping = time.time()
+        self._conn = _pg_connect(self._db_url, self._options)
+        _LIVENESS_STATS["reconnects"] += 1
+        self._touch()
 
     def _ensure_alive(self):
         """Mantiene viva la connessione SENZA rallentare ogni query.
 
         Strategia (dal più economico al più costoso):
+          0. connessione già restituita al pool → nuovo prestito
           1. connessione chiusa            → riconnetti
           2. transazione abortita (INERROR)→ rollback LOCALE (istantaneo)
           3. stato UNKNOWN (socket rotto)  → riconnetti
-          4. ping di rete `SELECT 1`       → solo 1 volta ogni 60s, per
-             scovare socket morti senza pagare un round-trip a ogni cursore.
-        Solo il caso 4 fa rete; gli altri sono operazioni locali → niente
-        più attese lunghe né tempeste di riconnessione a ogni query.
+          4. ping di rete `SELECT 1`       → solo se la connessione è rimasta
+             inutilizzata più di `idle_ping_s` secondi ([db] IDLE_PING_SECONDS).
+        Una connessione usata di recente costa zero round-trip in più: se il
+        socket è comunque caduto, _PgCursor riconnette e ripete lo statement.
         """
-        import time
+        # 0) riferimento rimasto in mano dopo release(): si riprende in prestito
+        if self._conn is None and self._pool is not None:
+            self._pool._reacquire(self)
+            return
         # 1) chiusa?
         try:
             if self._conn.closed:
@@ -2253,35 +2597,41 @@ class _PgConn:
             if status == 3:          # INERROR → transazione abortita: ripulisci
                 try:
                     self._conn.rollback()
+                    self._touch()
                 except Exception:
                     self._reconnect()
                     return
         except Exception:
             self._reconnect()
             return
-        # 4) ping di rete throttlato (max 1/min)
-        now = time.time()
-        if now - self._last_ping > 60:
+        # 4) ping di rete solo dopo un lungo periodo di inattività, e mai dentro
+        #    una transazione aperta (il rollback del ping la annullerebbe)
+        if status != 0 or time.monotonic() - self._last_used < self._idle_ping_s:
+            _LIVENESS_STATS["avoided"] += 1
+            return
+        _LIVENESS_STATS["performed"] += 1
+        try:
+            c = self._conn.cursor()
+            c.execute("SELECT 1")
+            c.fetchone()
+            c.close()
             try:
-                c = self._conn.cursor()
-                c.execute("SELECT 1")
-                c.fetchone()
-                c.close()
-                try:
-                    self._conn.rollback()  # chiude la mini-transazione del ping
-                except Exception:
-                    pass
-                self._last_ping = now
+                self._conn.rollback()  # chiude la mini-transazione del ping
             except Exception:
-                self._reconnect()
+                pass
+            self._touch()
+        except Exception:
+            self._reconnect()
 
     def cursor(self):
         self._ensure_alive()
-        # DictCursor yields DictRow which supports both mapping and sequence access
-        return _PgCursor(self._conn.cursor(cursor_factory=psycopg2.extras.DictCursor))
+        # cursore psycopg2 semplice (righe tuple): _PgCursor le espone come _RowCI
+        return _PgCursor(self._conn.cursor(), owner=self)
 
     def commit(self):
-        return self._conn.commit()
+        out = self._conn.commit()
+        self._touch()
+        return out
 
     def rollback(self):
         try:
@@ -2290,11 +2640,20 @@ class _PgConn:
             pass
 
     def close(self):
+        if self._pool is not None:
+            # In prestito dal pool: il socket resta aperto per il resto del run,
+            # scartiamo solo il lavoro non committato (come farebbe una close vera).
+            return self.rollback()
         try:
             return self._conn.close()
         except Exception:
             pass
 
+    def release(self):
+        """Restituisce la connessione al pool (no-op se non è in prestito)."""
+        if self._pool is not None and self._conn is not None:
+            self._pool.checkin(self)
+
     @property
     def closed(self):
         try:
@@ -2302,6 +2661,146 @@ class _PgConn:
         except Exception:
             return True
 
+
+class _PgPool:
+    """Pool di connessioni PostgreSQL per UNO studio.
+
+    - `minconn` connessioni aperte subito, fino a `maxconn` su richiesta;
+    - oltre `maxconn` chi chiede una connessione aspetta (max `timeout` s)
+      che un altro run la restituisca, poi solleva PoolError;
+    - ogni connessione usa le stesse `options` (app.current_studio per RLS);
+    - i prestiti di thread ormai terminati (run interrotti senza release)
+      vengono recuperati automaticamente quando il pool è pieno.
+    """
+    def __init__(self, db_url: str, options: str, minconn: int = 1, maxconn: int = 8, timeout: float = 15.0,
+                 idle_ping_s: float = 300.0):
+        self._db_url = db_url
+        self._options = options
+        self.minconn = max(0, int(minconn))
+        self.maxconn = max(1, int(maxconn), self.minconn)
+        self.timeout = float(timeout)
+        self.idle_ping_s = float(idle_ping_s)
+        self._cond = threading.Condition()
+        self._idle = []          # (psycopg2 conn, last_used) liberi (LIFO: la più calda in cima)
+        self._leased = {}        # id(wrapper) -> (wrapper, thread proprietario)
+        self._size = 0           # connessioni aperte (libere + in prestito)
+        self._waiters = 0
+        self._stats = {"checkouts": 0, "timeouts": 0, "reclaimed": 0, "discarded": 0,
+                       "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+        for _ in range(self.minconn):
+            self._idle.append((_pg_connect(self._db_url, self._options), time.monotonic()))
+            self._size += 1
+
+    def _reclaim_orphans(self):
+        # chiamata con self._cond acquisito
+        for key, (wrapper, owner) in list(self._leased.items()):
+            if not owner.is_alive():
+                self._stats["reclaimed"] += 1
+                self._checkin_locked(wrapper)
+
+    def _take_raw(self):
+        """Restituisce (connessione psycopg2, last_used): una libera o una nuova."""
+        t0 = time.perf_counter()
+        with self._cond:
+            deadline = t0 + self.timeout
+            while True:
+                if self._idle:
+                    raw, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    raw = None
+                    break
+                self._reclaim_orphans()
+                if self._idle:
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise psycopg2.pool.PoolError(
+                        f"Pool connessioni esaurito ({self.maxconn} in uso) dopo {self.timeout:g}s di attesa")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+        if raw is None:
+            try:
+                raw = _pg_connect(self._db_url, self._options)
+                last_used = time.monotonic()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        wait_ms = (time.perf_counter() - t0) * 1000.0
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+        return raw, last_used
+
+    def checkout(self) -> "_PgConn":
+        raw, last_used = self._take_raw()
+        wrapper = _PgConn(raw, options=self._options, pool=self,
+                          idle_ping_s=self.idle_ping_s, last_used=last_used)
+        with self._cond:
+            self._leased[id(wrapper)] = (wrapper, threading.current_thread())
+        return wrapper
+
+    def _reacquire(self, wrapper: "_PgConn"):
+        wrapper._conn, wrapper._last_used = self._take_raw()
+        with self._cond:
+            self._leased[id(wrapper)] = (wrapper, threading.current_thread())
+
+    def _checkin_locked(self, wrapper: "_PgConn"):
+        self._leased.pop(id(wrapper), None)
+        raw, wrapper._conn = wrapper._conn, None
+        if raw is None:
+            return
+        keep = False
+        try:
+            if not raw.closed:
+                status = raw.get_transaction_status()
+                if status != 4:
+                    if status != 0:      # transazione aperta o abortita: non passarla al prossimo run
+                        raw.rollback()
+                    keep = True
+        except Exception:
+            keep = False
+        if keep:
+            self._idle.append((raw, wrapper._last_used))
+        else:
+            self._size -= 1
+            self._stats["discarded"] += 1
+            try:
+                raw.close()
+            except Exception:
+                pass
+        self._cond.notify()
+
+    def checkin(self, wrapper: "_PgConn"):
+        with self._cond:
+            self._checkin_locked(wrapper)
+
+    def stats(self) -> dict:
+        with self._cond:
+            n = self._stats["checkouts"]
+            return {
+                "size": self._size,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": len(self._leased),
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "checkouts": n,
+                "timeouts": self._stats["timeouts"],
+                "reclaimed": self._stats["reclaimed"],
+                "discarded": self._stats["discarded"],
+                "checkout_ms_avg": round(self._stats["wait_ms_total"] / n, 2) if n else 0.0,
+                "checkout_ms_max": round(self._stats["wait_ms_max"], 2),
+            }
+
 def _secrets_diagnostics():
     """Return non-sensitive diagnostics about Streamlit secrets/env.
 
@@ -2489,66 +2988,160 @@ DATABASE_URL = "postgresql://...sslmode=require"
 
 Poi premi Save e riavvia l'app (Reboot).""")
         st.stop()
+def _pool_settings() -> dict:
+    """Dimensioni del pool da Secrets: [db] POOL_MIN, POOL_MAX, POOL_TIMEOUT,
+    IDLE_PING_SECONDS (soglia di inattività oltre cui si verifica il socket),
+    PREPARE_HOT_AFTER (vedi _prepared_statement)."""
+    out = {"minconn": 1, "maxconn": 8, "timeout": 15.0, "idle_ping_s": 300.0}
+    try:
+        dbsec = _safe_secrets().get("db", {})
+        if isinstance(dbsec, dict) or hasattr(dbsec, "get"):
+            out["minconn"] = int(dbsec.get("POOL_MIN", out["minconn"]))
+            out["maxconn"] = int(dbsec.get("POOL_MAX", out["maxconn"]))
+            out["timeout"] = float(dbsec.get("POOL_TIMEOUT", out["timeout"]))
+            out["idle_ping_s"] = float(dbsec.get("IDLE_PING_SECONDS", out["idle_ping_s"]))
+            out["prepare_hot_after"] = int(dbsec.get("PREPARE_HOT_AFTER", 0))
+    except Exception:
+        pass
+    return out
+
+
+# studio_id -> _PgPool, per la diagnostica (st.cache_resource non è enumerabile)
+_POOLS: dict = {}
+
+
 @st.cache_resource
-def _connect_cached(studio_id: int = 1):
-    """Connessione DB con cache — UNA per studio. Imposta app.current_studio
-    a livello di connessione: l'isolamento multi-tenant (RLS) è quindi garantito
-    dal database, e ogni studio ha la sua connessione (niente race condition)."""
+def _pool_cached(studio_id: int = 1):
+    """Pool di connessioni — UNO per studio. Ogni connessione del pool imposta
+    app.current_studio: l'isolamento multi-tenant (RLS) è garantito dal
+    database e le sessioni dello stesso studio non condividono più lo stesso
+    socket né la stessa transazione."""
     _require_postgres_on_cloud()
-    if _DB_BACKEND == "postgres":
-        if not PSYCOPG2_AVAILABLE:
-            raise RuntimeError("psycopg2 non disponibile. Aggiungi psycopg2-binary a requirements.txt")
+    if not PSYCOPG2_AVAILABLE:
+        raise RuntimeError("psycopg2 non disponibile. Aggiungi psycopg2-binary a requirements.txt")
 
-        try:
-            _sid = int(studio_id)
-        except (TypeError, ValueError):
-            _sid = 1
+    try:
+        _sid = int(studio_id)
+    except (TypeError, ValueError):
+        _sid = 1
 
-        _opts = f"-c statement_timeout=30000 -c app.current_studio={_sid}"
-        try:
-            conn = psycopg2.connect(
-                _DB_URL,
-                keepalives=1,
-                keepalives_idle=30,
-                keepalives_interval=10,
-                keepalives_count=5,
-                connect_timeout=10,
-                options=_opts,
-            )
-        except Exception:
-            # Non-leak diagnostics (does not print the URL)
-            u = _DB_URL or ""
-            st.error("❌ Errore connessione PostgreSQL (OVH). La DATABASE_URL non sembra in un formato valido per psycopg2.")
-            st.write({
-                "db_url_len": len(u),
-                "db_url_has_whitespace": any(ch.isspace() for ch in u),
-                "db_url_scheme": (u.split("://", 1)[0] if "://" in u else "<missing>"),
-                "hint_1": "Verifica che sia su UNA sola riga nei Secrets (nessun a capo).",
-                "hint_2": "Usa lo schema 'postgresql://'.",
-                "hint_3": "Se la password contiene caratteri speciali (@ : / ? # & %), deve essere URL-encoded (es. @ -> %40).",
-            })
-            st.stop()
+    _opts = f"-c statement_timeout=30000 -c app.current_studio={_sid}"
+    try:
+        _cfg = _pool_settings()
+        _cfg.pop("prepare_hot_after", None)
+        pool = _PgPool(_DB_URL, _opts, **_cfg)
+    except Exception:
+        # Non-leak diagnostics (does not print the URL)
+        u = _DB_URL or ""
+        st.error("❌ Errore connessione PostgreSQL (OVH). La DATABASE_URL non sembra in un formato valido per psycopg2.")
+        st.write({
+            "db_url_len": len(u),
+            "db_url_has_whitespace": any(ch.isspace() for ch in u),
+            "db_url_scheme": (u.split("://", 1)[0] if "://" in u else "<missing>"),
+            "hint_1": "Verifica che sia su UNA sola riga nei Secrets (nessun a capo).",
+            "hint_2": "Usa lo schema 'postgresql://'.",
+            "hint_3": "Se la password contiene caratteri speciali (@ : / ? # & %), deve essere URL-encoded (es. @ -> %40).",
+        })
+        st.stop()
+    _POOLS[_sid] = pool
+    return pool
 
-        return _PgConn(conn, options=_opts)
 
-    # SQLite (locale / fallback)
+@st.cache_resource
+def _connect_cached(studio_id: int = 1):
+    """Connessione SQLite (locale / fallback) con cache."""
+    _require_postgres_on_cloud()
     conn = sqlite3.connect(SQLITE_DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+# Connessioni in prestito al run corrente dello script: {studio_id: _PgConn}.
+# Ogni run di Streamlit gira nel proprio thread, quindi thread-local = per-run.
+_RUN_LEASES = threading.local()
+
+
+def _run_leases() -> dict:
+    d = getattr(_RUN_LEASES, "by_studio", None)
+    if d is None:
+        d = {}
+        _RUN_LEASES.by_studio = d
+    return d
+
+
+def release_run_connections() -> None:
+    """Restituisce al pool le connessioni prese in prestito da questo run.
+
+    Va chiamata a fine run: da main() e, nelle pages/*.py che girano fuori da
+    main(), nel finally attorno al corpo della pagina."""
+    d = _run_leases()
+    while d:
+        _sid, conn = d.popitem()
+        try:
+            conn.release()
+        except Exception:
+            pass
+
+
+def pool_stats() -> dict:
+    """Metriche dei pool attivi: {studio_id: {in_use, waiters, checkout_ms_avg, ...}}."""
+    return {sid: pool.stats() for sid, pool in sorted(_POOLS.items())}
+
+
+def sql_cache_stats() -> dict:
+    """Cache della traduzione SQL (hit/miss) e uso dei prepared statement."""
+    info = _adapt_sql_cached.cache_info()
+    tot = info.hits + info.misses
+    return {
+        "translate_hits": info.hits,
+        "translate_misses": info.misses,
+        "translate_hit_rate": round(info.hits / tot, 4) if tot else 0.0,
+        "translate_size": info.currsize,
+        "prepare_hot_after": _prepare_hot_after(),
+        **_SQL_STATS,
+    }
+
+
+def liveness_stats() -> dict:
+    """Ping SELECT 1 evitati/eseguiti, riconnessioni e statement ripetuti."""
+    return dict(_LIVENESS_STATS)
+
+
 def get_connection():
     # Legge lo studio della sessione (default 1 = studio attuale/produzione) e
     # restituisce la connessione dedicata a quello studio. Firma invariata: i
     # moduli continuano a chiamare get_connection() senza modifiche.
+    # Su PostgreSQL la connessione è presa in prestito dal pool alla prima
+    # chiamata del run e riusata fino a release_run_connections() (fine run).
     try:
         _sid = int(st.session_state.get("studio_id", 1) or 1)
     except Exception:
         _sid = 1
-    return _connect_cached(_sid)
+    if _DB_BACKEND != "postgres":
+        return _connect_cached(_sid)
+    leases = _run_leases()
+    conn = leases.get(_sid)
+    if conn is None:
+        conn = _pool_cached(_sid).checkout()
+        leases[_sid] = conn
+    return conn
 
-def init_db() -> None:
-    conn = get_connection()
+def init_db() -> dict:
+    """Verifica/applica lo schema: DDL vere solo al primo avvio del processo
+    (o quando il codice di un passo cambia), vedi modules/schema_migrations."""
+    from modules.schema_migrations import esegui_migrazioni
+    from modules.ricerca_pazienti import crea_indici_ricerca
+    passi = [(1, "init_db", _init_db_schema)]
+    if _DB_BACKEND == "postgres":
+        passi.append((2, "auth_schema", ensure_auth_schema))
+    passi.append((3, "indici_ricerca_pazienti", crea_indici_ricerca))
+    if _DB_BACKEND == "postgres":
+        from modules.storico_snapshot import crea_trigger_storico
+        passi.append((4, "trigger_storico_paziente", crea_trigger_storico))
+    return esegui_migrazioni(get_connection(), _DB_BACKEND, passi)
+
+
+def _init_db_schema(conn) -> None:
     cur = conn.cursor()
 
     if _DB_BACKEND == "sqlite":
@@ -2809,7 +3402,7 @@ def init_db() -> None:
     # -------------------------
     # PostgreSQL (OVH) init
     # -------------------------
-    # Reset difensivo della transazione: se la connessione cached (st.cache_resource)
+    # Reset difensivo della transazione: se la connessione presa dal pool
     # aveva una transazione abortita da una run precedente, qui la puliamo prima
     # di iniziare le DDL. Altrimenti tutte le CREATE TABLE successive fallirebbero
     # con `InFailedSqlTransaction: current transaction is aborted`.
@@ -3648,11 +4241,11 @@ def insert_privacy_consent(cur, paziente_id: int, payload: dict):
             _bool_i(payload.get("Canale_SMS")),
             _bool_i(payload.get("Canale_WhatsApp")),
             _bool_i(payload.get("Usa_Klaviyo")),
-            payload.get("Firma_Blob"),
+            _blob_conserva(payload.get("Firma_Blob")),
             payload.get("Firma_Filename") or "",
             payload.get("Firma_URL") or "",
             payload.get("Firma_Source") or "",
-            payload.get("Pdf_Blob"),
+            _blob_conserva(payload.get("Pdf_Blob")),
             payload.get("Pdf_Filename") or "",
             payload.get("Note") or "",
         ),
@@ -4906,6 +5499,7 @@ def ui_db_cleanup():
             try:
                 rep = db_merge_patients(cur, master_id=master_id, dup_ids=dup_ids)
                 conn.commit()
+                invalida_ricerca_pazienti()
                 st.success(f"Merge completato. Master: {master_id}. Eliminati: {rep['deleted']}")
                 # Dopo merge: mantieni SOLO l'ultimo consenso privacy (come richiesto)
                 try:
@@ -5165,6 +5759,7 @@ def ui_pazienti():
             )
 
             conn.commit()
+            invalida_ricerca_pazienti()
             st.success("Paziente salvato correttamente (privacy registrata).")
 
         except Exception as e:
@@ -5351,12 +5946,14 @@ def ui_pazienti():
         if st.button("Archivia paziente", key="archivia"):
             cur.execute("UPDATE Pazienti SET Stato_Paziente = 'ARCHIVIATO' WHERE id = %s", (sel_id,))
             conn.commit()
+            invalida_ricerca_pazienti()
             st.success("Paziente archiviato.")
             st.experimental_rerun() if hasattr(st, "experimental_rerun") else st.rerun()
     with col_b:
         if st.button("Riattiva paziente", key="riattiva"):
             cur.execute("UPDATE Pazienti SET Stato_Paziente = 'ATTIVO' WHERE id = %s", (sel_id,))
             conn.commit()
+            invalida_ricerca_pazienti()
             st.success("Paziente riattivato.")
             st.experimental_rerun() if hasattr(st, "experimental_rerun") else st.rerun()
     with col_c:
@@ -5404,6 +6001,7 @@ def ui_pazienti():
                             except Exception: pass
                     cur.execute("DELETE FROM Pazienti WHERE id = %s", (sel_id,))
                     conn.commit()
+                    invalida_ricerca_pazienti()
                     st.session_state["confirm_elimina_paz_id"] = None
                     st.success(f"Paziente {rec['Cognome']} {rec['Nome']} eliminato definitivamente.")
                     conn.close()
@@ -5509,6 +6107,7 @@ def ui_pazienti():
                 ),
             )
             conn.commit()
+            invalida_ricerca_pazienti()
             st.success("Dati paziente aggiornati.")
 
     conn.close()
@@ -5854,6 +6453,7 @@ def ui_anamnesi():
             (paz_id, data_iso, motivo, storia, note, pnev_dumped, (pnev_summary_new or "")),
         )
         conn.commit()
+        invalida_riepilogo_paziente(paz_id)
         st.success("Valutazione PNEV salvata.")
         st.rerun()
 
@@ -6140,6 +6740,7 @@ def ui_anamnesi():
             (data_iso_m, motivo_m, (pnev_summary_m or ""), note_m, pnev_dumped_m, (pnev_summary_m or ""), an_id),
         )
         conn.commit()
+        invalida_riepilogo_paziente(paz_id)
         st.success("Valutazione PNEV aggiornata.")
         st.rerun()
 
@@ -6153,6 +6754,7 @@ def ui_anamnesi():
             if st.button("Conferma eliminazione PNEV", key="del_pnev_yes", type="primary"):
                 cur.execute("DELETE FROM anamnesi WHERE id = %s", (an_id,))
                 conn.commit()
+                invalida_riepilogo_paziente(paz_id)
                 st.session_state["confirm_del_pnev"] = None
                 st.success("Valutazione PNEV eliminata.")
                 st.rerun()
@@ -7355,6 +7957,7 @@ def ui_sedute():
             ),
         )
         conn.commit()
+        invalida_riepilogo_paziente(paz_id)
         st.success("Seduta salvata.")
 
     st.markdown("---")
@@ -7432,6 +8035,7 @@ def ui_sedute():
             ),
         )
         conn.commit()
+        invalida_riepilogo_paziente(paz_id)
         st.success("Seduta aggiornata.")
 
     if cancella:
@@ -7444,6 +8048,7 @@ def ui_sedute():
             if st.button("Conferma eliminazione seduta", key="del_sed_yes", type="primary"):
                 cur.execute("DELETE FROM Sedute WHERE id = %s", (sed_id,))
                 conn.commit()
+                invalida_riepilogo_paziente(paz_id)
                 st.session_state["confirm_del_sed"] = None
                 st.success("Seduta eliminata.")
                 st.rerun()
@@ -7608,6 +8213,7 @@ def ui_coupons():
                             "UPDATE Coupons SET Utilizzato = %s, Luogo_Utilizzo = %s WHERE id = %s",
                             (1 if nuovo_usato else 0, luogo.strip() or None, cid))
                         conn.commit()
+                        invalida_riepilogo_paziente()
                         st.success("Coupon aggiornato.")
                         st.rerun()
                     except Exception as e:
@@ -7682,6 +8288,7 @@ def ui_coupons():
             ),
         )
         conn.commit()
+        invalida_riepilogo_paziente(paz_id)
         st.success("Coupon aggiunto correttamente.")
         st.rerun()
 
@@ -7727,6 +8334,7 @@ def ui_coupons():
                         (c["id"],),
                     )
                     conn.commit()
+                    invalida_riepilogo_paziente(paz_id)
                     st.rerun()
             else:
                 if st.button("Segna USATO", key=f"c_used_{c['id']}"):
@@ -7735,6 +8343,7 @@ def ui_coupons():
                         (c["id"],),
                     )
                     conn.commit()
+                    invalida_riepilogo_paziente(paz_id)
                     st.rerun()
         with col4:
             if st.button("Elimina", key=f"c_del_{c['id']}"):
@@ -7749,6 +8358,7 @@ def ui_coupons():
             if st.button("Conferma eliminazione coupon", key="del_coup_yes", type="primary"):
                 cur.execute("DELETE FROM Coupons WHERE id = %s", (del_coup_id,))
                 conn.commit()
+                invalida_riepilogo_paziente()
                 st.session_state["confirm_del_coup"] = None
                 st.success("Coupon eliminato.")
                 st.rerun()
@@ -8604,52 +9214,6 @@ def _sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
 
-def _s3_put_private(key: str, data: bytes, content_type: str = "application/pdf") -> tuple[bool, str]:
-    """Upload bytes to private S3. Never raises. Returns (ok, message)."""
-    try:
-        cli = _s3_client()
-        cli.put_object(
-            Bucket=_s3_bucket(),
-            Key=key,
-            Body=data,
-            ContentType=content_type,
-        )
-        return True, "OK"
-    except Exception as e:
-        try:
-            import botocore
-            if isinstance(e, botocore.exceptions.ClientError):
-                err = getattr(e, "response", {}).get("Error", {})
-                code = err.get("Code", "ClientError")
-                msg = err.get("Message", "")
-                return False, f"{code}: {msg}"
-        except Exception as e:
-            pass
-        return False, f"{type(e).__name__}: {e}"
-
-
-def _s3_put_private(key: str, data: bytes, content_type: str = "application/pdf") -> tuple[bool, str]:
-    """Upload bytes to private S3. Never raises. Returns (ok, message)."""
-    try:
-        cli = _s3_client()
-        cli.put_object(
-            Bucket=_s3_bucket(),
-            Key=key,
-            Body=data,
-            ContentType=content_type,
-        )
-        return True, "OK"
-    except Exception as e:
-        try:
-            import botocore
-            if isinstance(e, botocore.exceptions.ClientError):
-                err = getattr(e, "response", {}).get("Error", {})
-                return False, f"{err.get('Code','ClientError')}: {err.get('Message','')}"
-        except Exception as e:
-            pass
-        return False, f"{type(e).__name__}: {e}"
-
-
 def _s3_client():
     if boto3 is None:
         raise RuntimeError("Manca boto3. Aggiungi 'boto3' in requirements.txt")
@@ -8715,6 +9279,7 @@ def _s3_presign_get(key: str) -> str:
     )
 
 def _db_insert_documento(conn, paziente_id: int, tipo: str, s3_key: str, sha256: str, filename: str, blob: bytes | None = None):
+    blob = _blob_conserva(blob)
     cur = conn.cursor()
     if _DB_BACKEND == "sqlite":
         cur.execute(
@@ -9805,28 +10370,9 @@ def _ensure_audiogram_tables(conn):
 
 
 def _tone_wav_bytes(freq_hz: int, dbfs: float, seconds: float = 0.6, sr: int = 44100) -> bytes:
-    import io, wave
-    import numpy as _np
-    # dbfs -> amp lineare
-    amp = 10 ** (float(dbfs) / 20.0)
-    amp = max(0.0, min(0.9, amp))
-    t = _np.linspace(0, seconds, int(sr * seconds), endpoint=False)
-    x = amp * _np.sin(2 * _np.pi * float(freq_hz) * t)
-    fade = int(sr * 0.02)
-    if fade > 0 and len(x) > 2 * fade:
-        w = _np.ones_like(x)
-        w[:fade] = _np.linspace(0, 1, fade)
-        w[-fade:] = _np.linspace(1, 0, fade)
-        x = x * w
-    pcm = _np.int16(_np.clip(x, -1, 1) * 32767)
-
-    buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(sr)
-        wf.writeframes(pcm.tobytes())
-    return buf.getvalue()
+    # banca toni di processo: periodo per frequenza + scala intera + cache WAV
+    from modules.tone_bank import tone_wav_bytes
+    return tone_wav_bytes(freq_hz, dbfs, seconds=seconds, sr=sr)
 
 
 # ======================================
@@ -10317,6 +10863,22 @@ def ui_audiogramma_test():
     st.audio(_tone_wav_bytes(int(freq), float(dbfs)), format="audio/wav")
     st.caption("Premi play, regola il livello finché trovi la soglia; inserisci il valore finale e salva.")
 
+    with st.expander("Player precaricato (tutte le frequenze, senza ricaricare la pagina)"):
+        import streamlit.components.v1 as _components
+        from modules.tone_bank import export_tone_bank_zip, tone_bank_player_html
+        _components.html(
+            tone_bank_player_html(freqs, dbfs_start=float(dbfs), key_prefix="audiogr"),
+            height=130,
+        )
+        st.caption("Trovata la soglia nel player, riportala qui sotto in 'Soglia finale'.")
+        st.download_button(
+            "⬇️ Esporta banca toni (ZIP, -90..-5 dBFS)",
+            data=export_tone_bank_zip(freqs),
+            file_name="banca_toni_audiometria.zip",
+            mime="application/zip",
+            key="audiogr_bank_zip",
+        )
+
     thr = st.number_input("Soglia finale (dBFS) da salvare", value=float(dbfs), step=5.0)
 
     if st.button("Salva punto", key="save_audio_point"):
@@ -11763,6 +12325,15 @@ def ui_sessione_stimolazione_uditiva_test():
 
 
 def main():
+    # Ogni run dello script prende in prestito (get_connection) le connessioni
+    # dal pool e le restituisce qui, anche quando termina con st.stop()/st.rerun().
+    try:
+        _main_run()
+    finally:
+        release_run_connections()
+
+
+def _main_run():
     # Reset ad ogni caricamento pagina (non deve crescere all'infinito tra
     # un rerun e l'altro, altrimenti le chiavi dei widget del paziente
     # attivo cambiano ogni volta e perdono lo stato, es. selezione AgGrid).
@@ -11852,12 +12423,12 @@ def main():
     # fallisce, puliamo la transazione e proseguiamo: le tabelle base esistono
     # già in produzione, le migrazioni si ritentano al prossimo avvio.
     #
-    # VELOCITÀ: init_db() fa una serie di CREATE/ALTER TABLE (controlli DDL)
-    # — inutile ripeterli a ogni singolo clic sulla sidebar (ogni clic fa
-    # ripartire l'intero script). Lo eseguiamo una sola volta per sessione.
+    # VELOCITÀ: init_db() passa dal runner di modules/schema_migrations: le
+    # DDL girano solo al primo avvio del processo (o se un passo è cambiato);
+    # dopo, anche per le nuove sessioni, è un no-op senza query.
     if not st.session_state.get("_db_initialized"):
         try:
-            init_db()
+            init_db()   # esito nel log di modules.schema_migrations
             st.session_state["_db_initialized"] = True
         except Exception as _e_init:
             try:
@@ -20,37 +20,12 @@ from .app_menu import (
 # ══════════════════════════════════════════════════════════════════════
 
 def _seleziona_paziente(conn, key_suffix: str = "") -> tuple[int | None, str]:
-    """Selettore paziente — ritorna (id, label)."""
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, Cognome, Nome, Data_Nascita FROM Pazienti "
-            "WHERE COALESCE(Stato_Paziente,'ATTIVO')='ATTIVO' "
-            "ORDER BY Cognome, Nome"
-        )
-        rows = cur.fetchall() or []
-    except Exception as e:
-        st.error(f"Errore caricamento pazienti: {e}")
-        return None, ""
-
-    if not rows:
-        st.info("Nessun paziente registrato.")
-        return None, ""
-
-    def _label(r):
-        if isinstance(r, dict):
-            pid = r.get("id"); c = r.get("Cognome",""); n = r.get("Nome","")
-            dn  = r.get("Data_Nascita","")
-        else:
-            pid, c, n = r[0], r[1], r[2]
-            dn = r[3] if len(r) > 3 else ""
-        return f"{pid} — {c} {n}" + (f" · {dn}" if dn else "")
+    """Selettore paziente — ritorna (id, label).
 
-    sel = st.selectbox("👤 Paziente", options=rows,
-                       format_func=_label, key=f"paz_{key_suffix}")
-    if isinstance(sel, dict):
-        return int(sel.get("id")), _label(sel)
-    return int(sel[0]), _label(sel)
+    Ricerca lato server mentre si digita, a pagine (modules.ricerca_pazienti).
+    """
+    from .ricerca_pazienti import selettore_paziente
+    return selettore_paziente(conn, key=f"paz_{key_suffix}")
 
 
 # ══════════════════════════════════════════════════════════════════════
@@ -152,29 +127,31 @@ def _render_dashboard(conn) -> None:
         )
 
     # ── Nuovi contatti arrivati dal sito pnev.it ──────────────────────
-    try:
-        _cur = conn.cursor()
-        _cur.execute("SELECT count(*) FROM lead_sito WHERE stato='nuovo'")
-        _n_lead = int(_cur.fetchone()[0] or 0)
-    except Exception:
-        _n_lead = 0
-    if _n_lead:
-        _cav1, _cav2 = st.columns([4, 1])
-        _cav1.warning(
-            f"📨 **{_n_lead} " +
-            ("nuovo contatto" if _n_lead == 1 else "nuovi contatti") +
-            " dal sito pnev.it** — hanno giocato e lasciato i dati.")
-        if _cav2.button("Vai ai contatti", key="dash_goto_lead",
-                        use_container_width=True):
-            st.session_state["goto_area"] = "👥 Pazienti"
-            st.session_state["goto_sotto"] = "📨 Contatti dal sito"
-            st.rerun()
+    # Il conteggio arriva con il riepilogo del paziente (stessa query): qui
+    # si riserva solo il posto, riempito più sotto.
+    _lead_box = st.container()
 
     from .paziente_attivo import header_paziente_attivo, paziente_attivo_record
+    from .riepilogo_paziente import riepilogo_paziente, conteggio_lead_nuovi
     paz_id = header_paziente_attivo(conn)
+    riep = riepilogo_paziente(conn, paz_id) if paz_id else None
+    _n_lead = riep["n_lead"] if riep else conteggio_lead_nuovi(conn)
+    if _n_lead:
+        with _lead_box:
+            _cav1, _cav2 = st.columns([4, 1])
+            _cav1.warning(
+                f"📨 **{_n_lead} " +
+                ("nuovo contatto" if _n_lead == 1 else "nuovi contatti") +
+                " dal sito pnev.it** — hanno giocato e lasciato i dati.")
+            if _cav2.button("Vai ai contatti", key="dash_goto_lead",
+                            use_container_width=True):
+                st.session_state["goto_area"] = "👥 Pazienti"
+                st.session_state["goto_sotto"] = "📨 Contatti dal sito"
+                st.rerun()
     if not paz_id:
         return
     paz_info = paziente_attivo_record() or {}
+    _ko = set(riep["non_disponibili"])
 
     # ── Card paziente ─────────────────────────────────────────────────
     _g = lambda *ks: next((paz_info.get(k) for k in ks if paz_info.get(k)), "")
@@ -208,124 +185,65 @@ def _render_dashboard(conn) -> None:
 
     with col1:
         st.markdown("**📅 Ultima seduta**")
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT Data_Ora, Tipo FROM Sedute "
-                "WHERE paziente_id=%s ORDER BY Data_Ora DESC LIMIT 1",
-                (paz_id,)
-            )
-            s = cur.fetchone()
-            if s:
-                data = _fmt_data(s[0] if not isinstance(s, dict) else s.get("Data_Ora",""))
-                tipo = (s[1] if not isinstance(s, dict) else s.get("Tipo","")) or "—"
-                if st.button(f"📅 {data} — {tipo}", key="dash_go_seduta",
-                             use_container_width=True):
-                    st.session_state["goto_area"] = "👥 Pazienti"
-                    st.session_state["goto_sotto"] = "📅 Sedute / Terapie"
-                    st.session_state["paziente_attivo_id"] = paz_id
-                    st.rerun()
-            else:
-                st.caption("Nessuna seduta")
-        except Exception:
+        s = riep["ultima_seduta"]
+        if "ultima_seduta" in _ko:
             st.caption("—")
+        elif s:
+            data = _fmt_data(s["data"] or "")
+            tipo = s["tipo"] or "—"
+            if st.button(f"📅 {data} — {tipo}", key="dash_go_seduta",
+                         use_container_width=True):
+                st.session_state["goto_area"] = "👥 Pazienti"
+                st.session_state["goto_sotto"] = "📅 Sedute / Terapie"
+                st.session_state["paziente_attivo_id"] = paz_id
+                st.rerun()
+        else:
+            st.caption("Nessuna seduta")
 
     with col2:
         st.markdown("**📋 Questionari**")
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT questionario, used_at, expires_at "
-                "FROM questionari_links "
-                "WHERE paziente_id=%s ORDER BY created_at DESC LIMIT 5",
-                (paz_id,)
-            )
-            links = cur.fetchall() or []
-            if links:
-                for lk in links:
-                    if isinstance(lk, dict):
-                        q    = lk.get("questionario","")
-                        used = lk.get("used_at")
-                        exp  = lk.get("expires_at","")
-                    else:
-                        q, used, exp = lk[0], lk[1], lk[2]
-                    q_clean = q.replace("_"," ").title()
-                    _lbl = f"✅ {q_clean}" if used else f"⏳ {q_clean} — scade {_fmt_data(exp)}"
-                    if st.button(_lbl, key=f"dash_go_quest_{q}", use_container_width=True):
-                        st.session_state["goto_area"] = "📋 Questionari"
-                        st.session_state["goto_sotto"] = "📋 Questionari remoti"
-                        st.session_state["paziente_attivo_id"] = paz_id
-                        st.rerun()
-            else:
-                st.caption("Nessun link inviato")
-        except Exception:
+        links = riep["questionari"]
+        if "questionari" in _ko:
             st.caption("—")
+        elif links:
+            for lk in links:
+                q, used, exp = lk["questionario"], lk["used_at"], lk["expires_at"] or ""
+                q_clean = q.replace("_"," ").title()
+                _lbl = f"✅ {q_clean}" if used else f"⏳ {q_clean} — scade {_fmt_data(exp)}"
+                if st.button(_lbl, key=f"dash_go_quest_{q}", use_container_width=True):
+                    st.session_state["goto_area"] = "📋 Questionari"
+                    st.session_state["goto_sotto"] = "📋 Questionari remoti"
+                    st.session_state["paziente_attivo_id"] = paz_id
+                    st.rerun()
+        else:
+            st.caption("Nessun link inviato")
 
     with col3:
         st.markdown("**🔬 Ultimi test**")
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT nome_test, data_somm FROM somministrazioni_test "
-                "WHERE paziente_id=%s ORDER BY created_at DESC LIMIT 5",
-                (paz_id,)
-            )
-            tests = cur.fetchall() or []
-            if tests:
-                for _i, t in enumerate(tests):
-                    nome = t[0] if not isinstance(t, dict) else t.get("nome_test","")
-                    data = _fmt_data(t[1] if not isinstance(t, dict) else t.get("data_somm",""))
-                    if st.button(f"🔬 {nome} — {data}", key=f"dash_go_test_{_i}",
-                                 use_container_width=True):
-                        st.session_state["goto_area"] = "🖥️ Test live"
-                        st.session_state["goto_sotto"] = "🖥️ Somministrazione test"
-                        st.session_state["paziente_attivo_id"] = paz_id
-                        st.rerun()
-            else:
-                st.caption("Nessun test registrato")
-        except Exception:
+        tests = riep["test"]
+        if "test" in _ko:
             st.caption("—")
+        elif tests:
+            for _i, t in enumerate(tests):
+                nome = t["nome_test"]
+                data = _fmt_data(t["data_somm"] or "")
+                if st.button(f"🔬 {nome} — {data}", key=f"dash_go_test_{_i}",
+                             use_container_width=True):
+                    st.session_state["goto_area"] = "🖥️ Test live"
+                    st.session_state["goto_sotto"] = "🖥️ Somministrazione test"
+                    st.session_state["paziente_attivo_id"] = paz_id
+                    st.rerun()
+        else:
+            st.caption("Nessun test registrato")
 
     # ── Sintesi economica: incassi + coupon ───────────────────────────
     st.markdown("---")
     st.markdown("**💶 Sintesi economica**")
     ce1, ce2, ce3, ce4 = st.columns(4)
-    tot_sedute = tot_terapia = 0.0
-    n_coupon = n_coupon_usati = 0
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT COALESCE(SUM(Pagato),0) FROM Sedute WHERE paziente_id=%s", (paz_id,))
-        r = cur.fetchone()
-        tot_sedute = float(r[0] if not isinstance(r, dict) else list(r.values())[0]) or 0.0
-    except Exception:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT COALESCE(SUM(Incassato),0) FROM terapia_sedute WHERE paziente_id=%s",
-                    (paz_id,))
-        r = cur.fetchone()
-        tot_terapia = float(r[0] if not isinstance(r, dict) else list(r.values())[0]) or 0.0
-    except Exception:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*), COALESCE(SUM(CASE WHEN Utilizzato=1 OR Utilizzato=TRUE "
-                    "THEN 1 ELSE 0 END),0) FROM Coupons WHERE paziente_id=%s", (paz_id,))
-        r = cur.fetchone()
-        if r:
-            n_coupon = int(r[0] if not isinstance(r, dict) else list(r.values())[0]) or 0
-            n_coupon_usati = int(r[1] if not isinstance(r, dict) else list(r.values())[1]) or 0
-    except Exception:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
+    tot_sedute = riep["tot_sedute"]
+    tot_terapia = riep["tot_terapia"]
+    n_coupon = riep["n_coupon"]
+    n_coupon_usati = riep["n_coupon_usati"]
     ce1.metric("Incassato sedute", f"{tot_sedute:,.0f} €".replace(",", "."))
     ce2.metric("Incassato terapie", f"{tot_terapia:,.0f} €".replace(",", "."))
     ce3.metric("Totale complessivo", f"{tot_sedute + tot_terapia:,.0f} €".replace(",", "."))
@@ -356,27 +274,19 @@ def _render_dashboard(conn) -> None:
     # ── Anamnesi ─────────────────────────────────────────────────────
     st.markdown("---")
     st.markdown("**📊 Riepilogo valutazioni**")
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT data_anamnesi, motivo, pnev_summary "
-            "FROM anamnesi WHERE paziente_id=%s "
-            "ORDER BY data_anamnesi DESC LIMIT 1",
-            (paz_id,)
-        )
-        an = cur.fetchone()
-        if an:
-            data_an = _fmt_data(an[0] if not isinstance(an, dict) else an.get("data_anamnesi",""))
-            motivo  = (an[1] if not isinstance(an, dict) else an.get("motivo","")) or "—"
-            summary = (an[2] if not isinstance(an, dict) else an.get("pnev_summary","")) or ""
-            st.success(f"Ultima anamnesi: **{data_an}** — {motivo}")
-            if summary:
-                with st.expander("Leggi sintesi"):
-                    st.markdown(summary[:800] + ("…" if len(summary) > 800 else ""))
-        else:
-            st.info("Nessuna anamnesi registrata.")
-    except Exception:
+    an = riep["anamnesi"]
+    if "anamnesi" in _ko:
         st.caption("—")
+    elif an:
+        data_an = _fmt_data(an["data"] or "")
+        motivo  = an["motivo"] or "—"
+        summary = an["summary"]
+        st.success(f"Ultima anamnesi: **{data_an}** — {motivo}")
+        if summary:
+            with st.expander("Leggi sintesi"):
+                st.markdown(summary[:800] + ("…" if len(summary) > 800 else ""))
+    else:
+        st.info("Nessuna anamnesi registrata.")
 
 
 # ══════════════════════════════════════════════════════════════════════
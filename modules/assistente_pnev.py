@@ -71,16 +71,8 @@ def render_assistente(conn=None, paz_id=None, paziente=None, contesto: str = "",
         st.info("Seleziona prima un paziente.")
         return
 
-    if not isinstance(paziente, dict) or not (paziente.get("Cognome") or paziente.get("Nome")):
-        try:
-            p = carica_paziente(conn, paz_id)
-            if p:
-                paziente = p
-        except Exception:
-            pass
-
     try:
-        from .ai_estrazione import genera_testo, ai_disponibile
+        from .ai_estrazione import genera_testo_stream, ai_disponibile
     except Exception:
         st.warning("Motore AI non disponibile.")
         return
@@ -90,14 +82,31 @@ def render_assistente(conn=None, paz_id=None, paziente=None, contesto: str = "",
                    "l'assistente.")
         return
 
-    storico = _riassunto_storico(conn, paz_id)
-    if not storico and not contesto:
-        st.info("Nessuno storico ancora presente per questo paziente.")
-        return
+    # in coda alle schermate di test (compatto) lo storico si costruisce solo
+    # al clic: i rerun della schermata non toccano il database
+    storico = None
+    if not compatto:
+        storico = _riassunto_storico(conn, paz_id)
+        if not storico and not contesto:
+            st.info("Nessuno storico ancora presente per questo paziente.")
+            return
 
     key_out = f"assist_out_{paz_id}"
+    mostrato = False
     etichetta = "💡 Chiedi all'assistente" if not contesto else "💡 Leggi questo dato"
     if st.button(etichetta, type="primary", key=f"assist_btn_{paz_id}"):
+        if storico is None:
+            storico = _riassunto_storico(conn, paz_id)
+        if not storico and not contesto:
+            st.info("Nessuno storico ancora presente per questo paziente.")
+            return
+        if not isinstance(paziente, dict) or not (paziente.get("Cognome") or paziente.get("Nome")):
+            try:
+                p = carica_paziente(conn, paz_id)
+                if p:
+                    paziente = p
+            except Exception:
+                pass
         ident = _identificativi(paziente)
         blocco = ""
         if contesto:
@@ -105,13 +114,22 @@ def render_assistente(conn=None, paz_id=None, paziente=None, contesto: str = "",
                       + contesto.strip() + "\n\n"
         blocco += "=== DATI IDENTIFICATIVI ===\n" + ident + "\n\n"
         blocco += "=== STORICO COMPLETO DEL PAZIENTE ===\n" + (storico or "non disponibile")
-        with st.spinner("L'assistente sta leggendo il quadro…"):
-            st.session_state[key_out] = genera_testo(_RICHIESTA + blocco,
-                                                     sistema=_SISTEMA)
+        # il testo compare man mano che il modello lo scrive
+        esito: dict = {}
+        out = st.write_stream(genera_testo_stream(_RICHIESTA + blocco, sistema=_SISTEMA,
+                                                  esito=esito))
+        if esito.get("errore"):
+            # risposta parziale: niente download né riproposta ai rerun
+            st.session_state.pop(key_out, None)
+            st.error("Risposta AI interrotta: l'analisi è incompleta. Riprova.")
+            return
+        st.session_state[key_out] = out
+        mostrato = True
 
     out = st.session_state.get(key_out)
     if out:
-        st.markdown(out)
+        if not mostrato:
+            st.markdown(out)
         st.download_button("⬇️ Scarica analisi (.txt)", data=out,
                            file_name="assistente_pnev.txt", mime="text/plain",
                            key=f"assist_dl_{paz_id}")
@@ -0,0 +1,551 @@
+# -*- coding: utf-8 -*-
+"""
+Blob store content-addressed per i payload binari che oggi stanno in linea
+nel database: documenti clinici, foto Photoref, PDF e firme dei consensi,
+timbri dei professionisti.
+
+I file sono indirizzati per sha256 del contenuto: lo stesso PDF salvato due
+volte (anche in tabelle diverse) occupa spazio una volta sola. Nel database,
+al posto dei bytes, resta un RIFERIMENTO corto nella stessa colonna BYTEA:
+
+    b"blobref:v1:sha256:<64 hex>:<byte>"
+
+così schema e query non cambiano e le righe non ancora migrate (bytes in
+linea) continuano a funzionare: chi legge passa da risolvi() / apri(), chi
+scrive da conserva(). La migrazione delle righe esistenti è
+scripts/migra_blob.py.
+
+Backend:
+  - FileBlobStore: cartella locale o condivisa, <root>/<kk>/<sha256>,
+    scrittura atomica (tmp + os.replace);
+  - S3BlobStore: bucket S3-compatibile (AWS, R2, MinIO...), chiave
+    <prefisso><kk>/<sha256>, upload multipart in streaming (boto3), download
+    a blocchi o via URL presigned.
+
+I blob non si cancellano quando si cancella la riga (lo stesso contenuto può
+servire ad altre righe): i blob non più referenziati li toglie
+`scripts/migra_blob.py pulisci` (iter_blobs() + delete()). Un upload che
+trova il blob già presente ne rinfresca l'ora di scrittura (mtime, o
+LastModified con una copia su se stesso), e delete(prima_di=...) la
+ricontrolla: un blob appena ricaricato non viene cancellato.
+
+Config (variabili d'ambiente, altrimenti sezione [storage] dei Secrets):
+  BLOB_STORE        fs | s3   (vuoto = nessuno: i nuovi file restano in linea)
+  BLOB_STORE_DIR    cartella del backend fs
+  BLOB_S3_BUCKET    bucket dei blob (default S3_BUCKET)
+  BLOB_S3_PREFIX    prefisso delle chiavi (default "blobs/")
+  S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY, S3_SECRET_KEY
+
+Usage:
+    dati_db = conserva(file.getvalue())   # riferimento se c'è un blob store
+    pdf = risolvi(riga["Pdf_Blob"])       # bytes, sia in linea sia migrati
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+RIF_PREFISSO = b"blobref:v1:sha256:"
+_RIF_RE = re.compile(rb"^blobref:v1:sha256:([0-9a-f]{64}):([0-9]{1,15})$")
+_RIF_MAX = len(RIF_PREFISSO) + 64 + 1 + 15
+_SHA_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_BLOCCO = 1 << 20
+_SPOOL_MAX = 8 << 20           # upload S3: oltre questa soglia il buffer va su disco
+_TMP_PREFIX = ".tmp-"
+
+# blob piccoli già letti (timbri, foto recenti): il contenuto non cambia mai
+_MEMO_MAX_BYTES = 64 << 20
+_MEMO_MAX_BLOB = 8 << 20
+
+logger = logging.getLogger(__name__)
+
+
+class BlobNonDisponibile(RuntimeError):
+    """Riferimento non risolvibile: blob store assente o oggetto mancante."""
+
+
+# --- riferimenti ------------------------------------------------------------
+
+def riferimento(sha: str, size: int) -> bytes:
+    return RIF_PREFISSO + f"{sha}:{int(size)}".encode("ascii")
+
+
+def _head(v, n: int) -> bytes:
+    if isinstance(v, memoryview):
+        return v[:n].tobytes()
+    return bytes(v[:n])
+
+
+def leggi_riferimento(v) -> Optional[Tuple[str, int]]:
+    """(sha256, byte) se v è un riferimento, altrimenti None."""
+    if not isinstance(v, (bytes, bytearray, memoryview)):
+        return None
+    if len(v) > _RIF_MAX or _head(v, len(RIF_PREFISSO)) != RIF_PREFISSO:
+        return None
+    m = _RIF_RE.match(_head(v, _RIF_MAX))
+    if not m:
+        return None
+    return m.group(1).decode("ascii"), int(m.group(2))
+
+
+def e_riferimento(v) -> bool:
+    return leggi_riferimento(v) is not None
+
+
+# --- backend ----------------------------------------------------------------
+
+class BlobStore:
+    """Interfaccia comune: put_* restituiscono (sha256, byte)."""
+
+    nome = "base"
+
+    def exists(self, sha: str) -> bool:
+        raise NotImplementedError
+
+    def put_stream(self, src: BinaryIO) -> Tuple[str, int]:
+        raise NotImplementedError
+
+    def put_bytes(self, data: bytes) -> Tuple[str, int]:
+        return self.put_stream(io.BytesIO(data))
+
+    def open(self, sha: str) -> BinaryIO:
+        """File binario in sola lettura (stream: leggere a blocchi)."""
+        raise NotImplementedError
+
+    def url(self, sha: str, nome: str = "", mime: str = "",
+            scadenza_s: int = 3600) -> Optional[str]:
+        """URL di download temporaneo, se il backend lo supporta."""
+        return None
+
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        """(sha256, byte, ultima scrittura epoch) di tutti i blob presenti."""
+        raise NotImplementedError
+
+    def delete(self, sha: str, prima_di: Optional[float] = None) -> bool:
+        """Cancella il blob; con prima_di (epoch) solo se l'ultima scrittura
+        è anteriore, così un blob appena ricaricato (dedup) resta. True se
+        cancellato, False se assente o più recente."""
+        raise NotImplementedError
+
+    def iter_chunks(self, sha: str, size: int = _BLOCCO) -> Iterator[bytes]:
+        f = self.open(sha)
+        try:
+            for chunk in iter(lambda: f.read(size), b""):
+                yield chunk
+        finally:
+            f.close()
+
+    def get_bytes(self, sha: str) -> bytes:
+        """Contenuto intero, verificato contro lo sha256."""
+        h = hashlib.sha256()
+        buf = bytearray()
+        for chunk in self.iter_chunks(sha):
+            h.update(chunk)
+            buf += chunk
+        if h.hexdigest() != sha:
+            raise BlobNonDisponibile(f"blob {sha[:12]}… corrotto (sha256 diverso)")
+        return bytes(buf)
+
+
+class FileBlobStore(BlobStore):
+    """<root>/<kk>/<sha256> su filesystem locale o condiviso."""
+
+    nome = "fs"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha)
+
+    def exists(self, sha: str) -> bool:
+        return os.path.exists(self.path(sha))
+
+    def _tocca(self, sha: str) -> bool:
+        """Dedup: rinfresca l'mtime del blob già presente (la pulizia non
+        cancella i blob appena riscritti). False se il file non c'è più."""
+        try:
+            os.utime(self.path(sha))
+            return True
+        except OSError:
+            return False
+
+    def _commit(self, tmp: str, sha: str) -> None:
+        final = self.path(sha)
+        if self._tocca(sha):
+            os.remove(tmp)
+            return
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(tmp, final)
+
+    def put_stream(self, src: BinaryIO) -> Tuple[str, int]:
+        fd, tmp = tempfile.mkstemp(prefix=_TMP_PREFIX, dir=self.root)
+        h = hashlib.sha256()
+        n = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: src.read(_BLOCCO), b""):
+                    h.update(chunk)
+                    f.write(chunk)
+                    n += len(chunk)
+            sha = h.hexdigest()
+            self._commit(tmp, sha)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return sha, n
+
+    def put_bytes(self, data: bytes) -> Tuple[str, int]:
+        sha = hashlib.sha256(data).hexdigest()
+        if not self._tocca(sha):
+            fd, tmp = tempfile.mkstemp(prefix=_TMP_PREFIX, dir=self.root)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                self._commit(tmp, sha)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        return sha, len(data)
+
+    def open(self, sha: str) -> BinaryIO:
+        try:
+            return open(self.path(sha), "rb")
+        except FileNotFoundError:
+            raise BlobNonDisponibile(f"blob {sha[:12]}… non trovato in {self.root}")
+
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        for kk in sorted(os.listdir(self.root)):
+            cartella = os.path.join(self.root, kk)
+            if len(kk) != 2 or not os.path.isdir(cartella):
+                continue
+            for nome in sorted(os.listdir(cartella)):
+                if not _SHA_RE.match(nome):
+                    continue
+                try:
+                    st = os.stat(os.path.join(cartella, nome))
+                except FileNotFoundError:
+                    continue
+                yield nome, st.st_size, st.st_mtime
+
+    def delete(self, sha: str, prima_di: Optional[float] = None) -> bool:
+        # spostato fuori dal nome definitivo prima del controllo dell'mtime:
+        # un upload concorrente o lo trova già rinfrescato (e il file torna
+        # al suo posto) o non lo trova e lo riscrive
+        tmp = os.path.join(self.root, f"{_TMP_PREFIX}del-{sha}")
+        try:
+            os.replace(self.path(sha), tmp)
+        except FileNotFoundError:
+            return False
+        if prima_di is not None and os.stat(tmp).st_mtime >= prima_di:
+            os.replace(tmp, self.path(sha))
+            return False
+        os.remove(tmp)
+        return True
+
+
+def _codice_errore(e: Exception) -> str:
+    return str((getattr(e, "response", None) or {}).get("Error", {}).get("Code", ""))
+
+
+class S3BlobStore(BlobStore):
+    """Bucket S3-compatibile; `client` è un client boto3 ("s3")."""
+
+    nome = "s3"
+
+    def __init__(self, client, bucket: str, prefix: str = "blobs/"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix or ""
+
+    def key(self, sha: str) -> str:
+        return f"{self.prefix}{sha[:2]}/{sha}"
+
+    def exists(self, sha: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(sha))
+            return True
+        except Exception as e:
+            if _codice_errore(e) in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def _tocca(self, sha: str) -> bool:
+        """Dedup: copia l'oggetto su se stesso per rinfrescare LastModified
+        (la pulizia non cancella i blob appena riscritti). False se non c'è."""
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket, Key=self.key(sha),
+                CopySource={"Bucket": self.bucket, "Key": self.key(sha)},
+                MetadataDirective="REPLACE",
+            )
+            return True
+        except Exception as e:
+            if _codice_errore(e) in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put_stream(self, src: BinaryIO) -> Tuple[str, int]:
+        # la chiave è lo sha256: serve l'intero contenuto prima dell'upload
+        h = hashlib.sha256()
+        n = 0
+        with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX) as buf:
+            for chunk in iter(lambda: src.read(_BLOCCO), b""):
+                h.update(chunk)
+                buf.write(chunk)
+                n += len(chunk)
+            sha = h.hexdigest()
+            if not self._tocca(sha):
+                buf.seek(0)
+                self.client.upload_fileobj(buf, self.bucket, self.key(sha))
+        return sha, n
+
+    def put_bytes(self, data: bytes) -> Tuple[str, int]:
+        sha = hashlib.sha256(data).hexdigest()
+        if not self._tocca(sha):
+            self.client.put_object(Bucket=self.bucket, Key=self.key(sha), Body=data)
+        return sha, len(data)
+
+    def open(self, sha: str) -> BinaryIO:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(sha))["Body"]
+        except Exception as e:
+            if _codice_errore(e) in ("404", "NoSuchKey", "NotFound"):
+                raise BlobNonDisponibile(f"blob {sha[:12]}… non trovato nel bucket {self.bucket}")
+            raise
+
+    def url(self, sha: str, nome: str = "", mime: str = "",
+            scadenza_s: int = 3600) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": self.key(sha)}
+        if nome:
+            params["ResponseContentDisposition"] = f'attachment; filename="{nome}"'
+        if mime:
+            params["ResponseContentType"] = mime
+        return self.client.generate_presigned_url("get_object", Params=params,
+                                                  ExpiresIn=int(scadenza_s))
+
+    def iter_blobs(self) -> Iterator[Tuple[str, int, float]]:
+        pagine = self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=self.prefix)
+        for pagina in pagine:
+            for o in pagina.get("Contents", []):
+                sha = o["Key"].rsplit("/", 1)[-1]
+                if _SHA_RE.match(sha) and o["Key"] == self.key(sha):
+                    yield sha, int(o["Size"]), o["LastModified"].timestamp()
+
+    def delete(self, sha: str, prima_di: Optional[float] = None) -> bool:
+        # S3 non ha rename atomico: LastModified riletto subito prima della
+        # cancellazione (resta solo la finestra tra head e delete)
+        try:
+            o = self.client.head_object(Bucket=self.bucket, Key=self.key(sha))
+        except Exception as e:
+            if _codice_errore(e) in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        if prima_di is not None and o["LastModified"].timestamp() >= prima_di:
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(sha))
+        return True
+
+
+# --- configurazione ---------------------------------------------------------
+
+_CHIAVI_ENV = ("BLOB_STORE", "BLOB_STORE_DIR", "BLOB_S3_BUCKET", "BLOB_S3_PREFIX",
+               "S3_BUCKET", "S3_ENDPOINT_URL", "S3_REGION", "S3_ACCESS_KEY", "S3_SECRET_KEY")
+
+
+def _s3_client(cfg: dict):
+    import boto3
+    endpoint = cfg.get("S3_ENDPOINT_URL")
+    if endpoint and not str(endpoint).startswith(("http://", "https://")):
+        endpoint = "https://" + str(endpoint)
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint or None,
+        region_name=cfg.get("S3_REGION") or None,
+        aws_access_key_id=cfg.get("S3_ACCESS_KEY"),
+        aws_secret_access_key=cfg.get("S3_SECRET_KEY"),
+    )
+
+
+def blob_store_da_config(cfg: dict) -> Optional[BlobStore]:
+    """Backend descritto da un dict con le chiavi di [storage]; None se
+    BLOB_STORE è vuoto. ValueError se la configurazione è incompleta."""
+    tipo = str(cfg.get("BLOB_STORE") or "").strip().lower()
+    if not tipo:
+        return None
+    if tipo in ("fs", "file", "locale"):
+        root = cfg.get("BLOB_STORE_DIR")
+        if not root:
+            raise ValueError("BLOB_STORE=fs richiede BLOB_STORE_DIR")
+        return FileBlobStore(str(root))
+    if tipo == "s3":
+        bucket = cfg.get("BLOB_S3_BUCKET") or cfg.get("S3_BUCKET")
+        if not bucket:
+            raise ValueError("BLOB_STORE=s3 richiede BLOB_S3_BUCKET o S3_BUCKET")
+        return S3BlobStore(_s3_client(cfg), str(bucket),
+                           str(cfg.get("BLOB_S3_PREFIX", "blobs/")))
+    raise ValueError(f"BLOB_STORE sconosciuto: {tipo!r} (fs | s3)")
+
+
+def _config_processo() -> dict:
+    cfg: dict = {}
+    try:
+        import streamlit as st
+        s = st.secrets.get("storage", {})
+        if s:
+            cfg.update(dict(s))
+    except Exception:
+        pass
+    for k in _CHIAVI_ENV:
+        v = os.getenv(k)
+        if v:
+            cfg[k] = v
+    return cfg
+
+
+_default_lock = threading.Lock()
+_default: Optional[BlobStore] = None
+_default_letto = False
+
+
+def get_blob_store() -> Optional[BlobStore]:
+    """Blob store di processo (env / Secrets); None se non configurato o non valido."""
+    global _default, _default_letto
+    if _default_letto:
+        return _default
+    with _default_lock:
+        if not _default_letto:
+            try:
+                _default = blob_store_da_config(_config_processo())
+            except Exception as e:
+                logger.warning("configurazione non valida, file in linea: %s", e)
+                _default = None
+            _default_letto = True
+    return _default
+
+
+# --- lettura / scrittura per i moduli ---------------------------------------
+
+_memo_lock = threading.Lock()
+_memo: "OrderedDict[str, bytes]" = OrderedDict()
+_memo_bytes = 0
+
+
+def _memo_get(sha: str) -> Optional[bytes]:
+    with _memo_lock:
+        b = _memo.get(sha)
+        if b is not None:
+            _memo.move_to_end(sha)
+        return b
+
+
+def _memo_put(sha: str, data: bytes) -> None:
+    global _memo_bytes
+    if len(data) > _MEMO_MAX_BLOB:
+        return
+    with _memo_lock:
+        if sha in _memo:
+            return
+        _memo[sha] = data
+        _memo_bytes += len(data)
+        while _memo_bytes > _MEMO_MAX_BYTES and _memo:
+            _, old = _memo.popitem(last=False)
+            _memo_bytes -= len(old)
+
+
+def conserva(data, store: Optional[BlobStore] = None):
+    """Valore da scrivere nella colonna BYTEA: riferimento se c'è un blob
+    store, altrimenti i bytes stessi. Se il backend fallisce il file resta in
+    linea: una scrittura non si perde mai per colpa dello storage."""
+    if data is None or e_riferimento(data):
+        return data
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    elif isinstance(data, bytearray):
+        data = bytes(data)
+    if not data:
+        return data
+    store = store or get_blob_store()
+    if store is None:
+        return data
+    try:
+        sha, n = store.put_bytes(data)
+    except Exception as e:
+        logger.warning("put non riuscito, file in linea: %s: %s", type(e).__name__, e)
+        return data
+    return riferimento(sha, n)
+
+
+def risolvi(v, store: Optional[BlobStore] = None) -> Optional[bytes]:
+    """bytes di un valore BYTEA, in linea o riferimento. BlobNonDisponibile
+    se il riferimento non si può risolvere."""
+    if v is None:
+        return None
+    rif = leggi_riferimento(v)
+    if rif is None:
+        if isinstance(v, memoryview):
+            return v.tobytes()
+        return bytes(v)
+    sha, _n = rif
+    hit = _memo_get(sha)
+    if hit is not None:
+        return hit
+    store = store or get_blob_store()
+    if store is None:
+        raise BlobNonDisponibile("riferimento a blob ma nessun blob store configurato (BLOB_STORE)")
+    data = store.get_bytes(sha)
+    _memo_put(sha, data)
+    return data
+
+
+def apri(v, store: Optional[BlobStore] = None) -> Optional[BinaryIO]:
+    """File binario da leggere a blocchi, senza caricare il blob in memoria."""
+    if v is None:
+        return None
+    rif = leggi_riferimento(v)
+    if rif is None:
+        return io.BytesIO(risolvi(v))
+    store = store or get_blob_store()
+    if store is None:
+        raise BlobNonDisponibile("riferimento a blob ma nessun blob store configurato (BLOB_STORE)")
+    return store.open(rif[0])
+
+
+def dimensione(v) -> Optional[int]:
+    """Byte del contenuto (anche per i riferimenti, senza leggerlo)."""
+    if v is None:
+        return None
+    rif = leggi_riferimento(v)
+    return rif[1] if rif else len(v)
+
+
+def url_download(v, nome: str = "", mime: str = "", scadenza_s: int = 3600,
+                 store: Optional[BlobStore] = None) -> Optional[str]:
+    """URL presigned per i riferimenti su backend che lo supportano, altrimenti None."""
+    rif = leggi_riferimento(v)
+    if rif is None:
+        return None
+    store = store or get_blob_store()
+    if store is None:
+        return None
+    try:
+        return store.url(rif[0], nome=nome, mime=mime, scadenza_s=scadenza_s)
+    except Exception:
+        return None
+
@@ -98,115 +98,10 @@ _SCHEMA = (
 
 
 def _riassunto_storico(conn, paz_id) -> str:
-    parti = []
-
-    docs = _query(conn, "SELECT * FROM documenti_clinici WHERE paziente_id=%s", (paz_id,))
-    if docs:
-        parti.append("DOCUMENTI CLINICI:")
-        for d in sorted(docs, key=lambda x: str(_data_di(x)), reverse=True):
-            riga = f"- {d.get('tipo','Documento')} ({_fmt(_data_di(d))})"
-            if d.get("estratto"):
-                riga += "\n  Dati estratti: " + " ".join(str(d["estratto"]).split())
-            parti.append(riga)
-
-    g = _query(conn, "SELECT * FROM getman_risultati WHERE paziente_id=%s", (paz_id,))
-    if g:
-        parti.append("\nGETMAN (manipolazione visiva):")
-        for r in sorted(g, key=lambda x: str(_data_di(x)), reverse=True):
-            parti.append(f"- {_fmt(_data_di(r))}: punteggio {r.get('punteggio','?')}/12"
-                         + (f", classe {r.get('classe')}" if r.get('classe') else ""))
-
-    gr = _query(conn, "SELECT * FROM groffman_risultati WHERE paziente_id=%s", (paz_id,))
-    if gr:
-        parti.append("\nGROFFMAN (visual tracing):")
-        for r in sorted(gr, key=lambda x: str(_data_di(x)), reverse=True):
-            parti.append(f"- {_fmt(_data_di(r))}: punteggio {r.get('punteggio','?')}"
-                         + (f", tavola {r.get('forma')}" if r.get('forma') else "")
-                         + (f", osservazioni: {r.get('osservazioni')}" if r.get('osservazioni') else ""))
-
-    vv = _query(conn, "SELECT * FROM valutazioni_visive WHERE paziente_id=%s", (paz_id,))
-    if vv:
-        parti.append("\nVALUTAZIONI VISUO-PERCETTIVE:")
-        for r in sorted(vv, key=lambda x: str(_data_di(x)), reverse=True):
-            parti.append(f"- valutazione del {_fmt(_data_di(r))}")
-
-    an = _query(conn, "SELECT * FROM anamnesi WHERE paziente_id=%s", (paz_id,))
-    if an:
-        parti.append("\nVALUTAZIONI PNEV / ANAMNESI:")
-        for r in sorted(an, key=lambda x: str(_data_di(x)), reverse=True):
-            txt = (r.get("pnev_summary") or r.get("Motivo") or "").strip()
-            parti.append(f"- {_fmt(_data_di(r))}: {txt}" if txt else f"- {_fmt(_data_di(r))}")
-
-    es = _query(conn, "SELECT * FROM esiti_pnev WHERE paziente_id=%s", (paz_id,))
-    if es:
-        parti.append("\nESITI / FOLLOW-UP (cosa ha funzionato o no — IMPORTANTE):")
-        for r in sorted(es, key=lambda x: str(_data_di(x)), reverse=True):
-            riga = f"- {_fmt(_data_di(r))}: {r.get('intervento','')} → {r.get('esito','')}"
-            if r.get("note"):
-                riga += f" ({r['note']})"
-            parti.append(riga)
-
-    lo = _query(conn, "SELECT * FROM logopedia_valutazioni WHERE paziente_id=%s", (paz_id,))
-    if lo:
-        parti.append("\nLOGOPEDIA / SMOF:")
-        for r in sorted(lo, key=lambda x: str(_data_di(x)), reverse=True):
-            riga = f"- {_fmt(_data_di(r))}"
-            if r.get("sintesi"):
-                riga += f": {r['sintesi']}"
-            parti.append(riga)
-
-    ls = _query(conn, "SELECT * FROM logopedia_sedute WHERE paziente_id=%s", (paz_id,))
-    if ls:
-        parti.append("\nSEDUTE LOGOPEDICHE (diario):")
-        for r in sorted(ls, key=lambda x: str(x.get("data_seduta")), reverse=True)[:12]:
-            d = r.get("data_seduta")
-            ds = d.strftime("%d/%m/%Y") if hasattr(d, "strftime") else str(d or "")
-            riga = f"- n°{r.get('numero','?')} {ds}: {r.get('obiettivo','')}"
-            if r.get("risposta"):
-                riga += f" (risposta {r['risposta']})"
-            parti.append(riga)
-
-    ob = _query(conn, "SELECT * FROM logopedia_obiettivi WHERE paziente_id=%s", (paz_id,))
-    if ob:
-        parti.append("\nOBIETTIVI LOGOPEDICI (con avanzamento):")
-        for r in ob:
-            parti.append(f"- {r.get('descrizione','')} [{r.get('area','')}]: "
-                         f"{r.get('stato','')} {r.get('attuale','?')}/{r.get('target','?')} "
-                         f"(partenza {r.get('baseline','?')})")
-
-    ts = _query(conn, "SELECT * FROM terapia_sedute WHERE paziente_id=%s", (paz_id,))
-    if ts:
-        per_ter = {}
-        for r in ts:
-            per_ter.setdefault(r.get("terapia", "—"), []).append(r)
-        parti.append("\nPERCORSI TERAPEUTICI:")
-        for ter, righe in per_ter.items():
-            parti.append(f"- {ter}: {len(righe)} sedute")
-            for r in sorted(righe, key=lambda d: str(d.get("data_seduta")), reverse=True)[:6]:
-                d = r.get("data_seduta")
-                ds = d.strftime("%d/%m/%Y") if hasattr(d, "strftime") else str(d or "")
-                parti.append(f"   · {ds}: {r.get('obiettivo','')} ({r.get('risposta','')})")
-
-    tob = _query(conn, "SELECT * FROM terapia_obiettivi WHERE paziente_id=%s", (paz_id,))
-    if tob:
-        parti.append("\nOBIETTIVI TERAPEUTICI (con avanzamento):")
-        for r in tob:
-            parti.append(f"- {r.get('descrizione','')} [{r.get('terapia','')}]: "
-                         f"{r.get('stato','')} {r.get('attuale','?')}/{r.get('target','?')}")
-
-    prg = _query(conn, "SELECT * FROM terapia_programma WHERE paziente_id=%s", (paz_id,))
-    if prg:
-        per_appr = {}
-        for r in prg:
-            per_appr.setdefault(r.get("approccio", "—"), []).append(r)
-        parti.append("\nPROGRAMMA PNEV (procedure in corso):")
-        for appr, lista in per_appr.items():
-            parti.append(f"- {appr}:")
-            for r in lista:
-                step = f"{r.get('step')} " if r.get("step") and r["step"] != "—" else ""
-                parti.append(f"   · {step}{r.get('nome','')} — {r.get('stato','')}")
-
-    return "\n".join(parti).strip()
+    """Storico in testo per l'AI: dallo snapshot incrementale (rilegge solo
+    le sezioni cambiate dall'ultima volta)."""
+    from .storico_snapshot import storico_snapshot
+    return storico_snapshot(conn, paz_id).testo
 
 
 def render_diagnosi(conn=None, paz_id=None, paziente=None):
@@ -246,9 +141,9 @@ def render_diagnosi(conn=None, paz_id=None, paziente=None):
 
     # ── Bozza AI ──────────────────────────────────────────────────────
     try:
-        from .ai_estrazione import genera_testo, ai_disponibile
+        from .ai_estrazione import genera_testo_stream, ai_disponibile
     except Exception:
-        genera_testo = None
+        genera_testo_stream = None
         ai_disponibile = lambda: False
 
     key_bozza = f"diag_bozza_{paz_id}"
@@ -258,17 +153,26 @@ def render_diagnosi(conn=None, paz_id=None, paziente=None):
         st.markdown("#### Bozza di relazione diagnostica")
     with c2:
         disabled = not (ai_disponibile() and storico)
-        if st.button("🤖 Genera con AI", type="primary", disabled=disabled,
-                     use_container_width=True):
-            with st.spinner("L'AI sta scrivendo la bozza…"):
-                ident = _identificativi(paziente)
-                corpo = genera_testo(_SCHEMA.replace("{IDENT}", ident) + storico,
-                                     sistema=_SISTEMA)
-                if corpo.startswith("⚠️"):
-                    testo = corpo
-                else:
-                    testo = INTESTAZIONE + "\n\n" + corpo.strip() + "\n\n" + FIRMA
-            st.session_state[key_bozza] = testo
+        genera = st.button("🤖 Genera con AI", type="primary", disabled=disabled,
+                           use_container_width=True)
+    if genera:
+        # bozza in diretta a piena larghezza, poi nel riquadro modificabile
+        ident = _identificativi(paziente)
+        esito: dict = {}
+        diretta = st.empty()
+        with diretta.container():
+            corpo = st.write_stream(genera_testo_stream(
+                _SCHEMA.replace("{IDENT}", ident) + storico, sistema=_SISTEMA, esito=esito))
+        corpo = corpo if isinstance(corpo, str) else "".join(map(str, corpo or []))
+        if esito.get("errore"):
+            # bozza parziale: resta visibile qui sopra, ma senza intestazione
+            # e firma e fuori dal riquadro che si salva in cartella
+            st.error("Generazione AI interrotta: la bozza è incompleta e non è "
+                     "stata riportata nella relazione. Riprova.")
+        else:
+            diretta.empty()
+            st.session_state[key_bozza] = (INTESTAZIONE + "\n\n" + corpo.strip()
+                                           + "\n\n" + FIRMA)
     if not ai_disponibile():
         st.caption("AI non configurata: la diagnosi si scrive a mano. "
                    "Per la bozza automatica serve la chiave nei Secrets.")
@@ -86,11 +86,73 @@ def _controlla_import():
     return out
 
 
+def _mostra_pool_db():
+    """Metriche del pool di connessioni PostgreSQL (una riga per studio)."""
+    try:
+        from .app_core import pool_stats, liveness_stats, sql_cache_stats
+        stats = pool_stats()
+        vivo = liveness_stats()
+        sqlc = sql_cache_stats()
+    except Exception as e:
+        st.caption(f"Metriche pool non disponibili: {e}")
+        return
+    st.markdown("##### Pool connessioni database")
+    try:
+        from .schema_migrations import report_migrazioni
+        rep = report_migrazioni()
+    except Exception:
+        rep = {}
+    if rep:
+        st.caption(f"Verifica schema all'avvio del processo: {rep.get('totale_ms', 0):.0f} ms "
+                   f"(attesa lock {rep.get('attesa_lock_ms', 0):.0f} ms) · passi applicati: "
+                   + (", ".join(f"{p['passo']} {p['ms']:.0f} ms" for p in rep.get("applicati", [])) or "nessuno")
+                   + f" · già presenti: {', '.join(rep.get('saltati', [])) or 'nessuno'}")
+    try:
+        from .app_core import schema_introspezione
+        intro = schema_introspezione()
+    except Exception:
+        intro = {}
+    if intro:
+        st.caption(f"Catalogo in cache (schema {intro['versione']}): tabella pazienti "
+                   f"«{intro['pazienti'][0]}», {len(intro['tabelle'])} tabelle, "
+                   f"colonne lette per {len(intro['colonne'])}")
+    tot = vivo["avoided"] + vivo["performed"]
+    st.caption(f"Controlli di connessione: {vivo['avoided']} senza ping, "
+               f"{vivo['performed']} con ping SELECT 1"
+               + (f" ({100.0 * vivo['avoided'] / tot:.1f}% evitati)" if tot else "")
+               + f" · riconnessioni {vivo['reconnects']} · statement ripetuti {vivo['retries']}")
+    st.caption(f"Traduzione SQL in cache: {100.0 * sqlc['translate_hit_rate']:.1f}% hit "
+               f"({sqlc['translate_hits']}/{sqlc['translate_hits'] + sqlc['translate_misses']}) · "
+               + (f"PREPARE dopo {sqlc['prepare_hot_after']} usi: {sqlc['prepared']} preparate, "
+                  f"{sqlc['prepared_exec']} EXECUTE, {sqlc['prepare_failed']} non preparabili"
+                  if sqlc["prepare_hot_after"] else "PREPARE lato server disattivo ([db] PREPARE_HOT_AFTER)"))
+    if not stats:
+        st.caption("Nessun pool PostgreSQL attivo (SQLite o nessuna connessione ancora aperta).")
+        return
+    righe = []
+    for sid, s in stats.items():
+        righe.append({
+            "studio": sid,
+            "in uso": s["in_use"],
+            "libere": s["idle"],
+            "aperte": f"{s['size']} (min {s['min']}, max {s['max']})",
+            "in attesa": s["waiters"],
+            "prestiti": s["checkouts"],
+            "attesa media ms": s["checkout_ms_avg"],
+            "attesa max ms": s["checkout_ms_max"],
+            "timeout": s["timeouts"],
+            "recuperate": s["reclaimed"],
+        })
+    st.dataframe(righe, hide_index=True, use_container_width=True)
+
+
 def render_diagnostica():
     st.subheader("🩺 Diagnostica moduli")
     st.caption("Controlla che tutti i file del gestionale siano scritti "
               "correttamente. Utile subito dopo ogni caricamento su GitHub.")
 
+    _mostra_pool_db()
+
     if not st.button("▶️ Avvia controllo", type="primary"):
         st.info("Premi «Avvia controllo» per verificare tutti i file.")
         return
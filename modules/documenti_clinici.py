@@ -7,6 +7,31 @@
 
 import streamlit as st
 
+try:
+    from .blob_store import conserva, dimensione, risolvi, url_download
+except Exception:
+    def conserva(data, store=None):
+        return data
+    def dimensione(v):
+        return len(v) if v is not None else None
+    def risolvi(v, store=None):
+        return bytes(v) if v is not None else None
+    def url_download(v, nome="", mime="", scadenza_s=3600, store=None):
+        return None
+
+try:
+    from .anteprime import DOCUMENTI, anteprima, colonne_anteprime, dimentica, miniature
+except Exception:
+    DOCUMENTI = None
+    def anteprima(conn, src, chiave):
+        return None
+    def colonne_anteprime(src, dati):
+        return {}
+    def dimentica(src, chiave):
+        pass
+    def miniature(conn, src, chiavi):
+        return {}
+
 TIPI = ["Esame visivo", "Esame funzionale", "Diagnosi / referto",
         "Esame uditivo", "Riflessi / INPP", "Altro"]
 
@@ -34,6 +59,14 @@ def _assicura_tabella(conn):
             );
         """)
         cur.execute("ALTER TABLE documenti_clinici ADD COLUMN IF NOT EXISTS estratto TEXT;")
+        # anteprime generate al caricamento (modules/anteprime)
+        cur.execute("""
+            ALTER TABLE documenti_clinici
+                ADD COLUMN IF NOT EXISTS anteprima_mini BYTEA,
+                ADD COLUMN IF NOT EXISTS anteprima BYTEA,
+                ADD COLUMN IF NOT EXISTS larghezza INT,
+                ADD COLUMN IF NOT EXISTS altezza INT;
+        """)
         conn.commit()
     except Exception:
         try: conn.rollback()
@@ -107,14 +140,17 @@ def render_documenti(conn=None, paz_id=None, paziente=None):
 
 def _salva_documento(conn, paz_id, tipo, file, note) -> bool:
     try:
-        dati = file.getvalue()
+        originale = file.getvalue()
+        extra = colonne_anteprime(DOCUMENTI, originale) \
+            if DOCUMENTI and (file.type or "").startswith("image/") else {}
+        dati = conserva(originale)
+        cols = ["paziente_id", "studio_id", "tipo", "nome_file", "mime", "dati", "note"] + list(extra)
         cur = conn.cursor()
         cur.execute(
-            "INSERT INTO documenti_clinici "
-            "(paziente_id, studio_id, tipo, nome_file, mime, dati, note) "
-            "VALUES (%s,%s,%s,%s,%s,%s,%s)",
-            (paz_id, _studio_corrente(conn), tipo, file.name,
-             file.type or "", dati, note or ""))
+            f"INSERT INTO documenti_clinici ({', '.join(cols)}) "
+            f"VALUES ({', '.join(['%s'] * len(cols))})",
+            [paz_id, _studio_corrente(conn), tipo, file.name,
+             file.type or "", dati, note or ""] + list(extra.values()))
         conn.commit()
         return True
     except Exception:
@@ -129,7 +165,9 @@ def _elenco(conn, paz_id):
     try:
         cur = conn.cursor()
         cur.execute(
-            "SELECT id, tipo, nome_file, mime, note, data, octet_length(dati) "
+            "SELECT id, tipo, nome_file, mime, note, data, octet_length(dati), "
+            # riferimenti al blob store: corti, il peso vero è dentro
+            "CASE WHEN octet_length(dati) <= 128 THEN dati END, larghezza, altezza "
             "FROM documenti_clinici WHERE paziente_id=%s ORDER BY data DESC",
             (paz_id,))
         righe = cur.fetchall()
@@ -145,14 +183,24 @@ def _elenco(conn, paz_id):
         st.info("Nessun documento ancora caricato per questo paziente.")
         return
 
-    for doc_id, tipo, nome, mime, note, data, peso in righe:
+    # miniature delle immagini: dalla cache di processo, le mancanti con una query
+    mini = miniature(conn, DOCUMENTI, [r[0] for r in righe if (r[3] or "").startswith("image/")]) \
+        if DOCUMENTI else {}
+
+    for doc_id, tipo, nome, mime, note, data, peso, corto, larg, alt in righe:
+        if corto is not None:
+            peso = dimensione(corto)
         data_str = data.strftime("%d/%m/%Y %H:%M") if data else ""
         peso_kb = f"{(peso or 0)/1024:.0f} KB"
         with st.container():
-            c1, c2, c3 = st.columns([5, 2, 2])
+            c0, c1, c2, c3 = st.columns([1, 4, 2, 2])
+            with c0:
+                if mini.get(doc_id):
+                    st.image(mini[doc_id], width=96)
             with c1:
                 st.markdown(f"**{nome}**")
                 st.caption(f"{tipo} · {data_str} · {peso_kb}"
+                           + (f" · {larg}×{alt} px" if larg and alt else "")
                            + (f" · {note}" if note else ""))
             with c2:
                 if st.button("⬇️ Scarica", key=f"dl_{doc_id}"):
@@ -162,13 +210,12 @@ def _elenco(conn, paz_id):
                     _elimina(conn, doc_id)
                     st.rerun()
             if mime and mime.startswith("image/"):
-                with st.expander("👁 Anteprima"):
-                    try:
-                        cur = conn.cursor()
-                        cur.execute("SELECT dati FROM documenti_clinici WHERE id=%s",
-                                    (doc_id,))
-                        st.image(bytes(cur.fetchone()[0]), use_container_width=True)
-                    except Exception:
+                # l'anteprima media si legge solo quando viene aperta
+                if st.toggle("👁 Anteprima", key=f"prev_{doc_id}"):
+                    img = anteprima(conn, DOCUMENTI, doc_id) if DOCUMENTI else None
+                    if img:
+                        st.image(img, use_container_width=True)
+                    else:
                         st.caption("Anteprima non disponibile.")
             _blocco_ai(conn, doc_id, mime, nome)
         st.markdown("<hr style='margin:6px 0;border:none;border-top:1px solid #eee'>",
@@ -179,7 +226,13 @@ def _scarica(conn, doc_id, nome, mime):
     try:
         cur = conn.cursor()
         cur.execute("SELECT dati FROM documenti_clinici WHERE id=%s", (doc_id,))
-        dati = bytes(cur.fetchone()[0])
+        valore = cur.fetchone()[0]
+        # su S3 il file non passa dall'app: link presigned a scadenza
+        url = url_download(valore, nome=nome, mime=mime or "", scadenza_s=900)
+        if url:
+            st.link_button("📥 Conferma download", url)
+            return
+        dati = risolvi(valore)
         st.download_button("📥 Conferma download", data=dati, file_name=nome,
                            mime=mime or "application/octet-stream",
                            key=f"dlc_{doc_id}")
@@ -192,6 +245,8 @@ def _elimina(conn, doc_id):
         cur = conn.cursor()
         cur.execute("DELETE FROM documenti_clinici WHERE id=%s", (doc_id,))
         conn.commit()
+        if DOCUMENTI:
+            dimentica(DOCUMENTI, doc_id)
     except Exception:
         try:
             conn.rollback()
@@ -238,7 +293,7 @@ def _blocco_ai(conn, doc_id, mime, nome):
                         cur.execute("SELECT dati, mime, nome_file FROM documenti_clinici "
                                     "WHERE id=%s", (doc_id,))
                         d, m, n = cur.fetchone()
-                        risultato = estrai_da_documento(bytes(d), m or mime, n or nome)
+                        risultato = estrai_da_documento(risolvi(d), m or mime, n or nome)
                     except Exception as e:
                         risultato = f"⚠️ Errore lettura file: {e}"
                 st.markdown(risultato)
@@ -2,80 +2,125 @@ from __future__ import annotations
 
 from typing import Any
 
+import numpy as np
 import pandas as pd
 
 from .distance_gaze import compute_distance_metrics
 from .protocols_gaze import get_protocol_config
 
 
-def clean_gaze_signal(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    out["gaze_x"] = pd.to_numeric(out["gaze_x"], errors="coerce")
-    out["gaze_y"] = pd.to_numeric(out["gaze_y"], errors="coerce")
-    out["confidence"] = pd.to_numeric(out["confidence"], errors="coerce").fillna(1.0)
-    out = out.sort_values("ts_ms").reset_index(drop=True)
+# Le fasi della pipeline lavorano su array NumPy e scrivono le colonne sul
+# DataFrame ricevuto quando inplace=True: run_gaze_analytics fa UNA sola copia
+# dell'input (in clean_gaze_signal) e poi arricchisce sempre lo stesso frame.
+# Con inplace=False (default) ogni fase resta utilizzabile da sola come prima.
 
-    out["dt_ms"] = out["ts_ms"].diff().fillna(0)
-    out["dx"] = out["gaze_x"].diff().fillna(0)
-    out["dy"] = out["gaze_y"].diff().fillna(0)
-    out["distance_px"] = (out["dx"] ** 2 + out["dy"] ** 2) ** 0.5
-    out["velocity_px_per_ms"] = out["distance_px"] / out["dt_ms"].replace(0, pd.NA)
-    out["velocity_px_per_ms"] = out["velocity_px_per_ms"].fillna(0)
 
-    return out
+def _as_float(s: pd.Series) -> np.ndarray:
+    return pd.to_numeric(s, errors="coerce").to_numpy(dtype=float)
 
 
-def detect_fixations_and_saccades(df: pd.DataFrame, fixation_velocity_threshold: float = 0.5) -> pd.DataFrame:
-    out = df.copy()
-    out["derived_fixation_flag"] = out["velocity_px_per_ms"] <= fixation_velocity_threshold
-    out["derived_saccade_flag"] = out["velocity_px_per_ms"] > fixation_velocity_threshold
+def _shift1(a: np.ndarray) -> np.ndarray:
+    out = np.empty_like(a, dtype=float)
+    if a.size:
+        out[0] = np.nan
+        out[1:] = a[:-1]
     return out
 
 
-def cluster_reading_lines(df: pd.DataFrame, tolerance_px: float = 40.0) -> pd.DataFrame:
-    out = df.copy()
-    line_ids = []
-    current_line = 0
-    last_y = None
+def _diff0(a: np.ndarray) -> np.ndarray:
+    # come Series.diff().fillna(0)
+    out = np.zeros(a.size, dtype=float)
+    if a.size > 1:
+        out[1:] = np.diff(a)
+        out[np.isnan(out)] = 0.0
+    return out
 
-    for _, row in out.iterrows():
-        y = row.get("gaze_y")
-        if pd.isna(y):
-            line_ids.append(None)
-            continue
 
-        if last_y is None:
-            current_line = 0
-        elif abs(float(y) - float(last_y)) > tolerance_px:
-            current_line += 1
+def clean_gaze_signal(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+    out = df if inplace else df.copy()
+    out["gaze_x"] = pd.to_numeric(out["gaze_x"], errors="coerce")
+    out["gaze_y"] = pd.to_numeric(out["gaze_y"], errors="coerce")
+    out["confidence"] = pd.to_numeric(out["confidence"], errors="coerce").fillna(1.0)
+    if not out["ts_ms"].is_monotonic_increasing:
+        out.sort_values("ts_ms", inplace=True)
+    out.reset_index(drop=True, inplace=True)
+
+    dt = _diff0(out["ts_ms"].to_numpy(dtype=float))
+    dx = _diff0(out["gaze_x"].to_numpy(dtype=float))
+    dy = _diff0(out["gaze_y"].to_numpy(dtype=float))
+    distance = np.sqrt(dx * dx + dy * dy)
+    velocity = np.zeros_like(distance)
+    np.divide(distance, dt, out=velocity, where=dt != 0)
+
+    out["dt_ms"] = dt
+    out["dx"] = dx
+    out["dy"] = dy
+    out["distance_px"] = distance
+    out["velocity_px_per_ms"] = velocity
+    return out
 
-        line_ids.append(current_line)
-        last_y = y
 
-    out["reading_line_id"] = line_ids
+def detect_fixations_and_saccades(
+    df: pd.DataFrame,
+    fixation_velocity_threshold: float = 0.5,
+    inplace: bool = False,
+) -> pd.DataFrame:
+    out = df if inplace else df.copy()
+    velocity = out["velocity_px_per_ms"].to_numpy(dtype=float)
+    out["derived_fixation_flag"] = velocity <= fixation_velocity_threshold
+    out["derived_saccade_flag"] = velocity > fixation_velocity_threshold
     return out
 
 
-def assign_fixations_to_lines(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    out["fixation_line_id"] = out["reading_line_id"].where(out["derived_fixation_flag"], None)
+def reading_line_ids(gaze_y: np.ndarray, tolerance_px: float = 40.0) -> np.ndarray:
+    """Id riga per campione: nuova riga quando |Δy| fra due campioni validi
+    consecutivi supera la tolleranza (somma cumulativa dei salti). NaN dove
+    gaze_y manca; i campioni mancanti non interrompono il confronto."""
+    line = np.full(gaze_y.size, np.nan)
+    valid = ~np.isnan(gaze_y)
+    yv = gaze_y[valid]
+    if yv.size:
+        jumps = np.abs(np.diff(yv)) > tolerance_px
+        ids = np.empty(yv.size, dtype=float)
+        ids[0] = 0.0
+        np.cumsum(jumps, out=ids[1:])
+        line[valid] = ids
+    return line
+
+
+def cluster_reading_lines(df: pd.DataFrame, tolerance_px: float = 40.0, inplace: bool = False) -> pd.DataFrame:
+    out = df if inplace else df.copy()
+    line = reading_line_ids(_as_float(out["gaze_y"]), tolerance_px)
+    if line.size and not np.isnan(line).any():
+        out["reading_line_id"] = line.astype(np.int64)
+    else:
+        out["reading_line_id"] = line
     return out
 
 
-def classify_reading_transitions(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    out["prev_x"] = out["gaze_x"].shift(1)
-    out["prev_line"] = out["reading_line_id"].shift(1)
+def assign_fixations_to_lines(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+    out = df if inplace else df.copy()
+    line = out["reading_line_id"].to_numpy(dtype=float)
+    fixation = out["derived_fixation_flag"].to_numpy(dtype=bool)
+    out["fixation_line_id"] = np.where(fixation, line, np.nan)
+    return out
 
-    out["is_regression"] = (out["gaze_x"] < out["prev_x"]) & (out["reading_line_id"] == out["prev_line"])
-    out["is_line_return"] = (out["reading_line_id"] > out["prev_line"].fillna(out["reading_line_id"])) & (
-        out["gaze_x"] < out["prev_x"].fillna(out["gaze_x"])
-    )
-    out["is_line_loss"] = (out["reading_line_id"] > out["prev_line"].fillna(out["reading_line_id"]) + 1)
 
-    out["is_regression"] = out["is_regression"].fillna(False)
-    out["is_line_return"] = out["is_line_return"].fillna(False)
-    out["is_line_loss"] = out["is_line_loss"].fillna(False)
+def classify_reading_transitions(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+    out = df if inplace else df.copy()
+    x = out["gaze_x"].to_numpy(dtype=float)
+    line = out["reading_line_id"].to_numpy(dtype=float)
+    prev_x = _shift1(x)
+    prev_line = _shift1(line)
+    out["prev_x"] = prev_x
+    out["prev_line"] = prev_line
+
+    # confronti con NaN = False: niente fillna sulle maschere
+    prev_line_or_cur = np.where(np.isnan(prev_line), line, prev_line)
+    prev_x_or_cur = np.where(np.isnan(prev_x), x, prev_x)
+    out["is_regression"] = (x < prev_x) & (line == prev_line)
+    out["is_line_return"] = (line > prev_line_or_cur) & (x < prev_x_or_cur)
+    out["is_line_loss"] = line > prev_line_or_cur + 1
     return out
 
 
@@ -126,16 +171,14 @@ def compute_binocular_metrics(df: pd.DataFrame) -> dict[str, Any]:
             "binocular_mean_disparity_px": None,
         }
 
-    tmp = df.copy()
-    tmp["binocular_disparity_px"] = (
-        (pd.to_numeric(tmp["eye_left_x"], errors="coerce") - pd.to_numeric(tmp["eye_right_x"], errors="coerce")) ** 2
-        + (pd.to_numeric(tmp["eye_left_y"], errors="coerce") - pd.to_numeric(tmp["eye_right_y"], errors="coerce")) ** 2
-    ) ** 0.5
-
-    disparity = tmp["binocular_disparity_px"].dropna()
+    disparity = np.sqrt(
+        (_as_float(df["eye_left_x"]) - _as_float(df["eye_right_x"])) ** 2
+        + (_as_float(df["eye_left_y"]) - _as_float(df["eye_right_y"])) ** 2
+    )
+    disparity = disparity[~np.isnan(disparity)]
     return {
-        "binocular_available": not disparity.empty,
-        "binocular_mean_disparity_px": round(float(disparity.mean()), 4) if not disparity.empty else None,
+        "binocular_available": bool(disparity.size),
+        "binocular_mean_disparity_px": round(float(disparity.mean()), 4) if disparity.size else None,
     }
 
 
@@ -188,11 +231,12 @@ def run_gaze_analytics(
     metadata = metadata or {}
     protocol = get_protocol_config(protocol_name)
 
-    cleaned = clean_gaze_signal(df)
-    detected = detect_fixations_and_saccades(cleaned)
-    lined = cluster_reading_lines(detected, tolerance_px=protocol["line_cluster_tolerance_px"])
-    assigned = assign_fixations_to_lines(lined)
-    classified = classify_reading_transitions(assigned)
+    # una sola copia dell'input, poi tutte le fasi sullo stesso frame
+    classified = clean_gaze_signal(df)
+    detect_fixations_and_saccades(classified, inplace=True)
+    cluster_reading_lines(classified, tolerance_px=protocol["line_cluster_tolerance_px"], inplace=True)
+    assign_fixations_to_lines(classified, inplace=True)
+    classify_reading_transitions(classified, inplace=True)
 
     reading_metrics = compute_reading_metrics(classified)
     saccade_metrics = compute_saccade_metrics(classified)
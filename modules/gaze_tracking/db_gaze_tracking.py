@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import json
-from typing import Any
+from typing import Any, Iterable, Iterator
 
+import numpy as np
 import pandas as pd
 
 
@@ -92,7 +93,14 @@ def init_gaze_tracking_db(conn) -> None:
         cur.execute("CREATE INDEX IF NOT EXISTS idx_gaze_sessions_paziente_id ON gaze_sessions(paziente_id);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_gaze_samples_session_id ON gaze_samples(session_id);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_gaze_reports_session_id ON gaze_reports(session_id);")
+        # timeline compressa a colonne (vedi pack_timeline) al posto del JSONB duplicato
+        cur.execute("ALTER TABLE gaze_browser_sessions ADD COLUMN IF NOT EXISTS timeline_blob BYTEA;")
+        cur.execute("ALTER TABLE gaze_browser_sessions ADD COLUMN IF NOT EXISTS timeline_n INTEGER;")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_gaze_browser_sessions_paziente_id ON gaze_browser_sessions(paziente_id);")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_gaze_browser_sessions_paz_created "
+            "ON gaze_browser_sessions(paziente_id, created_at DESC, id DESC);"
+        )
         conn.commit()
     except Exception:
         try: conn.rollback()
@@ -103,24 +111,152 @@ def init_gaze_tracking_db(conn) -> None:
         except Exception: pass
 
 
+# -----------------------------------------------------------------------------
+# Sessioni browser (webcam): timeline compressa a colonne
+# -----------------------------------------------------------------------------
+#
+# La timeline (lista di punti {"t":..., "x":..., ...}) è salvata in
+# timeline_blob: una colonna per chiave, numeri come array float64/int64
+# (int64 in delta, float64 con byte shuffle: zlib li comprime molto meglio),
+# testi/oggetti come lista JSON, tutto compresso con zlib. payload_json non
+# contiene più la timeline e timeline_json resta NULL per le nuove sessioni;
+# le righe vecchie si leggono ancora e scripts/compatta_gaze_timeline.py le
+# converte (compact_browser_gaze_timelines). La UI (ui_webcam_browser_v3)
+# elenca le sessioni e carica la timeline solo per quella scelta.
+
+_TIMELINE_MAGIC = b"GZTL1"
+
+# metriche mostrate nell'elenco sessioni (estratte in SQL da metrics_json)
+BROWSER_SESSION_HEADLINE_METRICS = (
+    "gaze_direction", "head_tilt_deg", "blink_index", "palpebral_asymmetry",
+)
+
+
+def _col_kind(values: list) -> str:
+    vals = [v for v in values if v is not None]
+    if vals and all(isinstance(v, bool) for v in vals):
+        return "b1"
+    if all(isinstance(v, int) and not isinstance(v, bool) and -(1 << 62) < v < (1 << 62) for v in vals):
+        return "i8"
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in vals):
+        return "f8"
+    return "json"
+
+
+def pack_timeline(timeline: list[dict[str, Any]]) -> bytes:
+    """Timeline (lista di dict) -> blob a colonne compresso (reversibile con unpack_timeline)."""
+    import zlib
+
+    n = len(timeline)
+    keys: dict[str, None] = {}
+    for p in timeline:
+        for k in (p if isinstance(p, dict) else {}):
+            keys.setdefault(str(k), None)
+
+    cols, parts = [], []
+    for k in keys:
+        present = np.fromiter((isinstance(p, dict) and k in p for p in timeline), dtype=bool, count=n)
+        raw = [p.get(k) if isinstance(p, dict) else None for p in timeline]
+        kind = _col_kind(raw)
+        col = {"k": k, "t": kind}
+        if kind == "b1":
+            data = np.array([-1 if v is None else int(v) for v in raw], dtype=np.int8).tobytes()
+        elif kind == "i8":
+            arr = np.array([0 if v is None else v for v in raw], dtype=np.int64)
+            nulls = np.array([v is None for v in raw], dtype=bool)
+            data = np.diff(arr, prepend=np.int64(0)).astype("<i8").tobytes()
+            if nulls.any():
+                col["nulls"] = True
+                data += np.packbits(nulls).tobytes()
+        elif kind == "f8":
+            arr = np.array([np.nan if v is None else float(v) for v in raw], dtype="<f8")
+            data = arr.view(np.uint8).reshape(-1, 8).T.tobytes()  # byte shuffle
+        else:
+            data = json.dumps(raw, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if not present.all():
+            mask = np.packbits(present).tobytes()
+            col["mask"] = len(mask)
+            data += mask
+        col["len"] = len(data)
+        cols.append(col)
+        parts.append(data)
+
+    header = json.dumps({"n": n, "cols": cols}, separators=(",", ":")).encode("utf-8")
+    body = len(header).to_bytes(4, "big") + header + b"".join(parts)
+    return _TIMELINE_MAGIC + zlib.compress(body, 6)
+
+
+def unpack_timeline(blob: bytes) -> list[dict[str, Any]]:
+    """Blob di pack_timeline -> lista di dict (None per i valori nulli, chiavi assenti omesse)."""
+    import zlib
+
+    blob = bytes(blob)
+    if not blob.startswith(_TIMELINE_MAGIC):
+        raise ValueError("timeline_blob in formato sconosciuto")
+    body = zlib.decompress(blob[len(_TIMELINE_MAGIC):])
+    hlen = int.from_bytes(body[:4], "big")
+    header = json.loads(body[4:4 + hlen])
+    n = int(header["n"])
+    out: list[dict[str, Any]] = [{} for _ in range(n)]
+    off = 4 + hlen
+    for col in header["cols"]:
+        data = body[off:off + col["len"]]
+        off += col["len"]
+        mlen = int(col.get("mask") or 0)
+        present = (
+            np.unpackbits(np.frombuffer(data[len(data) - mlen:], dtype=np.uint8), count=n).astype(bool)
+            if mlen else None
+        )
+        if mlen:
+            data = data[:len(data) - mlen]
+        kind = col["t"]
+        if kind == "b1":
+            a = np.frombuffer(data, dtype=np.int8)
+            vals = [None if v < 0 else bool(v) for v in a.tolist()]
+        elif kind == "i8":
+            a = np.cumsum(np.frombuffer(data[:n * 8], dtype="<i8")).tolist()
+            if col.get("nulls"):
+                nulls = np.unpackbits(np.frombuffer(data[n * 8:], dtype=np.uint8), count=n).astype(bool)
+                a = [None if z else v for v, z in zip(a, nulls.tolist())]
+            vals = a
+        elif kind == "f8":
+            a = np.frombuffer(data, dtype=np.uint8).reshape(8, n).T.copy().view("<f8").ravel()
+            vals = [None if v != v else v for v in a.tolist()]
+        else:
+            vals = json.loads(data.decode("utf-8"))
+        k = col["k"]
+        if present is None:
+            for p, v in zip(out, vals):
+                p[k] = v
+        else:
+            for p, v, ok in zip(out, vals, present.tolist()):
+                if ok:
+                    p[k] = v
+    return out
+
+
 def save_browser_gaze_session(conn, paziente_id: int, paziente_label: str, payload: dict[str, Any], notes: str = "") -> int:
     metrics = payload.get("metrics") or {}
     timeline = payload.get("timeline") or []
+    # la timeline va solo in timeline_blob: niente copia in timeline_json/payload_json
+    payload_light = {k: v for k, v in payload.items() if k != "timeline"}
     cur = conn.cursor()
     try:
         cur.execute(
             """
             INSERT INTO gaze_browser_sessions (
-                paziente_id, paziente_label, metrics_json, timeline_json, payload_json, notes
-            ) VALUES (%s, %s, %s::jsonb, %s::jsonb, %s::jsonb, %s)
+                paziente_id, paziente_label, metrics_json, payload_json,
+                timeline_blob, timeline_n, notes
+            ) VALUES (%s, %s, %s::jsonb, %s::jsonb, %s, %s, %s)
             RETURNING id;
             """,
             (
                 int(paziente_id),
                 paziente_label,
                 json.dumps(metrics, ensure_ascii=False),
-                json.dumps(timeline, ensure_ascii=False),
-                json.dumps(payload, ensure_ascii=False),
+                json.dumps(payload_light, ensure_ascii=False),
+                _binary(pack_timeline(timeline)),
+                len(timeline),
                 notes,
             ),
         )
@@ -136,12 +272,30 @@ def save_browser_gaze_session(conn, paziente_id: int, paziente_label: str, paylo
         except Exception: pass
 
 
+def _binary(data: bytes):
+    try:
+        import psycopg2
+        return psycopg2.Binary(data)
+    except Exception:
+        return data
+
+
 def list_browser_gaze_sessions(conn, paziente_id: int, limit: int = 20) -> list[dict[str, Any]]:
+    """Elenco leggero: id, data, note, numero punti e poche metriche di testa
+    (metrics_summary). Timeline e payload NON vengono letti: per aprire una
+    sessione usare get_browser_gaze_session / load_browser_gaze_timeline."""
+    headline = ", ".join(f"'{k}', metrics_json->'{k}'" for k in BROWSER_SESSION_HEADLINE_METRICS)
     cur = conn.cursor()
     try:
         cur.execute(
-            """
-            SELECT id, paziente_id, paziente_label, metrics_json, timeline_json, payload_json, notes, created_at
+            f"""
+            SELECT id, paziente_id, paziente_label, session_type, notes, created_at,
+                   COALESCE(
+                       timeline_n,
+                       CASE WHEN jsonb_typeof(timeline_json) = 'array'
+                            THEN jsonb_array_length(timeline_json) END
+                   ) AS timeline_n,
+                   jsonb_strip_nulls(jsonb_build_object({headline})) AS metrics_summary
             FROM gaze_browser_sessions
             WHERE paziente_id = %s
             ORDER BY created_at DESC, id DESC
@@ -165,13 +319,126 @@ def list_browser_gaze_sessions(conn, paziente_id: int, limit: int = 20) -> list[
         else:
             row = {
                 "id": r[0], "paziente_id": r[1], "paziente_label": r[2],
-                "metrics_json": r[3], "timeline_json": r[4], "payload_json": r[5],
-                "notes": r[6], "created_at": r[7],
+                "session_type": r[3], "notes": r[4], "created_at": r[5],
+                "timeline_n": r[6], "metrics_summary": r[7],
             }
+        if isinstance(row.get("metrics_summary"), str):
+            row["metrics_summary"] = json.loads(row["metrics_summary"])
         out.append(row)
     return out
 
 
+def load_browser_gaze_timeline(conn, session_id: int) -> list[dict[str, Any]]:
+    """Timeline di UNA sessione (blob compresso o, per le righe vecchie, JSONB)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT timeline_blob,
+                   CASE WHEN timeline_blob IS NULL
+                        THEN COALESCE(timeline_json, payload_json->'timeline') END AS legacy
+            FROM gaze_browser_sessions
+            WHERE id = %s;
+            """,
+            (int(session_id),),
+        )
+        r = cur.fetchone()
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
+    if not r:
+        return []
+    blob, legacy = (r["timeline_blob"], r["legacy"]) if isinstance(r, dict) else (r[0], r[1])
+    if blob is not None:
+        return unpack_timeline(blob)
+    if isinstance(legacy, str):
+        legacy = json.loads(legacy)
+    return list(legacy or [])
+
+
+def get_browser_gaze_session(conn, session_id: int, with_timeline: bool = True) -> dict[str, Any] | None:
+    """Sessione completa (metrics_json, payload_json, timeline) per la sessione aperta."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT id, paziente_id, paziente_label, session_type, metrics_json,
+                   payload_json - 'timeline' AS payload_json, notes, created_at
+            FROM gaze_browser_sessions
+            WHERE id = %s;
+            """,
+            (int(session_id),),
+        )
+        r = cur.fetchone()
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
+    if not r:
+        return None
+    vals = list(r.values()) if isinstance(r, dict) else list(r)
+    row = dict(zip(
+        ("id", "paziente_id", "paziente_label", "session_type", "metrics_json",
+         "payload_json", "notes", "created_at"),
+        vals,
+    ))
+    if with_timeline:
+        row["timeline"] = load_browser_gaze_timeline(conn, session_id)
+    return row
+
+
+def compact_browser_gaze_timelines(conn, batch: int = 200) -> int:
+    """Converte le sessioni vecchie (timeline in JSONB, duplicata nel payload)
+    in timeline_blob. Lavora a lotti di `batch` righe; ritorna le righe convertite."""
+    done = 0
+    while True:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT id, COALESCE(timeline_json, payload_json->'timeline') AS tl
+                FROM gaze_browser_sessions
+                WHERE timeline_blob IS NULL
+                ORDER BY id
+                LIMIT %s;
+                """,
+                (int(batch),),
+            )
+            rows = cur.fetchall() or []
+            for r in rows:
+                sid, tl = (r["id"], r["tl"]) if isinstance(r, dict) else (r[0], r[1])
+                if isinstance(tl, str):
+                    tl = json.loads(tl)
+                tl = list(tl or [])
+                cur.execute(
+                    """
+                    UPDATE gaze_browser_sessions
+                    SET timeline_blob = %s, timeline_n = %s,
+                        timeline_json = NULL, payload_json = payload_json - 'timeline'
+                    WHERE id = %s;
+                    """,
+                    (_binary(pack_timeline(tl)), len(tl), int(sid)),
+                )
+            conn.commit()
+        except Exception:
+            try: conn.rollback()
+            except Exception: pass
+            raise
+        finally:
+            try: cur.close()
+            except Exception: pass
+        done += len(rows)
+        if len(rows) < batch:
+            return done
+
+
 def insert_gaze_session(conn, session_data: dict[str, Any]) -> int:
     cur = conn.cursor()
     try:
@@ -213,76 +480,270 @@ def insert_gaze_session(conn, session_data: dict[str, Any]) -> int:
         except Exception: pass
 
 
-def insert_gaze_samples_bulk(conn, session_id: int, df: pd.DataFrame) -> int:
-    rows = []
-    for idx, row in df.reset_index(drop=True).iterrows():
-        rows.append(
-            (
-                session_id,
-                idx,
-                _safe_num(row.get("ts_ms")),
-                _safe_num(row.get("gaze_x")),
-                _safe_num(row.get("gaze_y")),
-                _safe_num(row.get("confidence")),
-                bool(row.get("fixation_flag", False)) if row.get("fixation_flag") is not None else False,
-                bool(row.get("saccade_flag", False)) if row.get("saccade_flag") is not None else False,
-                bool(row.get("blink_flag", False)) if row.get("blink_flag") is not None else False,
-                _safe_num(row.get("eye_left_x")),
-                _safe_num(row.get("eye_left_y")),
-                _safe_num(row.get("eye_right_x")),
-                _safe_num(row.get("eye_right_y")),
-                _safe_num(row.get("pupil_size")),
-                _safe_num(row.get("distance_cm_est")),
-                _safe_num(row.get("target_x")),
-                _safe_num(row.get("target_y")),
-                _safe_text(row.get("target_label")),
-                _safe_text(row.get("source_vendor")),
-                _safe_text(row.get("source_format")),
-                _safe_text(row.get("source_filename")),
-            )
-        )
+_SAMPLE_NUM_COLS = (
+    "ts_ms", "gaze_x", "gaze_y", "confidence",
+)
+_SAMPLE_FLAG_COLS = ("fixation_flag", "saccade_flag", "blink_flag")
+_SAMPLE_NUM_COLS_2 = (
+    "eye_left_x", "eye_left_y", "eye_right_x", "eye_right_y",
+    "pupil_size", "distance_cm_est", "target_x", "target_y",
+)
+_SAMPLE_TEXT_COLS = ("target_label", "source_vendor", "source_format", "source_filename")
+_SAMPLE_COLUMNS = (
+    ("session_id", "sample_index") + _SAMPLE_NUM_COLS + _SAMPLE_FLAG_COLS
+    + _SAMPLE_NUM_COLS_2 + _SAMPLE_TEXT_COLS
+)
 
-    cur = conn.cursor()
+BULK_CHUNK_ROWS = 50_000
+
+# esito dell'ultimo caricamento (righe, secondi, righe/s, metodo) — diagnostica
+_last_bulk_stats: dict[str, Any] = {}
+
+
+def _samples_chunk(
+    df: pd.DataFrame, session_id: int, start: int, stop: int, index_base: int = 0,
+) -> pd.DataFrame:
+    """Righe [start, stop) di df già tipizzate e nell'ordine di _SAMPLE_COLUMNS.
+    sample_index parte da index_base + start (blocchi di uno stream)."""
+    part = df.iloc[start:stop]
+    n = len(part)
+    first = int(index_base) + start
+    out = {
+        "session_id": pd.Series([int(session_id)] * n, dtype="int64"),
+        "sample_index": pd.Series(range(first, first + n), dtype="int64"),
+    }
+    for c in _SAMPLE_NUM_COLS + _SAMPLE_NUM_COLS_2:
+        if c in part.columns:
+            out[c] = pd.to_numeric(part[c], errors="coerce").astype("float64").reset_index(drop=True)
+        else:
+            out[c] = pd.Series([float("nan")] * n, dtype="float64")
+    for c in _SAMPLE_FLAG_COLS:
+        if c in part.columns:
+            out[c] = part[c].fillna(False).astype(bool).reset_index(drop=True)
+        else:
+            out[c] = pd.Series([False] * n, dtype=bool)
+    for c in _SAMPLE_TEXT_COLS:
+        # testi: pochi valori distinti (vendor, formato, file, etichetta target),
+        # convertiti a str una volta per valore e non per riga
+        if c in part.columns:
+            codes, uniques = pd.factorize(part[c], use_na_sentinel=True)
+            lookup = np.array([str(u) for u in uniques] + [None], dtype=object)
+            out[c] = pd.Series(lookup[codes], dtype=object)
+        else:
+            out[c] = pd.Series([None] * n, dtype=object)
+    return pd.DataFrame(out, columns=list(_SAMPLE_COLUMNS))
+
+
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") + (0).to_bytes(4, "big")
+_PGCOPY_TRAILER = (-1).to_bytes(2, "big", signed=True)
+
+
+def _pgcopy_binary_rows(part: pd.DataFrame) -> bytes:
+    """Righe di part (da _samples_chunk) nel formato binario di COPY.
+
+    Ogni riga ha larghezza fissa (lunghezza int32 + valore per ogni campo);
+    la maschera `keep` scarta i byte di valore dei campi NULL e l'indicizzazione
+    booleana, che legge riga per riga, restituisce direttamente lo stream.
+    """
+    n = len(part)
+    mats = [np.full((n, 2), 0, dtype=np.uint8)]
+    mats[0][:] = np.frombuffer(len(_SAMPLE_COLUMNS).to_bytes(2, "big"), dtype=np.uint8)
+    keeps = [np.ones((n, 2), dtype=bool)]
+
+    def add(values: np.ndarray, width: int, null: np.ndarray | None, lengths: np.ndarray | None = None):
+        if lengths is None:
+            lengths = np.full(n, width, dtype=np.int64)
+        if null is not None:
+            lengths = np.where(null, -1, lengths)
+        mats.append(lengths.astype(">i4").view(np.uint8).reshape(n, 4))
+        keeps.append(np.ones((n, 4), dtype=bool))
+        mats.append(values.reshape(n, width))
+        keep = np.arange(width)[None, :] < np.maximum(lengths, 0)[:, None]
+        keeps.append(keep)
+
+    for c in _SAMPLE_COLUMNS:
+        col = part[c]
+        if c in ("session_id", "sample_index"):
+            add(col.to_numpy(dtype=">i8").view(np.uint8), 8, None)
+        elif c in _SAMPLE_FLAG_COLS:
+            add(col.to_numpy(dtype=np.uint8), 1, None)
+        elif c in _SAMPLE_TEXT_COLS:
+            codes, uniques = pd.factorize(col, use_na_sentinel=True)
+            enc = [str(u).encode("utf-8") for u in uniques] + [b""]
+            width = max([1] + [len(e) for e in enc])
+            ulen = np.array([len(e) for e in enc], dtype=np.int64)
+            uval = np.array(enc, dtype=f"S{width}").view(np.uint8).reshape(len(enc), width)
+            add(uval[codes], width, codes < 0, ulen[codes])
+        else:
+            v = col.to_numpy(dtype=float)
+            add(v.astype(">f8").view(np.uint8), 8, np.isnan(v))
+
+    return np.hstack(mats)[np.hstack(keeps)].tobytes()
+
+
+class _CopyStream:
+    """File-like per COPY ... FROM STDIN (formato binario): codifica i
+    DataFrame di campioni di un iteratore a sotto-blocchi di encode_rows
+    righe, così in memoria ci sono al più un blocco del produttore e la
+    codifica di un sotto-blocco. sample_index prosegue fra i blocchi."""
+
+    def __init__(
+        self, parts: Iterable[pd.DataFrame], session_id: int, on_chunk=None,
+        encode_rows: int = BULK_CHUNK_ROWS,
+    ):
+        self._parts = iter(parts)
+        self._sid = session_id
+        self._encode_rows = max(1, int(encode_rows))
+        self._part: pd.DataFrame | None = None
+        self._pos = 0
+        self._base = 0
+        self.rows = 0
+        self._buf = _PGCOPY_HEADER
+        self._off = 0
+        self._done = False
+        self._on_chunk = on_chunk
+
+    def _next_chunk(self) -> bool:
+        if self._done:
+            return False
+        if self._part is None or self._pos >= len(self._part):
+            if self._part is not None and self._on_chunk is not None:
+                self._on_chunk(self.rows)
+            self._part = next(self._parts, None)
+            self._pos = 0
+            self._base = self.rows
+            if self._part is None:
+                self._buf = self._buf[self._off:] + _PGCOPY_TRAILER
+                self._off = 0
+                self._done = True
+            return True
+        stop = min(len(self._part), self._pos + self._encode_rows)
+        rows = _pgcopy_binary_rows(_samples_chunk(self._part, self._sid, self._pos, stop, index_base=self._base))
+        self._buf = self._buf[self._off:] + rows
+        self._off = 0
+        self.rows += stop - self._pos
+        self._pos = stop
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self._buf) - self._off < size) and self._next_chunk():
+            pass
+        end = len(self._buf) if size < 0 else self._off + size
+        data = self._buf[self._off:end]
+        self._off += len(data)
+        return data
+
+
+def _raw_connection(conn):
+    return getattr(conn, "_conn", conn)
+
+
+def _df_parts(df: pd.DataFrame, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    step = max(1, int(chunk_rows))
+    for start in range(0, len(df), step):
+        yield df.iloc[start:start + step]
+
+
+def insert_gaze_samples_stream(
+    conn,
+    session_id: int,
+    parts: Iterable[pd.DataFrame],
+    on_chunk=None,
+    encode_rows: int = BULK_CHUNK_ROWS,
+) -> int:
+    """Carica i campioni di una sessione da un iteratore di DataFrame (colonne
+    canoniche, es. i blocchi di importer_gaze.iter_eye_tracker_chunks).
+    Ritorna il numero di righe inserite.
+
+    PostgreSQL: un solo COPY gaze_samples FROM STDIN in formato binario,
+    alimentato un blocco alla volta mentre il produttore legge il file.
+    Altri driver (SQLite): executemany per blocco. Tutto in un'unica
+    transazione: un errore a metà file (anche del produttore) annulla tutto.
+    Ogni blocco è codificato a sotto-blocchi di encode_rows righe (tetto alla
+    memoria della codifica). on_chunk(righe_fatte) dopo ogni blocco.
+    """
+    import time
+
+    t0 = time.perf_counter()
+    raw = _raw_connection(conn)
+    cur = raw.cursor()
+    method = "copy" if hasattr(cur, "copy_expert") else "executemany"
     try:
-        cur.executemany(
-            """
-            INSERT INTO gaze_samples (
-                session_id,
-                sample_index,
-                ts_ms,
-                gaze_x,
-                gaze_y,
-                confidence,
-                fixation_flag,
-                saccade_flag,
-                blink_flag,
-                eye_left_x,
-                eye_left_y,
-                eye_right_x,
-                eye_right_y,
-                pupil_size,
-                distance_cm_est,
-                target_x,
-                target_y,
-                target_label,
-                source_vendor,
-                source_format,
-                source_filename
+        if method == "copy":
+            stream = _CopyStream(parts, session_id, on_chunk, encode_rows)
+            cur.copy_expert(
+                "COPY gaze_samples (" + ", ".join(_SAMPLE_COLUMNS) + ") "
+                "FROM STDIN WITH (FORMAT binary)",
+                stream,
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-            """,
-            rows,
-        )
-        conn.commit()
-        return len(rows)
+            total = stream.rows
+        else:
+            ph = "?" if type(raw).__module__.startswith("sqlite3") else "%s"
+            sql = (
+                "INSERT INTO gaze_samples (" + ", ".join(_SAMPLE_COLUMNS) + ") "
+                "VALUES (" + ", ".join([ph] * len(_SAMPLE_COLUMNS)) + ")"
+            )
+            total = 0
+            step = max(1, int(encode_rows))
+            for p in parts:
+                base = total
+                for start in range(0, len(p), step):
+                    stop = min(len(p), start + step)
+                    part = _samples_chunk(p, session_id, start, stop, index_base=base).astype(object)
+                    part = part.where(part.notna(), None)
+                    cur.executemany(sql, list(part.itertuples(index=False, name=None)))
+                    total = base + stop
+                if on_chunk is not None:
+                    on_chunk(total)
+        raw.commit()
     except Exception:
-        try: conn.rollback()
+        try: raw.rollback()
         except Exception: pass
         raise
     finally:
         try: cur.close()
         except Exception: pass
 
+    secs = time.perf_counter() - t0
+    _last_bulk_stats.clear()
+    _last_bulk_stats.update({
+        "rows": total,
+        "seconds": round(secs, 3),
+        "rows_per_sec": round(total / secs) if secs > 0 else None,
+        "method": method,
+    })
+    return total
+
+
+def insert_gaze_samples_bulk(
+    conn,
+    session_id: int,
+    df: pd.DataFrame,
+    chunk_rows: int = BULK_CHUNK_ROWS,
+    on_progress=None,
+) -> int:
+    """Carica i campioni di una sessione. Ritorna il numero di righe inserite.
+
+    df viene passato a insert_gaze_samples_stream a blocchi di chunk_rows
+    righe (un solo COPY binario su PostgreSQL, executemany altrove), in
+    un'unica transazione. on_progress(righe_fatte, totale) viene chiamato
+    dopo ogni blocco.
+    """
+    total = len(df)
+    if total == 0:
+        return 0
+    on_chunk = None
+    if on_progress is not None:
+        on_chunk = lambda done: on_progress(done, total)  # noqa: E731
+    return insert_gaze_samples_stream(
+        conn, session_id, _df_parts(df, chunk_rows), on_chunk=on_chunk, encode_rows=chunk_rows,
+    )
+
+
+def last_bulk_load_stats() -> dict[str, Any]:
+    """Righe, secondi, righe/s e metodo (copy/executemany) dell'ultimo caricamento."""
+    return dict(_last_bulk_stats)
+
 
 def upsert_gaze_report(conn, session_id: int, report_data: dict[str, Any]) -> None:
     summary_json = report_data.get("summary_json", {})
@@ -3,6 +3,7 @@ from __future__ import annotations
 import math
 from typing import Any
 
+import numpy as np
 import pandas as pd
 
 
@@ -43,7 +44,12 @@ def compute_distance_metrics(
             "distance_zone_percentages": {},
         }
 
-    zones = series.apply(lambda x: classify_distance_zone(float(x), near_max=near_max, mid_max=mid_max))
+    # stessa soglia di classify_distance_zone, su tutto l'array in un colpo
+    values = series.to_numpy(dtype=float)
+    zones = pd.Series(
+        np.where(values <= near_max, "near", np.where(values <= mid_max, "mid", "far")),
+        index=series.index,
+    )
     zone_pct = zones.value_counts(normalize=True).mul(100).round(2).to_dict()
 
     return {
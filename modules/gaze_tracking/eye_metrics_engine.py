@@ -1,22 +1,62 @@
 from __future__ import annotations
 
 import math
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Mapping, NamedTuple, Sequence, Union
 
+import numpy as np
 
-def distance(p1: Dict[str, float], p2: Dict[str, float]) -> float:
-    return math.sqrt((p1["x"] - p2["x"]) ** 2 + (p1["y"] - p2["y"]) ** 2)
+# Motore fissazioni/saccadi su array (struct-of-arrays x, y, t):
+#   - una sola passata di velocità per tutta la registrazione (I-VT), usata
+#     sia per le fissazioni sia per il conteggio saccadi;
+#   - fissazioni = run consecutive di coppie sotto soglia (run-length con
+#     np.diff sulla maschera), durata e centroide per fissazione con
+#     np.add.reduceat, senza liste di dict per campione;
+#   - in alternativa I-DT (dispersione) con finestre espanse per blocchi.
+# compute_eye_metrics ritorna lo stesso dizionario di prima; le funzioni
+# a dict (preprocess_samples, detect_fixations, ...) restano per compatibilità.
 
 
-def velocity(p1: Dict[str, float], p2: Dict[str, float]) -> float:
-    dt = (p2["t"] - p1["t"]) / 1000.0
-    if dt == 0:
-        return 0.0
-    return distance(p1, p2) / dt
+class GazeArrays(NamedTuple):
+    """Campioni validi come array paralleli: x, y (coordinate), t (ms)."""
+    x: np.ndarray
+    y: np.ndarray
+    t: np.ndarray
 
+    def __len__(self) -> int:
+        return int(self.t.shape[0])
 
-def preprocess_samples(samples: List[Dict[str, Any]]) -> List[Dict[str, float]]:
-    processed: List[Dict[str, float]] = []
+
+class Fixations(NamedTuple):
+    """Fissazioni come array: campioni [start, stop] inclusi, durata ms, centroide."""
+    start: np.ndarray
+    stop: np.ndarray
+    duration_ms: np.ndarray
+    cx: np.ndarray
+    cy: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.start.shape[0])
+
+
+_EMPTY_I = np.empty(0, dtype=np.int64)
+_EMPTY_F = np.empty(0, dtype=float)
+
+
+def samples_to_arrays(samples: Union[Sequence[Mapping[str, Any]], Mapping[str, Any], GazeArrays]) -> GazeArrays:
+    """Campioni grezzi Tobii (lista di dict con left/right_valid, left/right_gaze,
+    timestamp) -> GazeArrays dei soli validi (occhio sinistro se valido, altrimenti
+    destro). Accetta anche un dict di colonne {"x", "y", "t"} già pronte."""
+    if isinstance(samples, GazeArrays):
+        return samples
+    if isinstance(samples, Mapping):
+        return GazeArrays(
+            np.asarray(samples["x"], dtype=float),
+            np.asarray(samples["y"], dtype=float),
+            np.asarray(samples["t"], dtype=float),
+        )
+    xs: List[float] = []
+    ys: List[float] = []
+    ts: List[float] = []
     for s in samples:
         gaze = None
         if s.get("left_valid") == 1:
@@ -25,92 +65,218 @@ def preprocess_samples(samples: List[Dict[str, Any]]) -> List[Dict[str, float]]:
             gaze = s.get("right_gaze")
         if not gaze or len(gaze) < 2:
             continue
-        processed.append({"x": float(gaze[0]), "y": float(gaze[1]), "t": float(s["timestamp"])})
-    return processed
+        xs.append(gaze[0])
+        ys.append(gaze[1])
+        ts.append(s["timestamp"])
+    return GazeArrays(
+        np.asarray(xs, dtype=float),
+        np.asarray(ys, dtype=float),
+        np.asarray(ts, dtype=float),
+    )
 
 
-def detect_fixations(samples: List[Dict[str, float]], velocity_threshold: float = 0.02, min_duration: float = 100.0) -> List[List[Dict[str, float]]]:
-    fixations: List[List[Dict[str, float]]] = []
-    current: List[Dict[str, float]] = []
-    for i in range(1, len(samples)):
-        v = velocity(samples[i - 1], samples[i])
-        if v < velocity_threshold:
-            if not current:
-                current.append(samples[i - 1])
-            current.append(samples[i])
-        else:
-            if current:
-                duration = current[-1]["t"] - current[0]["t"]
-                if duration >= min_duration:
-                    fixations.append(current)
-                current = []
-    if current:
-        duration = current[-1]["t"] - current[0]["t"]
-        if duration >= min_duration:
-            fixations.append(current)
-    return fixations
+def pair_velocities(g: GazeArrays) -> np.ndarray:
+    """Velocità fra campioni consecutivi (unità/s), n-1 valori; 0 dove dt = 0."""
+    if len(g) < 2:
+        return _EMPTY_F
+    dx = np.diff(g.x)
+    dy = np.diff(g.y)
+    dt = np.diff(g.t) / 1000.0
+    dist = np.sqrt(dx * dx + dy * dy)
+    v = np.zeros_like(dist)
+    np.divide(dist, dt, out=v, where=dt != 0)
+    return v
 
 
-def detect_regressions(fixations: List[List[Dict[str, float]]]) -> int:
-    regressions = 0
-    for i in range(1, len(fixations)):
-        prev_x = sum(p["x"] for p in fixations[i - 1]) / len(fixations[i - 1])
-        curr_x = sum(p["x"] for p in fixations[i]) / len(fixations[i])
-        if curr_x < prev_x:
-            regressions += 1
-    return regressions
+def _runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(inizi, fini esclusive) delle run di True in mask."""
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
 
 
-def detect_saccades_count(samples: List[Dict[str, float]], velocity_threshold: float = 0.02) -> int:
-    count = 0
-    for i in range(1, len(samples)):
-        if velocity(samples[i - 1], samples[i]) >= velocity_threshold:
-            count += 1
-    return count
-
-
-def compute_eye_metrics(raw_samples: List[Dict[str, Any]]) -> Dict[str, Any]:
-    samples = preprocess_samples(raw_samples)
-    if len(samples) < 10:
-        return {
-            "samples_total": len(raw_samples),
-            "samples_valid": len(samples),
-            "duration_sec": 0,
-            "fixations_total": 0,
-            "fixations_per_min": 0,
-            "fixation_mean_ms": 0,
-            "fixation_sd_ms": 0,
-            "fixation_median_ms": 0,
-            "regressions_total": 0,
-            "saccades_total": 0,
-        }
-
-    fixations = detect_fixations(samples)
-    fixation_durations = [f[-1]["t"] - f[0]["t"] for f in fixations]
-    duration_sec = max((samples[-1]["t"] - samples[0]["t"]) / 1000.0, 0.001)
-    fixations_total = len(fixations)
-    fixations_per_min = (fixations_total / duration_sec) * 60.0
-    fixation_mean = sum(fixation_durations) / len(fixation_durations) if fixation_durations else 0.0
-
-    if fixation_durations:
-        sorted_d = sorted(fixation_durations)
-        mid = len(sorted_d) // 2
-        fixation_median = (sorted_d[mid - 1] + sorted_d[mid]) / 2.0 if len(sorted_d) % 2 == 0 else sorted_d[mid]
-        mean = fixation_mean
-        fixation_sd = (sum((d - mean) ** 2 for d in fixation_durations) / len(fixation_durations)) ** 0.5
+def _fixations_from_ranges(g: GazeArrays, start: np.ndarray, stop: np.ndarray, min_duration: float) -> Fixations:
+    dur = g.t[stop] - g.t[start]
+    keep = dur >= min_duration
+    start, stop, dur = start[keep], stop[keep], dur[keep]
+    if not start.size:
+        return Fixations(_EMPTY_I, _EMPTY_I, _EMPTY_F, _EMPTY_F, _EMPTY_F)
+    # somme per fissazione: indici alternati [start, stop+1] e si tiene un
+    # risultato su due (un elemento in coda per stop+1 == n)
+    idx = np.empty(2 * start.size, dtype=np.int64)
+    idx[0::2] = start
+    idx[1::2] = stop + 1
+    n_pts = (stop - start + 1).astype(float)
+    cx = np.add.reduceat(np.append(g.x, 0.0), idx)[0::2] / n_pts
+    cy = np.add.reduceat(np.append(g.y, 0.0), idx)[0::2] / n_pts
+    return Fixations(start, stop, dur, cx, cy)
+
+
+def fixations_ivt(
+    g: GazeArrays,
+    velocity_threshold: float = 0.02,
+    min_duration: float = 100.0,
+    velocities: np.ndarray | None = None,
+) -> Fixations:
+    """I-VT: una fissazione è una run di coppie consecutive con velocità sotto
+    soglia; comprende il campione prima della run. Tenute solo se durano
+    almeno min_duration ms."""
+    v = pair_velocities(g) if velocities is None else velocities
+    a, b = _runs(v < velocity_threshold)
+    # coppia i = campioni (i, i+1): run di coppie [a, b) -> campioni [a, b]
+    return _fixations_from_ranges(g, a, b, min_duration)
+
+
+def fixations_idt(
+    g: GazeArrays,
+    dispersion_threshold: float = 0.03,
+    min_duration: float = 100.0,
+    block: int = 4096,
+) -> Fixations:
+    """I-DT: finestra di almeno min_duration ms con dispersione
+    (max-min x + max-min y) sotto soglia, espansa finché resta sotto soglia.
+    L'espansione usa massimi/minimi cumulativi su blocchi di campioni."""
+    n = len(g)
+    x, y, t = g.x, g.y, g.t
+    starts: List[int] = []
+    stops: List[int] = []
+    i = 0
+    while i < n:
+        j = int(np.searchsorted(t, t[i] + min_duration, side="left"))
+        if j >= n:
+            break
+        w = slice(i, j + 1)
+        disp = (x[w].max() - x[w].min()) + (y[w].max() - y[w].min())
+        if not disp <= dispersion_threshold:
+            i += 1
+            continue
+        # espansione: primo k > j in cui la dispersione cumulativa supera la soglia
+        xmin, xmax = x[w].min(), x[w].max()
+        ymin, ymax = y[w].min(), y[w].max()
+        k = j + 1
+        while k < n:
+            e = min(n, k + block)
+            cxmax = np.maximum.accumulate(np.maximum(x[k:e], xmax))
+            cxmin = np.minimum.accumulate(np.minimum(x[k:e], xmin))
+            cymax = np.maximum.accumulate(np.maximum(y[k:e], ymax))
+            cymin = np.minimum.accumulate(np.minimum(y[k:e], ymin))
+            over = np.flatnonzero(~((cxmax - cxmin) + (cymax - cymin) <= dispersion_threshold))
+            if over.size:
+                k += int(over[0])
+                break
+            xmin, xmax, ymin, ymax = cxmin[-1], cxmax[-1], cymin[-1], cymax[-1]
+            k = e
+        starts.append(i)
+        stops.append(k - 1)
+        i = k
+    return _fixations_from_ranges(
+        g, np.asarray(starts, dtype=np.int64), np.asarray(stops, dtype=np.int64), min_duration,
+    )
+
+
+def count_regressions(fix: Fixations) -> int:
+    """Fissazioni con centroide x a sinistra della precedente."""
+    return int(np.count_nonzero(fix.cx[1:] < fix.cx[:-1])) if len(fix) > 1 else 0
+
+
+def _metrics_vuote(samples_total: int, samples_valid: int) -> Dict[str, Any]:
+    return {
+        "samples_total": samples_total,
+        "samples_valid": samples_valid,
+        "duration_sec": 0,
+        "fixations_total": 0,
+        "fixations_per_min": 0,
+        "fixation_mean_ms": 0,
+        "fixation_sd_ms": 0,
+        "fixation_median_ms": 0,
+        "regressions_total": 0,
+        "saccades_total": 0,
+    }
+
+
+def compute_eye_metrics(
+    raw_samples: Union[Sequence[Mapping[str, Any]], Mapping[str, Any], GazeArrays],
+    method: str = "ivt",
+    velocity_threshold: float = 0.02,
+    dispersion_threshold: float = 0.03,
+    min_duration: float = 100.0,
+) -> Dict[str, Any]:
+    """Metriche di lettura da campioni eye tracker (lista di dict Tobii o colonne
+    x/y/t). method="ivt" (default, come prima) oppure "idt". Le saccadi sono
+    sempre le coppie con velocità sopra soglia (stessa passata di velocità)."""
+    g = samples_to_arrays(raw_samples)
+    samples_total = len(raw_samples) if not isinstance(raw_samples, Mapping) else len(g)
+    if len(g) < 10:
+        return _metrics_vuote(samples_total, len(g))
+
+    v = pair_velocities(g)
+    if method == "idt":
+        fix = fixations_idt(g, dispersion_threshold, min_duration)
     else:
-        fixation_median = 0.0
-        fixation_sd = 0.0
+        fix = fixations_ivt(g, velocity_threshold, min_duration, velocities=v)
+
+    duration_sec = max(float(g.t[-1] - g.t[0]) / 1000.0, 0.001)
+    d = fix.duration_ms
+    if d.size:
+        fixation_mean = float(d.mean())
+        fixation_median = float(np.median(d))
+        fixation_sd = float(d.std())
+    else:
+        fixation_mean = fixation_median = fixation_sd = 0.0
 
     return {
-        "samples_total": len(raw_samples),
-        "samples_valid": len(samples),
+        "samples_total": samples_total,
+        "samples_valid": len(g),
         "duration_sec": duration_sec,
-        "fixations_total": fixations_total,
-        "fixations_per_min": fixations_per_min,
+        "fixations_total": len(fix),
+        "fixations_per_min": (len(fix) / duration_sec) * 60.0,
         "fixation_mean_ms": fixation_mean,
         "fixation_sd_ms": fixation_sd,
         "fixation_median_ms": fixation_median,
-        "regressions_total": detect_regressions(fixations),
-        "saccades_total": detect_saccades_count(samples),
+        "regressions_total": count_regressions(fix),
+        "saccades_total": int(np.count_nonzero(v >= velocity_threshold)),
     }
+
+
+# -----------------------------------------------------------------------------
+# API a dict (compatibilità)
+# -----------------------------------------------------------------------------
+
+def distance(p1: Dict[str, float], p2: Dict[str, float]) -> float:
+    return math.sqrt((p1["x"] - p2["x"]) ** 2 + (p1["y"] - p2["y"]) ** 2)
+
+
+def velocity(p1: Dict[str, float], p2: Dict[str, float]) -> float:
+    dt = (p2["t"] - p1["t"]) / 1000.0
+    if dt == 0:
+        return 0.0
+    return distance(p1, p2) / dt
+
+
+def _as_points(g: GazeArrays) -> List[Dict[str, float]]:
+    return [{"x": x, "y": y, "t": t} for x, y, t in zip(g.x.tolist(), g.y.tolist(), g.t.tolist())]
+
+
+def _from_points(samples: List[Dict[str, float]]) -> GazeArrays:
+    return samples_to_arrays({
+        "x": [p["x"] for p in samples],
+        "y": [p["y"] for p in samples],
+        "t": [p["t"] for p in samples],
+    })
+
+
+def preprocess_samples(samples: List[Dict[str, Any]]) -> List[Dict[str, float]]:
+    return _as_points(samples_to_arrays(samples))
+
+
+def detect_fixations(samples: List[Dict[str, float]], velocity_threshold: float = 0.02, min_duration: float = 100.0) -> List[List[Dict[str, float]]]:
+    fix = fixations_ivt(_from_points(samples), velocity_threshold, min_duration)
+    return [samples[a:b + 1] for a, b in zip(fix.start.tolist(), fix.stop.tolist())]
+
+
+def detect_regressions(fixations: List[List[Dict[str, float]]]) -> int:
+    cx = np.array([np.mean([p["x"] for p in f]) for f in fixations], dtype=float)
+    return int(np.count_nonzero(cx[1:] < cx[:-1])) if cx.size > 1 else 0
+
+
+def detect_saccades_count(samples: List[Dict[str, float]], velocity_threshold: float = 0.02) -> int:
+    return int(np.count_nonzero(pair_velocities(_from_points(samples)) >= velocity_threshold))
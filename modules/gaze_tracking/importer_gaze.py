@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import os
 from dataclasses import dataclass
 from io import BytesIO
-from typing import Any
+from typing import Any, Callable, Iterator, Optional
 
+import numpy as np
 import pandas as pd
 
 
@@ -69,25 +71,29 @@ def detect_source_vendor(df: pd.DataFrame, filename: str | None = None) -> str:
     return "generic"
 
 
+_TRUE_FLAGS = {"1", "true", "yes", "y", "fixation", "saccade", "blink"}
+
+
 def _coerce_bool_flag(series: pd.Series) -> pd.Series:
     if series is None:
         return pd.Series(dtype="boolean")
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # import a blocchi: le colonne flag arrivano come category, si
+        # normalizzano solo le categorie (codice -1 = mancante -> False)
+        cats = series.cat.categories.astype(str).str.strip().str.lower().isin(_TRUE_FLAGS)
+        lookup = np.append(np.asarray(cats, dtype=bool), False)
+        return pd.Series(lookup[series.cat.codes.to_numpy()], index=series.index)
     normalized = series.astype(str).str.strip().str.lower()
-    return normalized.isin({"1", "true", "yes", "y", "fixation", "saccade", "blink"})
+    return normalized.isin(_TRUE_FLAGS)
 
 
 def _ensure_columns(df: pd.DataFrame, source_vendor: str, source_format: str, source_filename: str) -> pd.DataFrame:
-    out = df.copy()
-
-    for col in CANONICAL_COLUMNS:
-        if col not in out.columns:
-            out[col] = None
+    # una sola copia: le colonne canoniche mancanti diventano NaN
+    out = df.reindex(columns=CANONICAL_COLUMNS)
 
     out["source_vendor"] = source_vendor
     out["source_format"] = source_format
     out["source_filename"] = source_filename
-
-    out = out[CANONICAL_COLUMNS].copy()
     return out
 
 
@@ -187,13 +193,21 @@ def _finalize_internal_dataframe(
         "target_y",
     ]
     for col in numeric_cols:
-        out[col] = pd.to_numeric(out[col], errors="coerce")
+        # colonne già numeriche (float32/float64 dal parser) restano come sono
+        if out[col].dtype == bool or not pd.api.types.is_numeric_dtype(out[col]):
+            out[col] = pd.to_numeric(out[col], errors="coerce")
 
     for flag_col in ["fixation_flag", "saccade_flag", "blink_flag"]:
         if out[flag_col].dtype != bool:
             out[flag_col] = out[flag_col].fillna(False).astype(bool)
 
-    out = out.dropna(subset=["ts_ms"]).sort_values("ts_ms").reset_index(drop=True)
+    if out["ts_ms"].isna().any():
+        out = out.dropna(subset=["ts_ms"])
+    if not out["ts_ms"].is_monotonic_increasing:
+        out = out.sort_values("ts_ms", kind="stable")
+    idx = out.index
+    if not (isinstance(idx, pd.RangeIndex) and idx.start == 0 and idx.step == 1):
+        out = out.reset_index(drop=True)
     return out
 
 
@@ -257,3 +271,353 @@ def import_eye_tracking_file(uploaded_file, forced_vendor: str = "auto") -> Impo
     }
 
     return ImportResult(df=df, metadata=metadata, validation=validation)
+
+
+# -----------------------------------------------------------------------------
+# Import a blocchi (export grandi: Tobii Pro Lab da centinaia di MB)
+# -----------------------------------------------------------------------------
+# Invece di read() + read_csv di tutto il file: si legge l'header, si
+# riconosce il vendor, si proiettano solo le colonne che il normalizzatore
+# usa e si legge a blocchi con dtype espliciti (coordinate float32,
+# timestamp float64 senza arrotondamenti, flag category). I tipi numerici
+# non vanno a read_csv: gli export hanno segnaposto ("-", "N/A") che farebbero
+# fallire il parser, quindi ogni blocco passa da pd.to_numeric(errors="coerce")
+# come nell'import intero. Ogni blocco normalizzato va direttamente nel COPY
+# di db_gaze_tracking.
+
+STREAM_MAX_MEMORY_MB = 256
+STREAM_MIN_CHUNK_ROWS = 1_000
+STREAM_MAX_CHUNK_ROWS = 1_000_000
+_PROBE_ROWS = 2_000
+# codifica COPY binaria (_pgcopy_binary_rows): matrici per campo, maschere e
+# stream finale, ~1.5 KB per riga del sotto-blocco in codifica
+_COPY_BYTES_PER_ROW = 1536
+_PREVIEW_ROWS = 1_000
+
+_TOBII_FLOAT_KEYS = (
+    "gaze point x", "gaze point y",
+    "left gaze point x", "left gaze point y",
+    "right gaze point x", "right gaze point y",
+)
+_GENERIC_FLOAT_COLS = (
+    "gaze_x", "gaze_y", "confidence", "eye_left_x", "eye_left_y", "eye_right_x",
+    "eye_right_y", "pupil_size", "distance_cm_est", "target_x", "target_y",
+)
+
+
+def _source_format(filename: str) -> str:
+    return filename.lower().split(".")[-1] if "." in filename else "unknown"
+
+
+def column_projection(vendor: str, columns: list[str]) -> tuple[list[str], dict[str, Any]]:
+    """(usecols, dtype) per read_csv: solo le colonne lette dal normalizzatore
+    di vendor, nello stesso ordine del file (la prima colonna resta prima,
+    serve come timestamp quando manca "timestamp"/"ts_ms")."""
+    cols = {str(c).lower(): c for c in columns}
+    first = columns[0] if columns else None
+    floats: list[Any] = []
+    cats: list[Any] = []
+    other: list[Any] = []
+    if vendor == "tobii":
+        ts = cols.get("timestamp", first)
+        floats = [cols.get(k) for k in _TOBII_FLOAT_KEYS]
+    elif vendor == "thomson":
+        ts = cols.get("timestamp", first)
+        floats = [
+            cols.get("gaze_x", cols.get("x")),
+            cols.get("gaze_y", cols.get("y")),
+            cols.get("confidence"),
+            cols.get("pupil"),
+            cols.get("distance_cm_est", cols.get("distance")),
+        ]
+        cats = [cols.get("fixation"), cols.get("saccade"), cols.get("blink"), cols.get("target_label")]
+    else:
+        ts = "ts_ms" if "ts_ms" in columns else first
+        floats = [c for c in _GENERIC_FLOAT_COLS if c in columns]
+        cats = ["target_label"] if "target_label" in columns else []
+        # flag generici: tipo lasciato al parser (bool o 0/1), come prima
+        other = [c for c in ("fixation_flag", "saccade_flag", "blink_flag") if c in columns]
+
+    dtype: dict[Any, Any] = {}
+    for c in floats:
+        if c is not None and c != ts:
+            dtype[c] = "float32"
+    for c in cats:
+        if c is not None and c != ts:
+            dtype[c] = "category"
+    if ts is not None:
+        dtype[ts] = "float64"
+    wanted = set(dtype) | {c for c in other if c is not None}
+    return [c for c in columns if c in wanted], dtype
+
+
+def _normalize_chunk(vendor: str, df: pd.DataFrame, filename: str) -> pd.DataFrame:
+    if vendor == "tobii":
+        return normalize_tobii_dataframe(df, filename=filename)
+    if vendor == "thomson":
+        return normalize_thomson_dataframe(df, filename=filename)
+    return normalize_generic_dataframe(df, filename=filename)
+
+
+class EyeTrackerChunkReader:
+    """
+    Lettore a blocchi di un export eye tracker (CSV; XLS/XLSX letti interi ma
+    con le stesse colonne/dtype e consegnati a blocchi).
+
+    Iterando si ottengono DataFrame già normalizzati (CANONICAL_COLUMNS),
+    ordinati per ts_ms all'interno del blocco. L'ordine fra blocchi è quello
+    del file: i blocchi fuori ordine sono contati in validation().
+
+    max_memory_mb è diviso a metà: una per la codifica COPY (encode_rows,
+    da passare a insert_gaze_samples_stream), una per lettura e
+    normalizzazione, dove un primo blocco di prova misura i byte per riga e
+    ne ricava la dimensione dei blocchi.
+    on_progress(byte_letti, byte_totali) dopo ogni blocco.
+    """
+
+    def __init__(
+        self,
+        uploaded_file,
+        forced_vendor: str = "auto",
+        max_memory_mb: float = STREAM_MAX_MEMORY_MB,
+        chunk_rows: Optional[int] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ):
+        if isinstance(uploaded_file, (str, os.PathLike)):
+            self.filename = os.path.basename(str(uploaded_file))
+            self._path = str(uploaded_file)
+            self._fh = None
+        else:
+            self.filename = getattr(uploaded_file, "name", "unknown")
+            self._path = None
+            self._fh = uploaded_file
+        self.source_format = _source_format(self.filename)
+        if self.source_format not in {"csv", "xls", "xlsx"}:
+            raise ValueError(f"Formato file non supportato: {self.filename}")
+        self.forced_vendor = forced_vendor
+        self.max_memory_bytes = int(float(max_memory_mb) * 1024 * 1024)
+        self.encode_rows = max(
+            STREAM_MIN_CHUNK_ROWS,
+            min(STREAM_MAX_CHUNK_ROWS, self.max_memory_bytes // 2 // _COPY_BYTES_PER_ROW),
+        )
+        self.chunk_rows = int(chunk_rows) if chunk_rows else None
+        self.on_progress = on_progress
+
+        self.vendor: Optional[str] = None
+        self.raw_columns: list[str] = []
+        self.usecols: list[str] = []
+        self.dtype: dict[str, Any] = {}
+        self.bytes_per_row: Optional[float] = None
+        self.preview: Optional[pd.DataFrame] = None
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self.rows_read = 0
+        self.rows = 0
+        self.chunks = 0
+        self._na_x = 0
+        self._na_y = 0
+        self._dup_ts = 0
+        self._unordered = 0
+        self._last_ts: Optional[float] = None
+
+    # --- file ---------------------------------------------------------------
+
+    def _open(self):
+        if self._path is not None:
+            return open(self._path, "rb")
+        self._fh.seek(0)
+        return self._fh
+
+    def _close(self, fh) -> None:
+        if self._path is not None:
+            fh.close()
+
+    def _total_bytes(self, fh) -> int:
+        size = getattr(fh, "size", None)
+        if size is None:
+            pos = fh.tell()
+            size = fh.seek(0, os.SEEK_END)
+            fh.seek(pos)
+        return int(size)
+
+    def _header(self, fh) -> list[str]:
+        if self.source_format == "csv":
+            cols = list(pd.read_csv(fh, nrows=0).columns)
+        else:
+            cols = list(pd.read_excel(fh, nrows=0).columns)
+        fh.seek(0)
+        return cols
+
+    # --- blocchi ------------------------------------------------------------
+
+    def _size_chunks(self, raw: pd.DataFrame, norm: pd.DataFrame) -> int:
+        if self.chunk_rows:
+            return self.chunk_rows
+        n = max(1, len(raw))
+        raw_row = raw.memory_usage(deep=True, index=False).sum() / n
+        # source_* sono la stessa stringa ripetuta: basta la dimensione dei puntatori
+        norm_row = norm.memory_usage(deep=False, index=False).sum() / max(1, len(norm))
+        # testo nel buffer del parser + blocco grezzo, temporanei della
+        # normalizzazione, blocco normalizzato
+        self.bytes_per_row = float(2 * raw_row + 2 * norm_row)
+        rows = int(self.max_memory_bytes // 2 // max(1.0, self.bytes_per_row))
+        return max(STREAM_MIN_CHUNK_ROWS, min(STREAM_MAX_CHUNK_ROWS, rows))
+
+    def _account(self, chunk: pd.DataFrame) -> None:
+        ts = chunk["ts_ms"]
+        self.rows += len(chunk)
+        self.chunks += 1
+        self._na_x += int(chunk["gaze_x"].isna().sum())
+        self._na_y += int(chunk["gaze_y"].isna().sum())
+        self._dup_ts += int(ts.duplicated().sum())
+        if len(ts):
+            first = float(ts.iloc[0])
+            if self._last_ts is not None:
+                if first == self._last_ts:
+                    self._dup_ts += 1
+                elif first < self._last_ts:
+                    self._unordered += 1
+            self._last_ts = float(ts.iloc[-1])
+        if self.preview is None:
+            self.preview = chunk.head(_PREVIEW_ROWS).copy()
+
+    def _coerce(self, raw: pd.DataFrame) -> pd.DataFrame:
+        """Colonne numeriche del blocco al dtype di column_projection; le celle
+        non numeriche (segnaposto) diventano NaN."""
+        for c, t in self.dtype.items():
+            if t != "category" and c in raw.columns and raw[c].dtype != t:
+                raw[c] = pd.to_numeric(raw[c], errors="coerce").astype(t)
+        return raw
+
+    def _raw_chunks(self, fh) -> Iterator[tuple[pd.DataFrame, Optional[pd.DataFrame]]]:
+        """(blocco grezzo, blocco già normalizzato o None)."""
+        parse_dtype = {c: t for c, t in self.dtype.items() if t == "category"}
+        kw = {"usecols": self.usecols, "dtype": parse_dtype}
+        if self.source_format != "csv":
+            whole = self._coerce(pd.read_excel(fh, **kw))
+            probe = whole.iloc[:_PROBE_ROWS]
+            step = self._size_chunks(probe, _normalize_chunk(self.vendor, probe, self.filename))
+            for start in range(0, len(whole), step):
+                yield whole.iloc[start:start + step], None
+            return
+        with pd.read_csv(fh, iterator=True, **kw) as reader:
+            try:
+                probe = self._coerce(reader.get_chunk(_PROBE_ROWS))
+            except StopIteration:
+                return
+            norm = _normalize_chunk(self.vendor, probe, self.filename)
+            step = self._size_chunks(probe, norm)
+            yield probe, norm
+            while True:
+                try:
+                    raw = reader.get_chunk(step)
+                except StopIteration:
+                    return
+                yield self._coerce(raw), None
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        self._reset_stats()
+        self.preview = None
+        fh = self._open()
+        try:
+            total = self._total_bytes(fh)
+            header = self._header(fh)
+            self.raw_columns = [str(c) for c in header]
+            if self.forced_vendor == "auto":
+                self.vendor = detect_source_vendor(pd.DataFrame(columns=self.raw_columns), filename=self.filename)
+            else:
+                self.vendor = self.forced_vendor
+            self.usecols, self.dtype = column_projection(self.vendor, header)
+            for raw, chunk in self._raw_chunks(fh):
+                self.rows_read += len(raw)
+                if chunk is None:
+                    chunk = _normalize_chunk(self.vendor, raw, self.filename)
+                del raw
+                self._account(chunk)
+                if self.on_progress is not None:
+                    done = total if self.source_format != "csv" else min(total, fh.tell())
+                    self.on_progress(done, total)
+                yield chunk
+            if self.on_progress is not None:
+                self.on_progress(total, total)
+        finally:
+            self._close(fh)
+
+    def validation(self) -> dict[str, Any]:
+        """Stessi controlli di validate_imported_dataframe, accumulati per blocco
+        (duplicati: dentro i blocchi e al confine fra blocchi consecutivi)."""
+        errors: list[str] = []
+        warnings: list[str] = []
+        if self.rows == 0:
+            errors.append("Il file importato non contiene righe valide.")
+            return {"valid": False, "errors": errors, "warnings": warnings}
+        if self._na_x / self.rows > 0.8:
+            warnings.append("Molti valori gaze_x mancanti o non leggibili.")
+        if self._na_y / self.rows > 0.8:
+            warnings.append("Molti valori gaze_y mancanti o non leggibili.")
+        if self._dup_ts > 0:
+            warnings.append(f"Presenti {self._dup_ts} timestamp duplicati.")
+        if self._unordered > 0:
+            warnings.append(
+                f"{self._unordered} blocchi con timestamp precedenti al blocco prima: "
+                "ordinamento solo all'interno dei blocchi."
+            )
+        return {
+            "valid": True,
+            "errors": errors,
+            "warnings": warnings,
+            "row_count": int(self.rows),
+            "column_count": len(CANONICAL_COLUMNS),
+        }
+
+    def metadata(self) -> dict[str, Any]:
+        return {
+            "source_vendor": self.vendor,
+            "source_format": self.source_format,
+            "source_filename": self.filename,
+            "raw_columns": list(self.raw_columns),
+            "projected_columns": [str(c) for c in self.usecols],
+            "normalized_columns": list(CANONICAL_COLUMNS),
+            "row_count": int(self.rows),
+            "rows_read": int(self.rows_read),
+            "chunks": int(self.chunks),
+            "bytes_per_row_est": round(self.bytes_per_row, 1) if self.bytes_per_row else None,
+            "encode_rows": int(self.encode_rows),
+            "max_memory_mb": round(self.max_memory_bytes / (1024 * 1024), 1),
+        }
+
+
+def iter_eye_tracker_chunks(
+    uploaded_file,
+    forced_vendor: str = "auto",
+    max_memory_mb: float = STREAM_MAX_MEMORY_MB,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Blocchi normalizzati di un export (vedi EyeTrackerChunkReader)."""
+    return iter(EyeTrackerChunkReader(uploaded_file, forced_vendor, max_memory_mb, on_progress=on_progress))
+
+
+def import_eye_tracking_file_streaming(
+    conn,
+    session_id: int,
+    uploaded_file,
+    forced_vendor: str = "auto",
+    max_memory_mb: float = STREAM_MAX_MEMORY_MB,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> ImportResult:
+    """
+    Importa un export direttamente in gaze_samples della sessione (già creata
+    con insert_gaze_session), un blocco alla volta dentro un solo COPY: il
+    file non viene mai caricato tutto in memoria. In ImportResult.df ci sono
+    solo le prime righe normalizzate (anteprima); metadata e validation
+    descrivono l'intero file.
+    """
+    from .db_gaze_tracking import insert_gaze_samples_stream, last_bulk_load_stats
+
+    reader = EyeTrackerChunkReader(uploaded_file, forced_vendor, max_memory_mb, on_progress=on_progress)
+    insert_gaze_samples_stream(conn, session_id, reader, encode_rows=reader.encode_rows)
+    metadata = reader.metadata()
+    metadata["bulk_load"] = last_bulk_load_stats()
+    preview = reader.preview if reader.preview is not None else pd.DataFrame(columns=CANONICAL_COLUMNS)
+    return ImportResult(df=preview, metadata=metadata, validation=reader.validation())
@@ -8,4 +8,5 @@ def ui_gaze_tracking(paziente_id=None, paziente_label="", get_connection=None, *
     return ui_webcam_browser_v3(
         paziente_id=paziente_id,
         paziente_label=paziente_label,
+        get_conn=get_connection or kwargs.get("get_conn"),
     )
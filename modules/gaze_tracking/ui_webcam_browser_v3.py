@@ -9,7 +9,51 @@ from .webcam_browser_v3_embed import get_webcam_browser_v3_html
 from .report_gaze_pnev import build_report_from_payloads
 
 
-def ui_webcam_browser_v3(paziente_id=None, paziente_label=""):
+def _sessione_salvata(get_conn, paziente_id):
+    """Payload webcam di una sessione salvata in gaze_browser_sessions: l'elenco
+    è leggero, la timeline si carica solo per la sessione scelta."""
+    if get_conn is None or not paziente_id:
+        return None
+    from .db_gaze_tracking import get_browser_gaze_session, list_browser_gaze_sessions
+
+    conn = get_conn()
+    try:
+        sessioni = list_browser_gaze_sessions(conn, int(paziente_id))
+    except Exception:
+        return None  # tabella non ancora creata: solo upload del JSON
+    if not sessioni:
+        return None
+    per_id = {s["id"]: s for s in sessioni}
+
+    def _etichetta(sid):
+        if sid is None:
+            return "— nessuna —"
+        s = per_id[sid]
+        data = s["created_at"].strftime("%d/%m/%Y %H:%M") if s.get("created_at") else "?"
+        return f"{data} · {s.get('timeline_n') or 0} punti" + (f" · {s['notes']}" if s.get("notes") else "")
+
+    sid = st.selectbox(
+        "Oppure usa una sessione webcam salvata",
+        options=[None] + list(per_id),
+        format_func=_etichetta,
+        key="gaze_browser_session_sel",
+    )
+    if sid is None:
+        return None
+    try:
+        row = get_browser_gaze_session(conn, int(sid))
+    except Exception as e:
+        st.error(f"Errore lettura sessione salvata: {e}")
+        return None
+    if not row:
+        return None
+    payload = dict(row.get("payload_json") or {})
+    payload.setdefault("metrics", row.get("metrics_json") or {})
+    payload["timeline"] = row.get("timeline") or []
+    return payload
+
+
+def ui_webcam_browser_v3(paziente_id=None, paziente_label="", get_conn=None):
     st.subheader("Eye Tracking / Webcam AI")
     st.caption(
         "Versione browser-based stabile. La webcam viene gestita lato browser "
@@ -32,6 +76,8 @@ def ui_webcam_browser_v3(paziente_id=None, paziente_label=""):
         key="gaze_webcam_json_uploader",
     )
 
+    saved_webcam_payload = _sessione_salvata(get_conn, paziente_id)
+
     uploaded_clinical_eye_json = st.file_uploader(
         "Carica eventuale JSON/estratto Clinical Eye",
         type=["json"],
@@ -53,6 +99,8 @@ def ui_webcam_browser_v3(paziente_id=None, paziente_label=""):
             st.success("JSON webcam caricato correttamente.")
         except Exception as e:
             st.error(f"Errore lettura JSON webcam: {e}")
+    elif saved_webcam_payload is not None:
+        webcam_payload = saved_webcam_payload
 
     if uploaded_clinical_eye_json is not None:
         try:
@@ -737,6 +737,8 @@ def seed_caso_clinico(conn, verbose: bool = True) -> Optional[int]:
               json.dumps(seed["nps"], ensure_ascii=False)))
 
         conn.commit()
+        from modules.ricerca_pazienti import invalida_ricerca_pazienti
+        invalida_ricerca_pazienti()
 
         if verbose:
             st.success(
@@ -22,6 +22,8 @@ import json
 import datetime
 import streamlit as st
 
+from modules.ricerca_pazienti import invalida_ricerca_pazienti
+
 # Domini clinici: la definizione unica sta in soglie_cliniche.py (server-side)
 try:
     from modules.soglie_cliniche import DOMINI
@@ -652,6 +654,7 @@ def converti_in_paziente(conn, lead_id, row):
         cur.execute("UPDATE lead_sito SET paziente_id=%s, stato='convertito' WHERE id=%s",
                     (pid, lead_id))
         conn.commit()
+        invalida_ricerca_pazienti()
         return pid
     except Exception:
         try: conn.rollback()
@@ -17,9 +17,12 @@ from __future__ import annotations
 import datetime
 import streamlit as st
 
+from .ricerca_pazienti import cerca_pazienti, invalida_ricerca_pazienti
+
 
 KEY_ID = "paziente_attivo_id"
 KEY_REC = "paziente_attivo_record"
+_PAGINA_DIALOG = 50
 
 
 # ════════════════════════════════════════════════════════════════════
@@ -70,45 +73,6 @@ def _carica_paziente_record(conn, paz_id):
         return None
 
 
-@st.cache_data(ttl=30, show_spinner=False)
-def _carica_lista_pazienti(_conn):
-    """Lista pazienti ATTIVI per il dialog di selezione."""
-    conn = _conn
-    try:
-        cur = conn.cursor()
-        try:
-            cur.execute("ALTER TABLE pazienti ADD COLUMN IF NOT EXISTS creato_il TIMESTAMPTZ DEFAULT NOW();")
-            conn.commit()
-        except Exception:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
-        cur.execute(
-            "SELECT id, cognome, nome, data_nascita, telefono, stato_paziente, creato_il "
-            "FROM pazienti "
-            "WHERE COALESCE(stato_paziente, 'ATTIVO') = 'ATTIVO' "
-            "ORDER BY cognome, nome"
-        )
-        rows = cur.fetchall() or []
-        cols = [d[0] for d in cur.description] if cur.description else []
-        # Forza dict Python puri (non DictRow / RealDictRow / sqlite Row)
-        # altrimenti st.cache_data fallisce con UnserializableReturnValueError
-        result = []
-        for r in rows:
-            if isinstance(r, dict):
-                result.append({k: (v if not hasattr(v, 'isoformat') else v.isoformat())
-                               for k, v in r.items()})
-            else:
-                result.append({c: (v if not hasattr(v, 'isoformat') else v.isoformat())
-                               for c, v in zip(cols, r)})
-        return result
-    except Exception:
-        try: conn.rollback()
-        except Exception: pass
-        return []
-
-
 # ════════════════════════════════════════════════════════════════════
 #  API PUBBLICA
 # ════════════════════════════════════════════════════════════════════
@@ -237,10 +201,7 @@ def _crea_paziente_rapido(conn, cognome, nome, dn_str, sesso, telefono):
         row = cur.fetchone()
         pid = int(row["id"] if isinstance(row, dict) else row[0])
         conn.commit()
-        try:
-            _carica_lista_pazienti.clear()
-        except Exception:
-            pass
+        invalida_ricerca_pazienti()
         return pid, None
     except Exception as e:
         try:
@@ -289,40 +250,41 @@ def _dialog_seleziona(conn):
 
 
 def _corpo_seleziona(conn, ns="default"):
-    pazienti = _carica_lista_pazienti(conn)
-    if not pazienti:
-        st.info("Nessun paziente registrato. Puoi aggiungerne uno qui sotto.")
-        st.markdown("##### ➕ Nuovo paziente")
-        _form_nuovo_paziente(conn, key_suffix="empty")
-        if st.button("Chiudi"):
-            st.rerun()
-        return
-
-    # Filtro testuale rapido
+    # Filtro testuale: la ricerca la fa il database, a pagine
+    # (modules.ricerca_pazienti), niente lista completa in memoria.
     cerca = st.text_input(
         "Cerca",
-        placeholder="🔍 Cognome, nome, ID o telefono...",
+        placeholder="🔍 Cognome, nome, codice fiscale, data di nascita, ID o telefono...",
         key=f"paz_attivo_cerca_{ns}",
         label_visibility="collapsed",
     )
 
-    if cerca.strip():
-        q = cerca.strip().upper()
-        pazienti = [
-            p for p in pazienti
-            if q in (p.get("cognome", "") or "").upper()
-            or q in (p.get("nome", "") or "").upper()
-            or q in (p.get("telefono", "") or "")
-            or q in str(p.get("id", ""))
-        ]
-
-    st.caption(f"{len(pazienti)} paziente/i")
-
     ordina_recenti = False
     if not cerca.strip():
         ordina_recenti = st.checkbox("🕓 Ordina per ultimi registrati", key=f"paz_attivo_recenti_{ns}")
-        if ordina_recenti:
-            pazienti = sorted(pazienti, key=lambda p: str(p.get("creato_il") or ""), reverse=True)
+
+    k_pag = f"paz_attivo_pag_{ns}"
+    k_filtro = f"paz_attivo_filtro_{ns}"
+    if st.session_state.get(k_filtro) != (cerca.strip(), ordina_recenti):
+        st.session_state[k_filtro] = (cerca.strip(), ordina_recenti)
+        st.session_state[k_pag] = 0
+    pagina = int(st.session_state.get(k_pag, 0) or 0)
+
+    ris = cerca_pazienti(conn, cerca, pagina=pagina, per_pagina=_PAGINA_DIALOG,
+                         recenti=ordina_recenti)
+    pazienti = ris["righe"]
+    if not pazienti and not cerca.strip() and pagina == 0:
+        st.info("Nessun paziente registrato. Puoi aggiungerne uno qui sotto.")
+        st.markdown("##### ➕ Nuovo paziente")
+        _form_nuovo_paziente(conn, key_suffix="empty")
+        if st.button("Chiudi"):
+            st.rerun()
+        return
+
+    if pagina > 0 or ris["altre"]:
+        st.caption(f"Pagina {pagina + 1} · {len(pazienti)} paziente/i")
+    else:
+        st.caption(f"{len(pazienti)} paziente/i")
 
     # Nuovo paziente al volo — SEMPRE APERTO e in evidenza, così le
     # collaboratrici vedono subito come creare un'anagrafica senza uscire.
@@ -382,7 +344,8 @@ def _corpo_seleziona(conn, ns="default"):
     gob.configure_default_column(filter=True, sortable=True, resizable=True)
     gob.configure_column("_id", hide=True)
     gob.configure_column("Stato", width=70, pinned="left")
-    gob.configure_column("Cognome", width=170, pinned="left", sort="asc")
+    gob.configure_column("Cognome", width=170, pinned="left",
+                          sort=None if ordina_recenti else "asc")
     gob.configure_column("Nome", width=140)
     gob.configure_column("Data nasc.", width=110)
     gob.configure_column("Età", width=70, type=["numericColumn"])
@@ -402,9 +365,20 @@ def _corpo_seleziona(conn, ns="default"):
         allow_unsafe_jscode=False,
         theme="balham",
         fit_columns_on_grid_load=False,
-        key=f"aggrid_paz_attivo_{ns}_{cerca}",
+        key=f"aggrid_paz_attivo_{ns}_{cerca}_{pagina}_{int(ordina_recenti)}",
     )
 
+    if pagina > 0 or ris["altre"]:
+        c1, _, c3 = st.columns([1, 2, 1])
+        if c1.button("◀ Precedenti", key=f"paz_attivo_prev_{ns}", disabled=pagina == 0,
+                     use_container_width=True):
+            st.session_state[k_pag] = pagina - 1
+            st.rerun()
+        if c3.button("Successivi ▶", key=f"paz_attivo_next_{ns}", disabled=not ris["altre"],
+                     use_container_width=True):
+            st.session_state[k_pag] = pagina + 1
+            st.rerun()
+
     selected = grid_response.get("selected_rows", [])
     if hasattr(selected, "to_dict"):
         try:
@@ -594,6 +568,7 @@ def _salva_modifica_rapida(conn, pid, cognome, nome, dn_str, telefono, indirizzo
             (cognome, nome, data_iso, telefono.strip(), indirizzo.strip(),
              email.strip(), int(pid)))
         conn.commit()
+        invalida_ricerca_pazienti()
         return None
     except Exception as e:
         try:
@@ -1,5 +1,18 @@
 import json
 
+try:
+    from ..blob_store import conserva
+except Exception:
+    def conserva(data, store=None):
+        return data
+
+try:
+    from ..anteprime import PHOTOREF, PHOTOREF_ANNOTATA, colonne_anteprime
+except Exception:
+    PHOTOREF = PHOTOREF_ANNOTATA = None
+    def colonne_anteprime(src, dati):
+        return {}
+
 
 def _safe_close(cur):
     try:
@@ -36,6 +49,16 @@ def ensure_photoref_tables(conn):
                 created_at TIMESTAMPTZ DEFAULT NOW()
             );
         """)
+        # miniature e anteprime generate al salvataggio (modules/anteprime)
+        cur.execute("""
+            ALTER TABLE photoref_captures
+                ADD COLUMN IF NOT EXISTS image_thumb BYTEA NULL,
+                ADD COLUMN IF NOT EXISTS image_preview BYTEA NULL,
+                ADD COLUMN IF NOT EXISTS image_width INT NULL,
+                ADD COLUMN IF NOT EXISTS image_height INT NULL,
+                ADD COLUMN IF NOT EXISTS annotated_thumb BYTEA NULL,
+                ADD COLUMN IF NOT EXISTS annotated_preview BYTEA NULL;
+        """)
         cur.execute("""
             CREATE INDEX IF NOT EXISTS idx_photoref_sessions_token
             ON photoref_sessions(token);
@@ -158,20 +181,28 @@ def save_photoref_capture(conn, session, image_bytes, annotated, result, source)
     if "annotated_image_bytes" in clean_result:
         clean_result["annotated_image_bytes"] = None
 
+    extra = {}
+    if PHOTOREF is not None:
+        if image_bytes is not None:
+            extra.update(colonne_anteprime(PHOTOREF, bytes(image_bytes)))
+        if annotated_bytes is not None:
+            extra.update(colonne_anteprime(PHOTOREF_ANNOTATA, bytes(annotated_bytes)))
+    cols = ["session_id", "source", "image_bytes", "annotated_image_bytes", "analysis_json"] + list(extra)
+
     cur = conn.cursor()
     try:
-        cur.execute("""
+        cur.execute(f"""
             INSERT INTO photoref_captures
-            (session_id, source, image_bytes, annotated_image_bytes, analysis_json)
-            VALUES (%s, %s, %s, %s, %s)
+            ({", ".join(cols)})
+            VALUES ({", ".join(["%s"] * len(cols))})
             RETURNING id
-        """, (
+        """, [
             session_id,
             source,
-            bytes(image_bytes) if image_bytes is not None else None,
-            bytes(annotated_bytes) if annotated_bytes is not None else None,
+            conserva(bytes(image_bytes)) if image_bytes is not None else None,
+            conserva(bytes(annotated_bytes)) if annotated_bytes is not None else None,
             json.dumps(clean_result),
-        ))
+        ] + list(extra.values()))
         row = cur.fetchone()
         conn.commit()
         return {
@@ -13,6 +13,15 @@ except Exception:
 from .photoref_tokens import create_capture_token
 from .photoref_db import create_capture_session, list_recent_sessions
 
+try:
+    from ..anteprime import PHOTOREF, PHOTOREF_ANNOTATA, anteprima, miniature
+except Exception:
+    PHOTOREF = PHOTOREF_ANNOTATA = None
+    def anteprima(conn, src, chiave):
+        return None
+    def miniature(conn, src, chiavi):
+        return {}
+
 BASE_DIR = str(Path(__file__).resolve().parent)
 
 def _base_url_guess() -> str:
@@ -55,6 +64,15 @@ def _ensure_tables(conn):
             created_at TIMESTAMPTZ DEFAULT NOW()
         );
         """)
+        cur.execute("""
+        ALTER TABLE photoref_captures
+            ADD COLUMN IF NOT EXISTS image_thumb BYTEA NULL,
+            ADD COLUMN IF NOT EXISTS image_preview BYTEA NULL,
+            ADD COLUMN IF NOT EXISTS image_width INT NULL,
+            ADD COLUMN IF NOT EXISTS image_height INT NULL,
+            ADD COLUMN IF NOT EXISTS annotated_thumb BYTEA NULL,
+            ADD COLUMN IF NOT EXISTS annotated_preview BYTEA NULL;
+        """)
         conn.commit()
     except Exception:
         try: conn.rollback()
@@ -113,13 +131,16 @@ def _load_recent(conn, limit: int = 20):
                 s.status,
                 s.mobile_link,
                 s.created_at,
-                c.image_bytes,
-                c.annotated_image_bytes,
+                c.id,
+                c.has_image,
                 c.analysis_json,
-                c.created_at
+                c.created_at,
+                c.has_annotated
             FROM photoref_sessions s
             LEFT JOIN LATERAL (
-                SELECT image_bytes, annotated_image_bytes, analysis_json, created_at
+                SELECT id, image_bytes IS NOT NULL AS has_image,
+                       annotated_image_bytes IS NOT NULL AS has_annotated,
+                       analysis_json, created_at
                 FROM photoref_captures c
                 WHERE c.session_id = s.id
                 ORDER BY c.created_at DESC
@@ -155,8 +176,9 @@ def _load_recent(conn, limit: int = 20):
             "status": r[5],
             "mobile_link": r[6],
             "created_at": r[7],
-            "image_bytes": r[8],
-            "annotated_image_bytes": r[9],
+            "capture_id": r[8],
+            "has_image": bool(r[9]),
+            "has_annotated": bool(r[12]),
             "analysis_json": analysis,
             "capture_created_at": r[11],
         })
@@ -217,6 +239,12 @@ def ui_photoref_session(conn=None, patient_id: str = "", visit_id: str = "", ope
             st.info("Nessuna sessione trovata")
             return
         st.markdown("**Storico sessioni recenti**")
+        # miniature dalla cache di processo; le foto intere non si leggono
+        foto, annotate = {}, {}
+        if PHOTOREF is not None:
+            foto = miniature(conn, PHOTOREF, [r["capture_id"] for r in rows if r.get("has_image")])
+            annotate = miniature(conn, PHOTOREF_ANNOTATA,
+                                 [r["capture_id"] for r in rows if r.get("has_annotated")])
         for row in rows:
             st.markdown(
                 f"**{row.get('patient_id','')}** | visita **{row.get('visit_id','')}** | "
@@ -224,10 +252,19 @@ def ui_photoref_session(conn=None, patient_id: str = "", visit_id: str = "", ope
             )
             if row.get("mobile_link"):
                 st.code(row["mobile_link"], language="text")
-            if row.get("image_bytes"):
-                st.image(row["image_bytes"], caption="Ultima foto acquisita", use_container_width=True)
-            if row.get("annotated_image_bytes"):
-                st.image(row["annotated_image_bytes"], caption="Immagine annotata", use_container_width=True)
+            cid = row.get("capture_id")
+            if foto.get(cid) or annotate.get(cid):
+                c1, c2 = st.columns(2)
+                if foto.get(cid):
+                    c1.image(foto[cid], caption="Ultima foto acquisita")
+                if annotate.get(cid):
+                    c2.image(annotate[cid], caption="Immagine annotata")
+                if st.toggle("🔍 Ingrandisci", key=f"photoref_prev_{cid}"):
+                    for src, didascalia in ((PHOTOREF, "Ultima foto acquisita"),
+                                            (PHOTOREF_ANNOTATA, "Immagine annotata")):
+                        img = anteprima(conn, src, cid)
+                        if img:
+                            st.image(img, caption=didascalia, use_container_width=True)
             analysis = row.get("analysis_json")
             if analysis:
                 c1, c2, c3 = st.columns(3)
@@ -14,6 +14,13 @@
 ╚══════════════════════════════════════════════════════════════════════╝
 """
 
+import datetime
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
 import streamlit as st
 
 
@@ -46,6 +53,176 @@ def _fmt(dt):
         return str(dt) if dt else ""
 
 
+# ══════════════════════════════════════════════════════════ proiezioni
+# Cosa porta ogni sorgente al quadro (e allo storico della diagnosi
+# assistita): escono dal database solo queste colonne, non più SELECT * con
+# i BYTEA dei referti (documenti_clinici.dati) e i JSON di visite e
+# valutazioni. carica_timeline() le legge tutte con UNA query UNION ALL,
+# già ordinate dal server.
+
+_DATE_STORICO = ("data", "data_valutazione", "data_anamnesi", "creato", "created_at")
+
+
+@dataclass(frozen=True)
+class Proiezione:
+    """Una sorgente del quadro: tabella, colonne mostrate e colonne di
+    ordinamento (la prima non vuota, in ordine decrescente, come _data_di;
+    vuoto = ordine di inserimento). Le colonne assenti nella tabella si
+    ignorano, come r.get() sulle righe di SELECT *."""
+    tabella: str
+    colonne: Tuple[str, ...] = ()
+    ordina: Tuple[str, ...] = _DATE_STORICO
+
+
+PROIEZIONI: Tuple[Proiezione, ...] = (
+    Proiezione("documenti_clinici", ("tipo", "nome_file", "estratto")),
+    Proiezione("getman_risultati", ("punteggio", "classe")),
+    Proiezione("groffman_risultati", ("punteggio", "forma", "eta", "osservazioni")),
+    Proiezione("dem_risultati"),
+    Proiezione("valutazioni_visive"),
+    Proiezione("anamnesi", ("pnev_summary", "Motivo")),
+    Proiezione("logopedia_valutazioni", ("sintesi",)),
+    Proiezione("logopedia_sedute", ("numero", "obiettivo", "risposta"), ordina=("data_seduta",)),
+    Proiezione("logopedia_obiettivi",
+               ("descrizione", "area", "stato", "attuale", "target", "baseline"), ordina=()),
+    # raggruppate per terapia nell'ordine di inserimento, date ordinate nel gruppo
+    Proiezione("terapia_sedute", ("terapia", "data_seduta", "obiettivo", "risposta"), ordina=()),
+    Proiezione("terapia_obiettivi",
+               ("descrizione", "terapia", "stato", "attuale", "target"), ordina=()),
+    Proiezione("terapia_programma", ("approccio", "step", "nome", "stato"), ordina=()),
+    Proiezione("esiti_pnev", ("intervento", "esito", "note")),
+)
+_PER_TABELLA = {p.tabella: p for p in PROIEZIONI}
+
+_COLONNE_TTL_S = 300.0
+_colonne_lock = threading.Lock()
+_colonne_cache: Dict[str, Dict[str, str]] = {}
+_colonne_letto = 0.0
+
+
+def _ident(nome: str) -> str:
+    return '"' + nome.replace('"', '""') + '"'
+
+
+def _colonne(conn, tabelle: Sequence[str]) -> Optional[Dict[str, Dict[str, str]]]:
+    """{tabella: {colonna: tipo}} delle tabelle esistenti (risolte con il
+    search_path, come le query). In cache per _COLONNE_TTL_S; una tabella non
+    ancora creata fa ricontrollare subito. None se il catalogo non si legge."""
+    global _colonne_letto
+    with _colonne_lock:
+        fresca = time.time() - _colonne_letto < _COLONNE_TTL_S
+        if fresca and all(t in _colonne_cache for t in tabelle):
+            return {t: _colonne_cache[t] for t in tabelle}
+    righe = _query(
+        conn,
+        "SELECT c.relname AS tabella, a.attname AS colonna, "
+        "format_type(a.atttypid, a.atttypmod) AS tipo "
+        "FROM pg_attribute a JOIN pg_class c ON c.oid = a.attrelid "
+        "WHERE c.oid IN (SELECT to_regclass(t) FROM unnest(%s::text[]) t) "
+        "AND a.attnum > 0 AND NOT a.attisdropped",
+        (list(_PER_TABELLA),),
+    )
+    if righe is None:
+        return None
+    trovate: Dict[str, Dict[str, str]] = {}
+    for r in righe:
+        trovate.setdefault(r["tabella"], {})[r["colonna"]] = r["tipo"]
+    with _colonne_lock:
+        _colonne_cache.clear()
+        _colonne_cache.update(trovate)
+        _colonne_letto = time.time()
+    return {t: trovate[t] for t in tabelle if t in trovate}
+
+
+def _sql_ramo(i: int, p: Proiezione, esistenti: Dict[str, str]) -> str:
+    sel = [c for c in dict.fromkeys(p.colonne + p.ordina) if c in esistenti]
+    obj = ", ".join(f"'{c}', {_ident(c)}" for c in sel)
+    ordine = [f"NULLIF({_ident(c)}::text, '')" for c in p.ordina if c in esistenti]
+    # ordinamento sul testo della data, byte per byte (COLLATE "C"): lo
+    # stesso di sorted(key=str(...)) in Python, NULL ("None") per primi
+    ord_sql = f"COALESCE({', '.join(ordine)})" if ordine else "NULL::text"
+    id_sql = '"id"' if "id" in esistenti else "NULL::bigint"
+    return (
+        f"SELECT {i} AS _src, {ord_sql} COLLATE \"C\" AS _ord, {id_sql} AS _id, "
+        f"jsonb_build_object({obj}) AS _r FROM {_ident(p.tabella)} WHERE paziente_id = %s"
+    )
+
+
+def _da_json(valore, tipo: str):
+    """Date/ore dal JSON (stringhe ISO) di nuovo a date/datetime."""
+    if not isinstance(valore, str):
+        return valore
+    try:
+        if tipo == "date":
+            return datetime.date.fromisoformat(valore)
+        if tipo.startswith("timestamp"):
+            return datetime.datetime.fromisoformat(valore)
+    except ValueError:
+        pass
+    return valore
+
+
+def _timeline_select_star(conn, paz_id, tabelle) -> Dict[str, Optional[List[dict]]]:
+    """Ripiego (catalogo non leggibile o UNION fallita): una SELECT * per
+    tabella e ordinamento in Python, come prima."""
+    out: Dict[str, Optional[List[dict]]] = {}
+    for t in tabelle:
+        rows = _query(conn, f"SELECT * FROM {t} WHERE paziente_id=%s", (paz_id,))
+        p = _PER_TABELLA[t]
+        if rows and p.ordina:
+            chiavi = p.ordina
+            rows.sort(key=lambda d: str(next((d[k] for k in chiavi if d.get(k)), None)),
+                      reverse=True)
+        out[t] = rows
+    return out
+
+
+def carica_timeline(conn, paz_id, tabelle: Optional[Sequence[str]] = None) -> Dict[str, Optional[List[dict]]]:
+    """
+    Righe del paziente per ogni sorgente di PROIEZIONI (o solo `tabelle`):
+    {tabella: [dict, ...]} con le sole colonne proiettate, già ordinate;
+    None per le tabelle che non esistono (come _query). Una sola query.
+    """
+    global _colonne_letto
+    tabelle = list(tabelle) if tabelle is not None else list(_PER_TABELLA)
+    if not tabelle:
+        return {}
+    colonne = _colonne(conn, tabelle)
+    if colonne is None:
+        return _timeline_select_star(conn, paz_id, tabelle)
+    out: Dict[str, Optional[List[dict]]] = {t: None for t in tabelle}
+    rami = []
+    presenti = []
+    for t in tabelle:
+        if t in colonne:
+            rami.append(_sql_ramo(len(presenti), _PER_TABELLA[t], colonne[t]))
+            presenti.append(t)
+            out[t] = []
+    if not rami:
+        return out
+    sql = (
+        "SELECT _src, _r FROM (" + " UNION ALL ".join(rami) + ") u "
+        "ORDER BY _src, _ord DESC NULLS FIRST, _id"
+    )
+    righe = _query(conn, sql, tuple([paz_id] * len(rami)))
+    if righe is None:
+        # schema cambiato sotto di noi: catalogo da rileggere, poi come prima
+        with _colonne_lock:
+            _colonne_letto = 0.0
+        return _timeline_select_star(conn, paz_id, tabelle)
+    for r in righe:
+        t = presenti[r["_src"]]
+        riga = r["_r"]
+        if isinstance(riga, str):
+            riga = json.loads(riga)
+        tipi = colonne[t]
+        for c, v in riga.items():
+            if isinstance(v, str) and tipi.get(c, "").startswith(("date", "timestamp")):
+                riga[c] = _da_json(v, tipi[c])
+        out[t].append(riga)
+    return out
+
+
 def carica_paziente(conn, paz_id):
     """Carica il record del paziente e lo normalizza con le chiavi
     Cognome / Nome / Data_Nascita (robusto a maiuscole/minuscole di colonna).
@@ -108,12 +285,13 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown(f"### {nome}")
 
     trovato = False
+    # tutte le sorgenti in una query, solo le colonne mostrate, già ordinate
+    tl = carica_timeline(conn, paz_id)
 
     # ── Documenti clinici + estrazioni AI ─────────────────────────────
-    docs = _query(conn, "SELECT * FROM documenti_clinici WHERE paziente_id=%s", (paz_id,))
+    docs = tl["documenti_clinici"]
     if docs:
         trovato = True
-        docs.sort(key=lambda d: str(_data_di(d)), reverse=True)
         st.markdown(f"#### 📎 Documenti clinici ({len(docs)})")
         for d in docs:
             tipo = d.get("tipo") or "Documento"
@@ -128,17 +306,17 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
     # ── Test funzionali salvati ───────────────────────────────────────
     blocchi = []
 
-    g = _query(conn, "SELECT * FROM getman_risultati WHERE paziente_id=%s", (paz_id,))
+    g = tl["getman_risultati"]
     if g:
-        for r in sorted(g, key=lambda x: str(_data_di(x)), reverse=True):
+        for r in g:
             blocchi.append(("👁️ Getman (manipolazione visiva)",
                             f"Punteggio {r.get('punteggio','?')}/12"
                             + (f" · classe {r.get('classe')}" if r.get('classe') else "")
                             + f"  ·  _{_fmt(_data_di(r))}_"))
 
-    gr = _query(conn, "SELECT * FROM groffman_risultati WHERE paziente_id=%s", (paz_id,))
+    gr = tl["groffman_risultati"]
     if gr:
-        for r in sorted(gr, key=lambda x: str(_data_di(x)), reverse=True):
+        for r in gr:
             extra = []
             if r.get("forma"):
                 extra.append(f"tavola {r['forma']}")
@@ -149,9 +327,9 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
                             + (" · " + " · ".join(extra) if extra else "")
                             + f"  ·  _{_fmt(_data_di(r))}_"))
 
-    dem = _query(conn, "SELECT * FROM dem_risultati WHERE paziente_id=%s", (paz_id,))
+    dem = tl["dem_risultati"]
     if dem:
-        for r in sorted(dem, key=lambda x: str(_data_di(x)), reverse=True):
+        for r in dem:
             blocchi.append(("🔢 DEM",
                             "Risultato registrato  ·  _" + _fmt(_data_di(r)) + "_"))
 
@@ -163,20 +341,18 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown("---")
 
     # ── Valutazioni visuo-percettive ──────────────────────────────────
-    vv = _query(conn, "SELECT * FROM valutazioni_visive WHERE paziente_id=%s", (paz_id,))
+    vv = tl["valutazioni_visive"]
     if vv:
         trovato = True
-        vv.sort(key=lambda d: str(_data_di(d)), reverse=True)
         st.markdown(f"#### 👁️ Valutazioni visuo-percettive ({len(vv)})")
         for r in vv:
             st.markdown(f"- Valutazione del _{_fmt(_data_di(r))}_")
         st.markdown("---")
 
     # ── Valutazioni PNEV / anamnesi ───────────────────────────────────
-    an = _query(conn, "SELECT * FROM anamnesi WHERE paziente_id=%s", (paz_id,))
+    an = tl["anamnesi"]
     if an:
         trovato = True
-        an.sort(key=lambda d: str(_data_di(d)), reverse=True)
         st.markdown(f"#### 📋 Valutazioni PNEV / Anamnesi ({len(an)})")
         for r in an:
             riassunto = (r.get("pnev_summary") or r.get("Motivo") or "").strip()
@@ -187,10 +363,9 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown("---")
 
     # ── Logopedia / SMOF ──────────────────────────────────────────────
-    lo = _query(conn, "SELECT * FROM logopedia_valutazioni WHERE paziente_id=%s", (paz_id,))
+    lo = tl["logopedia_valutazioni"]
     if lo:
         trovato = True
-        lo.sort(key=lambda d: str(_data_di(d)), reverse=True)
         st.markdown(f"#### 🗣️ Logopedia / SMOF ({len(lo)})")
         for r in lo:
             riga = f"- _{_fmt(_data_di(r))}_"
@@ -200,10 +375,9 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown("---")
 
     # ── Sedute logopediche ────────────────────────────────────────────
-    ls = _query(conn, "SELECT * FROM logopedia_sedute WHERE paziente_id=%s", (paz_id,))
+    ls = tl["logopedia_sedute"]
     if ls:
         trovato = True
-        ls.sort(key=lambda d: str(d.get("data_seduta")), reverse=True)
         st.markdown(f"#### 📅 Sedute logopediche ({len(ls)})")
         for r in ls[:8]:
             d = r.get("data_seduta")
@@ -217,7 +391,7 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown("---")
 
     # ── Obiettivi logopedici ──────────────────────────────────────────
-    ob = _query(conn, "SELECT * FROM logopedia_obiettivi WHERE paziente_id=%s", (paz_id,))
+    ob = tl["logopedia_obiettivi"]
     if ob:
         trovato = True
         st.markdown(f"#### 🎯 Obiettivi logopedici ({len(ob)})")
@@ -227,7 +401,7 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown("---")
 
     # ── Percorsi terapeutici ──────────────────────────────────────────
-    ts = _query(conn, "SELECT * FROM terapia_sedute WHERE paziente_id=%s", (paz_id,))
+    ts = tl["terapia_sedute"]
     if ts:
         trovato = True
         per_ter = {}
@@ -241,7 +415,7 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
             st.markdown(f"- **{ter}**: {len(righe)} sedute (ultima {us})")
         st.markdown("---")
 
-    tob = _query(conn, "SELECT * FROM terapia_obiettivi WHERE paziente_id=%s", (paz_id,))
+    tob = tl["terapia_obiettivi"]
     if tob:
         trovato = True
         st.markdown(f"#### 🎯 Obiettivi terapeutici ({len(tob)})")
@@ -251,7 +425,7 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown("---")
 
     # ── Programma PNEV (procedure) ────────────────────────────────────
-    prg = _query(conn, "SELECT * FROM terapia_programma WHERE paziente_id=%s", (paz_id,))
+    prg = tl["terapia_programma"]
     if prg:
         trovato = True
         per_appr = {}
@@ -266,10 +440,9 @@ def render_quadro(conn=None, paz_id=None, paziente=None):
         st.markdown("---")
 
     # ── Esiti / Follow-up ─────────────────────────────────────────────
-    es = _query(conn, "SELECT * FROM esiti_pnev WHERE paziente_id=%s", (paz_id,))
+    es = tl["esiti_pnev"]
     if es:
         trovato = True
-        es.sort(key=lambda d: str(_data_di(d)), reverse=True)
         st.markdown(f"#### 📈 Esiti / Follow-up ({len(es)})")
         for r in es:
             riga = f"- **{r.get('esito','')}** — {r.get('intervento','')}  ·  _{_fmt(_data_di(r))}_"
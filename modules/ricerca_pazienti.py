@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""Ricerca pazienti lato server — indicizzata, a pagine, cache condivisa.
+
+Prima ogni sessione caricava fino a 5000 pazienti in st.session_state
+(rinfrescati ogni 30 s) e i selettori filtravano la lista in Python. Qui la
+ricerca la fa Postgres mentre l'operatore digita:
+
+- ogni parola digitata deve trovarsi nel cognome o nel nome (prefisso prima,
+  poi sottostringa: indice trigram pg_trgm su lower(cognome)/lower(nome));
+- una parola di 16 caratteri alfanumerici è un codice fiscale (prefisso);
+- una data (GG/MM/AAAA, GG-MM-AAAA, AAAA-MM-GG) o un mese (MM/AAAA,
+  AAAA-MM) cerca sulla data di nascita, come intervallo [inizio, fine)
+  che usa l'indice idx_pazienti_data_nascita;
+- un numero cerca per id paziente o dentro il telefono;
+- i risultati arrivano a pagine di _PAGINA righe (LIMIT/OFFSET + 1 riga
+  sentinella per sapere se esiste la pagina successiva).
+
+Cache: le pagine restano in memoria di processo, condivise da tutte le
+sessioni dello stesso studio, per _TTL_S secondi. Chi inserisce o modifica
+un paziente chiama invalida_ricerca_pazienti() e le ricerche ripartono dal
+database al rerun successivo.
+
+Gli indici sono creati dal passo di migrazione crea_indici_ricerca
+(vedi init_db / modules.schema_migrations).
+
+Usage:
+    from modules.ricerca_pazienti import selettore_paziente
+    paz_id, label = selettore_paziente(conn, key="val")
+
+    from modules.ricerca_pazienti import cerca_pazienti
+    ris = cerca_pazienti(conn, "ross mar", pagina=0)
+    ris["righe"], ris["altre"]
+"""
+from __future__ import annotations
+
+import datetime
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+
+_PAGINA = 25
+_TTL_S = 120
+_MAX_VOCI = 2048
+_MAX_PAROLE = 4
+
+_COLONNE = ("id", "cognome", "nome", "data_nascita", "codice_fiscale",
+            "telefono", "stato_paziente", "creato_il")
+
+_RE_CF = re.compile(r"^[A-Z0-9]{16}$")
+_RE_CF_PREFISSO = re.compile(r"^[A-Z]{6}[0-9]{2}")
+
+_lock = threading.Lock()
+_cache: "OrderedDict[tuple, tuple[float, dict]]" = OrderedDict()
+_generazione = 0   # incrementata a ogni invalidazione
+
+
+def _studio_id() -> int:
+    try:
+        return int(st.session_state.get("studio_id", 1) or 1)
+    except Exception:
+        return 1
+
+
+def _rollback(conn) -> None:
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+
+
+def _normalizza_testo(testo: str) -> str:
+    return " ".join((testo or "").split()).lower()
+
+
+def _intervallo_data(parola: str) -> tuple[str, str] | None:
+    """(inizio, fine esclusa) ISO di una data o di un mese digitati, o None."""
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d/%m/%y"):
+        try:
+            d = datetime.datetime.strptime(parola, fmt).date()
+        except ValueError:
+            continue
+        return d.isoformat(), (d + datetime.timedelta(days=1)).isoformat()
+    for fmt in ("%m/%Y", "%m-%Y", "%Y-%m"):
+        try:
+            d = datetime.datetime.strptime(parola, fmt).date()
+        except ValueError:
+            continue
+        fine = (d.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        return d.isoformat(), fine.isoformat()
+    return None
+
+
+def _escape_like(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _filtri(testo: str) -> tuple[list[str], list]:
+    """Condizioni WHERE (in AND) e parametri per il testo digitato."""
+    where: list[str] = []
+    params: list = []
+    for parola in testo.split()[:_MAX_PAROLE]:
+        intervallo = _intervallo_data(parola)
+        if intervallo:
+            # confronto diretto sulla colonna (DATE o testo ISO): usa l'indice
+            where.append("(data_nascita >= ? AND data_nascita < ?)")
+            params.extend(intervallo)
+            continue
+        if parola.isdigit():
+            where.append("(CAST(id AS TEXT) = ? OR telefono LIKE ?)")
+            params.extend([parola, "%" + parola + "%"])
+            continue
+        up = parola.upper()
+        if _RE_CF.match(up) or (len(up) >= 8 and _RE_CF_PREFISSO.match(up)):
+            where.append("upper(codice_fiscale) LIKE ? ESCAPE '\\'")
+            params.append(_escape_like(up) + "%")
+            continue
+        p = _escape_like(parola)
+        # prefisso con 1-2 lettere (indice btree), sottostringa da 3 in su (trigram)
+        pat = (p + "%") if len(parola) < 3 else ("%" + p + "%")
+        where.append("(lower(cognome) LIKE ? ESCAPE '\\' OR lower(nome) LIKE ? ESCAPE '\\')")
+        params.extend([pat, pat])
+    return where, params
+
+
+def _leggi(conn, testo: str, pagina: int, per_pagina: int, solo_attivi: bool,
+           recenti: bool) -> dict:
+    where, params = _filtri(testo)
+    if solo_attivi:
+        where.append("COALESCE(stato_paziente, 'ATTIVO') = 'ATTIVO'")
+    ordine = "creato_il DESC, id DESC" if recenti else "lower(cognome), lower(nome), id"
+    prima = testo.split()[0] if testo else ""
+    in_cima = bool(prima) and not recenti and not _intervallo_data(prima) and not prima.isdigit()
+    if in_cima:
+        # chi ha il cognome che inizia per la prima parola digitata sale in cima
+        ordine = "CASE WHEN lower(cognome) LIKE ? ESCAPE '\\' THEN 0 ELSE 1 END, " + ordine
+        params.append(_escape_like(prima) + "%")
+    sql = (
+        "SELECT " + ", ".join(_COLONNE) + " FROM pazienti"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY " + ordine
+        + f" LIMIT {int(per_pagina) + 1} OFFSET {int(pagina) * int(per_pagina)}"
+    )
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, tuple(params))
+        rows = cur.fetchall() or []
+    except Exception:
+        _rollback(conn)
+        raise
+    righe = []
+    for r in rows[:per_pagina]:
+        d = {c: r[i] for i, c in enumerate(_COLONNE)}
+        for k, v in d.items():
+            if hasattr(v, "isoformat"):
+                d[k] = v.isoformat()
+        righe.append(d)
+    return {"righe": righe, "altre": len(rows) > per_pagina, "pagina": int(pagina)}
+
+
+def cerca_pazienti(conn, testo: str = "", pagina: int = 0,
+                   per_pagina: int = _PAGINA, solo_attivi: bool = True,
+                   recenti: bool = False) -> dict:
+    """Una pagina di pazienti che corrispondono al testo digitato.
+
+    Ritorna {"righe": [dict con _COLONNE], "altre": bool, "pagina": int}.
+    Testo vuoto = elenco alfabetico a pagine (recenti=True: ultimi registrati).
+    """
+    testo = _normalizza_testo(testo)
+    key = (_studio_id(), testo, int(pagina), int(per_pagina), bool(solo_attivi), bool(recenti))
+    now = time.time()
+    with _lock:
+        gen = _generazione
+        hit = _cache.get(key)
+        if hit is not None and now - hit[0] < _TTL_S:
+            _cache.move_to_end(key)
+            return hit[1]
+
+    try:
+        ris = _leggi(conn, testo, pagina, per_pagina, solo_attivi, recenti)
+    except Exception:
+        return {"righe": [], "altre": False, "pagina": int(pagina), "errore": True}
+
+    with _lock:
+        # un'invalidazione arrivata durante la query rende il risultato vecchio
+        if gen == _generazione:
+            _cache[key] = (time.time(), ris)
+            _cache.move_to_end(key)
+            while len(_cache) > _MAX_VOCI:
+                _cache.popitem(last=False)
+    return ris
+
+
+def invalida_ricerca_pazienti() -> None:
+    """Da chiamare dopo INSERT/UPDATE su pazienti (nuovo, modifica, archivia)."""
+    global _generazione
+    with _lock:
+        _generazione += 1
+        _cache.clear()
+
+
+def generazione_pazienti() -> int:
+    """Contatore delle invalidazioni: cambia quando l'anagrafica cambia."""
+    return _generazione
+
+
+def etichetta_paziente(r: dict) -> str:
+    dn = r.get("data_nascita") or ""
+    lab = f"{r.get('cognome') or ''} {r.get('nome') or ''}".strip()
+    if dn:
+        try:
+            lab += " · " + datetime.date.fromisoformat(str(dn)[:10]).strftime("%d/%m/%Y")
+        except ValueError:
+            lab += f" · {str(dn)[:10]}"
+    return f"{lab} · id {r.get('id')}"
+
+
+def selettore_paziente(conn, key: str, label: str = "👤 Paziente",
+                       solo_attivi: bool = True) -> tuple[int | None, str]:
+    """Campo di ricerca + risultati a pagine. Ritorna (id, label) o (None, "")."""
+    k_testo = f"ricpaz_testo_{key}"
+    k_pag = f"ricpaz_pag_{key}"
+    k_ult = f"ricpaz_ultimo_{key}"
+
+    testo = st.text_input(
+        label,
+        placeholder="🔍 Cognome, nome, codice fiscale o data di nascita...",
+        key=k_testo,
+    )
+    # testo cambiato → si riparte dalla prima pagina
+    if st.session_state.get(k_ult) != testo:
+        st.session_state[k_ult] = testo
+        st.session_state[k_pag] = 0
+    pagina = int(st.session_state.get(k_pag, 0) or 0)
+
+    ris = cerca_pazienti(conn, testo, pagina=pagina, solo_attivi=solo_attivi)
+    if ris.get("errore"):
+        st.error("Errore nella ricerca pazienti.")
+        return None, ""
+    righe = ris["righe"]
+    if not righe:
+        st.info("Nessun paziente trovato." if testo.strip() else "Nessun paziente registrato.")
+        return None, ""
+
+    sel = st.selectbox(
+        label, options=righe, format_func=etichetta_paziente,
+        key=f"ricpaz_sel_{key}_{pagina}", label_visibility="collapsed",
+    )
+
+    if pagina > 0 or ris["altre"]:
+        c1, c2, c3 = st.columns([1, 2, 1])
+        if c1.button("◀", key=f"ricpaz_prev_{key}", disabled=pagina == 0,
+                     use_container_width=True):
+            st.session_state[k_pag] = pagina - 1
+            st.rerun()
+        c2.caption(f"Pagina {pagina + 1}")
+        if c3.button("▶", key=f"ricpaz_next_{key}", disabled=not ris["altre"],
+                     use_container_width=True):
+            st.session_state[k_pag] = pagina + 1
+            st.rerun()
+
+    return int(sel["id"]), etichetta_paziente(sel)
+
+
+def crea_indici_ricerca(conn) -> None:
+    """Passo di migrazione: indici per la ricerca per prefisso/trigram."""
+    cur = conn.cursor()
+    if getattr(conn, "backend", None) == "postgres":
+        try:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except Exception:
+            _rollback(conn)
+        try:
+            cur.execute("ALTER TABLE pazienti ADD COLUMN IF NOT EXISTS creato_il TIMESTAMPTZ DEFAULT NOW()")
+        except Exception:
+            _rollback(conn)
+        indici = [
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_cognome_prefix "
+            "ON pazienti (lower(cognome) text_pattern_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_nome_prefix "
+            "ON pazienti (lower(nome) text_pattern_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_cognome_trgm "
+            "ON pazienti USING gin (lower(cognome) gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_nome_trgm "
+            "ON pazienti USING gin (lower(nome) gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_cf "
+            "ON pazienti (upper(codice_fiscale) text_pattern_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_data_nascita "
+            "ON pazienti (data_nascita)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_creato_il "
+            "ON pazienti (creato_il DESC)",
+        ]
+    else:
+        try:
+            cur.execute("ALTER TABLE Pazienti ADD COLUMN creato_il TEXT")
+        except Exception:
+            pass   # colonna già presente
+        indici = [
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_cognome ON Pazienti (Cognome COLLATE NOCASE)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_nome ON Pazienti (Nome COLLATE NOCASE)",
+            "CREATE INDEX IF NOT EXISTS idx_pazienti_cf ON Pazienti (Codice_Fiscale)",
+        ]
+    for ddl in indici:
+        try:
+            cur.execute(ddl)
+        except Exception:
+            # pg_trgm non installabile (permessi) o colonna assente: si va avanti
+            _rollback(conn)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Riepilogo paziente per la dashboard home — UNA query, UN round-trip.
+
+Ogni cifra della dashboard (contatti dal sito, ultima seduta, questionari,
+ultimi test, incassi, coupon, ultima anamnesi) è una sezione dichiarata in
+_SEZIONI come sottoquery scalare. Le sezioni vengono unite in un'unica
+SELECT, così la dashboard paga un solo viaggio verso Postgres invece di otto.
+
+Robustezza: se la query unica fallisce (tabella o colonna mancante in uno
+schema più vecchio) ogni sezione viene provata da sola; quelle che falliscono
+sono ricordate per _RIPROVA_KO_S secondi ed escluse dalla query unica, così
+una colonna mancante non riporta la dashboard a otto query.
+
+Cache: il risultato resta in memoria di processo (condivisa fra le sessioni
+dello stesso studio) per _TTL_S secondi. Chi salva sedute, coupon o anamnesi
+chiama invalida_riepilogo_paziente(paz_id) e la dashboard si aggiorna subito.
+
+Usage:
+    from modules.riepilogo_paziente import riepilogo_paziente
+    r = riepilogo_paziente(conn, paz_id)
+    r["tot_sedute"], r["questionari"], r["anamnesi"] ...
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+
+_TTL_S = 30
+_RIPROVA_KO_S = 600
+_MAX_VOCI = 512
+
+# nome sezione -> sottoquery scalare (parametro: %(pid)s)
+_SEZIONI = {
+    "n_lead": "(SELECT count(*) FROM lead_sito WHERE stato='nuovo')",
+    "ultima_seduta": (
+        "(SELECT json_build_array(Data_Ora, Tipo) FROM Sedute "
+        "WHERE paziente_id=%(pid)s ORDER BY Data_Ora DESC LIMIT 1)"
+    ),
+    "questionari": (
+        "(SELECT COALESCE(json_agg(json_build_array(questionario, used_at, expires_at) "
+        "ORDER BY created_at DESC), '[]'::json) FROM ("
+        "SELECT questionario, used_at, expires_at, created_at FROM questionari_links "
+        "WHERE paziente_id=%(pid)s ORDER BY created_at DESC LIMIT 5) q)"
+    ),
+    "test": (
+        "(SELECT COALESCE(json_agg(json_build_array(nome_test, data_somm) "
+        "ORDER BY created_at DESC), '[]'::json) FROM ("
+        "SELECT nome_test, data_somm, created_at FROM somministrazioni_test "
+        "WHERE paziente_id=%(pid)s ORDER BY created_at DESC LIMIT 5) t)"
+    ),
+    "tot_sedute": "(SELECT COALESCE(SUM(Pagato),0) FROM Sedute WHERE paziente_id=%(pid)s)",
+    "tot_terapia": "(SELECT COALESCE(SUM(Incassato),0) FROM terapia_sedute WHERE paziente_id=%(pid)s)",
+    "coupon": (
+        "(SELECT json_build_array(COUNT(*), COALESCE(SUM(CASE WHEN Utilizzato::int=1 "
+        "THEN 1 ELSE 0 END),0)) FROM Coupons WHERE paziente_id=%(pid)s)"
+    ),
+    "anamnesi": (
+        "(SELECT json_build_array(data_anamnesi, motivo, pnev_summary) FROM anamnesi "
+        "WHERE paziente_id=%(pid)s ORDER BY data_anamnesi DESC LIMIT 1)"
+    ),
+}
+
+_lock = threading.Lock()
+_cache: "OrderedDict[tuple, tuple[float, dict]]" = OrderedDict()
+_sezioni_ko: dict[str, float] = {}   # sezione -> istante del fallimento
+
+
+def _studio_id() -> int:
+    try:
+        return int(st.session_state.get("studio_id", 1) or 1)
+    except Exception:
+        return 1
+
+
+def _rollback(conn) -> None:
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+
+
+def _sezioni_attive() -> list[str]:
+    now = time.time()
+    with _lock:
+        for k, t in list(_sezioni_ko.items()):
+            if now - t > _RIPROVA_KO_S:
+                del _sezioni_ko[k]
+        return [k for k in _SEZIONI if k not in _sezioni_ko]
+
+
+def _leggi_grezzo(conn, paz_id: int, sezioni: list[str]) -> dict:
+    """{sezione: valore} per le sezioni richieste (None se non disponibile)."""
+    out = {k: None for k in _SEZIONI}
+    if not sezioni:
+        return out
+    params = {"pid": int(paz_id)}
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT " + ", ".join(f"{_SEZIONI[k]} AS {k}" for k in sezioni), params)
+        row = cur.fetchone()
+        if row is not None:
+            for i, k in enumerate(sezioni):
+                out[k] = row[i]
+        return out
+    except Exception:
+        _rollback(conn)
+
+    # Query unica fallita: sezione per sezione, ricordando quelle rotte
+    for k in sezioni:
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT {_SEZIONI[k]} AS {k}", params)
+            row = cur.fetchone()
+            out[k] = row[0] if row is not None else None
+        except Exception:
+            _rollback(conn)
+            with _lock:
+                _sezioni_ko[k] = time.time()
+    return out
+
+
+def _num(v, cast=float):
+    try:
+        return cast(v or 0)
+    except Exception:
+        return cast(0)
+
+
+def _normalizza(raw: dict) -> dict:
+    seduta = raw.get("ultima_seduta")
+    coupon = raw.get("coupon") or [0, 0]
+    an = raw.get("anamnesi")
+    return {
+        "n_lead": _num(raw.get("n_lead"), int),
+        "ultima_seduta": (
+            {"data": seduta[0], "tipo": seduta[1]} if seduta else None
+        ),
+        "questionari": [
+            {"questionario": q[0] or "", "used_at": q[1], "expires_at": q[2]}
+            for q in (raw.get("questionari") or [])
+        ],
+        "test": [
+            {"nome_test": t[0] or "", "data_somm": t[1]}
+            for t in (raw.get("test") or [])
+        ],
+        "tot_sedute": _num(raw.get("tot_sedute")),
+        "tot_terapia": _num(raw.get("tot_terapia")),
+        "n_coupon": _num(coupon[0], int),
+        "n_coupon_usati": _num(coupon[1], int),
+        "anamnesi": (
+            {"data": an[0], "motivo": an[1], "summary": an[2] or ""} if an else None
+        ),
+        # sezioni che su questo schema non si possono leggere: la UI mostra "—"
+        "non_disponibili": [k for k in _SEZIONI if raw.get(k) is None and k in _sezioni_ko],
+    }
+
+
+def riepilogo_paziente(conn, paz_id: int) -> dict:
+    """Tutte le cifre della dashboard per un paziente, in un solo round-trip."""
+    key = (_studio_id(), int(paz_id))
+    now = time.time()
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and now - hit[0] < _TTL_S:
+            _cache.move_to_end(key)
+            return hit[1]
+
+    dati = _normalizza(_leggi_grezzo(conn, paz_id, _sezioni_attive()))
+    with _lock:
+        _cache[key] = (time.time(), dati)
+        _cache.move_to_end(key)
+        while len(_cache) > _MAX_VOCI:
+            _cache.popitem(last=False)
+    return dati
+
+
+def conteggio_lead_nuovi(conn) -> int:
+    """Contatti dal sito ancora da gestire (dashboard senza paziente attivo)."""
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM lead_sito WHERE stato='nuovo'")
+        return int(cur.fetchone()[0] or 0)
+    except Exception:
+        _rollback(conn)
+        return 0
+
+
+def invalida_riepilogo_paziente(paz_id: int | None = None) -> None:
+    """Da chiamare dopo il salvataggio di sedute, coupon, anamnesi, terapie.
+
+    paz_id=None svuota la cache di tutti i pazienti (quando il chiamante
+    conosce solo l'id della riga modificata).
+    """
+    with _lock:
+        if paz_id is None:
+            _cache.clear()
+            return
+        try:
+            pid = int(paz_id)
+        except (TypeError, ValueError):
+            _cache.clear()
+            return
+        for key in [k for k in _cache if k[1] == pid]:
+            del _cache[key]
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+schema_migrations.py — runner versionato delle migrazioni di schema.
+
+Prima init_db() lanciava decine di CREATE TABLE / ALTER TABLE ... IF NOT
+EXISTS a ogni avvio di sessione. Qui ogni blocco di DDL è un "passo"
+(versione, nome, funzione) e il database ricorda in schema_version quali
+passi sono già stati applicati e con quale checksum del codice:
+
+- passo già applicato con lo stesso checksum → saltato (zero DDL);
+- passo nuovo o il cui codice è cambiato      → rieseguito (le DDL sono
+  idempotenti) e il checksum aggiornato;
+- dopo una verifica riuscita il processo lo ricorda: i rerun successivi non
+  toccano nemmeno schema_version;
+- su PostgreSQL un advisory lock serializza più worker che partono insieme.
+
+versione_schema() è la firma dei passi registrati (nome + checksum) più un
+contatore che sale ogni volta che questo processo applica davvero un passo:
+chi tiene in cache dati ricavati dal catalogo (tabelle, colonne) la usa come
+chiave e si rinnova solo quando lo schema cambia.
+
+Usage:
+    from modules.schema_migrations import esegui_migrazioni
+    report = esegui_migrazioni(conn, "postgres", [
+        (1, "init_db", _init_db_schema),
+        (2, "auth_schema", ensure_auth_schema),
+    ])
+"""
+
+from __future__ import annotations
+
+import hashlib
+import inspect
+import logging
+import threading
+import time
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# chiave fissa dell'advisory lock (condivisa da tutti i processi del gestionale)
+_ADVISORY_KEY = 7420110
+
+Passo = tuple[int, str, Callable]
+
+_lock = threading.Lock()
+_verificato: set[str] = set()     # backend già verificati da questo processo
+_ultimo_report: dict = {}
+_firma = ""          # sha256 dei passi (nome:checksum) dell'ultima esecuzione
+_applicazioni = 0    # passi applicati da questo processo
+
+
+def _checksum(fn: Callable) -> str:
+    try:
+        src = inspect.getsource(fn).encode("utf-8")
+    except (OSError, TypeError):
+        src = fn.__code__.co_code
+    return hashlib.sha256(src).hexdigest()[:16]
+
+
+def _crea_tabella_versioni(cur) -> None:
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            step        TEXT PRIMARY KEY,
+            version     INTEGER NOT NULL,
+            checksum    TEXT NOT NULL,
+            applied_at  TEXT,
+            duration_ms REAL
+        )
+    """)
+
+
+def _passi_applicati(cur) -> dict[str, str]:
+    cur.execute("SELECT step, checksum FROM schema_version")
+    return {str(r[0]): str(r[1]) for r in cur.fetchall()}
+
+
+def _registra(cur, versione: int, nome: str, checksum: str, ms: float) -> None:
+    cur.execute(
+        "INSERT INTO schema_version (step, version, checksum, applied_at, duration_ms) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (step) DO UPDATE SET version = excluded.version, "
+        "checksum = excluded.checksum, applied_at = excluded.applied_at, "
+        "duration_ms = excluded.duration_ms",
+        (nome, int(versione), checksum, time.strftime("%Y-%m-%dT%H:%M:%S"), round(ms, 1)),
+    )
+
+
+def _set_autocommit(conn, on: bool) -> None:
+    # Ogni DDL confermata da sola: una ALTER fallita (dentro try/except del
+    # passo) non annulla quelle precedenti dello stesso passo.
+    raw = getattr(conn, "_conn", None)
+    if raw is None or not hasattr(raw, "autocommit"):
+        return
+    try:
+        raw.rollback()
+        raw.autocommit = on
+    except Exception:
+        pass
+
+
+def schema_verificato(backend: str = "postgres") -> bool:
+    """True se questo processo ha già verificato lo schema."""
+    return backend in _verificato
+
+
+def versione_schema() -> str:
+    """Chiave di versione dello schema; cambia quando il runner applica passi."""
+    return f"{_firma}:{_applicazioni}"
+
+
+def report_migrazioni() -> dict:
+    """Esito dell'ultima esecuzione (durate in ms, passi applicati/saltati)."""
+    return dict(_ultimo_report)
+
+
+def esegui_migrazioni(conn, backend: str, passi: Iterable[Passo]) -> dict:
+    """Applica i passi mancanti o modificati. Ritorna il report dell'esecuzione.
+
+    Solleva l'eccezione del primo passo fallito (i successivi non vengono
+    eseguiti); il processo non viene marcato verificato e ritenterà.
+    """
+    global _firma, _applicazioni
+    if backend in _verificato:
+        return {"backend": backend, "gia_verificato": True, "totale_ms": 0.0}
+
+    with _lock:
+        if backend in _verificato:
+            return {"backend": backend, "gia_verificato": True, "totale_ms": 0.0}
+
+        t0 = time.perf_counter()
+        report = {"backend": backend, "gia_verificato": False, "applicati": [], "saltati": [],
+                  "attesa_lock_ms": 0.0, "totale_ms": 0.0}
+        cur = conn.cursor()
+        pg = backend == "postgres"
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        if pg:
+            cur.execute("SELECT pg_advisory_lock(?)", (_ADVISORY_KEY,))
+            report["attesa_lock_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        try:
+            _crea_tabella_versioni(cur)
+            conn.commit()
+            applicati = _passi_applicati(cur)
+            conn.commit()
+            firma = hashlib.sha256()
+            for versione, nome, fn in sorted(passi, key=lambda p: p[0]):
+                chk = _checksum(fn)
+                firma.update(f"{nome}:{chk};".encode("utf-8"))
+                if applicati.get(nome) == chk:
+                    report["saltati"].append(nome)
+                    continue
+                ts = time.perf_counter()
+                _set_autocommit(conn, True)
+                try:
+                    fn(conn)
+                finally:
+                    _set_autocommit(conn, False)
+                ms = (time.perf_counter() - ts) * 1000.0
+                cur = conn.cursor()
+                _registra(cur, versione, nome, chk, ms)
+                conn.commit()
+                report["applicati"].append({"passo": nome, "versione": versione, "ms": round(ms, 1)})
+                _applicazioni += 1
+            _firma = firma.hexdigest()[:16]
+            _verificato.add(backend)
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            if pg:
+                try:
+                    c = conn.cursor()
+                    c.execute("SELECT pg_advisory_unlock(?)", (_ADVISORY_KEY,))
+                    conn.commit()
+                except Exception:
+                    pass
+            report["totale_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+            _ultimo_report.clear()
+            _ultimo_report.update(report)
+
+        logger.info(
+            "Migrazioni schema (%s): %.0f ms (attesa lock %.0f ms), applicate %s, già presenti %s",
+            backend, report["totale_ms"], report["attesa_lock_ms"],
+            [p["passo"] for p in report["applicati"]], report["saltati"],
+        )
+        return report
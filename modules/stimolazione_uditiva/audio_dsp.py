@@ -4,7 +4,21 @@ from __future__ import annotations
 import math
 import numpy as np
 from dataclasses import dataclass
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
+
+try:  # scipy è in requirements; senza (ambienti ridotti) si torna al loop per campione
+    from scipy.signal import lfilter as _lfilter, sosfilt as _sosfilt  # type: ignore
+except Exception:  # pragma: no cover
+    _lfilter = None
+    _sosfilt = None
+
+# Scarto massimo RELATIVO atteso fra il motore vettoriale (float64) e il loop
+# per campione storico (float32) su una cascata EQ 8 bande + passabanda:
+# max|vettoriale - loop| / max|loop|. Lo scarto assoluto cresce con il
+# livello d'uscita (guadagni EQ alti), quello relativo resta ~1e-5..3e-5
+# (precisione del riferimento float32); misurato da bench_stimolazione_dsp
+# a 0, +3 e +12 dB.
+SOS_TOLERANCE = 1e-4
 
 @dataclass
 class Biquad:
@@ -14,7 +28,18 @@ class Biquad:
     z2: float = 0.0
 
     def process(self, x: np.ndarray) -> np.ndarray:
-        # Direct Form I transposed
+        # Direct Form II transposed, stato (z1, z2) portato da un blocco all'altro
+        if _lfilter is None:
+            return self._process_loop(x)
+        y, zf = _lfilter(
+            [self.b0, self.b1, self.b2], [1.0, self.a1, self.a2],
+            np.asarray(x, dtype=np.float64), zi=[self.z1, self.z2],
+        )
+        self.z1, self.z2 = float(zf[0]), float(zf[1])
+        return y.astype(np.float32)
+
+    def _process_loop(self, x: np.ndarray) -> np.ndarray:
+        # implementazione di riferimento per campione (fallback senza scipy)
         y = np.empty_like(x, dtype=np.float32)
         b0,b1,b2,a1,a2 = self.b0,self.b1,self.b2,self.a1,self.a2
         z1,z2 = self.z1,self.z2
@@ -59,6 +84,136 @@ def biquad_bandpass(fs: float, f0: float, q: float) -> Biquad:
     b0,b1,b2,a1,a2 = _normalize(b0,b1,b2,a0,a1,a2)
     return Biquad(b0,b1,b2,a1,a2)
 
+def sos_from_biquads(filters: List[Biquad]) -> np.ndarray:
+    """Coefficienti della cascata come second-order sections (n, 6)."""
+    if not filters:
+        return np.zeros((0, 6), dtype=np.float64)
+    return np.array(
+        [[f.b0, f.b1, f.b2, 1.0, f.a1, f.a2] for f in filters], dtype=np.float64,
+    )
+
+
+class SosCascade:
+    """Cascata di biquad in un solo passaggio (scipy sosfilt, o un loop su
+    float Python se scipy manca) con stato zi conservato fra un blocco e il
+    successivo.
+
+    x: (n,) oppure (n, canali); tutti i canali con gli stessi coefficienti
+    vengono filtrati insieme.
+    """
+
+    def __init__(self, sos: np.ndarray, channels: int = 1):
+        self.sos = np.asarray(sos, dtype=np.float64).reshape(-1, 6)
+        self.channels = int(channels)
+        self.reset()
+
+    @classmethod
+    def from_biquads(cls, filters: List[Biquad], channels: int = 1) -> "SosCascade":
+        return cls(sos_from_biquads(filters), channels=channels)
+
+    def reset(self) -> None:
+        shape = (len(self.sos), 2) if self.channels == 1 else (len(self.sos), 2, self.channels)
+        self.zi = np.zeros(shape, dtype=np.float64)
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        if not len(self.sos):
+            return np.asarray(x, dtype=np.float32)
+        x64 = np.asarray(x, dtype=np.float64)
+        if _sosfilt is not None:
+            y, self.zi = _sosfilt(self.sos, x64, axis=0, zi=self.zi)
+            return y.astype(np.float32)
+        return self._process_loop(x64)
+
+    def _process_loop(self, x: np.ndarray) -> np.ndarray:
+        # fallback senza scipy: per canale e per sezione su float Python
+        # (tolist), molto più veloce dell'aritmetica su scalari NumPy
+        x2 = x.reshape(x.shape[0], -1)
+        y = np.empty(x2.shape, dtype=np.float64)
+        sos = self.sos.tolist()
+        zi = self.zi.reshape(len(sos), 2, -1).copy()
+        for c in range(x2.shape[1]):
+            col = x2[:, c].tolist()
+            for s, (b0, b1, b2, _a0, a1, a2) in enumerate(sos):
+                z1, z2 = float(zi[s, 0, c]), float(zi[s, 1, c])
+                out = [0.0] * len(col)
+                for i, xi in enumerate(col):
+                    yi = b0 * xi + z1
+                    z1 = b1 * xi - a1 * yi + z2
+                    z2 = b2 * xi - a2 * yi
+                    out[i] = yi
+                zi[s, 0, c], zi[s, 1, c] = z1, z2
+                col = out
+            y[:, c] = col
+        self.zi = zi.reshape(self.zi.shape)
+        return y.reshape(x.shape).astype(np.float32)
+
+
+def peaking_eq_sos(fs: float, bands: List[Tuple[float, float]], q: float = 1.0,
+                   min_gain_db: float = 0.01) -> np.ndarray:
+    """Tutte le bande peaking [(freq Hz, guadagno dB)] fuse in una cascata SOS;
+    le bande con |guadagno| <= min_gain_db sono saltate."""
+    return sos_from_biquads([
+        biquad_peaking(fs, float(f), q=float(q), gain_db=float(g))
+        for f, g in bands if abs(float(g)) > min_gain_db
+    ])
+
+
+class SteppedPeaking:
+    """Peaking a guadagno variabile nel tempo (gate frequenze): i coefficienti
+    cambiano dove cambia il guadagno, lo stato zi resta continuo, quindi
+    niente click ai cambi e un solo sosfilt per tratto a guadagno costante.
+
+    x: (n,) oppure (n, canali); gain_db: scalare oppure array (n,).
+    """
+
+    def __init__(self, fs: float, f0: float, q: float, channels: int = 1):
+        self.fs, self.f0, self.q = float(fs), float(f0), float(q)
+        self._casc = SosCascade(np.zeros((1, 6)), channels=channels)
+        self._coef: Dict[float, np.ndarray] = {}
+
+    def _sos(self, g: float) -> np.ndarray:
+        sos = self._coef.get(g)
+        if sos is None:
+            sos = self._coef[g] = sos_from_biquads([biquad_peaking(self.fs, self.f0, self.q, g)])
+        return sos
+
+    def process(self, x: np.ndarray, gain_db) -> np.ndarray:
+        n = x.shape[0]
+        g = np.broadcast_to(np.asarray(gain_db, dtype=np.float64), (n,))
+        cambi = np.flatnonzero(np.diff(g)) + 1
+        out = np.empty(x.shape, dtype=np.float32)
+        a = 0
+        for b in list(cambi) + [n]:
+            if b > a:
+                self._casc.sos = self._sos(float(g[a]))
+                out[a:b] = self._casc.process(x[a:b])
+            a = b
+        return out
+
+
+class StereoSosCascade:
+    """EQ stereo: una cascata per canale (0=SX, 1=DX). Se i due lati hanno
+    gli stessi coefficienti, un solo sosfilt su entrambi i canali."""
+
+    def __init__(self, sos_left: np.ndarray, sos_right: np.ndarray):
+        sos_left = np.asarray(sos_left, dtype=np.float64).reshape(-1, 6)
+        sos_right = np.asarray(sos_right, dtype=np.float64).reshape(-1, 6)
+        self._joint: Optional[SosCascade] = None
+        if sos_left.shape == sos_right.shape and np.array_equal(sos_left, sos_right):
+            self._joint = SosCascade(sos_left, channels=2)
+        else:
+            self._left = SosCascade(sos_left)
+            self._right = SosCascade(sos_right)
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        if self._joint is not None:
+            return self._joint.process(x)
+        out = np.empty((x.shape[0], 2), dtype=np.float32)
+        out[:, 0] = self._left.process(x[:, 0])
+        out[:, 1] = self._right.process(x[:, 1])
+        return out
+
+
 def apply_cascade(x: np.ndarray, filters: List[Biquad]) -> np.ndarray:
     y = x.astype(np.float32, copy=False)
     for f in filters:
@@ -1,7 +1,11 @@
 # modules/stimolazione_uditiva/db_jobs.py
 from __future__ import annotations
+import io
 import json
-from typing import Any, Dict, List, Tuple
+import logging
+from typing import Any, BinaryIO, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
 
 def ensure_jobs_schema(conn) -> None:
     cur = conn.cursor()
@@ -34,6 +38,45 @@ def ensure_jobs_schema(conn) -> None:
         """)
         cur.execute("CREATE INDEX IF NOT EXISTS idx_render_jobs_paz ON render_jobs(paziente_id, created_at DESC);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_render_jobs_status ON render_jobs(status, created_at DESC);")
+        # worker (scripts/render_worker.py): chi ha preso il job, quando, ultimo segno di vita
+        cur.execute("ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS worker TEXT;")
+        cur.execute("ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;")
+        cur.execute("ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS started_at TIMESTAMPTZ;")
+        cur.execute("ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ;")
+        cur.execute("ALTER TABLE render_jobs ADD COLUMN IF NOT EXISTS finished_at TIMESTAMPTZ;")
+        # coda: solo i queued, nell'ordine in cui il worker li prende
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_render_jobs_queued ON render_jobs(created_at, id) "
+            "WHERE status='queued';"
+        )
+        # file del job: input caricato dalla UI, output prodotti dal worker
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS render_job_files (
+            job_id BIGINT NOT NULL REFERENCES render_jobs(id) ON DELETE CASCADE,
+            role TEXT NOT NULL,                -- 'input' | 'output'
+            fmt TEXT NOT NULL,                 -- 'src' per l'input, poi wav|flac|mp3
+            filename TEXT,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (job_id, role, fmt)
+        );
+        """)
+        # output grandi scritti a blocchi (save_job_file_stream senza blob
+        # store): data resta b"" e il contenuto sta in render_job_file_parti
+        cur.execute("ALTER TABLE render_job_files ADD COLUMN IF NOT EXISTS parti INTEGER;")
+        cur.execute("ALTER TABLE render_job_files ADD COLUMN IF NOT EXISTS size_bytes BIGINT;")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS render_job_file_parti (
+            job_id BIGINT NOT NULL,
+            role TEXT NOT NULL,
+            fmt TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            data BYTEA NOT NULL,
+            PRIMARY KEY (job_id, role, fmt, n),
+            FOREIGN KEY (job_id, role, fmt) REFERENCES render_job_files(job_id, role, fmt)
+                ON DELETE CASCADE
+        );
+        """)
         conn.commit()
     except Exception:
         try: conn.rollback()
@@ -72,46 +115,49 @@ def read_tomatis_preset(conn, preset_id: int):
         except Exception:
             pass
 
+# Preset di fabbrica (nome, parametri), inseriti da seed_tomatis_presets.
+TOMATIS_PRESETS_DEFAULT = [
+    ("SOFT", {
+        "version": "tomatis_pnev_v1",
+        "lambda_events_per_sec": 3.0,
+        "bands": {"low":{"min_hz":400,"max_hz":700,"weight":0.20},
+                  "mid":{"min_hz":1000,"max_hz":3000,"weight":0.50},
+                  "high":{"min_hz":4000,"max_hz":6500,"weight":0.30}},
+        "open_state": {"duration_ms":{"min":10,"max":400},"attack_ms":{"min":5,"max":20},"q":{"min":0.8,"max":1.2}},
+        "closed_state":{"refractory_ms":{"min":20,"max":80},"attack_ms":{"min":5,"max":20},"q":{"value":2.8},"center_hz":{"value":1000}},
+        "mix":{"wet_mix":0.80,"closed_wet_attenuation_db":-6.0},
+        "lateral_bias":{"mode":"fixed","dominant_side":"DX","ratio":0.60,"alternate_minutes":2.5},
+        "safety":{"limiter_peak_dbfs":-1.0}
+    }),
+    ("STANDARD", {
+        "version": "tomatis_pnev_v1",
+        "lambda_events_per_sec": 5.0,
+        "bands": {"low":{"min_hz":400,"max_hz":700,"weight":0.20},
+                  "mid":{"min_hz":1000,"max_hz":3000,"weight":0.50},
+                  "high":{"min_hz":4000,"max_hz":6500,"weight":0.30}},
+        "open_state": {"duration_ms":{"min":10,"max":400},"attack_ms":{"min":5,"max":20},"q":{"min":0.8,"max":1.2}},
+        "closed_state":{"refractory_ms":{"min":20,"max":80},"attack_ms":{"min":5,"max":20},"q":{"value":2.8},"center_hz":{"value":1000}},
+        "mix":{"wet_mix":0.90,"closed_wet_attenuation_db":-10.0},
+        "lateral_bias":{"mode":"fixed","dominant_side":"DX","ratio":0.70,"alternate_minutes":2.5},
+        "safety":{"limiter_peak_dbfs":-1.0}
+    }),
+    ("FORTE+", {
+        "version": "tomatis_pnev_v1",
+        "lambda_events_per_sec": 7.0,
+        "bands": {"low":{"min_hz":400,"max_hz":700,"weight":0.20},
+                  "mid":{"min_hz":1000,"max_hz":3000,"weight":0.50},
+                  "high":{"min_hz":4000,"max_hz":6500,"weight":0.30}},
+        "open_state": {"duration_ms":{"min":10,"max":400},"attack_ms":{"min":5,"max":20},"q":{"min":0.8,"max":1.2}},
+        "closed_state":{"refractory_ms":{"min":20,"max":80},"attack_ms":{"min":5,"max":20},"q":{"value":2.8},"center_hz":{"value":1000}},
+        "mix":{"wet_mix":0.95,"closed_wet_attenuation_db":-14.0},
+        "lateral_bias":{"mode":"fixed","dominant_side":"DX","ratio":0.70,"alternate_minutes":2.5},
+        "safety":{"limiter_peak_dbfs":-1.0}
+    }),
+]
+
 def seed_tomatis_presets(conn) -> None:
     """Inserisce SOFT/STANDARD/FORTE+ se mancanti."""
-    presets = [
-        ("SOFT", {
-            "version": "tomatis_pnev_v1",
-            "lambda_events_per_sec": 3.0,
-            "bands": {"low":{"min_hz":400,"max_hz":700,"weight":0.20},
-                      "mid":{"min_hz":1000,"max_hz":3000,"weight":0.50},
-                      "high":{"min_hz":4000,"max_hz":6500,"weight":0.30}},
-            "open_state": {"duration_ms":{"min":10,"max":400},"attack_ms":{"min":5,"max":20},"q":{"min":0.8,"max":1.2}},
-            "closed_state":{"refractory_ms":{"min":20,"max":80},"attack_ms":{"min":5,"max":20},"q":{"value":2.8},"center_hz":{"value":1000}},
-            "mix":{"wet_mix":0.80,"closed_wet_attenuation_db":-6.0},
-            "lateral_bias":{"mode":"fixed","dominant_side":"DX","ratio":0.60,"alternate_minutes":2.5},
-            "safety":{"limiter_peak_dbfs":-1.0}
-        }),
-        ("STANDARD", {
-            "version": "tomatis_pnev_v1",
-            "lambda_events_per_sec": 5.0,
-            "bands": {"low":{"min_hz":400,"max_hz":700,"weight":0.20},
-                      "mid":{"min_hz":1000,"max_hz":3000,"weight":0.50},
-                      "high":{"min_hz":4000,"max_hz":6500,"weight":0.30}},
-            "open_state": {"duration_ms":{"min":10,"max":400},"attack_ms":{"min":5,"max":20},"q":{"min":0.8,"max":1.2}},
-            "closed_state":{"refractory_ms":{"min":20,"max":80},"attack_ms":{"min":5,"max":20},"q":{"value":2.8},"center_hz":{"value":1000}},
-            "mix":{"wet_mix":0.90,"closed_wet_attenuation_db":-10.0},
-            "lateral_bias":{"mode":"fixed","dominant_side":"DX","ratio":0.70,"alternate_minutes":2.5},
-            "safety":{"limiter_peak_dbfs":-1.0}
-        }),
-        ("FORTE+", {
-            "version": "tomatis_pnev_v1",
-            "lambda_events_per_sec": 7.0,
-            "bands": {"low":{"min_hz":400,"max_hz":700,"weight":0.20},
-                      "mid":{"min_hz":1000,"max_hz":3000,"weight":0.50},
-                      "high":{"min_hz":4000,"max_hz":6500,"weight":0.30}},
-            "open_state": {"duration_ms":{"min":10,"max":400},"attack_ms":{"min":5,"max":20},"q":{"min":0.8,"max":1.2}},
-            "closed_state":{"refractory_ms":{"min":20,"max":80},"attack_ms":{"min":5,"max":20},"q":{"value":2.8},"center_hz":{"value":1000}},
-            "mix":{"wet_mix":0.95,"closed_wet_attenuation_db":-14.0},
-            "lateral_bias":{"mode":"fixed","dominant_side":"DX","ratio":0.70,"alternate_minutes":2.5},
-            "safety":{"limiter_peak_dbfs":-1.0}
-        }),
-    ]
+    presets = TOMATIS_PRESETS_DEFAULT
     cur = conn.cursor()
     try:
         for name, params in presets:
@@ -142,7 +188,11 @@ def list_tomatis_presets(conn):
         except Exception: pass
 
 def create_render_job(conn, paziente_id: int, eq_profile_id: int, preset_id: int,
-                      input_kind: str, input_ref: str, params: Dict[str, Any]) -> int:
+                      input_kind: str, input_ref: str, params: Dict[str, Any],
+                      input_file: Tuple[str, bytes] | None = None) -> int:
+    """Crea il job queued. `input_file` = (filename, bytes) del file caricato:
+    va nella stessa transazione della riga, così il worker non può prendere
+    il job prima che l'input esista."""
     cur = conn.cursor()
     try:
         cur.execute(
@@ -154,6 +204,12 @@ def create_render_job(conn, paziente_id: int, eq_profile_id: int, preset_id: int
             (int(paziente_id), int(eq_profile_id), int(preset_id), input_kind, input_ref, json.dumps(params)),
         )
         jid = int(cur.fetchone()[0])
+        if input_file is not None:
+            cur.execute(
+                "INSERT INTO render_job_files(job_id, role, fmt, filename, data) "
+                "VALUES (%s,'input','src',%s,%s)",
+                (jid, input_file[0], bytes(input_file[1])),
+            )
         conn.commit()
         return jid
     except Exception:
@@ -181,3 +237,353 @@ def list_render_jobs(conn, paziente_id: int, limit: int = 50):
     finally:
         try: cur.close()
         except Exception: pass
+
+
+# --- Coda render: usata dal worker (scripts/render_worker.py) -----------------
+
+_JOB_COLS = "id, paziente_id, eq_profile_id, preset_id, input_kind, input_ref, params_json"
+
+
+def _job_dict(row) -> Dict[str, Any]:
+    keys = [c.strip() for c in _JOB_COLS.split(",")]
+    job = dict(zip(keys, row))
+    pj = job.get("params_json")
+    if pj is None:
+        job["params_json"] = {}
+    elif not isinstance(pj, dict):
+        job["params_json"] = json.loads(pj)
+    return job
+
+
+def save_job_file(conn, job_id: int, role: str, fmt: str, data: bytes,
+                  filename: str | None = None) -> None:
+    """Salva (o sostituisce) un file del job: l'input caricato o un output."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO render_job_files(job_id, role, fmt, filename, data)
+            VALUES (%s,%s,%s,%s,%s)
+            ON CONFLICT (job_id, role, fmt) DO UPDATE
+               SET filename = EXCLUDED.filename, data = EXCLUDED.data, created_at = now()
+            """,
+            (int(job_id), role, fmt, filename, bytes(data)),
+        )
+        conn.commit()
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
+
+
+# blocchi di save_job_file_stream senza blob store (una riga per blocco)
+PARTE_BYTES = 1 << 20
+
+
+def _blob_store():
+    try:
+        from ..blob_store import get_blob_store
+        return get_blob_store()
+    except Exception:
+        return None
+
+
+def save_job_file_stream(conn, job_id: int, role: str, fmt: str, fh: BinaryIO,
+                         filename: str | None = None) -> int:
+    """Come save_job_file ma da un file aperto, senza caricarlo in memoria:
+    nel blob store se configurato (in data resta il riferimento), altrimenti
+    a blocchi di PARTE_BYTES in render_job_file_parti. Ritorna i byte scritti."""
+    store = _blob_store()
+    if store is not None:
+        try:
+            from ..blob_store import riferimento
+            sha, n = store.put_stream(fh)
+        except Exception as e:
+            logger.warning("job %s %s/%s: blob store non riuscito, salvo a blocchi: %s: %s",
+                           job_id, role, fmt, type(e).__name__, e)
+            fh.seek(0)
+        else:
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    INSERT INTO render_job_files(job_id, role, fmt, filename, data, parti, size_bytes)
+                    VALUES (%s,%s,%s,%s,%s,NULL,%s)
+                    ON CONFLICT (job_id, role, fmt) DO UPDATE
+                       SET filename = EXCLUDED.filename, data = EXCLUDED.data, parti = NULL,
+                           size_bytes = EXCLUDED.size_bytes, created_at = now()
+                    """,
+                    (int(job_id), role, fmt, filename, riferimento(sha, n), int(n)),
+                )
+                cur.execute(
+                    "DELETE FROM render_job_file_parti WHERE job_id=%s AND role=%s AND fmt=%s",
+                    (int(job_id), role, fmt),
+                )
+                conn.commit()
+                return int(n)
+            except Exception:
+                try: conn.rollback()
+                except Exception: pass
+                raise
+            finally:
+                try: cur.close()
+                except Exception: pass
+
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO render_job_files(job_id, role, fmt, filename, data, parti, size_bytes)
+            VALUES (%s,%s,%s,%s,''::bytea,0,0)
+            ON CONFLICT (job_id, role, fmt) DO UPDATE
+               SET filename = EXCLUDED.filename, data = EXCLUDED.data, parti = 0,
+                   size_bytes = 0, created_at = now()
+            """,
+            (int(job_id), role, fmt, filename),
+        )
+        cur.execute(
+            "DELETE FROM render_job_file_parti WHERE job_id=%s AND role=%s AND fmt=%s",
+            (int(job_id), role, fmt),
+        )
+        n = size = 0
+        while True:
+            blocco = fh.read(PARTE_BYTES)
+            if not blocco:
+                break
+            cur.execute(
+                "INSERT INTO render_job_file_parti(job_id, role, fmt, n, data) VALUES (%s,%s,%s,%s,%s)",
+                (int(job_id), role, fmt, n, blocco),
+            )
+            n += 1
+            size += len(blocco)
+            del blocco
+        cur.execute(
+            "UPDATE render_job_files SET parti=%s, size_bytes=%s WHERE job_id=%s AND role=%s AND fmt=%s",
+            (n, size, int(job_id), role, fmt),
+        )
+        conn.commit()
+        return size
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
+
+
+class _PartiReader(io.RawIOBase):
+    """Lettura a blocchi di un file salvato in render_job_file_parti: una
+    SELECT per blocco, in memoria al massimo PARTE_BYTES."""
+
+    def __init__(self, conn, job_id: int, role: str, fmt: str, parti: int):
+        self._conn, self._key, self._parti = conn, (int(job_id), role, fmt), int(parti)
+        self._n = 0
+        self._buf = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def _prossima(self) -> bytes:
+        if self._n >= self._parti:
+            return b""
+        cur = self._conn.cursor()
+        try:
+            cur.execute(
+                "SELECT data FROM render_job_file_parti WHERE job_id=%s AND role=%s AND fmt=%s AND n=%s",
+                self._key + (self._n,),
+            )
+            row = cur.fetchone()
+        finally:
+            try: cur.close()
+            except Exception: pass
+        if row is None:
+            raise IOError(f"Blocco {self._n} mancante per il file del job {self._key}")
+        self._n += 1
+        return bytes(row[0])
+
+    def readinto(self, b) -> int:
+        if not self._buf:
+            self._buf = self._prossima()
+        k = min(len(b), len(self._buf))
+        b[:k] = self._buf[:k]
+        self._buf = self._buf[k:]
+        return k
+
+
+def apri_job_file(conn, job_id: int, role: str, fmt: str):
+    """Ritorna (filename, file binario da leggere a blocchi) oppure None:
+    vale per file in linea, nel blob store o salvati a blocchi."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT filename, data, parti FROM render_job_files WHERE job_id=%s AND role=%s AND fmt=%s",
+            (int(job_id), role, fmt),
+        )
+        row = cur.fetchone()
+    finally:
+        try: cur.close()
+        except Exception: pass
+    if not row:
+        return None
+    nome, data, parti = (row[0] or ""), row[1], row[2]
+    if parti is not None:
+        return nome, io.BufferedReader(_PartiReader(conn, job_id, role, fmt, parti), PARTE_BYTES)
+    try:
+        from ..blob_store import apri
+    except Exception:
+        return nome, io.BytesIO(bytes(data))
+    return nome, apri(data)
+
+
+def read_job_file(conn, job_id: int, role: str, fmt: str):
+    """Ritorna (filename, bytes) oppure None."""
+    f = apri_job_file(conn, job_id, role, fmt)
+    if f is None:
+        return None
+    nome, fh = f
+    try:
+        return nome, fh.read()
+    finally:
+        fh.close()
+
+
+def job_file_url(conn, job_id: int, role: str, fmt: str) -> str | None:
+    """URL presigned del file se sta in un blob store che lo supporta (S3),
+    così la UI non deve passare i bytes da Streamlit; altrimenti None."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT filename, data FROM render_job_files WHERE job_id=%s AND role=%s AND fmt=%s "
+            "AND parti IS NULL AND octet_length(data) <= 128",
+            (int(job_id), role, fmt),
+        )
+        row = cur.fetchone()
+    finally:
+        try: cur.close()
+        except Exception: pass
+    if not row:
+        return None
+    try:
+        from ..blob_store import url_download
+        return url_download(bytes(row[1]), nome=row[0] or "")
+    except Exception:
+        return None
+
+
+def list_job_outputs(conn, job_id: int) -> List[Tuple[str, str]]:
+    """[(fmt, filename)] degli output pronti di un job."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT fmt, filename FROM render_job_files WHERE job_id=%s AND role='output' ORDER BY fmt",
+            (int(job_id),),
+        )
+        return [(str(r[0]), str(r[1] or "")) for r in (cur.fetchall() or [])]
+    finally:
+        try: cur.close()
+        except Exception: pass
+
+
+def claim_next_render_job(conn, worker: str) -> Dict[str, Any] | None:
+    """Prende il job queued più vecchio e lo marca running per `worker`.
+
+    FOR UPDATE SKIP LOCKED: N worker in parallelo non si contendono mai la
+    stessa riga e non si aspettano a vicenda. Il lock dura solo il tempo
+    dell'UPDATE; il render avviene fuori transazione.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            UPDATE render_jobs
+               SET status='running', worker=%s, attempts=attempts+1, progress=0,
+                   started_at=now(), heartbeat_at=now(), finished_at=NULL, error_message=NULL
+             WHERE id = (
+                   SELECT id FROM render_jobs
+                    WHERE status='queued'
+                    ORDER BY created_at, id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED)
+            RETURNING {_JOB_COLS}
+            """,
+            (str(worker),),
+        )
+        row = cur.fetchone()
+        conn.commit()
+        return _job_dict(row) if row else None
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
+
+
+def _update_job(conn, job_id: int, sql_set: str, params: tuple) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute(f"UPDATE render_jobs SET {sql_set} WHERE id=%s", params + (int(job_id),))
+        conn.commit()
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
+
+
+def update_job_progress(conn, job_id: int, progress: float) -> None:
+    """progress in percentuale (0-100); vale anche come heartbeat."""
+    p = max(0.0, min(100.0, float(progress)))
+    _update_job(conn, job_id, "progress=%s, heartbeat_at=now()", (round(p, 2),))
+
+
+def finish_render_job(conn, job_id: int, output_ref: str) -> None:
+    _update_job(
+        conn, job_id,
+        "status='done', progress=100, output_ref=%s, finished_at=now(), heartbeat_at=now()",
+        (str(output_ref),),
+    )
+
+
+def fail_render_job(conn, job_id: int, error_message: str) -> None:
+    _update_job(
+        conn, job_id,
+        "status='error', error_message=%s, finished_at=now(), heartbeat_at=now()",
+        (str(error_message)[:4000],),
+    )
+
+
+def requeue_stale_jobs(conn, stale_minutes: float = 15.0, max_attempts: int = 3) -> int:
+    """Rimette in coda i job running senza heartbeat da stale_minutes (worker
+    morto); oltre max_attempts tentativi li chiude in errore. Ritorna quanti."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE render_jobs
+               SET status = CASE WHEN attempts >= %s THEN 'error' ELSE 'queued' END,
+                   error_message = CASE WHEN attempts >= %s
+                                        THEN 'Worker interrotto troppe volte' ELSE error_message END,
+                   worker = NULL
+             WHERE status='running'
+               AND COALESCE(heartbeat_at, started_at, created_at) < now() - (%s * interval '1 minute')
+            """,
+            (int(max_attempts), int(max_attempts), float(stale_minutes)),
+        )
+        n = cur.rowcount or 0
+        conn.commit()
+        return int(n)
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
@@ -0,0 +1,218 @@
+# modules/stimolazione_uditiva/gate_schedule.py
+"""
+Calendario del gating Tomatis-like, condiviso da preview e render finale.
+
+Gli eventi (attesa di Poisson, apertura con rampa d'attacco, refrattario,
+banda e Q del passabanda aperto) sono estratti tutti all'inizio da un
+random.Random(seed) e tenuti come array compatti (pochi eventi al secondo).
+Inviluppo e passabanda si ricavano da quegli array per finestre [i0, i1):
+nessuna macchina a stati per campione, e lo stesso seed dà lo stesso gating
+sia nella preview sia nel render finale.
+
+Usage:
+    sched = build_gate_schedule(params, n_campioni, fs, seed=1234)
+    bp = GateBandpass(sched, fs)
+    for i0, i1 in blocchi:
+        env = sched.envelope(i0, i1)
+        wet = bp.process(dry[i0:i1], i0) * env[:, None]
+"""
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .audio_dsp import SosCascade, biquad_bandpass, db_to_lin
+
+
+def choose_band(params: Dict[str, Any], rng: random.Random) -> Tuple[float, float]:
+    bands = params["bands"]
+    choices = [
+        ("low",  float(bands["low"]["weight"])),
+        ("mid",  float(bands["mid"]["weight"])),
+        ("high", float(bands["high"]["weight"])),
+    ]
+    r = rng.random() * sum(w for _, w in choices)
+    acc = 0.0
+    pick = "mid"
+    for name, w in choices:
+        acc += w
+        if r <= acc:
+            pick = name
+            break
+    b = bands[pick]
+    return float(b["min_hz"]), float(b["max_hz"])
+
+
+@dataclass(frozen=True)
+class GateEvent:
+    start: int        # primo campione aperto
+    ramp_n: int       # campioni della rampa closed_wet -> 1
+    end: int          # primo campione di nuovo chiuso
+    center_hz: float
+    q: float
+
+
+@dataclass
+class GateSchedule:
+    """Eventi di apertura come array paralleli (ordinati, non sovrapposti)."""
+    total_samples: int
+    closed_wet: float
+    center_closed: float
+    q_closed: float
+    starts: np.ndarray
+    ramp_n: np.ndarray
+    ends: np.ndarray
+    centers: np.ndarray
+    qs: np.ndarray
+    seed: Optional[int] = None
+
+    def __len__(self) -> int:
+        return int(self.starts.shape[0])
+
+    @property
+    def events(self) -> List[GateEvent]:
+        return [
+            GateEvent(int(s), int(r), int(e), float(c), float(q))
+            for s, r, e, c, q in zip(self.starts, self.ramp_n, self.ends, self.centers, self.qs)
+        ]
+
+    def _event_at(self, idx: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(indice evento, aperto?) per ogni campione di idx."""
+        k = np.searchsorted(self.starts, idx, side="right") - 1
+        kk = np.maximum(k, 0)
+        aperto = (k >= 0) & (idx < self.ends[kk]) if len(self) else np.zeros(idx.shape, dtype=bool)
+        return kk, aperto
+
+    def envelope(self, i0: int = 0, i1: Optional[int] = None) -> np.ndarray:
+        """Inviluppo del wet sui campioni [i0, i1): closed_wet da chiuso,
+        rampa lineare closed_wet -> 1 in attacco, 1 da aperto."""
+        i1 = self.total_samples if i1 is None else int(i1)
+        env = np.full((max(0, i1 - i0),), self.closed_wet, dtype=np.float32)
+        if not len(self) or not env.shape[0]:
+            return env
+        idx = np.arange(i0, i1)
+        k, aperto = self._event_at(idx)
+        if not aperto.any():
+            return env
+        ka = k[aperto]
+        pos = idx[aperto] - self.starts[ka]
+        # rampa troncata se l'apertura è più corta dell'attacco
+        rn = np.minimum(self.ramp_n[ka], self.ends[ka] - self.starts[ka])
+        # come np.linspace(closed_wet, 1, rn): passo 1/(rn-1), 1 oltre la rampa
+        frac = np.where(pos < rn, pos / np.maximum(rn - 1, 1), 1.0)
+        env[aperto] = self.closed_wet + (1.0 - self.closed_wet) * frac.astype(np.float32)
+        return env
+
+    def boundaries(self) -> np.ndarray:
+        """Campioni in cui cambia il passabanda (inizio/fine apertura, più lo 0)."""
+        return np.unique(np.concatenate(([0], self.starts, self.ends))).astype(np.int64)
+
+    def bandpass_at(self, pos: int) -> Tuple[float, float]:
+        """(centro Hz, Q) del passabanda attivo al campione pos."""
+        k, aperto = self._event_at(np.array([pos]))
+        if aperto[0]:
+            return float(self.centers[k[0]]), float(self.qs[k[0]])
+        return self.center_closed, self.q_closed
+
+
+def build_gate_schedule(
+    params: Dict[str, Any],
+    total_samples: int,
+    fs: int,
+    seed: Optional[int] = None,
+) -> GateSchedule:
+    """Estrae tutti gli eventi di gating per total_samples campioni.
+
+    Per ogni evento: attesa ~ Exp(lambda), durata aperta, attacco, refrattario
+    (uniformi nei range del preset), banda pesata, centro e Q. seed=None:
+    gating diverso a ogni render, come prima.
+    """
+    rng = random.Random(seed)
+    lam = float(params.get("lambda_events_per_sec", 5.0))
+    open_min = float(params["open_state"]["duration_ms"]["min"]) / 1000.0
+    open_max = float(params["open_state"]["duration_ms"]["max"]) / 1000.0
+    att_min  = float(params["open_state"]["attack_ms"]["min"]) / 1000.0
+    att_max  = float(params["open_state"]["attack_ms"]["max"]) / 1000.0
+    ref_min  = float(params["closed_state"]["refractory_ms"]["min"]) / 1000.0
+    ref_max  = float(params["closed_state"]["refractory_ms"]["max"]) / 1000.0
+    q_min = float(params["open_state"]["q"]["min"])
+    q_max = float(params["open_state"]["q"]["max"])
+
+    starts: List[int] = []
+    ramps: List[int] = []
+    ends: List[int] = []
+    centers: List[float] = []
+    qs: List[float] = []
+
+    t = 0.0
+    while lam > 0:
+        t += rng.expovariate(lam)
+        start = int(t * fs)
+        if start >= total_samples:
+            break
+        dur = rng.uniform(open_min, open_max)
+        att = rng.uniform(att_min, att_max)
+        ref = rng.uniform(ref_min, ref_max)
+        fmin, fmax = choose_band(params, rng)
+        center = rng.uniform(fmin, fmax)
+        q = rng.uniform(q_min, q_max)
+
+        end = min(total_samples, int((t + dur) * fs))
+        if end <= start:
+            continue
+        starts.append(start)
+        ramps.append(max(1, int(att * fs)))
+        ends.append(end)
+        centers.append(center)
+        qs.append(q)
+        t = t + dur + ref
+
+    return GateSchedule(
+        total_samples=int(total_samples),
+        closed_wet=db_to_lin(float(params["mix"].get("closed_wet_attenuation_db", -10.0))),
+        center_closed=float(params["closed_state"]["center_hz"].get("value", 1000.0)),
+        q_closed=float(params["closed_state"]["q"].get("value", 2.8)),
+        starts=np.asarray(starts, dtype=np.int64),
+        ramp_n=np.asarray(ramps, dtype=np.int64),
+        ends=np.asarray(ends, dtype=np.int64),
+        centers=np.asarray(centers, dtype=np.float64),
+        qs=np.asarray(qs, dtype=np.float64),
+        seed=seed,
+    )
+
+
+class GateBandpass:
+    """Passabanda del wet che segue il calendario: a ogni inizio/fine
+    apertura riparte da stato nullo con centro e Q dell'evento (o quelli
+    del chiuso). Stereo in un solo sosfilt; process() va chiamato con
+    blocchi consecutivi."""
+
+    def __init__(self, schedule: GateSchedule, fs: int, channels: int = 2):
+        self.schedule = schedule
+        self.fs = int(fs)
+        self.channels = int(channels)
+        self._bounds = schedule.boundaries()
+        self._seg = -1
+        self._bp: Optional[SosCascade] = None
+
+    def process(self, x: np.ndarray, i0: int) -> np.ndarray:
+        n = x.shape[0]
+        out = np.empty(x.shape, dtype=np.float32)
+        a = 0
+        while a < n:
+            pos = i0 + a
+            seg = int(np.searchsorted(self._bounds, pos, side="right")) - 1
+            nxt = int(self._bounds[seg + 1]) if seg + 1 < len(self._bounds) else i0 + n
+            b = min(n, nxt - i0)
+            if seg != self._seg or self._bp is None:
+                center, q = self.schedule.bandpass_at(int(self._bounds[seg]))
+                self._bp = SosCascade.from_biquads(
+                    [biquad_bandpass(self.fs, center, q)], channels=self.channels,
+                )
+                self._seg = seg
+            out[a:b] = self._bp.process(x[a:b])
+            a = b
+        return out
@@ -0,0 +1,301 @@
+# modules/stimolazione_uditiva/render_cache.py
+"""
+Cache content-addressed dei render audio (render finale, preview, processore
+offline).
+
+Chiave = sha256 di (sha256 dell'audio sorgente, tipo di render, formato,
+guadagni EQ per lato, parametri del preset, seed, opzioni, CACHE_VERSION):
+due richieste identiche hanno la stessa chiave e la seconda copia il file
+dalla cache invece di renderizzare. Entrano in cache solo render
+deterministici (seed noto).
+
+Oltre agli output la cache tiene l'audio sorgente già DECODIFICATO (WAV
+16-bit) quando il decode passa da ffmpeg (MP3/OGG/...): i render successivi
+dello stesso brano, anche una preview dei primi 30 s, lo leggono direttamente
+senza rilanciare il decoder.
+
+Su disco: <root>/<kk>/<chiave>.<ext>, scrittura atomica (tmp + os.replace),
+LRU per dimensione: ogni hit aggiorna mtime e oltre max_bytes si cancellano i
+file usati meno di recente. UI e worker possono condividere la stessa
+cartella: l'eviction di un processo può togliere un file che un altro ha
+appena trovato, perciò chi deve leggerlo lo apre subito con open() (un file
+sparito fra la ricerca e l'apertura conta come miss e si renderizza).
+
+Config: STIMOLAZIONE_CACHE_DIR (default <tmp>/stimolazione_render_cache),
+STIMOLAZIONE_CACHE_MB (default 2048; 0 = cache disattivata).
+
+Usage:
+    cache = get_render_cache()
+    out = render_full(dati, nome, eq_dx, eq_sx, preset, seed=1, cache=cache)
+    cache.stats()   # file, byte, hit/miss del processo
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Union
+
+# cambiarla quando cambia il DSP: invalida tutti gli output in cache
+CACHE_VERSION = "render-v1"
+
+_TMP_PREFIX = ".tmp-"
+_RICONTA_S = 60.0          # ogni quanto ricontare la cartella (altri processi scrivono)
+_TMP_ORFANI_S = 6 * 3600   # tmp di render interrotti: cancellati dall'eviction
+_MAX_DIGEST_MEMO = 256
+
+
+def _canon(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _gains(g: Optional[Dict[Any, Any]]) -> Dict[str, float]:
+    # 1 e 1.0, chiavi int o str: stessa chiave di cache
+    return {str(int(k)): round(float(v), 4) for k, v in (g or {}).items()}
+
+
+def render_key(input_sha: str, kind: str, fmt: str, **parti: Any) -> str:
+    """Chiave di un output: parti = eq_dx/eq_sx (dict freq->dB), params, seed, opzioni."""
+    for k in ("eq_dx", "eq_sx"):
+        if k in parti:
+            parti[k] = _gains(parti[k])
+    payload = {"v": CACHE_VERSION, "in": input_sha, "kind": kind, "fmt": fmt, **parti}
+    return hashlib.sha256(_canon(payload).encode("utf-8")).hexdigest()
+
+
+def decoded_key(input_sha: str) -> str:
+    """Chiave dell'audio sorgente decodificato (indipendente dal DSP)."""
+    return hashlib.sha256(f"decoded:{input_sha}".encode("ascii")).hexdigest()
+
+
+_digest_lock = threading.Lock()
+_digest_memo: "OrderedDict[tuple, str]" = OrderedDict()
+
+
+def input_digest(src: Union[bytes, bytearray, memoryview, str, BinaryIO]) -> str:
+    """sha256 dell'audio sorgente: bytes, percorso (letto a blocchi, memo per
+    percorso+dimensione+mtime) o file binario (riavvolto a inizio file)."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(src).hexdigest()
+    if isinstance(src, str):
+        st = os.stat(src)
+        memo_key = (os.path.realpath(src), st.st_size, st.st_mtime_ns)
+        with _digest_lock:
+            hit = _digest_memo.get(memo_key)
+            if hit is not None:
+                _digest_memo.move_to_end(memo_key)
+                return hit
+        h = hashlib.sha256()
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        sha = h.hexdigest()
+        with _digest_lock:
+            _digest_memo[memo_key] = sha
+            while len(_digest_memo) > _MAX_DIGEST_MEMO:
+                _digest_memo.popitem(last=False)
+        return sha
+    h = hashlib.sha256()
+    src.seek(0)
+    for chunk in iter(lambda: src.read(1 << 20), b""):
+        h.update(chunk)
+    src.seek(0)
+    return h.hexdigest()
+
+
+class RenderCache:
+    """Cartella di file content-addressed con eviction LRU per dimensione."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self._contato_il = 0.0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    def get(self, key: str, ext: str) -> Optional[str]:
+        """Percorso del file in cache (aggiornato come usato di recente) o None."""
+        p = self.path(key, ext)
+        try:
+            os.utime(p, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return p
+
+    def open(self, key: str, ext: str) -> Optional[BinaryIO]:
+        """Come get, ma il file è già aperto in lettura: un'eviction
+        successiva non lo toglie più a chi lo sta copiando. None se manca."""
+        p = self.get(key, ext)
+        if p is None:
+            return None
+        try:
+            return open(p, "rb")
+        except FileNotFoundError:
+            # tolto dall'eviction fra get e open: è un miss
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def get_bytes(self, key: str, ext: str) -> Optional[bytes]:
+        p = self.get(key, ext)
+        if p is None:
+            return None
+        try:
+            with open(p, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def tmp_path(self, key: str, ext: str) -> str:
+        """File temporaneo nella cartella finale (os.replace resta atomico)."""
+        d = os.path.dirname(self.path(key, ext))
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=_TMP_PREFIX, suffix=f".{ext}", dir=d)
+        os.close(fd)
+        return tmp
+
+    def commit(self, tmp: str, key: str, ext: str) -> str:
+        final = self.path(key, ext)
+        os.replace(tmp, final)
+        self._aggiunto(os.path.getsize(final))
+        return final
+
+    @staticmethod
+    def discard(tmp: str) -> None:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    @contextmanager
+    def writing(self, key: str, ext: str) -> Iterator[str]:
+        """with cache.writing(k, "wav") as tmp: ...  -> in cache solo se il blocco riesce."""
+        tmp = self.tmp_path(key, ext)
+        try:
+            yield tmp
+        except BaseException:
+            self.discard(tmp)
+            raise
+        self.commit(tmp, key, ext)
+
+    def put_bytes(self, key: str, ext: str, data: bytes) -> None:
+        with self.writing(key, ext) as tmp:
+            with open(tmp, "wb") as f:
+                f.write(data)
+
+    def copy_to(self, src: Union[str, BinaryIO], target: Union[str, BinaryIO]) -> None:
+        """Copia a blocchi un file di cache (percorso o file aperto con open())
+        su un percorso o file binario."""
+        if isinstance(src, str):
+            with open(src, "rb") as f:
+                return self.copy_to(f, target)
+        if isinstance(target, str):
+            with open(target, "wb") as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+        else:
+            shutil.copyfileobj(src, target, 1 << 20)
+
+    # --- dimensione / eviction ----------------------------------------------
+
+    def _scan(self):
+        files = []
+        now = time.time()
+        try:
+            subdirs = list(os.scandir(self.root))
+        except OSError:
+            return files
+        for d in subdirs:
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                if e.name.startswith(_TMP_PREFIX):
+                    if now - st.st_mtime > _TMP_ORFANI_S:
+                        self.discard(e.path)
+                    continue
+                files.append((st.st_mtime, st.st_size, e.path))
+        return files
+
+    def _aggiunto(self, n: int) -> None:
+        with self._lock:
+            stale = self._size is None or time.time() - self._contato_il > _RICONTA_S
+            if not stale:
+                self._size += int(n)
+            if stale or self._size > self.max_bytes:
+                self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        files = self._scan()
+        total = sum(sz for _, sz, _ in files)
+        if total > self.max_bytes:
+            target = int(self.max_bytes * 0.9)
+            for _mt, sz, p in sorted(files):
+                try:
+                    os.remove(p)
+                except OSError:
+                    continue
+                total -= sz
+                if total <= target:
+                    break
+        self._size = total
+        self._contato_il = time.time()
+
+    def evict(self) -> None:
+        with self._lock:
+            self._evict_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        files = self._scan()
+        return {
+            "root": self.root,
+            "files": len(files),
+            "bytes": sum(sz for _, sz, _ in files),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_default_lock = threading.Lock()
+_default: Optional[RenderCache] = None
+_default_ko = False
+
+
+def get_render_cache() -> Optional[RenderCache]:
+    """Cache di processo configurata da env; None se disattivata o non scrivibile."""
+    global _default, _default_ko
+    if _default is not None or _default_ko:
+        return _default
+    with _default_lock:
+        if _default is None and not _default_ko:
+            try:
+                mb = float(os.getenv("STIMOLAZIONE_CACHE_MB", "2048"))
+                root = os.getenv("STIMOLAZIONE_CACHE_DIR") or os.path.join(
+                    tempfile.gettempdir(), "stimolazione_render_cache")
+                if mb > 0:
+                    _default = RenderCache(root, int(mb * 1024 * 1024))
+                else:
+                    _default_ko = True
+            except Exception:
+                _default_ko = True
+    return _default
@@ -3,118 +3,215 @@ from __future__ import annotations
 
 import io
 import os
-import random
 import shutil
 import subprocess
 import tempfile
-from dataclasses import dataclass
-from typing import Any, Dict, Tuple, Optional
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Optional, Tuple, Union
 
 import numpy as np
 
 from .audio_dsp import (
-    biquad_peaking, biquad_bandpass, db_to_lin, soft_limiter
+    biquad_peaking, soft_limiter, sos_from_biquads, StereoSosCascade,
 )
 from .db_orl import FREQS_STD
+from .gate_schedule import GateBandpass, build_gate_schedule
+
+if TYPE_CHECKING:
+    from .render_cache import RenderCache
 
 
 # =============================================================================
-# IO helpers
+# IO a blocchi: lettori e scrittori in streaming (memoria ~ blocco, non brano)
 # =============================================================================
 
+# sorgenti senza durata nota (pipe ffmpeg): calendario di gating fino a qui
+_MAX_SECONDS_UNKNOWN = 6 * 3600.0
+
+
 def _ffmpeg_available() -> bool:
     return shutil.which("ffmpeg") is not None
 
 
-def _read_wav16_bytes(data: bytes) -> Tuple[np.ndarray, int]:
-    """Read WAV PCM 16-bit via stdlib (stable on Streamlit)."""
-    import wave
-    bio = io.BytesIO(data)
-    with wave.open(bio, "rb") as wf:
-        ch = wf.getnchannels()
-        fs = wf.getframerate()
-        sampw = wf.getsampwidth()
-        nframes = wf.getnframes()
-        raw = wf.readframes(nframes)
-
-    if sampw != 2:
-        raise ValueError("WAV input deve essere PCM 16-bit. Converti in WAV 16-bit.")
-    x = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
-    if ch == 1:
-        x = np.stack([x, x], axis=1)
-    elif ch == 2:
-        x = x.reshape(-1, 2)
-    else:
+def _as_stereo(x: np.ndarray) -> np.ndarray:
+    if x.shape[1] == 1:
+        return np.repeat(x, 2, axis=1)
+    if x.shape[1] != 2:
         raise ValueError("Supporto solo mono o stereo.")
-    return x.astype(np.float32, copy=False), int(fs)
+    return x
+
+
+class _AudioReader:
+    """Sorgente a blocchi: fs, frames (None se ignoto), read(n) -> (k, 2) float32."""
+
+    fs: int = 44100
+    frames: Optional[int] = None
+
+    def read(self, n: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class _Wav16Reader(_AudioReader):
+    """WAV PCM 16-bit via stdlib (stable on Streamlit)."""
+
+    def __init__(self, fileobj: BinaryIO, owned: bool = False):
+        import wave
+        self._owned = fileobj if owned else None
+        self._wf = wave.open(fileobj, "rb")
+        self._ch = self._wf.getnchannels()
+        if self._wf.getsampwidth() != 2:
+            self._wf.close()
+            raise ValueError("WAV input deve essere PCM 16-bit. Converti in WAV 16-bit.")
+        if self._ch not in (1, 2):
+            self._wf.close()
+            raise ValueError("Supporto solo mono o stereo.")
+        self.fs = int(self._wf.getframerate())
+        self.frames = int(self._wf.getnframes())
+
+    def read(self, n: int) -> np.ndarray:
+        raw = self._wf.readframes(int(n))
+        x = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+        return _as_stereo(x.reshape(-1, self._ch))
+
+    def close(self) -> None:
+        self._wf.close()
+        if self._owned is not None:
+            self._owned.close()
+
+
+class _SoundfileReader(_AudioReader):
+    """soundfile (molto comodo per FLAC) se presente."""
+
+    def __init__(self, src):
+        import soundfile as sf  # type: ignore
+        self._f = sf.SoundFile(src)
+        if self._f.channels not in (1, 2):
+            self._f.close()
+            raise ValueError("Supporto solo mono o stereo.")
+        self.fs = int(self._f.samplerate)
+        self.frames = int(self._f.frames)
+
+    def read(self, n: int) -> np.ndarray:
+        return _as_stereo(self._f.read(int(n), dtype="float32", always_2d=True))
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class _FfmpegReader(_AudioReader):
+    """Qualunque formato -> PCM 16-bit stereo 44.1 kHz su pipe, letto a blocchi."""
+
+    def __init__(self, path: str, cleanup: Optional[str] = None):
+        self._cleanup = cleanup
+        self._err = tempfile.TemporaryFile()
+        self._p = subprocess.Popen(
+            ["ffmpeg", "-v", "error", "-i", path, "-f", "s16le", "-ac", "2", "-ar", "44100", "-"],
+            stdout=subprocess.PIPE, stderr=self._err,
+        )
+        self.fs = 44100
+        self.frames = None
+
+    def read(self, n: int) -> np.ndarray:
+        want = int(n) * 4
+        parts = []
+        while want > 0:
+            chunk = self._p.stdout.read(want)
+            if not chunk:
+                break
+            parts.append(chunk)
+            want -= len(chunk)
+        raw = b"".join(parts)
+        raw = raw[: len(raw) - len(raw) % 4]
+        if not raw and self._p.wait() != 0:
+            self._err.seek(0)
+            raise ValueError(
+                "ffmpeg non riesce a decodificare questo file. "
+                "Consiglio: converti in WAV 16-bit e ricarica.\n"
+                + self._err.read().decode("utf-8", errors="ignore")[:4000]
+            )
+        return (np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0).reshape(-1, 2)
+
+    def close(self) -> None:
+        try:
+            self._p.stdout.close()
+            if self._p.poll() is None:
+                self._p.kill()
+            self._p.wait()
+        finally:
+            self._err.close()
+            if self._cleanup:
+                shutil.rmtree(self._cleanup, ignore_errors=True)
+
+
+class _TeeWavReader(_AudioReader):
+    """Passa i blocchi decodificati da un altro reader e intanto li scrive in
+    un WAV 16-bit (la copia decodificata per la render cache). complete=True
+    solo se il sorgente è stato letto fino in fondo."""
+
+    def __init__(self, inner: _AudioReader, path: str):
+        self._in = inner
+        self.fs = inner.fs
+        self.frames = inner.frames
+        self._f = open(path, "wb")
+        self._w = _WavWriter(self._f, self.fs, inner.frames)
+        self.complete = False
+
+    def read(self, n: int) -> np.ndarray:
+        x = self._in.read(n)
+        if x.shape[0] < int(n):
+            self.complete = True
+        if x.shape[0]:
+            # x = int16 / 32768 esatto: la copia è identica al PCM di ffmpeg
+            self._w.write(np.round(x * 32768.0).astype("<i2"))
+        return x
+
+    def close(self) -> None:
+        try:
+            self._in.close()
+        finally:
+            try:
+                self._w.close()
+            finally:
+                self._f.close()
 
 
-def _read_audio_bytes_any(data: bytes, filename: str) -> Tuple[np.ndarray, int]:
+def _open_reader(src: Union[bytes, str, BinaryIO], filename: str) -> _AudioReader:
     """
-    Decoder robusto:
-      1) WAV 16-bit -> ok sempre
+    Decoder robusto, a blocchi (src: bytes, percorso o file binario):
+      1) WAV 16-bit -> ok sempre (stdlib)
       2) soundfile (se disponibile) -> FLAC/WAV ecc.
-      3) pydub (se disponibile) -> MP3
-      4) ffmpeg (se disponibile) -> qualunque formato -> WAV 16-bit temporaneo
+      3) ffmpeg (se disponibile) -> qualunque formato (anche MP3), via pipe
     """
-    name = (filename or "").lower().strip()
+    name = (filename or (src if isinstance(src, str) else "")).lower().strip()
+
+    def _fileobj():
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            return io.BytesIO(bytes(src))
+        if isinstance(src, str):
+            return open(src, "rb")
+        src.seek(0)
+        return src
 
     if name.endswith(".wav"):
-        return _read_wav16_bytes(data)
+        return _Wav16Reader(_fileobj(), owned=isinstance(src, str))
 
-    # soundfile (molto comodo per FLAC) se presente
     try:
-        import soundfile as sf  # type: ignore
-        bio = io.BytesIO(data)
-        x, fs = sf.read(bio, dtype="float32", always_2d=True)
-        if x.shape[1] == 1:
-            x = np.repeat(x, 2, axis=1)
-        elif x.shape[1] != 2:
-            raise ValueError("Supporto solo mono o stereo.")
-        return x.astype(np.float32, copy=False), int(fs)
+        return _SoundfileReader(src if isinstance(src, str) else _fileobj())
     except Exception:
         pass
 
-    # pydub (MP3) se presente + ffmpeg
-    if name.endswith(".mp3"):
-        try:
-            from pydub import AudioSegment  # type: ignore
-            seg = AudioSegment.from_file(io.BytesIO(data), format="mp3").set_channels(2)
-            fs = int(seg.frame_rate)
-            samples = np.array(seg.get_array_of_samples()).reshape((-1, 2)).astype(np.float32)
-            maxv = float(2 ** (8 * seg.sample_width - 1))
-            x = samples / maxv
-            return x.astype(np.float32, copy=False), fs
-        except Exception:
-            pass
-
-    # ffmpeg fallback
     if _ffmpeg_available():
-        with tempfile.TemporaryDirectory() as td:
-            # keep extension to help ffmpeg sniff format
-            ext = os.path.splitext(name)[1] or ".bin"
-            in_guess = os.path.join(td, f"in{ext}")
-            out_wav = os.path.join(td, "out.wav")
-            with open(in_guess, "wb") as f:
-                f.write(data)
-
-            cmd = [
-                "ffmpeg", "-y",
-                "-i", in_guess,
-                "-ac", "2",
-                "-ar", "44100",
-                "-sample_fmt", "s16",
-                out_wav
-            ]
-            p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if p.returncode != 0:
-                raise ValueError(
-                    "ffmpeg non riesce a decodificare questo file. "
-                    "Consiglio: converti in WAV 16-bit e ricarica.\n"
-                    + p.stderr.decode("utf-8", errors="ignore")[:4000]
-                )
-            wav_bytes = open(out_wav, "rb").read()
-            return _read_wav16_bytes(wav_bytes)
+        if isinstance(src, str):
+            return _FfmpegReader(src)
+        # ffmpeg vuole un file con estensione per riconoscere il formato
+        td = tempfile.mkdtemp()
+        ext = os.path.splitext(name)[1] or ".bin"
+        path = os.path.join(td, f"in{ext}")
+        with open(path, "wb") as f:
+            shutil.copyfileobj(_fileobj(), f, 1 << 20)
+        return _FfmpegReader(path, cleanup=td)
 
     raise ValueError(
         "Formato non supportato in questa installazione. "
@@ -123,102 +220,132 @@ def _read_audio_bytes_any(data: bytes, filename: str) -> Tuple[np.ndarray, int]:
     )
 
 
-def _write_wav16_bytes(x: np.ndarray, fs: int) -> bytes:
-    import wave
-    x = np.clip(x, -1.0, 1.0)
-    pcm16 = (x * 32767.0).astype("<i2")
-    bio = io.BytesIO()
-    with wave.open(bio, "wb") as wf:
-        wf.setnchannels(2)
-        wf.setsampwidth(2)
-        wf.setframerate(int(fs))
-        wf.writeframes(pcm16.tobytes())
-    return bio.getvalue()
+class _AudioWriter:
+    """Destinazione a blocchi di PCM 16-bit stereo (k, 2) int16."""
 
+    def write(self, pcm16: np.ndarray) -> None:
+        raise NotImplementedError
 
-def _write_flac_bytes_from_wav(wav_bytes: bytes) -> bytes:
-    """
-    FLAC export:
-      - prefer soundfile (se disponibile)
-      - fallback ffmpeg (se disponibile)
-    """
-    try:
-        import soundfile as sf  # type: ignore
-        bio = io.BytesIO(wav_bytes)
-        x, fs = sf.read(bio, dtype="float32", always_2d=True)
-        out = io.BytesIO()
-        sf.write(out, np.clip(x, -1.0, 1.0), int(fs), format="FLAC", subtype="PCM_16")
-        return out.getvalue()
-    except Exception:
+    def close(self) -> None:
         pass
 
-    if not _ffmpeg_available():
-        raise ValueError(
-            "Per FLAC serve 'soundfile' (libsndfile) oppure ffmpeg. "
-            "Nel tuo Streamlit Cloud sembra mancare: per ora usa WAV."
-        )
+    def abort(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
 
-    with tempfile.TemporaryDirectory() as td:
-        in_wav = os.path.join(td, "in.wav")
-        out_flac = os.path.join(td, "out.flac")
-        with open(in_wav, "wb") as f:
-            f.write(wav_bytes)
-        cmd = ["ffmpeg", "-y", "-i", in_wav, "-c:a", "flac", out_flac]
-        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if p.returncode != 0:
-            raise ValueError(
-                "ffmpeg non riesce a esportare FLAC.\n"
-                + p.stderr.decode("utf-8", errors="ignore")[:4000]
-            )
-        return open(out_flac, "rb").read()
 
+class _WavWriter(_AudioWriter):
+    def __init__(self, target: BinaryIO, fs: int, frames: Optional[int]):
+        import wave
+        self._wf = wave.open(target, "wb")
+        self._wf.setnchannels(2)
+        self._wf.setsampwidth(2)
+        self._wf.setframerate(int(fs))
+        if frames:
+            # header già giusto: nessun seek a fine file se i frame tornano
+            self._wf.setnframes(int(frames))
 
-def _write_mp3_bytes_from_wav(wav_bytes: bytes, bitrate: str = "192k") -> bytes:
-    """
-    MP3 export:
-      - prefer pydub (se disponibile)
-      - fallback ffmpeg (se disponibile)
-    """
-    try:
-        from pydub import AudioSegment  # type: ignore
-        seg = AudioSegment.from_file(io.BytesIO(wav_bytes), format="wav")
-        out = io.BytesIO()
-        seg.export(out, format="mp3", bitrate=str(bitrate))
-        return out.getvalue()
-    except Exception:
-        pass
+    def write(self, pcm16: np.ndarray) -> None:
+        self._wf.writeframes(pcm16.tobytes())
+
+    def close(self) -> None:
+        self._wf.close()
+
+
+class _SoundfileWriter(_AudioWriter):
+    def __init__(self, target: BinaryIO, fs: int, fmt: str):
+        import soundfile as sf  # type: ignore
+        self._f = sf.SoundFile(target, "w", samplerate=int(fs), channels=2,
+                               format=fmt.upper(), subtype="PCM_16")
+
+    def write(self, pcm16: np.ndarray) -> None:
+        self._f.write(pcm16)
 
-    if not _ffmpeg_available():
-        raise ValueError(
-            "Per MP3 serve 'pydub'+ffmpeg oppure ffmpeg. "
-            "Nel tuo Streamlit Cloud sembra mancare: per ora usa WAV."
+    def close(self) -> None:
+        self._f.close()
+
+
+class _FfmpegWriter(_AudioWriter):
+    """PCM su stdin di ffmpeg -> file temporaneo -> copiato a blocchi nella destinazione."""
+
+    def __init__(self, target: BinaryIO, fs: int, fmt: str, args: Tuple[str, ...]):
+        self._target = target
+        self._fmt = fmt
+        self._td = tempfile.mkdtemp()
+        self._out = os.path.join(self._td, f"out.{fmt}")
+        self._err = tempfile.TemporaryFile()
+        self._p = subprocess.Popen(
+            ["ffmpeg", "-y", "-v", "error", "-f", "s16le", "-ar", str(int(fs)), "-ac", "2",
+             "-i", "-", *args, self._out],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._err,
         )
 
-    with tempfile.TemporaryDirectory() as td:
-        in_wav = os.path.join(td, "in.wav")
-        out_mp3 = os.path.join(td, "out.mp3")
-        with open(in_wav, "wb") as f:
-            f.write(wav_bytes)
-        cmd = ["ffmpeg", "-y", "-i", in_wav, "-b:a", str(bitrate), out_mp3]
-        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if p.returncode != 0:
+    def write(self, pcm16: np.ndarray) -> None:
+        self._p.stdin.write(pcm16.tobytes())
+
+    def close(self) -> None:
+        try:
+            self._p.stdin.close()
+            if self._p.wait() != 0:
+                self._err.seek(0)
+                raise ValueError(
+                    f"ffmpeg non riesce a esportare {self._fmt.upper()}.\n"
+                    + self._err.read().decode("utf-8", errors="ignore")[:4000]
+                )
+            with open(self._out, "rb") as f:
+                shutil.copyfileobj(f, self._target, 1 << 20)
+        finally:
+            self._err.close()
+            shutil.rmtree(self._td, ignore_errors=True)
+
+    def abort(self) -> None:
+        try:
+            self._p.kill()
+            self._p.wait()
+        finally:
+            self._err.close()
+            shutil.rmtree(self._td, ignore_errors=True)
+
+
+def _open_writer(fmt: str, target: BinaryIO, fs: int, frames: Optional[int],
+                 mp3_bitrate: str) -> _AudioWriter:
+    """
+    Export a blocchi:
+      - WAV: stdlib, sempre
+      - FLAC: soundfile (se disponibile), altrimenti ffmpeg
+      - MP3: ffmpeg
+    """
+    if fmt == "wav":
+        return _WavWriter(target, fs, frames)
+    if fmt == "flac":
+        try:
+            return _SoundfileWriter(target, fs, "flac")
+        except Exception:
+            pass
+        if not _ffmpeg_available():
             raise ValueError(
-                "ffmpeg non riesce a esportare MP3.\n"
-                + p.stderr.decode("utf-8", errors="ignore")[:4000]
+                "Per FLAC serve 'soundfile' (libsndfile) oppure ffmpeg. "
+                "Nel tuo Streamlit Cloud sembra mancare: per ora usa WAV."
             )
-        return open(out_mp3, "rb").read()
+        return _FfmpegWriter(target, fs, "flac", ("-c:a", "flac"))
+    if fmt == "mp3":
+        if not _ffmpeg_available():
+            raise ValueError(
+                "Per MP3 serve ffmpeg. "
+                "Nel tuo Streamlit Cloud sembra mancare: per ora usa WAV."
+            )
+        return _FfmpegWriter(target, fs, "mp3", ("-b:a", str(mp3_bitrate)))
+    raise ValueError(f"Formato di output non supportato: {fmt}")
 
 
 # =============================================================================
 # DSP engine (streaming a blocchi)
 # =============================================================================
 
-@dataclass
-class GateState:
-    mode: str = "closed_wait"   # closed_wait -> open -> closed
-    time_left_s: float = 0.0
-    attack_left_s: float = 0.0
-
+# frame per blocco: ~0.4 s a 44.1 kHz, poche centinaia di KB in memoria
+BLOCK_FRAMES = 16384
 
 def _build_eq_filters(fs: int, gains: Dict[int, float], q: float = 1.0):
     filters = []
@@ -230,35 +357,246 @@ def _build_eq_filters(fs: int, gains: Dict[int, float], q: float = 1.0):
     return filters
 
 
-def _choose_band(params: Dict[str, Any]) -> Tuple[float, float]:
-    bands = params["bands"]
-    choices = [
-        ("low",  float(bands["low"]["weight"])),
-        ("mid",  float(bands["mid"]["weight"])),
-        ("high", float(bands["high"]["weight"])),
-    ]
-    r = random.random() * sum(w for _, w in choices)
-    acc = 0.0
-    pick = "mid"
-    for name, w in choices:
-        acc += w
-        if r <= acc:
-            pick = name
-            break
-    b = bands[pick]
-    return float(b["min_hz"]), float(b["max_hz"])
-
-
-def _dominant_at_time(lb: Dict[str, Any], t_s: float) -> str:
-    mode = lb.get("mode", "fixed")
+def _bias_gains(lb: Dict[str, Any], i: int, j: int, fs: int, g_oth: float):
+    """Guadagni (SX, DX) per i campioni [i, j): scalari se il lato dominante
+    non cambia nel blocco, array se 'alternate' scatta dentro il blocco."""
     dom = lb.get("dominant_side", "DX")
-    if mode != "alternate":
-        return dom
+    g_sx, g_dx = (g_oth, 1.0) if dom == "DX" else (1.0, g_oth)
     mins = float(lb.get("alternate_minutes", 2.5))
-    if mins <= 0:
-        return dom
-    period = mins * 60.0
-    return dom if (int(t_s // period) % 2 == 0) else ("SX" if dom == "DX" else "DX")
+    if lb.get("mode", "fixed") != "alternate" or mins <= 0:
+        return g_sx, g_dx
+    period = int(round(mins * 60.0 * fs))
+    scambio = ((np.arange(i, j) // period) % 2).astype(bool)
+    if not scambio.any():
+        return g_sx, g_dx
+    if scambio.all():
+        return g_dx, g_sx
+    return np.where(scambio, g_dx, g_sx), np.where(scambio, g_sx, g_dx)
+
+
+def _render_stream(
+    src: Union[bytes, str, BinaryIO],
+    filename: str,
+    outputs: Dict[str, Union[str, BinaryIO]],
+    eq_gain_dx: Dict[int, float],
+    eq_gain_sx: Dict[int, float],
+    preset_params: Dict[str, Any],
+    *,
+    limiter_peak_dbfs: float = -1.0,
+    mp3_bitrate: str = "192k",
+    max_seconds: Optional[float] = None,
+    seed: Optional[int] = None,
+    on_progress: Optional[Callable[[float], None]] = None,
+    block: int = BLOCK_FRAMES,
+    decoded_to: Optional[Tuple["RenderCache", str]] = None,
+) -> Dict[str, Any]:
+    """
+    Render in streaming, memoria limitata dal blocco (non dalla durata):
+      - decode a blocchi (WAV stdlib, soundfile, pipe ffmpeg)
+      - EQ DX/SX, gating Tomatis-like, bias laterale, limiter: blocco per blocco
+      - ogni blocco va subito a tutti gli encoder richiesti (un solo passaggio,
+        nessun WAV intermedio da ridecodificare per FLAC/MP3)
+
+    src: bytes, percorso o file binario. outputs: {"wav"|"flac"|"mp3": percorso
+    o file binario scrivibile}. on_progress(frazione 0..1) dopo ogni blocco
+    (solo se la durata è nota). Ritorna {"frames", "fs", "seconds"}.
+    decoded_to=(cache, chiave): se il decode passa da ffmpeg, la copia
+    decodificata finisce in cache (solo se il sorgente è letto tutto).
+    """
+    reader = _open_reader(src, filename)
+    tee_tmp = None
+    if decoded_to is not None and isinstance(reader, _FfmpegReader):
+        tee_tmp = decoded_to[0].tmp_path(decoded_to[1], "wav")
+        reader = _TeeWavReader(reader, tee_tmp)
+    owned: list = []
+    writers: Dict[str, _AudioWriter] = {}
+    try:
+        fs = reader.fs
+        limit = int(max_seconds * fs) if max_seconds is not None else None
+        total = reader.frames
+        if limit is not None:
+            total = limit if total is None else min(total, limit)
+        if total == 0:
+            raise ValueError("Audio vuoto.")
+
+        # EQ: una cascata SOS per lato (0=SX, 1=DX), stato conservato fra i blocchi
+        eq = StereoSosCascade(
+            sos_from_biquads(_build_eq_filters(fs, eq_gain_sx, q=1.0)),
+            sos_from_biquads(_build_eq_filters(fs, eq_gain_dx, q=1.0)),
+        )
+
+        # gating: calendario eventi estratto una volta (stesso seed = stesso gating della preview)
+        sched_n = total if total is not None else int(_MAX_SECONDS_UNKNOWN * fs)
+        sched = build_gate_schedule(preset_params, sched_n, fs, seed=seed)
+        bp = GateBandpass(sched, fs)
+
+        wet_mix = float(preset_params["mix"].get("wet_mix", 0.9))
+
+        # bias
+        lb = preset_params.get("lateral_bias", {})
+        ratio = float(lb.get("ratio", 0.7))
+        g_oth = max(0.0, min(1.0, (1.0 - ratio) / ratio)) if ratio > 0 else 1.0
+
+        for fmt, target in outputs.items():
+            if isinstance(target, str):
+                target = open(target, "wb")
+                owned.append(target)
+            writers[fmt] = _open_writer(fmt, target, fs, total, mp3_bitrate)
+
+        i = 0
+        while True:
+            want = block if total is None else min(block, total - i)
+            if want <= 0:
+                break
+            x = reader.read(want)
+            if x.shape[0] == 0:
+                break
+            j = i + x.shape[0]
+
+            # EQ block (keep states)
+            dry = eq.process(x)
+            wet = bp.process(dry, i) * sched.envelope(i, j)[:, None]
+            o = dry * (1.0 - wet_mix) + wet * wet_mix
+
+            g_sx, g_dx = _bias_gains(lb, i, j, fs, g_oth)
+            o[:, 0] *= g_sx
+            o[:, 1] *= g_dx
+
+            o = soft_limiter(o, peak_dbfs=float(limiter_peak_dbfs))
+            pcm16 = (np.clip(o, -1.0, 1.0) * 32767.0).astype("<i2")
+            for w in writers.values():
+                w.write(pcm16)
+            i = j
+            if on_progress is not None and total:
+                on_progress(j / total)
+
+        if i == 0:
+            raise ValueError("Audio vuoto.")
+        for fmt in list(writers):
+            writers.pop(fmt).close()
+        return {"frames": i, "fs": fs, "seconds": i / float(fs)}
+    except Exception:
+        for w in writers.values():
+            w.abort()
+        raise
+    finally:
+        reader.close()
+        if tee_tmp is not None:
+            if reader.complete:
+                decoded_to[0].commit(tee_tmp, decoded_to[1], "wav")
+            else:
+                decoded_to[0].discard(tee_tmp)
+        for f in owned:
+            try:
+                f.close()
+            except Exception:
+                pass
+
+
+def render_stream(
+    src: Union[bytes, str, BinaryIO],
+    filename: str,
+    outputs: Dict[str, Union[str, BinaryIO]],
+    eq_gain_dx: Dict[int, float],
+    eq_gain_sx: Dict[int, float],
+    preset_params: Dict[str, Any],
+    *,
+    limiter_peak_dbfs: float = -1.0,
+    mp3_bitrate: str = "192k",
+    max_seconds: Optional[float] = None,
+    seed: Optional[int] = None,
+    on_progress: Optional[Callable[[float], None]] = None,
+    block: int = BLOCK_FRAMES,
+    cache: Optional["RenderCache"] = None,
+) -> Dict[str, Any]:
+    """
+    Render in streaming (vedi _render_stream), con render cache opzionale:
+      - output già in cache per (audio, EQ, preset, seed, formato, opzioni)
+        -> copiati, nessun DSP; ritorna {"cache": "hit"}
+      - altrimenti si renderizzano solo i formati mancanti, direttamente in
+        cache, e poi si copiano nelle destinazioni
+      - audio già decodificato da ffmpeg in un render precedente -> letto
+        dalla copia WAV in cache (vale anche per le preview con max_seconds)
+
+    Senza seed il gating cambia a ogni render: niente cache degli output.
+    """
+    if cache is None:
+        return _render_stream(
+            src, filename, outputs, eq_gain_dx, eq_gain_sx, preset_params,
+            limiter_peak_dbfs=limiter_peak_dbfs, mp3_bitrate=mp3_bitrate,
+            max_seconds=max_seconds, seed=seed, on_progress=on_progress, block=block,
+        )
+    from .render_cache import decoded_key, input_digest, render_key
+
+    in_sha = input_digest(src)
+    dkey = decoded_key(in_sha)
+    # file di cache aperti subito: l'eviction (anche di un altro processo)
+    # non li toglie più fra la ricerca e la copia
+    aperti: list = []
+    try:
+        dec = cache.open(dkey, "wav")
+        decoded_to = None
+        if dec is not None:
+            aperti.append(dec)
+            src, filename = dec, cache.path(dkey, "wav")
+        else:
+            decoded_to = (cache, dkey)
+
+        keys: Dict[str, str] = {}
+        if seed is not None:
+            for fmt in outputs:
+                keys[fmt] = render_key(
+                    in_sha, "full", fmt, eq_dx=eq_gain_dx, eq_sx=eq_gain_sx,
+                    params=preset_params, seed=int(seed), max_seconds=max_seconds,
+                    limiter=float(limiter_peak_dbfs),
+                    bitrate=mp3_bitrate if fmt == "mp3" else None,
+                )
+        hits: Dict[str, BinaryIO] = {}
+        for fmt, k in keys.items():
+            f = cache.open(k, fmt)
+            if f is not None:
+                aperti.append(f)
+                hits[fmt] = f
+        todo = {fmt: t for fmt, t in outputs.items() if fmt not in hits}
+
+        stats: Dict[str, Any] = {"cache": "hit"}
+        if todo:
+            if seed is None:
+                return _render_stream(
+                    src, filename, todo, eq_gain_dx, eq_gain_sx, preset_params,
+                    limiter_peak_dbfs=limiter_peak_dbfs, mp3_bitrate=mp3_bitrate,
+                    max_seconds=max_seconds, seed=seed, on_progress=on_progress,
+                    block=block, decoded_to=decoded_to,
+                )
+            tmps = {fmt: cache.tmp_path(keys[fmt], fmt) for fmt in todo}
+            try:
+                stats = _render_stream(
+                    src, filename, tmps, eq_gain_dx, eq_gain_sx, preset_params,
+                    limiter_peak_dbfs=limiter_peak_dbfs, mp3_bitrate=mp3_bitrate,
+                    max_seconds=max_seconds, seed=seed, on_progress=on_progress,
+                    block=block, decoded_to=decoded_to,
+                )
+            except BaseException:
+                for t in tmps.values():
+                    cache.discard(t)
+                raise
+            for fmt, t in tmps.items():
+                # aperto prima del commit: l'eviction che segue il commit può
+                # togliere anche questo file (cache più piccola del brano)
+                f = open(t, "rb")
+                aperti.append(f)
+                cache.commit(t, keys[fmt], fmt)
+                hits[fmt] = f
+            stats["cache"] = "miss"
+        elif on_progress is not None:
+            on_progress(1.0)
+
+        for fmt, target in outputs.items():
+            cache.copy_to(hits[fmt], target)
+        return stats
+    finally:
+        for f in aperti:
+            f.close()
 
 
 def render_full(
@@ -272,153 +610,26 @@ def render_full(
     out_formats: Tuple[str, ...] = ("wav", "flac"),
     mp3_bitrate: str = "192k",
     max_seconds: Optional[float] = None,
+    seed: Optional[int] = None,
+    on_progress: Optional[Callable[[float], None]] = None,
+    cache: Optional["RenderCache"] = None,
 ) -> Dict[str, bytes]:
     """
-    Render finale:
-      - decode best-effort (WAV consigliato)
-      - EQ DX/SX
-      - gating Tomatis-like
-      - export WAV sempre; FLAC/MP3 se possibile (soundfile/pydub/ffmpeg) altrimenti errore chiaro.
-    """
-    x, fs = _read_audio_bytes_any(audio_bytes, filename)
-    if max_seconds is not None:
-        x = x[: int(max_seconds * fs), :]
-
-    n = x.shape[0]
-    if n <= 0:
-        raise ValueError("Audio vuoto.")
-
-    # EQ filters (stateful)
-    eqL = _build_eq_filters(fs, eq_gain_sx, q=1.0)  # 0=SX
-    eqR = _build_eq_filters(fs, eq_gain_dx, q=1.0)  # 1=DX
-
-    # closed bandpass default
-    q_closed = float(preset_params["closed_state"]["q"].get("value", 2.8))
-    center_closed = float(preset_params["closed_state"]["center_hz"].get("value", 1000.0))
-
-    # gating params
-    lam = float(preset_params.get("lambda_events_per_sec", 5.0))
-    open_min = float(preset_params["open_state"]["duration_ms"]["min"]) / 1000.0
-    open_max = float(preset_params["open_state"]["duration_ms"]["max"]) / 1000.0
-    att_min  = float(preset_params["open_state"]["attack_ms"]["min"]) / 1000.0
-    att_max  = float(preset_params["open_state"]["attack_ms"]["max"]) / 1000.0
-    ref_min  = float(preset_params["closed_state"]["refractory_ms"]["min"]) / 1000.0
-    ref_max  = float(preset_params["closed_state"]["refractory_ms"]["max"]) / 1000.0
-
-    wet_mix = float(preset_params["mix"].get("wet_mix", 0.9))
-    closed_att_db = float(preset_params["mix"].get("closed_wet_attenuation_db", -10.0))
-    closed_wet = db_to_lin(closed_att_db)
-
-    # bias
-    lb = preset_params.get("lateral_bias", {})
-    ratio = float(lb.get("ratio", 0.7))
-    g_dom = 1.0
-    g_oth = max(0.0, min(1.0, (1.0 - ratio) / ratio)) if ratio > 0 else 1.0
-
-    # bandpass stateful
-    bpL = biquad_bandpass(fs, center_closed, q_closed)
-    bpR = biquad_bandpass(fs, center_closed, q_closed)
-
-    st = GateState(
-        mode="closed_wait",
-        time_left_s=(random.expovariate(lam) if lam > 0 else 1e9),
-        attack_left_s=0.0,
-    )
-    t_s = 0.0
-
-    out = np.zeros_like(x, dtype=np.float32)
-    block = 2048
-    i = 0
-    while i < n:
-        j = min(n, i + block)
-        block_n = j - i
-
-        # EQ block (keep states)
-        L = x[i:j, 0].astype(np.float32, copy=True)
-        R = x[i:j, 1].astype(np.float32, copy=True)
-        for f in eqL:
-            L = f.process(L)
-        for f in eqR:
-            R = f.process(R)
-        dryL, dryR = L, R
-
-        env = np.empty((block_n,), dtype=np.float32)
-        for k in range(block_n):
-            dt = 1.0 / fs
-
-            if st.time_left_s <= 0.0:
-                if st.mode == "closed_wait":
-                    # start OPEN
-                    st.mode = "open"
-                    st.time_left_s = random.uniform(open_min, open_max)
-                    st.attack_left_s = random.uniform(att_min, att_max)
-
-                    fmin, fmax = _choose_band(preset_params)
-                    center = random.uniform(fmin, fmax)
-                    q = random.uniform(
-                        float(preset_params["open_state"]["q"]["min"]),
-                        float(preset_params["open_state"]["q"]["max"]),
-                    )
-                    bpL = biquad_bandpass(fs, center, q)
-                    bpR = biquad_bandpass(fs, center, q)
-
-                elif st.mode == "open":
-                    # go CLOSED refractory
-                    st.mode = "closed"
-                    st.time_left_s = random.uniform(ref_min, ref_max)
-                    st.attack_left_s = 0.0
-                    bpL = biquad_bandpass(fs, center_closed, q_closed)
-                    bpR = biquad_bandpass(fs, center_closed, q_closed)
-
-                elif st.mode == "closed":
-                    # schedule next OPEN (Poisson)
-                    st.mode = "closed_wait"
-                    st.time_left_s = random.expovariate(lam) if lam > 0 else 1e9
-                    st.attack_left_s = 0.0
-
-            # env value
-            if st.mode == "open":
-                if st.attack_left_s > 0.0:
-                    # linear ramp closed_wet -> 1 (approx)
-                    frac = 1.0 - max(0.0, min(1.0, st.attack_left_s / max(att_max, 1e-6)))
-                    env[k] = closed_wet + (1.0 - closed_wet) * frac
-                    st.attack_left_s -= dt
-                else:
-                    env[k] = 1.0
-            else:
-                env[k] = closed_wet
-
-            st.time_left_s -= dt
-            t_s += dt
-
-        wetL = bpL.process(dryL) * env
-        wetR = bpR.process(dryR) * env
+    Render finale in memoria: come render_stream, ma input e output come bytes
+    (per la UI). Per brani lunghi usare render_stream su file.
+      - export WAV sempre; FLAC/MP3 se possibile (soundfile/ffmpeg) altrimenti errore chiaro.
 
-        oL = dryL * (1.0 - wet_mix) + wetL * wet_mix
-        oR = dryR * (1.0 - wet_mix) + wetR * wet_mix
+    on_progress(frazione 0..1) viene chiamata dopo ogni blocco DSP: il
+    chiamante decide quanto spesso propagarla (es. il worker la scrive in
+    render_jobs.progress al massimo ogni pochi secondi).
 
-        dom = _dominant_at_time(lb, t_s)
-        if dom == "DX":
-            oR *= g_dom
-            oL *= g_oth
-        else:
-            oL *= g_dom
-            oR *= g_oth
-
-        out[i:j, 0] = oL
-        out[i:j, 1] = oR
-        i = j
-
-    out = soft_limiter(out, peak_dbfs=float(limiter_peak_dbfs))
-
-    # Always produce WAV first (guaranteed)
-    wav_bytes = _write_wav16_bytes(out, fs)
-
-    outputs: Dict[str, bytes] = {}
-    if "wav" in out_formats:
-        outputs["wav"] = wav_bytes
-    if "flac" in out_formats:
-        outputs["flac"] = _write_flac_bytes_from_wav(wav_bytes)
-    if "mp3" in out_formats:
-        outputs["mp3"] = _write_mp3_bytes_from_wav(wav_bytes, bitrate=str(mp3_bitrate))
-    return outputs
+    cache: RenderCache opzionale (vedi render_stream): con seed fisso, una
+    richiesta identica torna i byte già renderizzati.
+    """
+    bufs = {fmt: io.BytesIO() for fmt in ("wav", "flac", "mp3") if fmt in out_formats}
+    render_stream(
+        audio_bytes, filename, bufs, eq_gain_dx, eq_gain_sx, preset_params,
+        limiter_peak_dbfs=limiter_peak_dbfs, mp3_bitrate=mp3_bitrate,
+        max_seconds=max_seconds, seed=seed, on_progress=on_progress, cache=cache,
+    )
+    return {fmt: b.getvalue() for fmt, b in bufs.items()}
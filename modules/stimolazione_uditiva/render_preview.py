@@ -1,14 +1,15 @@
 # modules/stimolazione_uditiva/render_preview.py
 from __future__ import annotations
 
-import io, wave, random, json
+import io, wave, json
 import numpy as np
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Optional, Tuple
 
 from .audio_dsp import (
-    biquad_peaking, biquad_bandpass, apply_cascade, db_to_lin, soft_limiter
+    biquad_peaking, apply_cascade, soft_limiter
 )
 from .db_orl import FREQS_STD
+from .gate_schedule import GateBandpass, build_gate_schedule
 
 def _read_wav_bytes(data: bytes, max_seconds: float = 30.0) -> Tuple[np.ndarray, int]:
     """
@@ -36,68 +37,6 @@ def _read_wav_bytes(data: bytes, max_seconds: float = 30.0) -> Tuple[np.ndarray,
         raise ValueError("Supporto solo mono o stereo.")
     return x, fs
 
-def _envelope(params: Dict[str, Any], total_samples: int, fs: int) -> np.ndarray:
-    lam = float(params.get("lambda_events_per_sec", 5.0))
-
-    open_min = float(params["open_state"]["duration_ms"]["min"]) / 1000.0
-    open_max = float(params["open_state"]["duration_ms"]["max"]) / 1000.0
-    att_min  = float(params["open_state"]["attack_ms"]["min"]) / 1000.0
-    att_max  = float(params["open_state"]["attack_ms"]["max"]) / 1000.0
-
-    ref_min  = float(params["closed_state"]["refractory_ms"]["min"]) / 1000.0
-    ref_max  = float(params["closed_state"]["refractory_ms"]["max"]) / 1000.0
-
-    closed_att_db = float(params["mix"].get("closed_wet_attenuation_db", -10.0))
-    closed_wet = db_to_lin(closed_att_db)
-
-    env = np.full((total_samples,), closed_wet, dtype=np.float32)
-
-    t = 0.0
-    while True:
-        dt = random.expovariate(lam) if lam > 0 else 1e9
-        t += dt
-        if int(t*fs) >= total_samples:
-            break
-
-        dur = random.uniform(open_min, open_max)
-        att = random.uniform(att_min, att_max)
-        ref = random.uniform(ref_min, ref_max)
-
-        start = int(t*fs)
-        end = min(total_samples, int((t+dur)*fs))
-        if end <= start:
-            continue
-
-        att_n = max(1, int(att*fs))
-        ramp_end = min(end, start+att_n)
-        if ramp_end > start:
-            ramp = np.linspace(closed_wet, 1.0, ramp_end-start, dtype=np.float32)
-            env[start:ramp_end] = np.maximum(env[start:ramp_end], ramp)
-        if end > ramp_end:
-            env[ramp_end:end] = 1.0
-
-        t = t + dur + ref
-
-    return env
-
-def _choose_band(params: Dict[str, Any]) -> Tuple[float,float]:
-    bands = params["bands"]
-    choices = [
-        ("low",  float(bands["low"]["weight"])),
-        ("mid",  float(bands["mid"]["weight"])),
-        ("high", float(bands["high"]["weight"])),
-    ]
-    r = random.random() * sum(w for _,w in choices)
-    acc = 0.0
-    band_name = "mid"
-    for name, w in choices:
-        acc += w
-        if r <= acc:
-            band_name = name
-            break
-    b = bands[band_name]
-    return float(b["min_hz"]), float(b["max_hz"])
-
 def _build_eq_filters(fs: int, gains: Dict[int, float], q: float = 1.0):
     filters = []
     for f in FREQS_STD:
@@ -113,7 +52,22 @@ def render_preview_wav(
     eq_gain_sx: Dict[int, float],
     preset_params: Dict[str, Any],
     seconds: float = 30.0,
+    seed: Optional[int] = None,
+    cache=None,
 ) -> Tuple[bytes, int]:
+    # render cache (seed fisso): stessa preview già calcolata -> byte dalla cache
+    key = None
+    if cache is not None and seed is not None:
+        from .render_cache import input_digest, render_key
+        key = render_key(
+            input_digest(wav_bytes), "preview", "wav", eq_dx=eq_gain_dx, eq_sx=eq_gain_sx,
+            params=preset_params, seed=int(seed), seconds=float(seconds),
+        )
+        hit = cache.get_bytes(key, "wav")
+        if hit is not None:
+            with wave.open(io.BytesIO(hit), "rb") as wf:
+                return hit, wf.getframerate()
+
     x, fs = _read_wav_bytes(wav_bytes, max_seconds=seconds)
     n = x.shape[0]
 
@@ -125,37 +79,11 @@ def render_preview_wav(
     xR = apply_cascade(x[:,1], eqR)
     dry = np.stack([xL, xR], axis=1)
 
-    env = _envelope(preset_params, total_samples=n, fs=fs)
-
-    q_closed = float(preset_params["closed_state"]["q"].get("value", 2.8))
-    center_closed = float(preset_params["closed_state"]["center_hz"].get("value", 1000.0))
-
-    block = 1024
-    wet = np.zeros_like(dry, dtype=np.float32)
-
-    bpL = biquad_bandpass(fs, center_closed, q_closed)
-    bpR = biquad_bandpass(fs, center_closed, q_closed)
-
-    i = 0
-    while i < n:
-        j = min(n, i+block)
-        e_mean = float(env[i:j].mean())
-        if e_mean > 0.75:
-            fmin,fmax = _choose_band(preset_params)
-            center = random.uniform(fmin, fmax)
-            q = random.uniform(float(preset_params["open_state"]["q"]["min"]), float(preset_params["open_state"]["q"]["max"]))
-            bpL = biquad_bandpass(fs, center, q)
-            bpR = biquad_bandpass(fs, center, q)
-        else:
-            bpL = biquad_bandpass(fs, center_closed, q_closed)
-            bpR = biquad_bandpass(fs, center_closed, q_closed)
-
-        wet[i:j,0] = bpL.process(dry[i:j,0])
-        wet[i:j,1] = bpR.process(dry[i:j,1])
-        i = j
+    # stesso calendario di gating del render finale (a parità di seed)
+    sched = build_gate_schedule(preset_params, n, fs, seed=seed)
+    wet = GateBandpass(sched, fs).process(dry, 0) * sched.envelope()[:,None]
 
     wet_mix = float(preset_params["mix"].get("wet_mix", 0.9))
-    wet = wet * env[:,None]
 
     out = dry*(1.0-wet_mix) + wet*wet_mix
 
@@ -186,4 +114,6 @@ def render_preview_wav(
         wf.setsampwidth(2)
         wf.setframerate(fs)
         wf.writeframes(pcm16.tobytes())
+    if key is not None:
+        cache.put_bytes(key, "wav", bio.getvalue())
     return bio.getvalue(), fs
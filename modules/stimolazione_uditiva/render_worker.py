@@ -0,0 +1,206 @@
+# modules/stimolazione_uditiva/render_worker.py
+"""
+Worker della coda render_jobs: prende i job queued, li renderizza con
+render_stream su file temporanei (memoria costante anche per brani di
+un'ora) fuori da Streamlit e salva gli output a blocchi (blob store o
+render_job_file_parti, vedi db_jobs.save_job_file_stream).
+
+Il ciclo (run_worker) è pensato per girare in un processo dedicato
+(scripts/render_worker.py ne avvia N in parallelo): claim con
+FOR UPDATE SKIP LOCKED, progress scritto in render_jobs al massimo ogni
+PROGRESS_EVERY_S secondi (fa anche da heartbeat), errore registrato sul
+job senza fermare il worker. Job identici (stesso audio, EQ, preset, seed e
+formato) escono dalla render cache condivisa senza rifare il DSP.
+
+Input:
+  - input_kind='upload'       -> file salvato dalla UI in render_job_files (role='input')
+  - input_kind='dropbox_path' -> percorso relativo sotto STIMOLAZIONE_INPUT_DIR
+                                 (cartella Dropbox sincronizzata sul server del worker)
+"""
+from __future__ import annotations
+
+import copy
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from .db_eq import read_eq_profile
+from .db_jobs import (
+    apri_job_file, claim_next_render_job, fail_render_job, finish_render_job,
+    read_tomatis_preset, save_job_file_stream, update_job_progress,
+)
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY_S = 2.0
+# quota del progress riservata al DSP; il resto è export + salvataggio
+_QUOTA_RENDER = 90.0
+
+
+def job_render_params(preset_params: Dict[str, Any], job_params: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[int]]:
+    """Preset + override rapidi del JOB (dominanza, bias, ratio, minuti) -> (params, seed)."""
+    params = copy.deepcopy(preset_params or {})
+    jp = job_params or {}
+    lb = params.setdefault("lateral_bias", {})
+    if jp.get("dominant_side") in ("DX", "SX"):
+        lb["dominant_side"] = jp["dominant_side"]
+    if jp.get("bias_mode") in ("fixed", "alternate"):
+        lb["mode"] = jp["bias_mode"]
+    for k in ("ratio", "alternate_minutes"):
+        if jp.get(k) is not None:
+            lb[k] = float(jp[k])
+    seed = jp.get("gate_seed")
+    return params, (int(seed) if seed is not None else None)
+
+
+def load_job_input(conn, job: Dict[str, Any], workdir: Optional[str] = None) -> Tuple[Union[bytes, str], str]:
+    """(sorgente, filename) dell'audio del job: percorso per i file su disco
+    (letti poi a blocchi da render_stream). Gli upload vengono copiati a
+    blocchi in `workdir` se indicata, altrimenti restituiti come bytes."""
+    kind = job.get("input_kind")
+    ref = str(job.get("input_ref") or "")
+    if kind == "upload":
+        f = apri_job_file(conn, int(job["id"]), "input", "src")
+        if f is None:
+            raise ValueError("File caricato non trovato per questo JOB (ricrealo dalla UI).")
+        name, fh = f
+        name = name or ref
+        try:
+            if workdir is None:
+                return fh.read(), name
+            ext = os.path.splitext(name)[1]
+            path = os.path.join(workdir, f"input{ext}")
+            with open(path, "wb") as out:
+                shutil.copyfileobj(fh, out, 1 << 20)
+            return path, name
+        finally:
+            fh.close()
+    if kind == "dropbox_path":
+        root = (os.getenv("STIMOLAZIONE_INPUT_DIR") or "").strip()
+        if not root:
+            raise ValueError("dropbox_path non risolvibile: imposta STIMOLAZIONE_INPUT_DIR sul worker.")
+        root = os.path.realpath(root)
+        path = os.path.realpath(os.path.join(root, ref.lstrip("/\\")))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"Percorso fuori da STIMOLAZIONE_INPUT_DIR: {ref}")
+        if not os.path.isfile(path):
+            raise ValueError(f"File non trovato: {ref}")
+        return path, os.path.basename(path)
+    raise ValueError(f"input_kind non supportato: {kind}")
+
+
+def process_render_job(conn, job: Dict[str, Any], *, progress_every_s: float = PROGRESS_EVERY_S) -> str:
+    """Renderizza un job già preso in carico. Ritorna output_ref."""
+    from .render_cache import get_render_cache
+    from .render_final import render_stream
+
+    jid = int(job["id"])
+    eq = read_eq_profile(conn, int(job["eq_profile_id"]))
+    if not eq:
+        raise ValueError(f"EQ profile {job['eq_profile_id']} non trovato.")
+    _, _eq_params, gain_dx, gain_sx = eq
+    pres = read_tomatis_preset(conn, int(job["preset_id"]))
+    if not pres:
+        raise ValueError(f"Preset Tomatis {job['preset_id']} non trovato.")
+    _pname, preset_params = pres
+
+    jp = job.get("params_json") or {}
+    params, seed = job_render_params(preset_params, jp)
+    formats = tuple(jp.get("out_formats") or ("wav",))
+
+    ultimo = [time.monotonic()]
+
+    def _progress(frac: float) -> None:
+        now = time.monotonic()
+        if now - ultimo[0] >= progress_every_s:
+            ultimo[0] = now
+            update_job_progress(conn, jid, frac * _QUOTA_RENDER)
+
+    base = f"stim_paz{job['paziente_id']}_job{jid}"
+    with tempfile.TemporaryDirectory(prefix="render_job_") as td:
+        src, filename = load_job_input(conn, job, workdir=td)
+        # render in streaming su file temporanei: memoria limitata dal blocco
+        paths = {fmt: os.path.join(td, f"{base}.{fmt}") for fmt in formats}
+        render_stream(
+            src, filename, paths, gain_dx, gain_sx, params,
+            limiter_peak_dbfs=float(params.get("safety", {}).get("limiter_peak_dbfs", -1.0)),
+            seed=seed,
+            on_progress=_progress,
+            cache=get_render_cache(),
+        )
+        update_job_progress(conn, jid, _QUOTA_RENDER)
+
+        # anche il salvataggio è a blocchi (blob store o render_job_file_parti)
+        for fmt, path in paths.items():
+            with open(path, "rb") as fh:
+                save_job_file_stream(conn, jid, "output", fmt, fh, filename=os.path.basename(path))
+    return f"db:render_job_files/{jid}:" + ",".join(sorted(paths))
+
+
+def run_worker(
+    connect: Callable[[], Any],
+    worker: str,
+    *,
+    once: bool = False,
+    poll_s: float = 5.0,
+    should_stop: Callable[[], bool] = lambda: False,
+) -> Dict[str, int]:
+    """Svuota la coda finché should_stop() è falso.
+
+    once=True: esce appena la coda è vuota. Una connessione persa viene
+    riaperta con connect() al giro successivo. Ritorna {"done", "error"}.
+    """
+    stats = {"done": 0, "error": 0}
+    conn = None
+    while not should_stop():
+        try:
+            if conn is None:
+                conn = connect()
+            job = claim_next_render_job(conn, worker)
+        except Exception as e:
+            logger.warning("[%s] coda non raggiungibile: %s", worker, e)
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+            conn = None
+            time.sleep(poll_s)
+            continue
+
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_s)
+            continue
+
+        jid = int(job["id"])
+        t0 = time.perf_counter()
+        logger.info("[%s] job %s: avvio (%s %s)", worker, jid, job.get("input_kind"), job.get("input_ref"))
+        try:
+            ref = process_render_job(conn, job)
+            finish_render_job(conn, jid, ref)
+            stats["done"] += 1
+            logger.info("[%s] job %s: completato in %.1f s -> %s", worker, jid, time.perf_counter() - t0, ref)
+        except Exception as e:
+            stats["error"] += 1
+            logger.error("[%s] job %s: errore %s: %s", worker, jid, type(e).__name__, e)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            try:
+                fail_render_job(conn, jid, f"{type(e).__name__}: {e}")
+            except Exception:
+                # connessione persa: il job resta running e requeue_stale_jobs lo rimette in coda
+                conn = None
+
+    try:
+        if conn is not None:
+            conn.close()
+    except Exception:
+        pass
+    return stats
@@ -4,7 +4,10 @@ import streamlit as st
 
 from .schema import ensure_audio_schema
 from .db_eq import list_eq_profiles
-from .db_jobs import ensure_jobs_schema, seed_tomatis_presets, list_tomatis_presets, create_render_job, list_render_jobs
+from .db_jobs import (
+    ensure_jobs_schema, seed_tomatis_presets, list_tomatis_presets, create_render_job, list_render_jobs,
+    read_job_file, list_job_outputs, job_file_url,
+)
 
 def ui_generatore_stimolazione(get_conn, paziente_selector_fn):
     st.header("🎧 Genera stimolazione (JOB) — EQ + Preset Tomatis")
@@ -62,13 +65,13 @@ def ui_generatore_stimolazione(get_conn, paziente_selector_fn):
     input_kind = st.radio("Tipo input", options=["Upload (piccolo)", "Dropbox path (testuale)"], horizontal=True)
 
     input_ref = None
+    up = None
     if input_kind == "Upload (piccolo)":
         up = st.file_uploader("Carica WAV/MP3/OGG (consigliato < 50 MB per TEST)", type=["wav","mp3","ogg"])
         if up is not None:
-            # per ora NON salviamo file sul server (Streamlit effimero).
-            # creiamo JOB con filename: in Step B2 decideremo dove persist.
+            # il file viene salvato col JOB (render_job_files): lo renderizza il worker
             input_ref = up.name
-            st.info("Nota: in questa fase il file non viene renderizzato. Creiamo solo il JOB (queued).")
+            st.info("Il render avviene in background (scripts/render_worker.py): puoi chiudere la pagina.")
     else:
         input_ref = st.text_input("Dropbox path (es. /INBOX/brano.wav)", value="")
 
@@ -84,13 +87,23 @@ def ui_generatore_stimolazione(get_conn, paziente_selector_fn):
         ratio = st.slider("Ratio dominante", min_value=0.50, max_value=0.90, value=0.70, step=0.05)
 
     alt_minutes = st.number_input("Switch minuti (se alternate)", value=2.5, step=0.5)
+    out_formats = st.multiselect(
+        "Formati output", ["wav", "flac", "mp3"], default=["wav"],
+        help="FLAC/MP3 richiedono soundfile/pydub o ffmpeg sul worker.",
+    ) or ["wav"]
+    gate_seed = int(st.number_input(
+        "Seed gating", min_value=0, value=1, step=1,
+        help="Stesso seed = stessi eventi di gating nella preview e nel render finale.",
+    ))
 
     params = {
         "dominant_side": dominant_side,
         "bias_mode": bias_mode,
         "ratio": float(ratio),
         "alternate_minutes": float(alt_minutes),
-        "note": "JOB creato da UI_generatore_stimolazione (Step B1, no render)",
+        "gate_seed": gate_seed,
+        "out_formats": out_formats,
+        "note": "JOB creato da UI_generatore_stimolazione",
     }
 
     can_create = bool(input_ref) and eq_profile_id and preset_id
@@ -105,6 +118,7 @@ def ui_generatore_stimolazione(get_conn, paziente_selector_fn):
             input_kind=kind,
             input_ref=str(input_ref),
             params=params,
+            input_file=(up.name, up.getvalue()) if up is not None else None,
         )
         st.success(f"JOB creato! id = {jid} (status = queued)")
 
@@ -129,6 +143,7 @@ def ui_generatore_stimolazione(get_conn, paziente_selector_fn):
         try:
             from .db_eq import read_eq_profile
             from .db_jobs import read_tomatis_preset
+            from .render_cache import get_render_cache
             from .render_preview import render_preview_wav
         except Exception as e:
             st.error("Manca qualche file della patch B2 (render_preview/db_eq/db_jobs).")
@@ -151,6 +166,8 @@ def ui_generatore_stimolazione(get_conn, paziente_selector_fn):
                             eq_gain_sx=gain_sx,
                             preset_params=preset_params,
                             seconds=float(prev_secs),
+                            seed=gate_seed,
+                            cache=get_render_cache(),
                         )
                         st.success("Preview pronta!")
                         st.audio(out_bytes, format="audio/wav")
@@ -187,3 +204,24 @@ def ui_generatore_stimolazione(get_conn, paziente_selector_fn):
             use_container_width=True,
             hide_index=True,
         )
+
+        pronti = [r for r in jobs if r[2] == "done"]
+        if pronti:
+            sel_job = st.selectbox(
+                "Scarica output",
+                options=pronti,
+                format_func=lambda r: f"JOB {r[0]} • {r[5]}",
+            )
+            for fmt, fname in list_job_outputs(conn, int(sel_job[0])):
+                url = job_file_url(conn, int(sel_job[0]), "output", fmt)
+                if url:
+                    st.link_button(f"⬇️ {fname}", url)
+                    continue
+                f = read_job_file(conn, int(sel_job[0]), "output", fmt)
+                if f is not None:
+                    st.download_button(
+                        f"⬇️ {fname}",
+                        data=f[1],
+                        file_name=fname,
+                        key=f"dl_job_{sel_job[0]}_{fmt}",
+                    )
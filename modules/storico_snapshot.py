@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot incrementale dello storico paziente (Assistente PNEV, diagnosi
+assistita, apprendimento).
+
+Prima _riassunto_storico lanciava ~12 SELECT * (documenti, Getman,
+Groffman, valutazioni, anamnesi, esiti, logopedia, terapia) a ogni rerun di
+ogni schermata di test. Qui lo storico è diviso in SEZIONI (una per
+tabella), ciascuna con:
+  - le righe di testo già pronte (il testo finale è la loro concatenazione,
+    identica a quella di prima);
+  - un numero di versione, incrementato da un trigger AFTER INSERT/UPDATE/
+    DELETE sulla tabella per il paziente toccato (tabella storico_versioni).
+
+storico_snapshot(conn, paz_id) legge tutte le versioni del paziente con UNA
+query e rilegge solo le sezioni cambiate (insieme, con la UNION proiettata di
+quadro_storico.carica_timeline); le altre vengono dalla cache di processo,
+per (studio, paziente). Tabella versioni, funzione e trigger li crea il passo
+di migrazione crea_trigger_storico (init_db), mai il rendering. Le sezioni
+senza trigger (tabella creata dopo il passo, permessi mancanti, database
+senza plpgsql) non sono versionate e si rileggono ogni volta: si torna al
+comportamento di prima, mai a uno storico vecchio.
+
+Usage:
+    snap = storico_snapshot(conn, paz_id)
+    snap.testo                  # come il vecchio _riassunto_storico
+    snap.sezioni["esiti_pnev"]  # {"titolo", "righe", "n", "versione", "letto"}
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from .quadro_storico import _query, _data_di, _fmt, carica_timeline
+except Exception:
+    carica_timeline = None
+    def _query(conn, sql, params=()):
+        try:
+            cur = conn.cursor(); cur.execute(sql, params)
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, r)) for r in cur.fetchall()]
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            return None
+    def _data_di(d):
+        for k in ("data", "data_valutazione", "data_anamnesi", "creato"):
+            if d.get(k):
+                return d[k]
+        return None
+    def _fmt(dt):
+        try:
+            return dt.strftime("%d/%m/%Y")
+        except Exception:
+            return str(dt) if dt else ""
+
+
+# ══════════════════════════════════════════════════════════ sezioni
+
+def _per_data(rows):
+    return sorted(rows, key=lambda x: str(_data_di(x)), reverse=True)
+
+
+def _data_seduta(r) -> str:
+    d = r.get("data_seduta")
+    return d.strftime("%d/%m/%Y") if hasattr(d, "strftime") else str(d or "")
+
+
+def _documenti(rows):
+    out = ["DOCUMENTI CLINICI:"]
+    for d in _per_data(rows):
+        riga = f"- {d.get('tipo','Documento')} ({_fmt(_data_di(d))})"
+        if d.get("estratto"):
+            riga += "\n  Dati estratti: " + " ".join(str(d["estratto"]).split())
+        out.append(riga)
+    return out
+
+
+def _getman(rows):
+    out = ["\nGETMAN (manipolazione visiva):"]
+    for r in _per_data(rows):
+        out.append(f"- {_fmt(_data_di(r))}: punteggio {r.get('punteggio','?')}/12"
+                   + (f", classe {r.get('classe')}" if r.get('classe') else ""))
+    return out
+
+
+def _groffman(rows):
+    out = ["\nGROFFMAN (visual tracing):"]
+    for r in _per_data(rows):
+        out.append(f"- {_fmt(_data_di(r))}: punteggio {r.get('punteggio','?')}"
+                   + (f", tavola {r.get('forma')}" if r.get('forma') else "")
+                   + (f", osservazioni: {r.get('osservazioni')}" if r.get('osservazioni') else ""))
+    return out
+
+
+def _valutazioni_visive(rows):
+    out = ["\nVALUTAZIONI VISUO-PERCETTIVE:"]
+    for r in _per_data(rows):
+        out.append(f"- valutazione del {_fmt(_data_di(r))}")
+    return out
+
+
+def _anamnesi(rows):
+    out = ["\nVALUTAZIONI PNEV / ANAMNESI:"]
+    for r in _per_data(rows):
+        txt = (r.get("pnev_summary") or r.get("Motivo") or "").strip()
+        out.append(f"- {_fmt(_data_di(r))}: {txt}" if txt else f"- {_fmt(_data_di(r))}")
+    return out
+
+
+def _esiti(rows):
+    out = ["\nESITI / FOLLOW-UP (cosa ha funzionato o no — IMPORTANTE):"]
+    for r in _per_data(rows):
+        riga = f"- {_fmt(_data_di(r))}: {r.get('intervento','')} → {r.get('esito','')}"
+        if r.get("note"):
+            riga += f" ({r['note']})"
+        out.append(riga)
+    return out
+
+
+def _logopedia_valutazioni(rows):
+    out = ["\nLOGOPEDIA / SMOF:"]
+    for r in _per_data(rows):
+        riga = f"- {_fmt(_data_di(r))}"
+        if r.get("sintesi"):
+            riga += f": {r['sintesi']}"
+        out.append(riga)
+    return out
+
+
+def _logopedia_sedute(rows):
+    out = ["\nSEDUTE LOGOPEDICHE (diario):"]
+    for r in sorted(rows, key=lambda x: str(x.get("data_seduta")), reverse=True)[:12]:
+        riga = f"- n°{r.get('numero','?')} {_data_seduta(r)}: {r.get('obiettivo','')}"
+        if r.get("risposta"):
+            riga += f" (risposta {r['risposta']})"
+        out.append(riga)
+    return out
+
+
+def _logopedia_obiettivi(rows):
+    out = ["\nOBIETTIVI LOGOPEDICI (con avanzamento):"]
+    for r in rows:
+        out.append(f"- {r.get('descrizione','')} [{r.get('area','')}]: "
+                   f"{r.get('stato','')} {r.get('attuale','?')}/{r.get('target','?')} "
+                   f"(partenza {r.get('baseline','?')})")
+    return out
+
+
+def _terapia_sedute(rows):
+    per_ter = {}
+    for r in rows:
+        per_ter.setdefault(r.get("terapia", "—"), []).append(r)
+    out = ["\nPERCORSI TERAPEUTICI:"]
+    for ter, righe in per_ter.items():
+        out.append(f"- {ter}: {len(righe)} sedute")
+        for r in sorted(righe, key=lambda d: str(d.get("data_seduta")), reverse=True)[:6]:
+            out.append(f"   · {_data_seduta(r)}: {r.get('obiettivo','')} ({r.get('risposta','')})")
+    return out
+
+
+def _terapia_obiettivi(rows):
+    out = ["\nOBIETTIVI TERAPEUTICI (con avanzamento):"]
+    for r in rows:
+        out.append(f"- {r.get('descrizione','')} [{r.get('terapia','')}]: "
+                   f"{r.get('stato','')} {r.get('attuale','?')}/{r.get('target','?')}")
+    return out
+
+
+def _terapia_programma(rows):
+    per_appr = {}
+    for r in rows:
+        per_appr.setdefault(r.get("approccio", "—"), []).append(r)
+    out = ["\nPROGRAMMA PNEV (procedure in corso):"]
+    for appr, lista in per_appr.items():
+        out.append(f"- {appr}:")
+        for r in lista:
+            step = f"{r.get('step')} " if r.get("step") and r["step"] != "—" else ""
+            out.append(f"   · {step}{r.get('nome','')} — {r.get('stato','')}")
+    return out
+
+
+# (tabella, formattatore) nell'ordine del testo; la tabella è anche il nome
+# della sezione e l'argomento del trigger
+SEZIONI: Tuple[Tuple[str, Callable[[List[dict]], List[str]]], ...] = (
+    ("documenti_clinici", _documenti),
+    ("getman_risultati", _getman),
+    ("groffman_risultati", _groffman),
+    ("valutazioni_visive", _valutazioni_visive),
+    ("anamnesi", _anamnesi),
+    ("esiti_pnev", _esiti),
+    ("logopedia_valutazioni", _logopedia_valutazioni),
+    ("logopedia_sedute", _logopedia_sedute),
+    ("logopedia_obiettivi", _logopedia_obiettivi),
+    ("terapia_sedute", _terapia_sedute),
+    ("terapia_obiettivi", _terapia_obiettivi),
+    ("terapia_programma", _terapia_programma),
+)
+_TABELLE = tuple(t for t, _f in SEZIONI)
+
+
+def _leggi_righe(conn, paz_id, tabelle: List[str]) -> Dict[str, Optional[List[dict]]]:
+    """Righe delle sezioni da rileggere: una sola query con le proiezioni di
+    quadro_storico (niente BYTEA/JSON), o SELECT * se non disponibili."""
+    if carica_timeline is not None:
+        return carica_timeline(conn, paz_id, tabelle)
+    return {t: _query(conn, f"SELECT * FROM {t} WHERE paziente_id=%s", (paz_id,)) for t in tabelle}
+
+
+def _sezione(rows, formatta) -> Dict[str, Any]:
+    righe = formatta(rows) if rows else []
+    return {
+        "titolo": righe[0].strip().rstrip(":") if righe else "",
+        "righe": righe,
+        "n": len(rows or []),
+    }
+
+
+# ══════════════════════════════════════════════════════════ versioni (trigger)
+
+_SQL_INFRA = (
+    """
+    CREATE TABLE IF NOT EXISTS storico_versioni (
+        paziente_id  BIGINT NOT NULL,
+        sezione      TEXT   NOT NULL,
+        versione     BIGINT NOT NULL DEFAULT 1,
+        aggiornato   TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (paziente_id, sezione)
+    );
+    """,
+    # un errore qui non deve MAI far fallire la scrittura clinica che lo ha
+    # scatenato: finisce nel log del server (RAISE WARNING) e la sezione in
+    # cache resta vecchia al massimo _MAX_ETA_S secondi
+    """
+    CREATE OR REPLACE FUNCTION storico_versioni_bump() RETURNS TRIGGER AS $$
+    DECLARE
+        pid_new BIGINT;
+        pid_old BIGINT;
+    BEGIN
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN pid_new := NEW.paziente_id; END IF;
+            IF TG_OP <> 'INSERT' THEN pid_old := OLD.paziente_id; END IF;
+            INSERT INTO storico_versioni AS v (paziente_id, sezione)
+            SELECT DISTINCT p, TG_ARGV[0] FROM unnest(ARRAY[pid_new, pid_old]) p
+            WHERE p IS NOT NULL
+            ON CONFLICT (paziente_id, sezione)
+            DO UPDATE SET versione = v.versione + 1, aggiornato = now();
+        EXCEPTION WHEN OTHERS THEN
+            RAISE WARNING 'storico_versioni_bump(%): % (%)', TG_ARGV[0], SQLERRM, SQLSTATE;
+        END;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+)
+
+_TRIGGER_CHECK_S = 60.0   # ogni quanto rileggere da pg_trigger le tabelle versionate
+_MAX_ETA_S = 600.0        # rete di sicurezza: sezioni in cache rilette comunque dopo 10'
+
+_infra_lock = threading.Lock()
+_con_trigger: frozenset = frozenset()
+_ultimo_check = 0.0
+
+
+def crea_trigger_storico(conn) -> None:
+    """Passo di migrazione (vedi init_db / modules.schema_migrations): tabella
+    versioni, funzione e trigger sulle tabelle delle sezioni già esistenti.
+    Le DDL non girano mai dal percorso di rendering. Una tabella creata dopo
+    il passo resta senza trigger (sezione riletta ogni volta, mai vecchia)
+    finché il passo non viene rieseguito."""
+    cur = conn.cursor()
+    try:
+        for sql in _SQL_INFRA:
+            cur.execute(sql)
+        cur.execute(
+            "SELECT t FROM unnest(%s::text[]) t WHERE to_regclass(t) IS NOT NULL",
+            (list(_TABELLE),),
+        )
+        esistenti = [r[0] for r in cur.fetchall()]
+        for t in esistenti:
+            trg = f"trg_storico_{t}"
+            cur.execute(f"DROP TRIGGER IF EXISTS {trg} ON {t}")
+            cur.execute(
+                f"CREATE TRIGGER {trg} AFTER INSERT OR UPDATE OR DELETE ON {t} "
+                f"FOR EACH ROW EXECUTE FUNCTION storico_versioni_bump('{t}')"
+            )
+        conn.commit()
+    except Exception:
+        try: conn.rollback()
+        except Exception: pass
+        raise
+    finally:
+        try: cur.close()
+        except Exception: pass
+
+
+def _tabelle_versionate(conn) -> frozenset:
+    """Tabelle delle sezioni con il trigger installato (sola lettura del
+    catalogo, ricontrollata ogni _TRIGGER_CHECK_S secondi)."""
+    global _con_trigger, _ultimo_check
+    with _infra_lock:
+        if time.time() - _ultimo_check < _TRIGGER_CHECK_S:
+            return _con_trigger
+    rows = _query(
+        conn,
+        "SELECT c.relname AS t FROM pg_trigger g JOIN pg_class c ON c.oid = g.tgrelid "
+        "WHERE g.tgname = ANY(%s) AND pg_table_is_visible(c.oid) "
+        "AND to_regclass('storico_versioni') IS NOT NULL",
+        ([f"trg_storico_{t}" for t in _TABELLE],),
+    )
+    with _infra_lock:
+        if rows is not None:
+            _con_trigger = frozenset(r["t"] for r in rows if r["t"] in _TABELLE)
+        _ultimo_check = time.time()
+        return _con_trigger
+
+
+def _versioni(conn, paz_id) -> Dict[str, int]:
+    rows = _query(
+        conn, "SELECT sezione, versione FROM storico_versioni WHERE paziente_id=%s", (paz_id,),
+    ) or []
+    return {r["sezione"]: int(r["versione"]) for r in rows}
+
+
+# ══════════════════════════════════════════════════════════ snapshot
+
+@dataclass
+class StoricoSnapshot:
+    paziente_id: Any
+    sezioni: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    testo: str = ""
+    letture: int = 0            # sezioni rilette dal DB nell'ultimo aggiornamento
+
+    def vuoto(self) -> bool:
+        return not self.testo
+
+
+_MAX_PAZIENTI = 64
+
+_lock = threading.Lock()
+_cache: "OrderedDict[Tuple[int, Any], StoricoSnapshot]" = OrderedDict()   # (studio, paziente)
+
+
+def _componi(sezioni: Dict[str, Dict[str, Any]]) -> str:
+    parti: List[str] = []
+    for tabella, _f in SEZIONI:
+        s = sezioni.get(tabella)
+        if s:
+            parti.extend(s["righe"])
+    return "\n".join(parti).strip()
+
+
+def _studio_id() -> int:
+    try:
+        import streamlit as st
+        return int(st.session_state.get("studio_id", 1) or 1)
+    except Exception:
+        return 1
+
+
+def storico_snapshot(conn, paz_id) -> StoricoSnapshot:
+    """Snapshot aggiornato dello storico: rilegge solo le sezioni la cui
+    versione è cambiata (o non versionate) rispetto alla copia in cache."""
+    versionate = _tabelle_versionate(conn)
+    key = (_studio_id(), paz_id)
+    # versioni PRIMA delle letture: una scrittura concorrente fa salire la
+    # versione e la sezione viene riletta alla richiesta successiva
+    versioni = _versioni(conn, paz_id) if versionate else {}
+
+    with _lock:
+        vecchio = _cache.get(key)
+        if vecchio is not None:
+            _cache.move_to_end(key)
+    sezioni: Dict[str, Dict[str, Any]] = {}
+    da_leggere: List[str] = []
+    ora = time.time()
+    for tabella, _f in SEZIONI:
+        v = versioni.get(tabella, 0) if tabella in versionate else None
+        prima = vecchio.sezioni.get(tabella) if vecchio is not None else None
+        if (prima is not None and v is not None and prima["versione"] == v
+                and ora - prima["letto"] < _MAX_ETA_S):
+            sezioni[tabella] = prima
+        else:
+            da_leggere.append(tabella)
+
+    letture = len(da_leggere)
+    if da_leggere:
+        righe = _leggi_righe(conn, paz_id, da_leggere)
+        for tabella, formatta in SEZIONI:
+            if tabella in righe:
+                s = _sezione(righe[tabella], formatta)
+                s["versione"] = versioni.get(tabella, 0) if tabella in versionate else None
+                s["letto"] = ora
+                sezioni[tabella] = s
+
+    if vecchio is not None and letture == 0:
+        vecchio.letture = 0
+        return vecchio
+    snap = StoricoSnapshot(paziente_id=paz_id, sezioni=sezioni, testo=_componi(sezioni), letture=letture)
+    with _lock:
+        _cache[key] = snap
+        _cache.move_to_end(key)
+        while len(_cache) > _MAX_PAZIENTI:
+            _cache.popitem(last=False)
+    return snap
+
+
+def storico_in_cache(paz_id) -> Optional[StoricoSnapshot]:
+    """Ultimo snapshot già costruito (senza query) per lo studio corrente, o None."""
+    with _lock:
+        return _cache.get((_studio_id(), paz_id))
+
+
+def invalida_storico(paz_id=None) -> None:
+    """Scarta lo snapshot di un paziente (in tutti gli studi) o tutti: per
+    scritture che non passano dai trigger."""
+    with _lock:
+        if paz_id is None:
+            _cache.clear()
+        else:
+            for k in [k for k in _cache if k[1] == paz_id]:
+                del _cache[k]
@@ -19,6 +19,8 @@ import datetime
 import io
 import streamlit as st
 
+from .riepilogo_paziente import invalida_riepilogo_paziente
+
 _DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
 
@@ -535,6 +537,7 @@ def _salva_seduta(conn, paz_id, terapia, data_s, numero, prof, ob, att, risp,
             conn.commit()
         except Exception:
             conn.rollback()  # se Sedute ha schema diverso, non blocco il salvataggio
+        invalida_riepilogo_paziente(paz_id)
         return True
     except Exception:
         try:
@@ -628,6 +631,7 @@ def _elenco_sedute(conn, paz_id, terapia):
                 if st.button("💾 Salva modifiche", key=f"ter_ed_save_{rid}", type="primary"):
                     if _aggiorna_seduta(conn, rid, n_data, n_num, n_prof, n_ob, n_att,
                                         n_risp, n_costo, n_sconto, n_inc, n_met, n_note):
+                        invalida_riepilogo_paziente(paz_id)
                         st.success("Seduta aggiornata.")
                         st.rerun()
                     else:
@@ -638,6 +642,7 @@ def _elenco_sedute(conn, paz_id, terapia):
                         cur = conn.cursor()
                         cur.execute("DELETE FROM terapia_sedute WHERE id=%s", (rid,))
                         conn.commit()
+                        invalida_riepilogo_paziente(paz_id)
                         st.rerun()
                     except Exception:
                         try:
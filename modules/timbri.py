@@ -7,6 +7,14 @@ delle relazioni cliniche che genera.
 import io
 import streamlit as st
 
+try:
+    from .blob_store import conserva, risolvi
+except Exception:
+    def conserva(data, store=None):
+        return data
+    def risolvi(v, store=None):
+        return bytes(v) if v is not None else None
+
 
 def _ensure_schema(conn):
     try:
@@ -63,7 +71,7 @@ def carica_timbro(conn, username: str):
                     (username,))
         r = cur.fetchone()
         if r and r[0]:
-            return bytes(r[0])
+            return risolvi(r[0])
     except Exception:
         try:
             conn.rollback()
@@ -77,7 +85,7 @@ def salva_timbro(conn, username: str, dati_immagine: bytes) -> bool:
         return False
     try:
         _ensure_schema(conn)
-        png = _to_transparent_png(dati_immagine)
+        png = conserva(_to_transparent_png(dati_immagine))
         cur = conn.cursor()
         cur.execute("""INSERT INTO professionisti_timbri(username, timbro_png, updated_at)
             VALUES(%s,%s,NOW())
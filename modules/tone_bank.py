@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Banca toni per audiometria funzionale e calibrazione cuffie.
+
+Prima ogni click su ▶️ rigenerava seno, finestra di fade e contenitore WAV
+(np.linspace + wave). Qui, una volta per processo:
+  - per ogni frequenza un PERIODO esatto (sr / gcd(sr, f) campioni, un
+    numero intero di cicli), ripetuto con np.tile: seno a fase continua
+    senza ricalcolare sin() sull'intera durata;
+  - per (frequenza, durata) il tono unitario con fade 20 ms, in interi a
+    23 bit;
+  - ogni livello dBFS = scala INTERA del tono unitario (guadagno a virgola
+    fissa, arrotondamento al campione 16-bit) + header WAV precompilato.
+I WAV pronti stanno in una cache LRU limitata per byte.
+
+Per il test senza ricaricare la pagina, tone_bank_player_html() esporta la
+banca al browser: i toni unitari (uno per frequenza) vengono decodificati
+una volta in WebAudio e i livelli sono un GainNode, quindi play immediato e
+senza buchi fra frequenze e livelli.
+
+Usage:
+    wav = tone_wav_bytes(1000, -40.0)              # come il vecchio _tone_wav_bytes
+    zip_bytes = export_tone_bank_zip([250, 1000], range(-80, 0, 5))
+    components.html(tone_bank_player_html(FREQS_AUDIOMETRIA), height=130)
+"""
+from __future__ import annotations
+
+import base64
+import io
+import json
+import math
+import struct
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+FREQS_AUDIOMETRIA = (125, 250, 500, 1000, 2000, 4000, 6000, 8000)
+
+SR_DEFAULT = 44100
+FADE_S = 0.02
+AMP_MAX = 0.9
+_UNIT_BITS = 23          # risoluzione del tono unitario (interi)
+_GAIN_BITS = 16          # frazione del guadagno a virgola fissa
+_SHIFT = _UNIT_BITS + _GAIN_BITS
+
+_MAX_WAV_BYTES = 64 * 1024 * 1024
+_MAX_UNIT_TONES = 64
+
+_lock = threading.Lock()
+_periodi: Dict[tuple, np.ndarray] = {}
+_unitari: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_wav: "OrderedDict[tuple, bytes]" = OrderedDict()
+_wav_bytes_tot = 0
+_zip: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+
+def _periodo(freq_hz: float, sr: int) -> np.ndarray:
+    """Seno unitario su un numero intero di cicli (float64)."""
+    key = (float(freq_hz), int(sr))
+    p = _periodi.get(key)
+    if p is not None:
+        return p
+    f = float(freq_hz)
+    if f == int(f) and f > 0:
+        n = sr // math.gcd(int(sr), int(f))
+    else:
+        # frequenza non intera: nessun periodo esatto breve, si genera tutto
+        n = 0
+    p = np.sin(2.0 * np.pi * f * np.arange(n) / sr) if n else np.empty(0)
+    _periodi[key] = p
+    return p
+
+
+def _tono_unitario(freq_hz: float, seconds: float, sr: int) -> np.ndarray:
+    """Tono a piena scala con fade in/out, interi a _UNIT_BITS bit (int64)."""
+    key = (float(freq_hz), round(float(seconds), 4), int(sr))
+    with _lock:
+        u = _unitari.get(key)
+        if u is not None:
+            _unitari.move_to_end(key)
+            return u
+    n = int(sr * seconds)
+    p = _periodo(freq_hz, sr)
+    if p.size:
+        x = np.tile(p, -(-n // p.size))[:n]
+    else:
+        x = np.sin(2.0 * np.pi * float(freq_hz) * np.arange(n) / sr)
+    fade = int(sr * FADE_S)
+    if fade > 0 and n > 2 * fade:
+        x = x.copy()
+        x[:fade] *= np.linspace(0, 1, fade)
+        x[-fade:] *= np.linspace(1, 0, fade)
+    u = np.round(x * (1 << _UNIT_BITS)).astype(np.int64)
+    with _lock:
+        _unitari[key] = u
+        while len(_unitari) > _MAX_UNIT_TONES:
+            _unitari.popitem(last=False)
+    return u
+
+
+def _wav_header(n_frames: int, sr: int) -> bytes:
+    """Header RIFF/WAVE PCM 16-bit mono per n_frames campioni."""
+    data = n_frames * 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data, b"WAVE", b"fmt ", 16, 1, 1, int(sr), int(sr) * 2, 2, 16,
+        b"data", data,
+    )
+
+
+def _amp(dbfs: float) -> float:
+    return max(0.0, min(AMP_MAX, 10 ** (float(dbfs) / 20.0)))
+
+
+def tone_pcm16(freq_hz: float, dbfs: float, seconds: float = 0.6, sr: int = SR_DEFAULT) -> np.ndarray:
+    """Campioni int16 del tono a dbfs (ampiezza limitata a AMP_MAX)."""
+    u = _tono_unitario(freq_hz, seconds, sr)
+    g = int(round(_amp(dbfs) * 32767 * (1 << _GAIN_BITS)))
+    return ((u * g + (1 << (_SHIFT - 1))) >> _SHIFT).astype("<i2")
+
+
+def tone_wav_bytes(freq_hz: float, dbfs: float, seconds: float = 0.6, sr: int = SR_DEFAULT) -> bytes:
+    """WAV mono 16-bit del tono, dalla cache se già generato."""
+    global _wav_bytes_tot
+    key = (float(freq_hz), round(float(dbfs), 2), round(float(seconds), 4), int(sr))
+    with _lock:
+        hit = _wav.get(key)
+        if hit is not None:
+            _wav.move_to_end(key)
+            return hit
+    pcm = tone_pcm16(freq_hz, dbfs, seconds, sr)
+    out = _wav_header(pcm.shape[0], sr) + pcm.tobytes()
+    with _lock:
+        if key not in _wav:
+            _wav[key] = out
+            _wav_bytes_tot += len(out)
+            while _wav_bytes_tot > _MAX_WAV_BYTES and len(_wav) > 1:
+                _k, old = _wav.popitem(last=False)
+                _wav_bytes_tot -= len(old)
+    return out
+
+
+def export_tone_bank_zip(
+    freqs: Iterable[float] = FREQS_AUDIOMETRIA,
+    levels_dbfs: Iterable[float] = range(-90, -4, 5),
+    seconds: float = 0.6,
+    sr: int = SR_DEFAULT,
+) -> bytes:
+    """ZIP con un WAV per (frequenza, livello) + manifest.json (memo degli ultimi 4)."""
+    freqs = tuple(float(f) for f in freqs)
+    levels = tuple(float(l) for l in levels_dbfs)
+    key = (freqs, levels, round(float(seconds), 4), int(sr))
+    with _lock:
+        hit = _zip.get(key)
+        if hit is not None:
+            return hit
+    manifest = {"sr": int(sr), "seconds": float(seconds), "files": []}
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for f in freqs:
+            for l in levels:
+                name = f"tono_{int(f)}Hz_{l:+.1f}dBFS.wav"
+                zf.writestr(name, tone_wav_bytes(f, l, seconds, sr))
+                manifest["files"].append({"file": name, "freq_hz": float(f), "dbfs": l})
+        zf.writestr("manifest.json", json.dumps(manifest, indent=2))
+    out = buf.getvalue()
+    with _lock:
+        _zip[key] = out
+        while len(_zip) > 4:
+            _zip.popitem(last=False)
+    return out
+
+
+def tone_bank_player_html(
+    freqs: Sequence[float] = FREQS_AUDIOMETRIA,
+    seconds: float = 0.6,
+    sr: int = SR_DEFAULT,
+    dbfs_start: float = -40.0,
+    dbfs_step: float = 5.0,
+    key_prefix: Optional[str] = None,
+) -> str:
+    """
+    Player HTML/WebAudio con la banca precaricata: un tono unitario (0 dBFS
+    limitato a AMP_MAX) per frequenza, livelli applicati con un GainNode.
+    Tasti: ←/→ frequenza, ↑/↓ livello, spazio play.
+    """
+    toni = {
+        str(int(f)): base64.b64encode(tone_wav_bytes(f, 20 * math.log10(AMP_MAX), seconds, sr)).decode("ascii")
+        for f in freqs
+    }
+    cfg = {
+        "toni": toni,
+        "freqs": [int(f) for f in freqs],
+        "ampMax": AMP_MAX,
+        "db": float(dbfs_start),
+        "step": float(dbfs_step),
+        "id": key_prefix or "tb",
+    }
+    return """
+<div id="%(id)s" style="font-family:sans-serif;font-size:14px">
+  <div style="margin-bottom:6px">
+    <b>Frequenza:</b> <select id="%(id)s_f"></select>
+    <b style="margin-left:12px">Livello:</b>
+    <button id="%(id)s_m">−</button>
+    <span id="%(id)s_db" style="display:inline-block;width:80px;text-align:center"></span>
+    <button id="%(id)s_p">+</button>
+  </div>
+  <button id="%(id)s_play" style="font-size:16px;padding:6px 18px">▶ Play</button>
+  <span id="%(id)s_st" style="margin-left:10px;color:#666">caricamento toni…</span>
+  <div style="margin-top:6px;color:#888;font-size:12px">←/→ frequenza · ↑/↓ livello · spazio play</div>
+</div>
+<script>
+(function(){
+  const C = %(cfg)s;
+  const $ = s => document.getElementById(C.id + s);
+  const ctx = new (window.AudioContext || window.webkitAudioContext)();
+  const buf = {};
+  let db = C.db;
+  const sel = $("_f");
+  C.freqs.forEach(f => { const o = document.createElement("option"); o.value = f; o.text = f + " Hz"; sel.appendChild(o); });
+  sel.value = C.freqs.includes(1000) ? 1000 : C.freqs[0];
+  const showDb = () => { $("_db").textContent = db.toFixed(1) + " dBFS"; };
+  showDb();
+  Promise.all(Object.entries(C.toni).map(([f, b64]) => {
+    const bin = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+    return ctx.decodeAudioData(bin.buffer).then(b => { buf[f] = b; });
+  })).then(() => { $("_st").textContent = "pronto (" + C.freqs.length + " frequenze)"; });
+  function play() {
+    const b = buf[sel.value];
+    if (!b) return;
+    if (ctx.state === "suspended") ctx.resume();
+    const src = ctx.createBufferSource();
+    const g = ctx.createGain();
+    g.gain.value = Math.min(C.ampMax, Math.pow(10, db / 20)) / C.ampMax;
+    src.buffer = b; src.connect(g); g.connect(ctx.destination); src.start();
+  }
+  $("_play").onclick = play;
+  $("_m").onclick = () => { db -= C.step; showDb(); };
+  $("_p").onclick = () => { db = Math.min(db + C.step, 20 * Math.log10(C.ampMax)); showDb(); };
+  document.addEventListener("keydown", e => {
+    const i = C.freqs.indexOf(parseInt(sel.value));
+    if (e.key === "ArrowLeft" && i > 0) sel.value = C.freqs[i - 1];
+    else if (e.key === "ArrowRight" && i < C.freqs.length - 1) sel.value = C.freqs[i + 1];
+    else if (e.key === "ArrowDown") { db -= C.step; showDb(); }
+    else if (e.key === "ArrowUp") { db = Math.min(db + C.step, 20 * Math.log10(C.ampMax)); showDb(); }
+    else if (e.key === " ") play();
+    else return;
+    e.preventDefault();
+  });
+})();
+</script>
+""" % {"id": cfg["id"], "cfg": json.dumps(cfg)}
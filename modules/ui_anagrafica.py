@@ -17,6 +17,9 @@ import io
 import os
 import streamlit as st
 
+from .riepilogo_paziente import invalida_riepilogo_paziente
+from .ricerca_pazienti import invalida_ricerca_pazienti
+
 
 # ════════════════════════════════════════════════════════════════════
 #  HELPERS
@@ -508,6 +511,7 @@ def _carica_visite(_conn):
 
 
 def _invalida_cache():
+    invalida_ricerca_pazienti()
     try:
         _carica_pazienti_full.clear()
         _carica_paziente.clear()
@@ -1191,6 +1195,7 @@ def _sezione_coupon_paziente(conn, paz_id):
                                     "WHERE id=%s",
                                     (0 if usato else 1, nl.strip() or None, cid))
                         conn.commit()
+                        invalida_riepilogo_paziente(paz_id)
                         st.rerun()
                     except Exception:
                         try:
@@ -1203,6 +1208,7 @@ def _sezione_coupon_paziente(conn, paz_id):
                     try:
                         cur.execute("DELETE FROM Coupons WHERE id=%s", (cid,))
                         conn.commit()
+                        invalida_riepilogo_paziente(paz_id)
                         st.rerun()
                     except Exception:
                         try:
@@ -1230,6 +1236,7 @@ def _sezione_coupon_paziente(conn, paz_id):
                      _dt.date.today().strftime("%Y-%m-%d"),
                      note.strip() or None, 1 if usato_new else 0))
                 conn.commit()
+                invalida_riepilogo_paziente(paz_id)
                 st.success("Coupon aggiunto.")
                 st.rerun()
             except Exception as e:
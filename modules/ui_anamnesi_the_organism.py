@@ -10,6 +10,8 @@ import json
 import datetime
 import streamlit as st
 
+from .riepilogo_paziente import invalida_riepilogo_paziente
+
 
 def _salva(conn, paz_id: int, dati: dict) -> None:
     try:
@@ -38,6 +40,7 @@ def _salva(conn, paz_id: int, dati: dict) -> None:
                  "Anamnesi The Organism", dump)
             )
         conn.commit()
+        invalida_riepilogo_paziente(paz_id)
         st.success("Salvato.")
     except Exception as e:
         try: conn.rollback()
@@ -17,27 +17,9 @@ from datetime import datetime
 
 
 def _tone_wav_bytes(freq_hz: int, dbfs: float, seconds: float = 0.6, sr: int = 44100) -> bytes:
-    import io, wave
-    import numpy as _np
-    amp = 10 ** (float(dbfs) / 20.0)
-    amp = max(0.0, min(0.9, amp))
-    t = _np.linspace(0, seconds, int(sr * seconds), endpoint=False)
-    x = amp * _np.sin(2 * _np.pi * float(freq_hz) * t)
-    fade = int(sr * 0.02)
-    if fade > 0 and len(x) > 2 * fade:
-        w = _np.ones_like(x)
-        w[:fade] = _np.linspace(0, 1, fade)
-        w[-fade:] = _np.linspace(1, 0, fade)
-        x = x * w
-    pcm = _np.int16(_np.clip(x, -1, 1) * 32767)
-
-    buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(sr)
-        wf.writeframes(pcm.tobytes())
-    return buf.getvalue()
+    # banca toni di processo: periodo per frequenza + scala intera + cache WAV
+    from modules.tone_bank import tone_wav_bytes
+    return tone_wav_bytes(freq_hz, dbfs, seconds=seconds, sr=sr)
 
 
 def _ensure_calibration_tables(conn):
@@ -16,6 +16,7 @@ Esporta WAV stereo processato, pronto per piattaforma.
 import io
 import math
 import json
+import time
 import numpy as np
 import streamlit as st
 
@@ -77,45 +78,26 @@ def _ensure_stereo(samples):
     return samples
 
 
-def _peaking_eq(samples, sr, freq_hz, gain_db, Q=1.4):
-    """Applica filtro peaking EQ (biquad) a un canale mono."""
-    from scipy.signal import lfilter, bilinear_zpk, zpk2sos, sosfilt
-    if abs(gain_db) < 0.1:
-        return samples
-    try:
-        from scipy.signal import sosfilt, iirpeak
-        A  = 10**(gain_db/40.0)
-        w0 = 2 * math.pi * freq_hz / sr
-        alpha = math.sin(w0) / (2 * Q)
-        b0 =  1 + alpha * A
-        b1 = -2 * math.cos(w0)
-        b2 =  1 - alpha * A
-        a0 =  1 + alpha / A
-        a1 = -2 * math.cos(w0)
-        a2 =  1 - alpha / A
-        b = np.array([b0, b1, b2]) / a0
-        a = np.array([1.0, a1/a0, a2/a0])
-        return lfilter(b, a, samples)
-    except Exception:
-        return samples
-
-
-def _apply_eq_channel(ch, sr, gains):
-    """Applica 11 bande EQ a un canale."""
-    out = ch.copy()
-    for i, freq in enumerate(FREQS_EQ):
-        if abs(gains[i]) > 0.1:
-            out = _peaking_eq(out, sr, freq, gains[i])
-    return out
+def _apply_eq_stereo(samples, sr, gains_od, gains_os):
+    """EQ 11 bande su entrambi i canali (col 0 = OD, col 1 = OS): tutte le
+    bande di un canale in una sola cascata SOS (peaking RBJ, Q=1.4)."""
+    from modules.stimolazione_uditiva.audio_dsp import StereoSosCascade, peaking_eq_sos
+    eq = StereoSosCascade(
+        peaking_eq_sos(sr, list(zip(FREQS_EQ, gains_od)), q=1.4, min_gain_db=0.1),
+        peaking_eq_sos(sr, list(zip(FREQS_EQ, gains_os)), q=1.4, min_gain_db=0.1),
+    )
+    return eq.process(samples)
 
 
 def _generate_gate_envelope(n_samples, sr,
                              t_min, t_max, atten_db,
-                             lissage_ms, gd_mode, alea):
+                             lissage_ms, gd_mode, alea, rng=None):
     """
     Genera envelope gate ampiezza.
     Ritorna array (n_samples,) con valori 0..1.
+    rng: np.random.Generator (seed fisso = stesso gating); None = np.random globale.
     """
+    rng = rng if rng is not None else np.random
     fade_n  = max(1, int(lissage_ms / 1000 * sr))
     atten_l = 10 ** (-abs(atten_db) / 20.0)
     env     = np.ones(n_samples, dtype=np.float32)
@@ -124,7 +106,7 @@ def _generate_gate_envelope(n_samples, sr,
 
     while i < n_samples:
         if alea:
-            dur_s = t_min + np.random.random() * (t_max - t_min)
+            dur_s = t_min + rng.random() * (t_max - t_min)
         else:
             dur_s = (t_min + t_max) / 2
         seg_n = min(int(dur_s * sr), n_samples - i)
@@ -152,38 +134,34 @@ def _generate_gate_envelope(n_samples, sr,
 
 def _generate_freq_gate_envelope(n_samples, sr,
                                   tornante_hz, atten_range,
-                                  t_min_ms, t_max_ms, alea):
+                                  t_min_ms, t_max_ms, alea, rng=None):
     """
     Genera gain envelope per gate frequenza (oscillazione attorno a tornante).
     Ritorna array (n_samples,) con valori -max_atten..0 dB.
     """
+    rng = rng if rng is not None else np.random
     env = np.zeros(n_samples, dtype=np.float32)
     i   = 0
     while i < n_samples:
         if alea:
-            dur_ms = t_min_ms + np.random.random() * (t_max_ms - t_min_ms)
+            dur_ms = t_min_ms + rng.random() * (t_max_ms - t_min_ms)
         else:
             dur_ms = (t_min_ms + t_max_ms) / 2
         seg_n  = min(int(dur_ms / 1000 * sr), n_samples - i)
         if seg_n <= 0:
             break
-        atten  = np.random.uniform(-atten_range[1], -atten_range[0])
+        atten  = rng.uniform(-atten_range[1], -atten_range[0])
         env[i:i+seg_n] = atten
         i += seg_n
     return env
 
 
-def _apply_freq_gate(ch, sr, tornante_hz, gain_db_arr):
-    """Applica modulazione frequenza tornante campione per campione con lfilter."""
-    # Approssimazione: applica EQ a blocchi con guadagno variabile
-    block = max(256, sr // 20)
-    out   = ch.copy()
-    for start in range(0, len(ch), block):
-        end   = min(start + block, len(ch))
-        g_db  = float(np.mean(gain_db_arr[start:end]))
-        seg   = _peaking_eq(ch[start:end], sr, tornante_hz, g_db, Q=2.0)
-        out[start:end] = seg
-    return out
+def _apply_freq_gate(stereo, sr, tornante_hz, gain_db_arr):
+    """Peaking sulla frequenza tornante (Q=2.0) col guadagno dell'envelope:
+    coefficienti aggiornati a ogni cambio di guadagno, stato del filtro
+    continuo, entrambi i canali insieme."""
+    from modules.stimolazione_uditiva.audio_dsp import SteppedPeaking
+    return SteppedPeaking(sr, tornante_hz, 2.0, channels=2).process(stereo, gain_db_arr)
 
 
 def _generate_binaural(n_samples, sr, carrier_hz, beat_hz, amplitude=0.08):
@@ -215,6 +193,22 @@ def _samples_to_wav(samples_stereo, sr):
     return buf.getvalue()
 
 
+def _wav_head(wav_bytes, seconds):
+    """Primi `seconds` secondi di un WAV 16-bit -> (bytes WAV, durata totale s)."""
+    import wave
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        sr = wf.getframerate()
+        dur_sec = wf.getnframes() / float(sr)
+        raw = wf.readframes(int(seconds * sr))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(sr)
+        wf.writeframes(raw)
+    return buf.getvalue(), dur_sec
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # UI
 # ─────────────────────────────────────────────────────────────────────────────
@@ -288,6 +282,14 @@ def ui_processore_offline(eq_od_default=None, eq_os_default=None):
                                key="proc_gd")
         alea      = st.toggle("Alea (timing random)", value=True,
                                key="proc_alea")
+        seed      = st.number_input("Seed alea", 0, 2**31 - 1, 1, 1,
+                                     key="proc_seed", disabled=not alea,
+                                     help="Stesso seed = stesso gating: "
+                                          "il file si può rigenerare identico "
+                                          "(e viene preso dalla cache).")
+        if not alea:
+            # senza alea il render non dipende dal seed (rng fisso)
+            seed = 0
 
     with ga2:
         st.markdown("*Bascula Frequenze*")
@@ -351,78 +353,120 @@ def ui_processore_offline(eq_od_default=None, eq_os_default=None):
         f_atten_max = abs(float(parts[1])) if len(parts) > 1 else 9.0
 
         progress = st.progress(0, text="Caricamento file...")
+        tempi = []
+        t_passo = [time.perf_counter()]
+
+        def _fine_passo(nome):
+            now = time.perf_counter()
+            tempi.append((nome, now - t_passo[0]))
+            t_passo[0] = now
 
         try:
-            # 1. Carica audio
-            uploaded.seek(0)
-            samples, sr, n_ch = _load_audio(uploaded)
-            samples = _ensure_stereo(samples)
-            n_samples = len(samples)
-            dur_sec   = n_samples / sr
-            progress.progress(10, text=f"Audio caricato: {dur_sec:.0f}s, {sr}Hz")
-
-            # 2. EQ OD
-            progress.progress(20, text="Applicazione EQ OD...")
-            ch_od = _apply_eq_channel(samples[:,0], sr, eq_od_edit)
-
-            # 3. EQ OS
-            progress.progress(30, text="Applicazione EQ OS...")
-            ch_os = _apply_eq_channel(samples[:,1], sr, eq_os_edit)
-
-            # 4. Gate Ampiezza
-            progress.progress(40, text="Generazione gate ampiezza...")
-            g_tmin_f = float(g_tmin)
-            g_tmax_f = float(g_tmax)
-            if g_tmin_f > g_tmax_f:
-                g_tmin_f, g_tmax_f = g_tmax_f, g_tmin_f
-
-            if gd_mode:
-                # Canali alternati
-                env_od = _generate_gate_envelope(
-                    n_samples, sr, g_tmin_f, g_tmax_f,
-                    g_atten, lissage_ms, True, alea)
-                env_os = 1.0 - env_od + (10**(-g_atten/20))
-                env_os = np.clip(env_os, 10**(-g_atten/20), 1.0)
+            # 0. Render cache: stesso file + stessi parametri + stesso seed -> WAV già pronto
+            from modules.stimolazione_uditiva.render_cache import (
+                get_render_cache, input_digest, render_key,
+            )
+            cache = get_render_cache()
+            cache_key = None
+            wav_bytes = None
+            if cache is not None:
+                uploaded.seek(0)
+                cache_key = render_key(
+                    input_digest(uploaded.read()), "hiperion", "wav",
+                    eq_dx=dict(zip(FREQS_EQ, eq_od_edit)),
+                    eq_sx=dict(zip(FREQS_EQ, eq_os_edit)),
+                    params={
+                        "g_atten": g_atten, "g_tmin": g_tmin, "g_tmax": g_tmax,
+                        "lissage_ms": lissage_ms, "gd_mode": gd_mode, "alea": alea,
+                        "tornante": tornante, "f_range": f_range,
+                        "f_tmin_ms": f_tmin_ms, "f_tmax_ms": f_tmax_ms,
+                        "binaurale": [carrier_hz, beat_hz, bin_vol] if bin_on else None,
+                    },
+                    seed=int(seed) if alea else None,
+                )
+                wav_bytes = cache.get_bytes(cache_key, "wav")
+                _fine_passo("Cache")
+
+            if wav_bytes is not None:
+                preview_bytes, dur_sec = _wav_head(wav_bytes, 30)
+                progress.progress(100, text="Completato (dalla cache)!")
             else:
-                env_od = _generate_gate_envelope(
-                    n_samples, sr, g_tmin_f, g_tmax_f,
-                    g_atten, lissage_ms, False, alea)
-                env_os = env_od.copy()
-
-            ch_od *= env_od
-            ch_os *= env_os
-
-            # 5. Gate Frequenze
-            progress.progress(55, text="Applicazione gate frequenze...")
-            freq_env = _generate_freq_gate_envelope(
-                n_samples, sr, tornante,
-                (f_atten_min, f_atten_max),
-                f_tmin_ms, f_tmax_ms, alea)
-            ch_od = _apply_freq_gate(ch_od, sr, tornante, freq_env)
-            ch_os = _apply_freq_gate(ch_os, sr, tornante, freq_env)
-
-            # 6. Binaurale
-            if bin_on:
-                progress.progress(70, text="Generazione binaurale...")
-                amp_bin = bin_vol / 100.0 * 0.3
-                tone_od, tone_os = _generate_binaural(
-                    n_samples, sr, carrier_hz, beat_hz, amp_bin)
-                ch_od = ch_od + tone_od
-                ch_os = ch_os + tone_os
-
-            # 7. Normalizzazione
-            progress.progress(85, text="Normalizzazione...")
-            peak = max(np.abs(ch_od).max(), np.abs(ch_os).max())
-            if peak > 0.95:
-                ch_od = ch_od / peak * 0.95
-                ch_os = ch_os / peak * 0.95
-
-            # 8. Export WAV
-            progress.progress(92, text="Export WAV...")
-            stereo = np.stack([ch_od, ch_os], axis=1).astype(np.float32)
-            wav_bytes = _samples_to_wav(stereo, sr)
-
-            progress.progress(100, text="Completato!")
+                rng = np.random.default_rng(int(seed))
+
+                # 1. Carica audio
+                uploaded.seek(0)
+                samples, sr, n_ch = _load_audio(uploaded)
+                samples = _ensure_stereo(samples)
+                n_samples = len(samples)
+                dur_sec   = n_samples / sr
+                _fine_passo("Caricamento")
+                progress.progress(10, text=f"Audio caricato: {dur_sec:.0f}s, {sr}Hz")
+
+                # 2. EQ OD + OS (una cascata per canale, un solo passaggio)
+                progress.progress(20, text="Applicazione EQ OD/OS...")
+                stereo = _apply_eq_stereo(samples, sr, eq_od_edit, eq_os_edit)
+                del samples
+                _fine_passo("EQ OD/OS")
+
+                # 3. Gate Ampiezza
+                progress.progress(40, text="Generazione gate ampiezza...")
+                g_tmin_f = float(g_tmin)
+                g_tmax_f = float(g_tmax)
+                if g_tmin_f > g_tmax_f:
+                    g_tmin_f, g_tmax_f = g_tmax_f, g_tmin_f
+
+                if gd_mode:
+                    # Canali alternati
+                    env_od = _generate_gate_envelope(
+                        n_samples, sr, g_tmin_f, g_tmax_f,
+                        g_atten, lissage_ms, True, alea, rng=rng)
+                    env_os = 1.0 - env_od + (10**(-g_atten/20))
+                    env_os = np.clip(env_os, 10**(-g_atten/20), 1.0)
+                else:
+                    env_od = _generate_gate_envelope(
+                        n_samples, sr, g_tmin_f, g_tmax_f,
+                        g_atten, lissage_ms, False, alea, rng=rng)
+                    env_os = env_od
+
+                stereo[:, 0] *= env_od
+                stereo[:, 1] *= env_os
+                _fine_passo("Gate ampiezza")
+
+                # 4. Gate Frequenze
+                progress.progress(55, text="Applicazione gate frequenze...")
+                freq_env = _generate_freq_gate_envelope(
+                    n_samples, sr, tornante,
+                    (f_atten_min, f_atten_max),
+                    f_tmin_ms, f_tmax_ms, alea, rng=rng)
+                stereo = _apply_freq_gate(stereo, sr, tornante, freq_env)
+                _fine_passo("Gate frequenze")
+
+                # 5. Binaurale
+                if bin_on:
+                    progress.progress(70, text="Generazione binaurale...")
+                    amp_bin = bin_vol / 100.0 * 0.3
+                    tone_od, tone_os = _generate_binaural(
+                        n_samples, sr, carrier_hz, beat_hz, amp_bin)
+                    stereo[:, 0] += tone_od
+                    stereo[:, 1] += tone_os
+                    _fine_passo("Binaurale")
+
+                # 6. Normalizzazione
+                progress.progress(85, text="Normalizzazione...")
+                peak = float(np.abs(stereo).max())
+                if peak > 0.95:
+                    stereo *= 0.95 / peak
+                _fine_passo("Normalizzazione")
+
+                # 7. Export WAV
+                progress.progress(92, text="Export WAV...")
+                wav_bytes = _samples_to_wav(stereo, sr)
+                if cache_key is not None:
+                    cache.put_bytes(cache_key, "wav", wav_bytes)
+                preview_bytes = _samples_to_wav(stereo[:min(30 * sr, n_samples)], sr)
+                _fine_passo("Export WAV")
+
+                progress.progress(100, text="Completato!")
 
             # Nome file output
             base_name = uploaded.name.rsplit(".", 1)[0]
@@ -442,11 +486,17 @@ def ui_processore_offline(eq_od_default=None, eq_os_default=None):
                 key="proc_download"
             )
 
+            totale = sum(sec for _, sec in tempi)
+            with st.expander(f"Tempi di elaborazione — {totale:.1f}s "
+                             f"({dur_sec / max(totale, 1e-9):.0f}x tempo reale)"):
+                st.dataframe(
+                    [{"Passo": nome, "Secondi": round(sec, 3)} for nome, sec in tempi],
+                    hide_index=True, use_container_width=True,
+                )
+
             # Anteprima
             st.markdown("**Anteprima** (primi 30 secondi)")
-            preview_n = min(30 * sr, n_samples)
-            preview   = stereo[:preview_n]
-            st.audio(_samples_to_wav(preview, sr), format="audio/wav")
+            st.audio(preview_bytes, format="audio/wav")
 
         except Exception as e:
             progress.empty()
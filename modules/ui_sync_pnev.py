@@ -36,6 +36,8 @@ import urllib.error
 
 import streamlit as st
 
+from .ricerca_pazienti import invalida_ricerca_pazienti
+
 # NB: get_connection si importa SOLO quando serve davvero (dentro le funzioni,
 # se conn non viene passata). Importarlo qui in cima tirerebbe dentro tutto
 # app_core (matplotlib ecc.), che nel cron leggero non c'è.
@@ -434,6 +436,7 @@ def render_sync_pnev(conn=None):
                 conn.commit()
             except Exception:
                 pass
+            invalida_ricerca_pazienti()
             st.session_state["maps_import_result"] = (ok, ko)
             st.session_state.pop("maps_studenti", None)  # forza una rilettura pulita
             _rerun()
@@ -542,6 +545,7 @@ def processa_sync_pnev(conn=None, dry_run: bool = False) -> dict:
         try:
             _importa_paziente(conn, nome, cognome, em)
             conn.commit()                      # ogni paziente confermato subito
+            invalida_ricerca_pazienti()
             report["importati"] += 1
             report["dettaglio"].append(
                 {"azione": "importato", "nome": u.get("name", ""), "email": em})
@@ -55,41 +55,44 @@ if dry_run:
 
 # === CONNESSIONE E PROCESSO ===
 try:
-    from modules.app_core import get_connection
+    from modules.app_core import get_connection, release_run_connections
     conn = get_connection()
 except Exception as e:
     st.error(f"Errore connessione DB: {e}")
     st.stop()
 
 try:
-    from modules.eventi.promemoria_eventi import processa_promemoria_automatici
-    report = processa_promemoria_automatici(conn, dry_run=dry_run)
-except Exception as e:
-    st.error(f"Errore esecuzione promemoria: {e}")
-    import traceback
-    st.code(traceback.format_exc())
-    st.stop()
-
-# === REPORT ===
-st.subheader("Report")
-col1, col2, col3 = st.columns(3)
-col1.metric("Eventi processati", report["eventi_processati"])
-col2.metric("Email inviate", report["email_inviate"])
-col3.metric("Email fallite", report["email_fallite"])
-
-if report["dettaglio"]:
-    st.write("**Dettaglio:**")
-    st.dataframe(report["dettaglio"], use_container_width=True)
-else:
-    st.info("Nessun promemoria da inviare in questo momento.")
-
-if report["errori"]:
-    st.error("Errori:")
-    for err in report["errori"]:
-        st.code(err)
-
-# Output machine-readable per il cron (testo semplice in fondo)
-st.text(
-    f"CRON_RESULT eventi={report['eventi_processati']} "
-    f"inviate={report['email_inviate']} fallite={report['email_fallite']}"
-)
+    try:
+        from modules.eventi.promemoria_eventi import processa_promemoria_automatici
+        report = processa_promemoria_automatici(conn, dry_run=dry_run)
+    except Exception as e:
+        st.error(f"Errore esecuzione promemoria: {e}")
+        import traceback
+        st.code(traceback.format_exc())
+        st.stop()
+
+    # === REPORT ===
+    st.subheader("Report")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Eventi processati", report["eventi_processati"])
+    col2.metric("Email inviate", report["email_inviate"])
+    col3.metric("Email fallite", report["email_fallite"])
+
+    if report["dettaglio"]:
+        st.write("**Dettaglio:**")
+        st.dataframe(report["dettaglio"], use_container_width=True)
+    else:
+        st.info("Nessun promemoria da inviare in questo momento.")
+
+    if report["errori"]:
+        st.error("Errori:")
+        for err in report["errori"]:
+            st.code(err)
+
+    # Output machine-readable per il cron (testo semplice in fondo)
+    st.text(
+        f"CRON_RESULT eventi={report['eventi_processati']} "
+        f"inviate={report['email_inviate']} fallite={report['email_fallite']}"
+    )
+finally:
+    release_run_connections()   # anche dopo st.stop()
@@ -46,41 +46,44 @@ if dry_run:
     st.info("🧪 Modalità DRY RUN: non importo davvero, mostro solo cosa farei")
 
 try:
-    from modules.app_core import get_connection
+    from modules.app_core import get_connection, release_run_connections
     conn = get_connection()
 except Exception as e:
     st.error(f"Errore connessione DB: {e}")
     st.stop()
 
 try:
-    from modules.ui_sync_pnev import processa_sync_pnev
-    report = processa_sync_pnev(conn, dry_run=dry_run)
-except Exception as e:
-    st.error(f"Errore esecuzione sync: {e}")
-    import traceback
-    st.code(traceback.format_exc())
-    st.stop()
-
-st.subheader("Report")
-c1, c2, c3, c4 = st.columns(4)
-c1.metric("Letti da MAPS", report["letti"])
-c2.metric("Già presenti", report["gia_presenti"])
-c3.metric("Esclusi (test)", report["esclusi_test"])
-c4.metric("Importati", report["importati"])
-
-if report["dettaglio"]:
-    st.write("**Dettaglio:**")
-    st.dataframe(report["dettaglio"], use_container_width=True)
-else:
-    st.info("Nessun nuovo paziente da importare in questo momento.")
-
-if report["errori"]:
-    st.error("Errori:")
-    for err in report["errori"]:
-        st.code(err)
-
-# Riga machine-readable per il cron
-st.text(
-    f"CRON_RESULT letti={report['letti']} gia_presenti={report['gia_presenti']} "
-    f"esclusi_test={report['esclusi_test']} importati={report['importati']}"
-)
+    try:
+        from modules.ui_sync_pnev import processa_sync_pnev
+        report = processa_sync_pnev(conn, dry_run=dry_run)
+    except Exception as e:
+        st.error(f"Errore esecuzione sync: {e}")
+        import traceback
+        st.code(traceback.format_exc())
+        st.stop()
+
+    st.subheader("Report")
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Letti da MAPS", report["letti"])
+    c2.metric("Già presenti", report["gia_presenti"])
+    c3.metric("Esclusi (test)", report["esclusi_test"])
+    c4.metric("Importati", report["importati"])
+
+    if report["dettaglio"]:
+        st.write("**Dettaglio:**")
+        st.dataframe(report["dettaglio"], use_container_width=True)
+    else:
+        st.info("Nessun nuovo paziente da importare in questo momento.")
+
+    if report["errori"]:
+        st.error("Errori:")
+        for err in report["errori"]:
+            st.code(err)
+
+    # Riga machine-readable per il cron
+    st.text(
+        f"CRON_RESULT letti={report['letti']} gia_presenti={report['gia_presenti']} "
+        f"esclusi_test={report['esclusi_test']} importati={report['importati']}"
+    )
+finally:
+    release_run_connections()   # anche dopo st.stop()
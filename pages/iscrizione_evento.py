@@ -68,7 +68,7 @@ if not slug:
 # =============================================================================
 
 try:
-    from modules.app_core import get_connection
+    from modules.app_core import get_connection, release_run_connections
     from modules.eventi.db_eventi import (
         get_evento_by_slug,
         crea_iscrizione,
@@ -88,161 +88,162 @@ except Exception as e:
     st.stop()
 
 try:
-    evento = get_evento_by_slug(conn, slug)
-except Exception as e:
-    st.error(f"Errore caricamento evento: {e}")
-    st.stop()
+    try:
+        evento = get_evento_by_slug(conn, slug)
+    except Exception as e:
+        st.error(f"Errore caricamento evento: {e}")
+        st.stop()
 
-if not evento:
-    st.error("❌ Evento non trovato.")
-    st.info("Il link potrebbe essere scaduto. Contatta lo Studio per maggiori informazioni.")
-    st.stop()
+    if not evento:
+        st.error("❌ Evento non trovato.")
+        st.info("Il link potrebbe essere scaduto. Contatta lo Studio per maggiori informazioni.")
+        st.stop()
 
-if not evento.get("attivo"):
-    st.warning("⚠️ Questo evento non è più disponibile.")
-    st.stop()
+    if not evento.get("attivo"):
+        st.warning("⚠️ Questo evento non è più disponibile.")
+        st.stop()
 
 
-# =============================================================================
-# RENDER DETTAGLI EVENTO
-# =============================================================================
+    # =============================================================================
+    # RENDER DETTAGLI EVENTO
+    # =============================================================================
 
-GIORNI = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
-MESI = ["gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno",
-        "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"]
+    GIORNI = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
+    MESI = ["gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno",
+            "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"]
 
 
-def _format_data_ora(dt: datetime) -> str:
-    if dt.tzinfo is not None:
-        dt = dt.astimezone(ROME_TZ)
-    g = GIORNI[dt.weekday()]
-    return f"{g} {dt.day} {MESI[dt.month - 1]} {dt.year} · ore {dt.strftime('%H:%M')}"
+    def _format_data_ora(dt: datetime) -> str:
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(ROME_TZ)
+        g = GIORNI[dt.weekday()]
+        return f"{g} {dt.day} {MESI[dt.month - 1]} {dt.year} · ore {dt.strftime('%H:%M')}"
 
 
-data_str = _format_data_ora(evento["data_ora"])
+    data_str = _format_data_ora(evento["data_ora"])
 
-# Header con titolo evento
-meta_parts = [f"📅 {data_str}"]
-if evento.get("sede"):
-    meta_parts.append(f"📍 {evento['sede']}")
-if evento.get("conduttore"):
-    meta_parts.append(f"👤 {evento['conduttore']}")
+    # Header con titolo evento
+    meta_parts = [f"📅 {data_str}"]
+    if evento.get("sede"):
+        meta_parts.append(f"📍 {evento['sede']}")
+    if evento.get("conduttore"):
+        meta_parts.append(f"👤 {evento['conduttore']}")
 
-st.markdown(
-    f"""
+    st.markdown(
+        f"""
     <div class="ev-header">
         <h1>{evento.get('titolo', '')}</h1>
         <div class="meta">{' · '.join(meta_parts)}</div>
     </div>
     """,
-    unsafe_allow_html=True,
-)
+        unsafe_allow_html=True,
+    )
 
-if evento.get("immagine_url"):
-    try:
-        st.image(evento["immagine_url"], use_container_width=True)
-    except Exception:
-        pass
-
-if evento.get("descrizione"):
-    st.markdown(evento["descrizione"])
-
-# Riepilogo veloce
-info_extra = []
-if evento.get("durata_minuti"):
-    info_extra.append(f"⏱️ Durata: {evento['durata_minuti']} minuti")
-if evento.get("prezzo") is not None and float(evento["prezzo"]) > 0:
-    info_extra.append(f"💶 Contributo: € {float(evento['prezzo']):.2f}")
-if info_extra:
-    st.info(" · ".join(info_extra))
-
-# Posti disponibili / sold out
-rimasti = posti_rimasti(conn, evento["id"])
-if evento.get("posti_max"):
-    if rimasti is None or rimasti > 0:
-        st.success(f"✅ Posti disponibili: **{rimasti}** su {evento['posti_max']}")
-    else:
-        st.warning(
-            f"⚠️ Posti esauriti ({evento['posti_max']} su {evento['posti_max']}). "
-            "Puoi comunque iscriverti in **lista d'attesa**."
-        )
+    if evento.get("immagine_url"):
+        try:
+            st.image(evento["immagine_url"], use_container_width=True)
+        except Exception:
+            pass
+
+    if evento.get("descrizione"):
+        st.markdown(evento["descrizione"])
+
+    # Riepilogo veloce
+    info_extra = []
+    if evento.get("durata_minuti"):
+        info_extra.append(f"⏱️ Durata: {evento['durata_minuti']} minuti")
+    if evento.get("prezzo") is not None and float(evento["prezzo"]) > 0:
+        info_extra.append(f"💶 Contributo: € {float(evento['prezzo']):.2f}")
+    if info_extra:
+        st.info(" · ".join(info_extra))
+
+    # Posti disponibili / sold out
+    rimasti = posti_rimasti(conn, evento["id"])
+    if evento.get("posti_max"):
+        if rimasti is None or rimasti > 0:
+            st.success(f"✅ Posti disponibili: **{rimasti}** su {evento['posti_max']}")
+        else:
+            st.warning(
+                f"⚠️ Posti esauriti ({evento['posti_max']} su {evento['posti_max']}). "
+                "Puoi comunque iscriverti in **lista d'attesa**."
+            )
 
-# Iscrizioni chiuse?
-if not evento.get("iscrizioni_aperte"):
-    st.error("🔒 Le iscrizioni a questo evento sono chiuse.")
-    st.stop()
+    # Iscrizioni chiuse?
+    if not evento.get("iscrizioni_aperte"):
+        st.error("🔒 Le iscrizioni a questo evento sono chiuse.")
+        st.stop()
 
-st.divider()
+    st.divider()
 
 
-# =============================================================================
-# FORM ISCRIZIONE
-# =============================================================================
+    # =============================================================================
+    # FORM ISCRIZIONE
+    # =============================================================================
 
-# Se appena inviato con successo, mostra schermata "grazie" invece del form
-if st.session_state.get("ev_iscrizione_completata", {}).get("slug") == slug:
-    dati = st.session_state["ev_iscrizione_completata"]
-    st.markdown("## ✅ Iscrizione registrata!")
-    stato = dati.get("stato", "confermata")
-    if stato == "confermata":
-        st.success(
-            f"Grazie **{dati.get('nome', '')}**! La tua iscrizione è confermata.\n\n"
-            f"Ti abbiamo inviato una email di conferma all'indirizzo "
-            f"**{dati.get('email', '')}** con il PDF in allegato."
-        )
-    elif stato == "lista_attesa":
-        st.warning(
-            f"Grazie **{dati.get('nome', '')}**! L'evento è al completo, "
-            f"quindi sei in **lista d'attesa**.\n\n"
-            f"Ti contatteremo appena si libera un posto. Abbiamo inviato un PDF "
-            f"all'indirizzo **{dati.get('email', '')}**."
-        )
+    # Se appena inviato con successo, mostra schermata "grazie" invece del form
+    if st.session_state.get("ev_iscrizione_completata", {}).get("slug") == slug:
+        dati = st.session_state["ev_iscrizione_completata"]
+        st.markdown("## ✅ Iscrizione registrata!")
+        stato = dati.get("stato", "confermata")
+        if stato == "confermata":
+            st.success(
+                f"Grazie **{dati.get('nome', '')}**! La tua iscrizione è confermata.\n\n"
+                f"Ti abbiamo inviato una email di conferma all'indirizzo "
+                f"**{dati.get('email', '')}** con il PDF in allegato."
+            )
+        elif stato == "lista_attesa":
+            st.warning(
+                f"Grazie **{dati.get('nome', '')}**! L'evento è al completo, "
+                f"quindi sei in **lista d'attesa**.\n\n"
+                f"Ti contatteremo appena si libera un posto. Abbiamo inviato un PDF "
+                f"all'indirizzo **{dati.get('email', '')}**."
+            )
 
-    if dati.get("email_problema"):
-        st.warning(
-            f"⚠️ Non siamo riusciti a inviarti l'email di conferma "
-            f"(causa: {dati['email_problema']}). "
-            f"La tua iscrizione è comunque registrata regolarmente. "
-            f"Per ricevere il PDF contatta lo Studio."
-        )
+        if dati.get("email_problema"):
+            st.warning(
+                f"⚠️ Non siamo riusciti a inviarti l'email di conferma "
+                f"(causa: {dati['email_problema']}). "
+                f"La tua iscrizione è comunque registrata regolarmente. "
+                f"Per ricevere il PDF contatta lo Studio."
+            )
 
-    st.info(
-        "**Cosa fare ora?**  \n"
-        f"📅 Salva la data: {data_str}  \n"
-        + (f"📍 Sede: {evento['sede']}  \n" if evento.get("sede") else "")
-        + "📧 Per qualsiasi necessità rispondi all'email di conferma."
-    )
+        st.info(
+            "**Cosa fare ora?**  \n"
+            f"📅 Salva la data: {data_str}  \n"
+            + (f"📍 Sede: {evento['sede']}  \n" if evento.get("sede") else "")
+            + "📧 Per qualsiasi necessità rispondi all'email di conferma."
+        )
 
-    if st.button("← Nuova iscrizione"):
-        del st.session_state["ev_iscrizione_completata"]
-        st.rerun()
-    st.stop()
+        if st.button("← Nuova iscrizione"):
+            del st.session_state["ev_iscrizione_completata"]
+            st.rerun()
+        st.stop()
 
 
-st.markdown("## 📝 Iscriviti")
+    st.markdown("## 📝 Iscriviti")
 
-with st.form("form_iscrizione_pubblica"):
-    col1, col2 = st.columns(2)
-    with col1:
-        nome = st.text_input("Nome ✱", max_chars=100)
-    with col2:
-        cognome = st.text_input("Cognome ✱", max_chars=100)
+    with st.form("form_iscrizione_pubblica"):
+        col1, col2 = st.columns(2)
+        with col1:
+            nome = st.text_input("Nome ✱", max_chars=100)
+        with col2:
+            cognome = st.text_input("Cognome ✱", max_chars=100)
 
-    col3, col4 = st.columns(2)
-    with col3:
-        email = st.text_input("Email ✱", max_chars=200)
-    with col4:
-        telefono = st.text_input("Cellulare ✱", max_chars=50,
-                                 placeholder="Es. 333 1234567")
+        col3, col4 = st.columns(2)
+        with col3:
+            email = st.text_input("Email ✱", max_chars=200)
+        with col4:
+            telefono = st.text_input("Cellulare ✱", max_chars=50,
+                                     placeholder="Es. 333 1234567")
 
-    note = st.text_area("Note (opzionale)", max_chars=500, height=80,
-                        placeholder="Eventuali necessità, allergie, richieste particolari...")
+        note = st.text_area("Note (opzionale)", max_chars=500, height=80,
+                            placeholder="Eventuali necessità, allergie, richieste particolari...")
 
-    st.markdown("---")
-    st.markdown("### 🔒 Privacy")
+        st.markdown("---")
+        st.markdown("### 🔒 Privacy")
 
-    with st.expander("📖 Leggi l'informativa completa"):
-        st.markdown("""
+        with st.expander("📖 Leggi l'informativa completa"):
+            st.markdown("""
 **Informativa ai sensi dell'art. 13 del Reg. UE 2016/679 (GDPR)**
 
 **Titolare del trattamento**: Studio The Organism — Via De Rosa 46, 84016 Pagani (SA).
@@ -275,115 +276,117 @@ portabilità, revoca del consenso) scrivendo a info@theorganism.com.
 dei dati personali (www.garanteprivacy.it).
 """)
 
-    consenso_privacy = st.checkbox(
-        "✅ Ho letto l'informativa e acconsento al trattamento dei miei dati personali "
-        "per le finalità di gestione dell'iscrizione (obbligatorio).",
-    )
-    consenso_marketing = st.checkbox(
-        "📨 Acconsento a ricevere comunicazioni informative su prossimi eventi "
-        "e iniziative dello Studio (facoltativo).",
-    )
-
-    submitted = st.form_submit_button("📅 Confermare iscrizione", type="primary", use_container_width=True)
-
-
-# =============================================================================
-# HANDLER SUBMIT
-# =============================================================================
-
-if submitted:
-    # Validazioni base
-    errors = []
-    if not nome or not nome.strip():
-        errors.append("Il **nome** è obbligatorio.")
-    if not cognome or not cognome.strip():
-        errors.append("Il **cognome** è obbligatorio.")
-    if not email or "@" not in email or "." not in email.split("@")[-1]:
-        errors.append("L'**email** non è valida.")
-    # Cellulare obbligatorio + validazione base
-    tel_pulito = "".join(c for c in (telefono or "") if c.isdigit())
-    if not telefono or not telefono.strip():
-        errors.append("Il **cellulare** è obbligatorio.")
-    elif len(tel_pulito) < 9:
-        errors.append(
-            "Il **cellulare** non sembra valido. Inserisci un numero di "
-            "cellulare completo (es. 333 1234567)."
+        consenso_privacy = st.checkbox(
+            "✅ Ho letto l'informativa e acconsento al trattamento dei miei dati personali "
+            "per le finalità di gestione dell'iscrizione (obbligatorio).",
+        )
+        consenso_marketing = st.checkbox(
+            "📨 Acconsento a ricevere comunicazioni informative su prossimi eventi "
+            "e iniziative dello Studio (facoltativo).",
         )
-    if not consenso_privacy:
-        errors.append("Devi accettare l'**informativa privacy** per iscriverti.")
-
-    if errors:
-        for e in errors:
-            st.error(e)
-        st.stop()
 
-    # Check duplicato
-    try:
-        if email_gia_iscritta(conn, evento["id"], email):
-            st.error(
-                f"⚠️ L'email **{email}** risulta già iscritta a questo evento. "
-                "Controlla la tua casella di posta per la conferma. "
-                "Se non l'hai ricevuta, contatta lo Studio."
+        submitted = st.form_submit_button("📅 Confermare iscrizione", type="primary", use_container_width=True)
+
+
+    # =============================================================================
+    # HANDLER SUBMIT
+    # =============================================================================
+
+    if submitted:
+        # Validazioni base
+        errors = []
+        if not nome or not nome.strip():
+            errors.append("Il **nome** è obbligatorio.")
+        if not cognome or not cognome.strip():
+            errors.append("Il **cognome** è obbligatorio.")
+        if not email or "@" not in email or "." not in email.split("@")[-1]:
+            errors.append("L'**email** non è valida.")
+        # Cellulare obbligatorio + validazione base
+        tel_pulito = "".join(c for c in (telefono or "") if c.isdigit())
+        if not telefono or not telefono.strip():
+            errors.append("Il **cellulare** è obbligatorio.")
+        elif len(tel_pulito) < 9:
+            errors.append(
+                "Il **cellulare** non sembra valido. Inserisci un numero di "
+                "cellulare completo (es. 333 1234567)."
             )
-            st.stop()
-    except Exception as e:
-        logger.error("Check duplicato fallito", exc_info=True)
-        st.error(f"Errore di sistema: {e}")
-        st.stop()
+        if not consenso_privacy:
+            errors.append("Devi accettare l'**informativa privacy** per iscriverti.")
 
-    # Crea iscrizione
-    try:
-        nuova = crea_iscrizione(
-            conn,
-            evento_id=evento["id"],
-            nome=nome.strip(),
-            cognome=cognome.strip(),
-            email=email.strip().lower(),
-            telefono=(telefono or "").strip() or None,
-            note=(note or "").strip() or None,
-            consenso_privacy=True,
-            consenso_marketing=consenso_marketing,
-            sorgente="web_pubblico",
-        )
-    except ValueError as e:
-        st.error(f"⚠️ {e}")
-        st.stop()
-    except Exception as e:
-        logger.error("crea_iscrizione fallita", exc_info=True)
-        st.error(f"Errore registrazione iscrizione: {e}")
-        st.stop()
+        if errors:
+            for e in errors:
+                st.error(e)
+            st.stop()
 
-    # Genera PDF
-    pdf_bytes = None
-    pdf_problema = None
-    try:
-        pdf_bytes = genera_pdf_conferma(evento, nuova)
-    except Exception as e:
-        pdf_problema = str(e)
-        logger.error("PDF generazione fallita", exc_info=True)
+        # Check duplicato
+        try:
+            if email_gia_iscritta(conn, evento["id"], email):
+                st.error(
+                    f"⚠️ L'email **{email}** risulta già iscritta a questo evento. "
+                    "Controlla la tua casella di posta per la conferma. "
+                    "Se non l'hai ricevuta, contatta lo Studio."
+                )
+                st.stop()
+        except Exception as e:
+            logger.error("Check duplicato fallito", exc_info=True)
+            st.error(f"Errore di sistema: {e}")
+            st.stop()
 
-    # Invia email all'iscritto (+ Bcc allo studio)
-    email_problema = None
-    try:
-        invia_conferma_iscritto(evento, nuova, pdf_bytes=pdf_bytes)
-        mark_email_conferma_inviata(conn, nuova["id"])
-    except Exception as e:
-        email_problema = str(e)
-        logger.error("invio email iscritto fallito", exc_info=True)
+        # Crea iscrizione
+        try:
+            nuova = crea_iscrizione(
+                conn,
+                evento_id=evento["id"],
+                nome=nome.strip(),
+                cognome=cognome.strip(),
+                email=email.strip().lower(),
+                telefono=(telefono or "").strip() or None,
+                note=(note or "").strip() or None,
+                consenso_privacy=True,
+                consenso_marketing=consenso_marketing,
+                sorgente="web_pubblico",
+            )
+        except ValueError as e:
+            st.error(f"⚠️ {e}")
+            st.stop()
+        except Exception as e:
+            logger.error("crea_iscrizione fallita", exc_info=True)
+            st.error(f"Errore registrazione iscrizione: {e}")
+            st.stop()
 
-    # Invia notifica studio (best effort, non blocca)
-    try:
-        invia_notifica_studio(evento, nuova)
-    except Exception:
-        logger.error("notifica studio fallita", exc_info=True)
-
-    # Salva stato per la pagina "grazie"
-    st.session_state["ev_iscrizione_completata"] = {
-        "slug": slug,
-        "nome": nuova.get("nome"),
-        "email": nuova.get("email"),
-        "stato": nuova.get("stato"),
-        "email_problema": email_problema,
-        "pdf_problema": pdf_problema,
-    }
-    st.rerun()
+        # Genera PDF
+        pdf_bytes = None
+        pdf_problema = None
+        try:
+            pdf_bytes = genera_pdf_conferma(evento, nuova)
+        except Exception as e:
+            pdf_problema = str(e)
+            logger.error("PDF generazione fallita", exc_info=True)
+
+        # Invia email all'iscritto (+ Bcc allo studio)
+        email_problema = None
+        try:
+            invia_conferma_iscritto(evento, nuova, pdf_bytes=pdf_bytes)
+            mark_email_conferma_inviata(conn, nuova["id"])
+        except Exception as e:
+            email_problema = str(e)
+            logger.error("invio email iscritto fallito", exc_info=True)
+
+        # Invia notifica studio (best effort, non blocca)
+        try:
+            invia_notifica_studio(evento, nuova)
+        except Exception:
+            logger.error("notifica studio fallita", exc_info=True)
+
+        # Salva stato per la pagina "grazie"
+        st.session_state["ev_iscrizione_completata"] = {
+            "slug": slug,
+            "nome": nuova.get("nome"),
+            "email": nuova.get("email"),
+            "stato": nuova.get("stato"),
+            "email_problema": email_problema,
+            "pdf_problema": pdf_problema,
+        }
+        st.rerun()
+finally:
+    release_run_connections()   # anche dopo st.stop()
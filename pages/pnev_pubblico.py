@@ -20,6 +20,7 @@ from modules.public_questionnaires import (
     save_inpps_response,
     REGISTRY,
 )
+from modules.app_core import release_run_connections
 
 st.set_page_config(
     page_title="The Organism — Questionario PNEV",
@@ -52,12 +53,13 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 try:
-    init_public_tokens_table()
-except Exception as e:
-    st.error(f"Errore DB: {e}")
-    st.stop()
+    try:
+        init_public_tokens_table()
+    except Exception as e:
+        st.error(f"Errore DB: {e}")
+        st.stop()
 
-st.markdown("""
+    st.markdown("""
 <div style="text-align:center;padding:1rem 0 0.3rem">
     <span style="font-size:2.6rem">🌿</span>
 </div>
@@ -68,40 +70,40 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-qp     = st.query_params
-q_type = (qp.get("q", "") or "").upper().strip()
-token  = (qp.get("t", "") or "").strip()
-
-if not q_type or not token:
-    st.warning(
-        "Pagina riservata ai pazienti dello Studio The Organism.\n\n"
-        "Se hai ricevuto un link dallo studio, assicurati di aprirlo per intero."
-    )
-    st.caption("📞 0815152334 · dr.ferraioligiuseppe@gmail.com · www.theorganism.it")
-    st.stop()
-
-if q_type not in REGISTRY:
-    st.error(f"Tipo questionario '{q_type}' non riconosciuto.")
-    st.stop()
-
-rec = validate_public_token(token, q_type)
-if rec is None:
-    st.error(
-        "⛔ Link non valido, già utilizzato o scaduto.\n\n"
-        "Contatta lo studio per ricevere un nuovo link:\n"
-        "📞 0815152334 · dr.ferraioligiuseppe@gmail.com"
-    )
-    st.stop()
-
-paziente_id   = int(rec["paziente_id"])
-nome_paziente = rec.get("nome_paziente", "")
-token_id      = int(rec["id"])
-
-if "pq_completato" not in st.session_state:
-    st.session_state.pq_completato = False
-
-if st.session_state.pq_completato:
-    st.markdown("""
+    qp     = st.query_params
+    q_type = (qp.get("q", "") or "").upper().strip()
+    token  = (qp.get("t", "") or "").strip()
+
+    if not q_type or not token:
+        st.warning(
+            "Pagina riservata ai pazienti dello Studio The Organism.\n\n"
+            "Se hai ricevuto un link dallo studio, assicurati di aprirlo per intero."
+        )
+        st.caption("📞 0815152334 · dr.ferraioligiuseppe@gmail.com · www.theorganism.it")
+        st.stop()
+
+    if q_type not in REGISTRY:
+        st.error(f"Tipo questionario '{q_type}' non riconosciuto.")
+        st.stop()
+
+    rec = validate_public_token(token, q_type)
+    if rec is None:
+        st.error(
+            "⛔ Link non valido, già utilizzato o scaduto.\n\n"
+            "Contatta lo studio per ricevere un nuovo link:\n"
+            "📞 0815152334 · dr.ferraioligiuseppe@gmail.com"
+        )
+        st.stop()
+
+    paziente_id   = int(rec["paziente_id"])
+    nome_paziente = rec.get("nome_paziente", "")
+    token_id      = int(rec["id"])
+
+    if "pq_completato" not in st.session_state:
+        st.session_state.pq_completato = False
+
+    if st.session_state.pq_completato:
+        st.markdown("""
     <div class="completato-box">
         <div style="font-size:3rem;margin-bottom:0.5rem">✅</div>
         <h2 style="color:#1D6B44 !important;-webkit-text-fill-color:#1D6B44 !important">
@@ -116,42 +118,44 @@ if st.session_state.pq_completato:
         </p>
     </div>
     """, unsafe_allow_html=True)
-    st.stop()
+        st.stop()
 
-reg_info = REGISTRY[q_type]
-st.markdown(f"### {reg_info['label']}")
-if nome_paziente:
-    st.caption(f"Paziente: **{nome_paziente}**")
-st.caption("Compila e premi **INVIA**. Le risposte verranno registrate nel gestionale.")
+    reg_info = REGISTRY[q_type]
+    st.markdown(f"### {reg_info['label']}")
+    if nome_paziente:
+        st.caption(f"Paziente: **{nome_paziente}**")
+    st.caption("Compila e premi **INVIA**. Le risposte verranno registrate nel gestionale.")
 
-if q_type in ("INPPS", "INPPS_ADULTI"):
-    try:
-        from app_core import inpps_collect_ui
-    except ImportError:
+    if q_type in ("INPPS", "INPPS_ADULTI"):
         try:
-            from modules.app_core import inpps_collect_ui
+            from app_core import inpps_collect_ui
         except ImportError:
-            st.error("Impossibile caricare il questionario. Contattare lo studio: 📞 0815152334")
-            st.stop()
-
-    with st.form("public_form"):
-        inpps_data, inpps_summary = inpps_collect_ui(
-            prefix=f"pub_{q_type.lower()}",
-            existing=None,
-        )
-        submitted = st.form_submit_button(
-            "✅ INVIA QUESTIONARIO",
-            type="primary",
-            use_container_width=True,
-        )
-
-    if submitted:
-        try:
-            save_inpps_response(paziente_id, inpps_data, inpps_summary)
-            mark_token_used(token_id)
-            st.session_state.pq_completato = True
-            st.rerun()
-        except Exception as e:
-            st.error(f"Errore salvataggio: {e}\n\nRiprova o contatta lo studio: 📞 0815152334")
-else:
-    st.info(f"Il questionario **{reg_info['label']}** è in fase di attivazione.")
+            try:
+                from modules.app_core import inpps_collect_ui
+            except ImportError:
+                st.error("Impossibile caricare il questionario. Contattare lo studio: 📞 0815152334")
+                st.stop()
+
+        with st.form("public_form"):
+            inpps_data, inpps_summary = inpps_collect_ui(
+                prefix=f"pub_{q_type.lower()}",
+                existing=None,
+            )
+            submitted = st.form_submit_button(
+                "✅ INVIA QUESTIONARIO",
+                type="primary",
+                use_container_width=True,
+            )
+
+        if submitted:
+            try:
+                save_inpps_response(paziente_id, inpps_data, inpps_summary)
+                mark_token_used(token_id)
+                st.session_state.pq_completato = True
+                st.rerun()
+            except Exception as e:
+                st.error(f"Errore salvataggio: {e}\n\nRiprova o contatta lo studio: 📞 0815152334")
+    else:
+        st.info(f"Il questionario **{reg_info['label']}** è in fase di attivazione.")
+finally:
+    release_run_connections()   # anche dopo st.stop()
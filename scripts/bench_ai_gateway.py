@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/bench_ai_gateway.py
+
+Verifica OFFLINE del gateway AI (modules/ai_gateway) contro un finto
+endpoint OpenAI compatibile avviato in locale (chat/completions, anche in
+streaming SSE): nessuna chiave vera, nessuna chiamata esterna.
+
+Controlla:
+  - cache: la stessa richiesta due volte arriva al server una volta sola;
+    scaduto AI_CACHE_TTL_S viene rifatta; oltre AI_CACHE_MAX si scartano le
+    voci più vecchie;
+  - concorrenza: con più thread in parallelo il server non vede mai più di
+    AI_MAX_CONCORRENTI richieste in corso;
+  - streaming: più pezzi in arrivo, poi la stessa richiesta esce dalla cache
+    in un pezzo solo;
+  - stream chiuso dal chiamante (rerun Streamlit): slot rilasciato, niente
+    cache;
+  - stream interrotto dal server a metà: il gateway solleva eccezione,
+    niente cache, metrica con errore, e ai_estrazione.genera_testo_stream lo
+    segnala in esito["errore"] (la diagnosi assistita non firma la bozza).
+
+Stampa le latenze (riepilogo() del gateway) e un OK/ERRORE per controllo.
+
+Uso:
+    python scripts/bench_ai_gateway.py
+
+Exit code: 0 ok, 1 almeno un controllo fallito.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+TTL_S = 1.0
+MAX_CACHE = 3
+MAX_CONCORRENTI = 2
+RITARDO_S = 0.2          # tempo di risposta del finto endpoint
+INTERROMPI = "[interrompi]"  # nel prompt: il server chiude lo stream a metà
+
+_stato = {"richieste": 0, "in_corso": 0, "max_in_corso": 0}
+_stato_lock = threading.Lock()
+
+
+class _FintoOpenAI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with _stato_lock:
+            _stato["richieste"] += 1
+            _stato["in_corso"] += 1
+            _stato["max_in_corso"] = max(_stato["max_in_corso"], _stato["in_corso"])
+        try:
+            time.sleep(RITARDO_S)
+            prompt = str(body["messages"][-1]["content"])
+            testo = "eco: " + prompt
+            if body.get("stream"):
+                try:
+                    self._stream(body["model"], testo, interrompi=INTERROMPI in prompt)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass    # stream chiuso dal chiamante
+            else:
+                self._json({
+                    "id": "c", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": testo}}],
+                    "usage": {"prompt_tokens": 11, "completion_tokens": 7, "total_tokens": 18},
+                })
+        finally:
+            with _stato_lock:
+                _stato["in_corso"] -= 1
+
+    def _stream(self, modello: str, testo: str, interrompi: bool) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def evento(dati) -> None:
+            b = ("data: " + (dati if isinstance(dati, str) else json.dumps(dati)) + "\n\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(b), b))
+            self.wfile.flush()
+
+        parole = testo.split(" ")
+        for i, w in enumerate(parole):
+            if interrompi and i == len(parole) // 2:
+                # connessione chiusa senza chiudere il corpo chunked
+                self.close_connection = True
+                return
+            evento({"id": "c", "object": "chat.completion.chunk", "created": 0, "model": modello,
+                    "choices": [{"index": 0, "delta": {"content": w + " "}, "finish_reason": None}]})
+            time.sleep(0.02)
+        evento({"id": "c", "object": "chat.completion.chunk", "created": 0, "model": modello,
+                "choices": [], "usage": {"prompt_tokens": 11, "completion_tokens": 7,
+                                         "total_tokens": 18}})
+        evento("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _json(self, o) -> None:
+        b = json.dumps(o).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+
+def _richieste() -> int:
+    with _stato_lock:
+        return _stato["richieste"]
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FintoOpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for k in ("GEMINI_API_KEY", "GEMINI_MODEL"):
+        os.environ.pop(k, None)
+    os.environ.update(
+        OPENAI_API_KEY="finta", OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_port}/v1",
+        AI_CACHE_TTL_S=str(TTL_S), AI_CACHE_MAX=str(MAX_CACHE),
+        AI_MAX_CONCORRENTI=str(MAX_CONCORRENTI), AI_TIMEOUT_S="10",
+    )
+    from modules import ai_gateway as gw
+
+    esiti: list[tuple[str, bool, str]] = []
+
+    def controlla(nome: str, ok: bool, dettaglio: str = "") -> None:
+        esiti.append((nome, bool(ok), dettaglio))
+
+    try:
+        # cache, TTL, numero massimo di voci
+        n = _richieste()
+        a = gw.completa("ciao", sistema="S")
+        b = gw.completa("ciao", sistema="S")
+        controlla("cache", a == b and _richieste() == n + 1, f"{_richieste() - n} richieste")
+        time.sleep(TTL_S + 0.1)
+        gw.completa("ciao", sistema="S")
+        controlla("TTL", _richieste() == n + 2, f"{_richieste() - n} richieste")
+        for i in range(MAX_CACHE + 2):
+            gw.completa(f"voce {i}")
+        controlla("AI_CACHE_MAX", len(gw._cache) == MAX_CACHE, f"{len(gw._cache)} voci")
+
+        # limite di concorrenza
+        with _stato_lock:
+            _stato["max_in_corso"] = 0
+        t0 = time.perf_counter()
+        thr = [threading.Thread(target=gw.completa, args=(f"parallela {i}",)) for i in range(8)]
+        for t in thr:
+            t.start()
+        for t in thr:
+            t.join()
+        controlla("AI_MAX_CONCORRENTI", _stato["max_in_corso"] <= MAX_CONCORRENTI,
+                  f"max {_stato['max_in_corso']} in corso, 8 chiamate in "
+                  f"{time.perf_counter() - t0:.2f}s")
+
+        # streaming completo, poi dalla cache
+        pezzi = list(gw.stream("uno due tre quattro"))
+        ripetuto = list(gw.stream("uno due tre quattro"))
+        controlla("stream", len(pezzi) > 2 and ripetuto == ["".join(pezzi).strip()],
+                  f"{len(pezzi)} pezzi, poi {len(ripetuto)} dalla cache")
+
+        # stream chiuso dal chiamante
+        n = _richieste()
+        it = gw.stream("chiuso dal chiamante a metà")
+        next(it)
+        it.close()
+        list(gw.stream("chiuso dal chiamante a metà"))
+        controlla("stream chiuso dal chiamante",
+                  gw._slot({})._value == MAX_CONCORRENTI and _richieste() == n + 2,
+                  "slot rilasciato, non in cache")
+
+        # stream interrotto dal server
+        n = _richieste()
+        prompt = f"cinque sei sette otto nove {INTERROMPI}"
+        arrivati: list[str] = []
+        errore = ""
+        try:
+            for p in gw.stream(prompt):
+                arrivati.append(p)
+        except Exception as e:
+            errore = type(e).__name__
+        ultima = gw.metriche()[-1]
+        try:
+            list(gw.stream(prompt))
+        except Exception:
+            pass
+        controlla("stream interrotto dal server",
+                  bool(errore) and bool(arrivati) and ultima["errore"] and _richieste() == n + 2
+                  and gw._slot({})._value == MAX_CONCORRENTI,
+                  f"{len(arrivati)} pezzi poi {errore or 'nessun errore'}, non in cache")
+
+        # ai_estrazione segnala l'interruzione al chiamante
+        try:
+            from modules import ai_estrazione
+        except Exception as e:
+            controlla("genera_testo_stream esito", False, f"import: {type(e).__name__}: {e}")
+        else:
+            ai_estrazione.ai_disponibile = lambda: True
+            esito: dict = {}
+            testo = "".join(ai_estrazione.genera_testo_stream(prompt, esito=esito))
+            ok: dict = {}
+            "".join(ai_estrazione.genera_testo_stream("dieci undici", esito=ok))
+            controlla("genera_testo_stream esito",
+                      bool(esito.get("errore")) and "⚠️" in testo and not ok,
+                      esito.get("errore", "")[:60])
+    finally:
+        server.shutdown()
+
+    for nome, ok, dettaglio in esiti:
+        print(f"{nome:<30} {'OK' if ok else 'ERRORE':<7} {dettaglio}")
+    print("riepilogo:", gw.riepilogo())
+    return 0 if all(ok for _n, ok, _d in esiti) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/bench_gaze_analytics.py
+
+Benchmark della pipeline run_gaze_analytics (modules/gaze_tracking/analytics_gaze)
+su registrazioni SINTETICHE di lettura: 120 Hz, righe di testo da 2 s,
+rumore di fissazione, regressioni (~3%) e campioni persi per blink (~2%).
+
+Per ogni dimensione stampa il tempo di ogni fase, il totale e i campioni al
+secondo. Non tocca il database.
+
+Uso:
+    python scripts/bench_gaze_analytics.py
+    python scripts/bench_gaze_analytics.py 10000 250000 1000000
+    RIPETIZIONI=5 python scripts/bench_gaze_analytics.py
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from modules.gaze_tracking import analytics_gaze as ag
+
+DIMENSIONI = (10_000, 100_000, 1_000_000)
+HZ = 120.0
+CAMPIONI_PER_RIGA = 240
+
+
+def registrazione_sintetica(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    i = np.arange(n)
+    x = (i % CAMPIONI_PER_RIGA) * 4.0 + rng.normal(0, 3, n)
+    x[rng.random(n) < 0.03] -= 40.0
+    y = (i // CAMPIONI_PER_RIGA) * 60.0 + rng.normal(0, 5, n)
+    y[rng.random(n) < 0.02] = np.nan
+    return pd.DataFrame({
+        "ts_ms": i * (1000.0 / HZ),
+        "gaze_x": x,
+        "gaze_y": y,
+        "confidence": rng.random(n),
+        "eye_left_x": x + 3.0, "eye_left_y": y,
+        "eye_right_x": x - 3.0, "eye_right_y": y + 1.0,
+        "distance_cm_est": rng.normal(55.0, 8.0, n),
+    })
+
+
+def _fasi(df: pd.DataFrame) -> dict[str, float]:
+    t = {}
+    t0 = time.perf_counter()
+    out = ag.clean_gaze_signal(df)
+    t["clean"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ag.detect_fixations_and_saccades(out, inplace=True)
+    t["fix/sacc"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ag.cluster_reading_lines(out, inplace=True)
+    t["righe"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ag.assign_fixations_to_lines(out, inplace=True)
+    ag.classify_reading_transitions(out, inplace=True)
+    t["transizioni"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ag.run_gaze_analytics(df)
+    t["totale"] = time.perf_counter() - t0
+    return t
+
+
+def main(argv: list[str]) -> int:
+    dimensioni = [int(a) for a in argv] or list(DIMENSIONI)
+    ripetizioni = max(1, int(os.environ.get("RIPETIZIONI", "3")))
+    print(f"{'campioni':>10}  {'clean':>8}  {'fix/sacc':>8}  {'righe':>8}  "
+          f"{'transiz.':>8}  {'totale':>8}  {'camp./s':>12}")
+    for n in dimensioni:
+        df = registrazione_sintetica(n)
+        migliori: dict[str, float] = {}
+        for _ in range(ripetizioni):
+            for k, v in _fasi(df).items():
+                migliori[k] = min(v, migliori.get(k, v))
+        print(f"{n:>10}  "
+              + "  ".join(f"{migliori[k] * 1000:>6.1f}ms"
+                          for k in ("clean", "fix/sacc", "righe", "transizioni", "totale"))
+              + f"  {n / migliori['totale']:>12,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/bench_import_gaze.py
+
+Benchmark dell'import eye tracker (modules/gaze_tracking/importer_gaze) su un
+export Tobii Pro Lab SINTETICO (CSV, 120 Hz, colonne di validità ed eventi
+che il normalizzatore non usa).
+
+Confronta, fino allo stream binario di COPY (senza database):
+  - import_eye_tracking_file: read() + read_csv di tutto il file;
+  - EyeTrackerChunkReader: blocchi con proiezione colonne e dtype espliciti.
+Generazione dell'export e ogni misura girano in sottoprocessi separati, per
+avere il picco di memoria (maxrss) di ciascun percorso.
+
+Con --verifica confronta invece i due percorsi su un export piccolo con
+celle segnaposto ("-", "N/A", vuote) come quelle di Tobii Pro Lab per i
+campioni persi: devono importare le stesse righe, con NaN al posto dei
+segnaposto.
+
+Uso:
+    python scripts/bench_import_gaze.py               # 1M righe, tetto 64 MB
+    python scripts/bench_import_gaze.py 3000000 128
+    python scripts/bench_import_gaze.py --verifica    # exit 1 se differiscono
+"""
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+
+def export_sintetico(path: str, n: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        "Recording timestamp": (np.arange(n) * 8333).astype(np.int64),
+        "Gaze point X": rng.uniform(0, 1920, n).round(1),
+        "Gaze point Y": rng.uniform(0, 1080, n).round(1),
+        "Validity left": rng.choice(["Valid", "Invalid"], n),
+        "Validity right": "Valid",
+        "Left gaze point X": rng.uniform(0, 1920, n).round(2),
+        "Left gaze point Y": rng.uniform(0, 1080, n).round(2),
+        "Right gaze point X": rng.uniform(0, 1920, n).round(2),
+        "Right gaze point Y": rng.uniform(0, 1080, n).round(2),
+        "Participant name": "P01",
+        "Eye movement type": rng.choice(["Fixation", "Saccade"], n),
+    }).to_csv(path, index=False)
+
+
+def export_segnaposto(path: str, n: int = 5000, seed: int = 1) -> None:
+    """Export sintetico con segnaposto sparsi nelle colonne numeriche (anche
+    dopo il primo blocco di prova, per i blocchi successivi)."""
+    export_sintetico(path, n, seed)
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    rng = np.random.default_rng(seed)
+    for col in ("Gaze point X", "Gaze point Y", "Left gaze point X", "Right gaze point Y"):
+        righe = rng.choice(n, size=n // 20, replace=False)
+        df.loc[righe, col] = rng.choice(["-", "N/A", ""], size=len(righe))
+    df.loc[n - 1, "Recording timestamp"] = "-"
+    df.to_csv(path, index=False)
+
+
+def verifica() -> int:
+    """Chunk reader e import intero sullo stesso export con segnaposto."""
+    from modules.gaze_tracking import importer_gaze as ig
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export_tobii_segnaposto.csv")
+        export_segnaposto(path)
+        with open(path, "rb") as f:
+            atteso = ig.import_eye_tracking_file(f, forced_vendor="tobii").df
+        reader = ig.EyeTrackerChunkReader(path, forced_vendor="tobii", chunk_rows=1_500)
+        blocchi = pd.concat(list(reader), ignore_index=True)
+    cols = ["ts_ms", "gaze_x", "gaze_y", "eye_left_x", "eye_left_y", "eye_right_x", "eye_right_y"]
+    a = atteso[cols].sort_values("ts_ms", kind="stable").reset_index(drop=True)
+    b = blocchi[cols].sort_values("ts_ms", kind="stable").reset_index(drop=True)
+    ok = len(a) == len(b) and np.allclose(a.to_numpy(float), b.to_numpy(float),
+                                          rtol=1e-6, atol=1e-3, equal_nan=True)
+    print(f"intero {len(a)} righe, blocchi {len(b)} righe "
+          f"({reader.chunks} blocchi), gaze_x NaN {int(b['gaze_x'].isna().sum())}: "
+          f"{'OK' if ok else 'DIFFERENZE'}")
+    return 0 if ok else 1
+
+
+def _misura(percorso: str, path: str, max_mb: float) -> None:
+    """Eseguita nel sottoprocesso: stampa secondi, righe e maxrss."""
+    import resource
+
+    from modules.gaze_tracking import db_gaze_tracking as db
+    from modules.gaze_tracking import importer_gaze as ig
+
+    def drain(stream) -> None:
+        while stream.read(1 << 16):
+            pass
+
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    if percorso == "intero":
+        with open(path, "rb") as f:
+            res = ig.import_eye_tracking_file(f)
+        stream = db._CopyStream(db._df_parts(res.df, db.BULK_CHUNK_ROWS), 1)
+    else:
+        reader = ig.EyeTrackerChunkReader(path, forced_vendor="tobii", max_memory_mb=max_mb)
+        stream = db._CopyStream(reader, 1, encode_rows=reader.encode_rows)
+    drain(stream)
+    secs = time.perf_counter() - t0
+    rss_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024
+    print(f"{secs:.3f} {stream.rows} {rss_mb:.0f}")
+
+
+def main(argv: list[str]) -> int:
+    if argv and argv[0] == "--verifica":
+        return verifica()
+    if argv and argv[0] == "--misura":
+        _misura(argv[1], argv[2], float(argv[3]))
+        return 0
+    if argv and argv[0] == "--genera":
+        export_sintetico(argv[1], int(argv[2]))
+        return 0
+    n = int(argv[0]) if argv else 1_000_000
+    max_mb = float(argv[1]) if len(argv) > 1 else 64.0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export_tobii.csv")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--genera", path, str(n)], check=True)
+        print(f"export: {n} righe, {os.path.getsize(path) / 1e6:.1f} MB, tetto {max_mb:g} MB")
+        print(f"{'percorso':>10}  {'secondi':>8}  {'righe':>10}  {'maxrss +MB':>10}")
+        for percorso in ("intero", "blocchi"):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--misura", percorso, path, str(max_mb)],
+                check=True, capture_output=True, text=True,
+            ).stdout.split()
+            print(f"{percorso:>10}  {float(out[0]):>8.2f}  {int(out[1]):>10}  {float(out[2]):>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
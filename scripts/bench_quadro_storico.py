@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/bench_quadro_storico.py
+
+Benchmark del caricamento del quadro storico su un paziente con MOLTI
+documenti (default 100 referti da 2 MB = 200 MB di BYTEA), confrontando:
+  - prima: una SELECT * per sorgente (13 query, BYTEA e JSON compresi);
+  - dopo:  quadro_storico.carica_timeline (una UNION ALL con le sole
+           colonne di PROIEZIONI, ordinata dal server).
+
+Lavora in uno schema temporaneo (bench_quadro_<pid>) creato e poi
+cancellato: non tocca le tabelle dell'applicazione. Usare un database di
+test.
+
+Uso:
+    TEST_DATABASE_URL=postgresql://... python scripts/bench_quadro_storico.py
+    TEST_DATABASE_URL=... DOCUMENTI=50 DOC_MB=4 RIPETIZIONI=5 python scripts/bench_quadro_storico.py
+
+Exit code: 0 ok, 2 configurazione mancante.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# schema minimo delle sorgenti del quadro (stesse colonne dei moduli)
+_DDL = """
+CREATE TABLE documenti_clinici (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT NOT NULL,
+    studio_id INT, tipo TEXT, nome_file TEXT, mime TEXT, dati BYTEA, note TEXT,
+    estratto TEXT, data TIMESTAMP DEFAULT NOW());
+CREATE TABLE getman_risultati (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    data TIMESTAMP DEFAULT NOW(), punteggio INT, classe TEXT, atteso INT);
+CREATE TABLE groffman_risultati (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    data TIMESTAMP DEFAULT NOW(), forma TEXT, punteggio INT, eta INT, osservazioni TEXT);
+CREATE TABLE dem_risultati (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    data TIMESTAMP DEFAULT NOW(), eta INT, vt REAL, ht REAL);
+CREATE TABLE valutazioni_visive (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    data_valutazione TEXT, professionista TEXT, visita_json JSONB);
+CREATE TABLE anamnesi (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT, data_anamnesi DATE,
+    motivo TEXT, pnev_json JSONB, pnev_summary TEXT);
+CREATE TABLE logopedia_valutazioni (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    data TIMESTAMP DEFAULT NOW(), tipo TEXT, dati JSONB, sintesi TEXT);
+CREATE TABLE logopedia_sedute (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    data_seduta DATE, numero INT, aree TEXT, obiettivo TEXT, attivita TEXT,
+    risposta TEXT, compiti TEXT, note TEXT, creato TIMESTAMP DEFAULT NOW());
+CREATE TABLE logopedia_obiettivi (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    area TEXT, descrizione TEXT, baseline INT, attuale INT, target INT, stato TEXT,
+    data_inizio DATE, data_rivalut DATE, note TEXT, creato TIMESTAMP DEFAULT NOW());
+CREATE TABLE terapia_sedute (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT, terapia TEXT,
+    data_seduta DATE, numero INT, professionista TEXT, obiettivo TEXT, attivita TEXT,
+    risposta TEXT, costo REAL, sconto REAL, incassato REAL, metodo TEXT, note TEXT,
+    creato TIMESTAMP DEFAULT NOW());
+CREATE TABLE terapia_obiettivi (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT, terapia TEXT,
+    descrizione TEXT, baseline INT, attuale INT, target INT, stato TEXT,
+    data_inizio DATE, data_rivalut DATE, note TEXT, creato TIMESTAMP DEFAULT NOW());
+CREATE TABLE terapia_programma (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    procedura_id BIGINT, approccio TEXT, step TEXT, nome TEXT, stato TEXT, note TEXT,
+    data_inserim DATE DEFAULT CURRENT_DATE, creato TIMESTAMP DEFAULT NOW());
+CREATE TABLE esiti_pnev (id BIGSERIAL PRIMARY KEY, paziente_id BIGINT,
+    data TIMESTAMP DEFAULT NOW(), intervento TEXT, esito TEXT, note TEXT);
+"""
+
+PAZ = 1
+
+
+def _popola(conn, n_doc: int, doc_mb: float) -> None:
+    cur = conn.cursor()
+    blob = os.urandom(int(doc_mb * 1024 * 1024))
+    for i in range(n_doc):
+        cur.execute(
+            "INSERT INTO documenti_clinici (paziente_id, tipo, nome_file, mime, dati, estratto, data) "
+            "VALUES (%s, 'Referto', %s, 'application/pdf', %s, %s, NOW() - %s * interval '1 day')",
+            (PAZ, f"referto_{i:03d}.pdf", blob, "Visus 10/10 OO; motilità nella norma.", i),
+        )
+        conn.commit()
+    visita = '{"campi": "%s"}' % ("x" * 20000)
+    for i in range(40):
+        cur.execute("INSERT INTO getman_risultati (paziente_id, punteggio, classe) VALUES (%s, %s, 'B')", (PAZ, i % 12))
+        cur.execute("INSERT INTO valutazioni_visive (paziente_id, data_valutazione, visita_json) "
+                    "VALUES (%s, %s, %s::jsonb)", (PAZ, f"2024-01-{i % 28 + 1:02d}", visita))
+        cur.execute("INSERT INTO logopedia_valutazioni (paziente_id, dati, sintesi) VALUES (%s, %s::jsonb, 'ok')",
+                    (PAZ, visita))
+        cur.execute("INSERT INTO logopedia_sedute (paziente_id, data_seduta, numero, obiettivo) "
+                    "VALUES (%s, CURRENT_DATE - %s, %s, 'lettura')", (PAZ, i, i))
+        cur.execute("INSERT INTO terapia_sedute (paziente_id, terapia, data_seduta, obiettivo, risposta) "
+                    "VALUES (%s, 'VT', CURRENT_DATE - %s, 'vergenze', 'buona')", (PAZ, i))
+        cur.execute("INSERT INTO esiti_pnev (paziente_id, intervento, esito) VALUES (%s, 'VT', 'migliorato')", (PAZ,))
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.commit()
+
+
+def _migliore(fn, ripetizioni: int) -> float:
+    best = float("inf")
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> int:
+    url = (os.getenv("TEST_DATABASE_URL") or "").strip()
+    if not url:
+        print("ERRORE: impostare TEST_DATABASE_URL (database di test).")
+        return 2
+    import psycopg2
+
+    from modules.quadro_storico import PROIEZIONI, _query, carica_timeline
+
+    n_doc = int(os.getenv("DOCUMENTI", "100"))
+    doc_mb = float(os.getenv("DOC_MB", "2"))
+    ripetizioni = max(1, int(os.getenv("RIPETIZIONI", "3")))
+    schema = f"bench_quadro_{os.getpid()}"
+
+    conn = psycopg2.connect(url, connect_timeout=15)
+    cur = conn.cursor()
+    try:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path TO {schema}")
+        cur.execute(_DDL)
+        conn.commit()
+        print(f"popolo {n_doc} documenti da {doc_mb:g} MB ...")
+        _popola(conn, n_doc, doc_mb)
+
+        def prima():
+            for p in PROIEZIONI:
+                _query(conn, f"SELECT * FROM {p.tabella} WHERE paziente_id=%s", (PAZ,))
+
+        def dopo():
+            carica_timeline(conn, PAZ)
+
+        dopo()  # catalogo colonne in cache, come in una sessione già avviata
+        t_prima = _migliore(prima, ripetizioni)
+        t_dopo = _migliore(dopo, ripetizioni)
+        righe = sum(len(v or []) for v in carica_timeline(conn, PAZ).values())
+        print(f"{'percorso':>22}  {'secondi':>8}  {'query':>5}")
+        print(f"{'SELECT * per sorgente':>22}  {t_prima:>8.3f}  {len(PROIEZIONI):>5}")
+        print(f"{'carica_timeline':>22}  {t_dopo:>8.3f}  {1:>5}")
+        print(f"righe: {righe}  ·  {t_prima / t_dopo:.0f}x")
+    finally:
+        try: conn.rollback()
+        except Exception: pass
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.commit()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
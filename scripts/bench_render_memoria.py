@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/bench_render_memoria.py
+
+Benchmark di MEMORIA del render della stimolazione uditiva
+(modules/stimolazione_uditiva/render_final): per ogni durata scrive su disco
+un WAV 16-bit stereo SINTETICO (rumore a -12 dBFS, generato a blocchi) e
+misura con tracemalloc il picco di memoria allocata da Python/NumPy per:
+
+  - render_stream  da file a file (percorso del worker): deve restare
+    costante al crescere della durata, limitato da BLOCK_FRAMES;
+  - render_full    da bytes a bytes (percorso della UI): cresce con il brano,
+    perché input e output stanno in memoria come bytes;
+  - process_render_job END TO END (con TEST_DATABASE_URL): job con upload
+    salvato a blocchi, lettura dell'input, render e salvataggio degli output
+    (render_job_file_parti, o blob store se BLOB_STORE è impostato), come lo
+    esegue il worker; "job prima" è lo stesso job con il salvataggio di
+    prima (fh.read() + save_job_file in un solo BYTEA).
+
+Stampa anche secondi di render e fattore realtime. Le colonne dei job
+lavorano in uno schema temporaneo (bench_render_<pid>) poi cancellato; la
+render cache è disattivata (STIMOLAZIONE_CACHE_MB=0) per misurare il DSP.
+
+Uso:
+    python scripts/bench_render_memoria.py                 # 60 s e 600 s
+    python scripts/bench_render_memoria.py 60 600 3600     # durate in secondi
+    FORMATI=wav,flac python scripts/bench_render_memoria.py
+    TEST_DATABASE_URL=postgresql://... python scripts/bench_render_memoria.py
+"""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+
+os.environ.setdefault("STIMOLAZIONE_CACHE_MB", "0")
+
+from modules.stimolazione_uditiva import db_jobs, render_worker
+from modules.stimolazione_uditiva.db_jobs import TOMATIS_PRESETS_DEFAULT
+from modules.stimolazione_uditiva.render_final import BLOCK_FRAMES, render_full, render_stream
+
+DURATE = (60, 600)
+FS = 44100
+EQ_SX = {125: -5.0, 250: -3.0, 500: 1.5, 1000: 2.0, 2000: 4.0, 4000: 6.0, 6000: 8.0, 8000: 6.0}
+EQ_DX = {125: -4.0, 250: -2.0, 500: 0.5, 1000: 3.0, 2000: 5.0, 4000: 7.0, 6000: 6.0, 8000: 4.0}
+PRESET = dict(TOMATIS_PRESETS_DEFAULT)["STANDARD"]
+
+
+def scrivi_wav_sintetico(path: str, secondi: float, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    n = int(secondi * FS)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(FS)
+        for i in range(0, n, 1 << 18):
+            k = min(1 << 18, n - i)
+            x = rng.standard_normal((k, 2)) * (10 ** (-12 / 20) / 4.0)
+            wf.writeframes((np.clip(x, -1, 1) * 32767).astype("<i2").tobytes())
+
+
+def _picco(fn) -> tuple[float, float]:
+    """(picco MB, secondi) di fn() misurati con tracemalloc."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn()
+    secs = time.perf_counter() - t0
+    _cur, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6, secs
+
+
+def _prepara_db(conn, schema: str) -> int:
+    """Schema temporaneo con tabelle ORL/EQ e job; ritorna l'id del profilo EQ."""
+    import json
+
+    from modules.stimolazione_uditiva.schema import ensure_audio_schema
+
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path TO {schema}")
+    conn.commit()
+    ok, msg = ensure_audio_schema(conn)
+    if not ok:
+        raise RuntimeError(msg)
+    db_jobs.ensure_jobs_schema(conn)
+    db_jobs.seed_tomatis_presets(conn)
+    cur.execute(
+        "INSERT INTO eq_profiles (paziente_id, nome, gain_dx_json, gain_sx_json) "
+        "VALUES (1, 'bench', %s::jsonb, %s::jsonb) RETURNING id",
+        (json.dumps(EQ_DX), json.dumps(EQ_SX)),
+    )
+    eq_id = int(cur.fetchone()[0])
+    conn.commit()
+    return eq_id
+
+
+def _job(conn, eq_id: int, src: str, formati: list[str], prima: bool) -> None:
+    """Un job come lo esegue il worker: upload salvato, claim, process_render_job."""
+    preset_id = dict((n, i) for i, n, *_ in db_jobs.list_tomatis_presets(conn))["STANDARD"]
+    jid = db_jobs.create_render_job(conn, 1, eq_id, preset_id, "upload", os.path.basename(src),
+                                    {"gate_seed": 0, "out_formats": formati})
+    with open(src, "rb") as fh:
+        db_jobs.save_job_file_stream(conn, jid, "input", "src", fh, filename=os.path.basename(src))
+    job = db_jobs.claim_next_render_job(conn, "bench")
+    salva = render_worker.save_job_file_stream
+    if prima:
+        render_worker.save_job_file_stream = lambda c, j, r, f, fh, filename=None: \
+            db_jobs.save_job_file(c, j, r, f, fh.read(), filename=filename)
+    try:
+        render_worker.process_render_job(conn, job)
+    finally:
+        render_worker.save_job_file_stream = salva
+
+
+def main(argv: list[str]) -> int:
+    durate = [float(a) for a in argv] or list(DURATE)
+    formati = [f.strip() for f in os.environ.get("FORMATI", "wav").split(",") if f.strip()]
+    url = (os.getenv("TEST_DATABASE_URL") or "").strip()
+    conn = schema = None
+    if url:
+        import psycopg2
+        conn = psycopg2.connect(url, connect_timeout=15)
+        schema = f"bench_render_{os.getpid()}"
+        eq_id = _prepara_db(conn, schema)
+    print(f"Formati: {','.join(formati)}  blocco: {BLOCK_FRAMES} frame"
+          + ("" if url else "  (job end to end: imposta TEST_DATABASE_URL)"))
+    print(f"{'durata':>8}  {'WAV in':>9}  {'stream':>10}  {'job':>10}  {'job prima':>10}  "
+          f"{'in memoria':>11}  {'realtime':>9}")
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_render_") as td:
+            for secondi in durate:
+                src = os.path.join(td, f"in_{int(secondi)}.wav")
+                scrivi_wav_sintetico(src, secondi)
+                outs = {f: os.path.join(td, f"out.{f}") for f in formati}
+
+                picco_stream, secs = _picco(lambda: render_stream(
+                    src, src, outs, EQ_DX, EQ_SX, PRESET, seed=0))
+
+                job = job_prima = "-"
+                if conn is not None:
+                    job = f"{_picco(lambda: _job(conn, eq_id, src, formati, False))[0]:.1f}MB"
+                    job_prima = f"{_picco(lambda: _job(conn, eq_id, src, formati, True))[0]:.1f}MB"
+
+                def _in_memoria():
+                    with open(src, "rb") as fh:
+                        dati = fh.read()
+                    render_full(dati, src, EQ_DX, EQ_SX, PRESET, out_formats=tuple(formati), seed=0)
+
+                picco_mem, _ = _picco(_in_memoria)
+                print(f"{secondi:>7.0f}s  {os.path.getsize(src) / 1e6:>7.1f}MB  "
+                      f"{picco_stream:>8.1f}MB  {job:>10}  {job_prima:>10}  "
+                      f"{picco_mem:>9.1f}MB  {secondi / secs:>8.1f}x")
+                os.remove(src)
+    finally:
+        if conn is not None:
+            try: conn.rollback()
+            except Exception: pass
+            cur = conn.cursor()
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            conn.commit()
+            conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
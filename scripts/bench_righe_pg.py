@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/bench_righe_pg.py
+
+Benchmark delle righe restituite da _PgCursor (modules/app_core._RowCI) su
+un result set grande (default 50 000 righe x 12 colonne, nomi con
+maiuscole come le tabelle legacy), confrontando:
+  - prima:  cursore DictCursor + _RowCI(dict(riga), list(riga)) per riga
+            (DictRow, un dict e una lista per riga, lookup case-insensitive
+            con lower()/upper() a ogni accesso);
+  - dopo:   cursore semplice + _RowCI(tupla, nomi, _column_index(nomi))
+            (la tupla di psycopg2 e il dict delle colonne per riga, indice
+            dei nomi condiviso da tutto il result set);
+  - tuple:  riferimento, fetchall() senza wrapper.
+
+Misura i secondi di fetch + wrapper (migliore di RIPETIZIONI), il picco di
+memoria Python (tracemalloc) e il tempo di un accesso per nome per riga
+(row["Cognome"]). Il "prima" non trova row["cognome"] su una colonna
+"Cognome" (prova solo lower()/upper() della chiave), il "dopo" sì.
+
+Uso:
+    TEST_DATABASE_URL=postgresql://... python scripts/bench_righe_pg.py
+    TEST_DATABASE_URL=... RIGHE=200000 RIPETIZIONI=5 python scripts/bench_righe_pg.py
+
+Exit code: 0 ok, 2 configurazione mancante.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_SQL = """
+SELECT g AS id, 'Rossi' || g AS "Cognome", 'Mario' AS "Nome", DATE '2015-01-01' + g %% 3000 AS "Data_Nascita",
+       'M' AS "Sesso", '081' || g AS "Telefono", 'm' || g || '@x.it' AS "Email", 'Via Roma ' || g AS "Indirizzo",
+       '84016' AS "CAP", 'Pagani' AS "Citta", 'SA' AS "Provincia", g %% 2 = 0 AS attivo
+FROM generate_series(1, %s) AS g
+"""
+
+
+class _RowCIPrima(dict):
+    """_RowCI com'era prima dell'indice condiviso (riferimento del confronto)."""
+
+    def __init__(self, mapping, seq=None):
+        super().__init__(mapping or {})
+        if seq is None:
+            seq = list((mapping or {}).values())
+        self._seq = list(seq)
+
+    def __iter__(self):
+        return iter(self._seq)
+
+    def __len__(self):
+        return len(self._seq)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return self._seq[key]
+        if isinstance(key, str):
+            if dict.__contains__(self, key):
+                return dict.__getitem__(self, key)
+            lk = key.lower()
+            if dict.__contains__(self, lk):
+                return dict.__getitem__(self, lk)
+            uk = key.upper()
+            if dict.__contains__(self, uk):
+                return dict.__getitem__(self, uk)
+        return dict.__getitem__(self, key)
+
+
+def _misura(fn, ripetizioni: int) -> tuple[float, float, list]:
+    """(secondi migliori, picco MB, righe dell'ultima esecuzione)."""
+    best = float("inf")
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        righe = fn()
+        best = min(best, time.perf_counter() - t0)
+        del righe
+    tracemalloc.start()
+    righe = fn()
+    _cur, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / 1e6, righe
+
+
+def main() -> int:
+    url = (os.getenv("TEST_DATABASE_URL") or "").strip()
+    if not url:
+        print("Imposta TEST_DATABASE_URL (database di test).")
+        return 2
+    n = int(os.getenv("RIGHE", "50000"))
+    ripetizioni = int(os.getenv("RIPETIZIONI", "3"))
+
+    import psycopg2
+    import psycopg2.extras
+
+    from modules.app_core import _RowCI, _column_index
+
+    conn = psycopg2.connect(url, connect_timeout=15)
+
+    def prima():
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(_SQL, (n,))
+        out = [_RowCIPrima(dict(r), list(r)) for r in cur.fetchall()]
+        cur.close()
+        return out
+
+    def dopo():
+        cur = conn.cursor()
+        cur.execute(_SQL, (n,))
+        names = tuple(d[0] for d in cur.description)
+        idx = _column_index(names)
+        out = [_RowCI(r, names, idx) for r in cur.fetchall()]
+        cur.close()
+        return out
+
+    def tuple_():
+        cur = conn.cursor()
+        cur.execute(_SQL, (n,))
+        out = cur.fetchall()
+        cur.close()
+        return out
+
+    print(f"{n} righe x 12 colonne, migliore di {ripetizioni}")
+    print(f"{'':>8}  {'fetch+wrap':>10}  {'picco':>9}  {'accesso':>9}")
+    try:
+        for nome, fn in (("prima", prima), ("dopo", dopo), ("tuple", tuple_)):
+            secs, mb, righe = _misura(fn, ripetizioni)
+            accesso = "-"
+            if nome != "tuple":
+                t0 = time.perf_counter()
+                for r in righe:
+                    r["Cognome"]
+                accesso = f"{(time.perf_counter() - t0) * 1e3:.1f}ms"
+            print(f"{nome:>8}  {secs:>9.3f}s  {mb:>7.1f}MB  {accesso:>9}")
+            del righe
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
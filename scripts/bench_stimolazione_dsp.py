@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/bench_stimolazione_dsp.py
+
+Benchmark del motore DSP della stimolazione uditiva
+(modules/stimolazione_uditiva): per ogni preset di fabbrica (SOFT, STANDARD,
+FORTE+) esegue render_full su un brano SINTETICO stereo (rumore rosa a
+-12 dBFS di picco, 44.1 kHz) con un EQ a 8 bande diverso per lato, e stampa:
+
+  - secondi di render e fattore realtime (durata audio / tempo di calcolo);
+  - lo scarto massimo RELATIVO (al picco del riferimento) fra la cascata EQ
+    vettoriale (SosCascade) e il loop per campione storico, su un estratto
+    di 5 s con l'EQ a 0, +3 e +12 dB, confrontato con SOS_TOLERANCE;
+  - i secondi della cascata senza scipy (SosCascade._process_loop, il
+    fallback) contro il loop storico per biquad, sullo stesso estratto;
+  - il costo del solo gating (calendario eventi + inviluppo) sull'intero brano.
+
+Non tocca il database.
+
+Uso:
+    python scripts/bench_stimolazione_dsp.py            # 60 s di audio
+    DURATA_S=600 python scripts/bench_stimolazione_dsp.py
+"""
+from __future__ import annotations
+
+import io
+import os
+import sys
+import time
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from modules.stimolazione_uditiva.audio_dsp import (
+    SOS_TOLERANCE, SosCascade, biquad_bandpass,
+)
+from modules.stimolazione_uditiva.db_jobs import TOMATIS_PRESETS_DEFAULT
+from modules.stimolazione_uditiva.gate_schedule import build_gate_schedule
+from modules.stimolazione_uditiva.render_final import _build_eq_filters, render_full
+
+FS = 44100
+EQ_SX = {125: -5.0, 250: -3.0, 500: 1.5, 1000: 2.0, 2000: 4.0, 4000: 6.0, 6000: 8.0, 8000: 6.0}
+EQ_DX = {125: -4.0, 250: -2.0, 500: 0.5, 1000: 3.0, 2000: 5.0, 4000: 7.0, 6000: 6.0, 8000: 4.0}
+
+
+def brano_sintetico(secondi: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n = int(secondi * FS)
+    # rumore rosa: spettro del rumore bianco pesato 1/sqrt(f)
+    spettro = np.fft.rfft(rng.standard_normal((n, 2)), axis=0)
+    f = np.fft.rfftfreq(n, 1.0 / FS)
+    spettro[1:] /= np.sqrt(f[1:, None])
+    spettro[0] = 0.0
+    rosa = np.fft.irfft(spettro, n=n, axis=0)
+    rosa /= np.max(np.abs(rosa)) or 1.0
+    return (rosa * 10 ** (-12 / 20)).astype(np.float32)
+
+
+def wav16(x: np.ndarray) -> bytes:
+    bio = io.BytesIO()
+    with wave.open(bio, "wb") as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(FS)
+        wf.writeframes((np.clip(x, -1, 1) * 32767).astype("<i2").tobytes())
+    return bio.getvalue()
+
+
+def _filtri(eq: dict, extra_db: float = 0.0) -> list:
+    return (_build_eq_filters(FS, {f: g + extra_db for f, g in eq.items()})
+            + [biquad_bandpass(FS, 1000.0, 2.8)])
+
+
+def scarto_vs_loop(x: np.ndarray, extra_db: float = 0.0) -> float:
+    """Max |vettoriale - loop per campione| / max |loop| sulla cascata EQ
+    (+extra_db su ogni banda) + passabanda, a blocchi da 2048."""
+    casc = SosCascade.from_biquads(_filtri(EQ_SX, extra_db))
+    rif = _filtri(EQ_SX, extra_db)
+    scarto = picco = 0.0
+    for i in range(0, x.shape[0], 2048):
+        blk = x[i:i + 2048, 0]
+        y_vec = casc.process(blk)
+        y_rif = blk
+        for f in rif:
+            y_rif = f._process_loop(y_rif)
+        scarto = max(scarto, float(np.max(np.abs(y_vec - y_rif))))
+        picco = max(picco, float(np.max(np.abs(y_rif))))
+    return scarto / (picco or 1.0)
+
+
+def tempi_fallback(x: np.ndarray) -> tuple[float, float]:
+    """(secondi loop storico per biquad, secondi cascata senza scipy) su x
+    stereo, a blocchi da 16384 frame come render_stream."""
+    t0 = time.perf_counter()
+    for ch, eq in ((0, EQ_SX), (1, EQ_DX)):
+        rif = _filtri(eq)
+        for i in range(0, x.shape[0], 16384):
+            y = x[i:i + 16384, ch]
+            for f in rif:
+                y = f._process_loop(y)
+    t_loop = time.perf_counter() - t0
+    casc = SosCascade.from_biquads(_filtri(EQ_SX), channels=2)
+    t0 = time.perf_counter()
+    for i in range(0, x.shape[0], 16384):
+        casc._process_loop(x[i:i + 16384].astype(np.float64))
+    return t_loop, time.perf_counter() - t0
+
+
+def main() -> int:
+    durata = float(os.environ.get("DURATA_S", "60"))
+    x = brano_sintetico(durata)
+    dati = wav16(x)
+
+    estratto = x[: 5 * FS] * 4.0   # portato a 0 dBFS di picco
+    err = 0.0
+    for extra in (0.0, 3.0, 12.0):
+        e = scarto_vs_loop(estratto, extra)
+        err = max(err, e)
+        esito = "OK" if e <= SOS_TOLERANCE else "FUORI TOLLERANZA"
+        print(f"Scarto relativo cascata vs loop, EQ {extra:+.0f} dB: {e:.2e} "
+              f"(tolleranza {SOS_TOLERANCE:.0e}) {esito}")
+    t_loop, t_fb = tempi_fallback(estratto)
+    print(f"Cascata senza scipy: {t_fb:.2f}s, loop storico per biquad: {t_loop:.2f}s (5 s stereo)")
+    print(f"Brano: {durata:.0f} s stereo {FS} Hz")
+    print(f"{'preset':>10}  {'eventi':>7}  {'gating':>9}  {'render':>9}  {'realtime':>9}")
+    for nome, params in TOMATIS_PRESETS_DEFAULT:
+        t0 = time.perf_counter()
+        sched = build_gate_schedule(params, x.shape[0], FS, seed=0)
+        sched.envelope()
+        gate = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        render_full(dati, "bench.wav", EQ_DX, EQ_SX, params, out_formats=("wav",), seed=0)
+        secs = time.perf_counter() - t0
+        print(f"{nome:>10}  {len(sched):>7}  {gate * 1000:>7.1f}ms  {secs:>8.2f}s  {durata / secs:>8.1f}x")
+    return 0 if err <= SOS_TOLERANCE else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
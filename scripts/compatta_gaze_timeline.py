@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/compatta_gaze_timeline.py
+
+Converte le sessioni webcam salvate prima della timeline compressa
+(gaze_browser_sessions con timeline in timeline_json e di nuovo in
+payload_json) nel formato a colonne di timeline_blob
+(modules/gaze_tracking/db_gaze_tracking.compact_browser_gaze_timelines).
+Le nuove sessioni sono già salvate così; le vecchie restano leggibili anche
+senza conversione, ma ogni apertura trasferisce il JSONB intero.
+
+Aggiunge prima le colonne timeline_blob/timeline_n se mancano
+(init_gaze_tracking_db, idempotente). Commit a lotti: si può interrompere e
+rilanciare, riparte dalle righe non ancora convertite. Lo spazio nel
+database torna disponibile dopo VACUUM.
+
+Le credenziali vengono lette da .streamlit/secrets.toml o da DATABASE_URL
+(che ha la precedenza). STUDIO (default 1) imposta app.current_studio per
+la RLS, come fa l'app.
+
+Uso:
+    DRY_RUN=1 python scripts/compatta_gaze_timeline.py   # conta righe e MB, non scrive
+    python scripts/compatta_gaze_timeline.py [--lotto 200]
+
+Exit code:
+    0  -> ok
+    1  -> errore durante la conversione
+    2  -> errore di configurazione / connessione DB
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SECRETS_PATH = os.path.join(ROOT, ".streamlit", "secrets.toml")
+
+logger = logging.getLogger("compatta_gaze_timeline")
+
+
+def _load_secrets_toml() -> dict:
+    if not os.path.exists(SECRETS_PATH):
+        return {}
+    try:
+        import tomllib
+        with open(SECRETS_PATH, "rb") as f:
+            return tomllib.load(f)
+    except Exception as e:
+        logger.warning("ATTENZIONE: lettura secrets.toml non riuscita: %s", e)
+        return {}
+
+
+def _database_url(secrets: dict) -> str:
+    env = (os.getenv("DATABASE_URL") or "").strip()
+    if env:
+        return env
+    db = secrets.get("db", {})
+    if isinstance(db, dict):
+        for k in ("DATABASE_URL", "database_url", "url", "URL"):
+            v = db.get(k)
+            if v:
+                return str(v).strip().strip('"').strip("'")
+    for k in ("DATABASE_URL", "database_url"):
+        v = secrets.get(k)
+        if v:
+            return str(v).strip().strip('"').strip("'")
+    return ""
+
+
+def da_convertire(conn) -> tuple[int, int]:
+    """(righe, byte JSONB) delle sessioni con la timeline non ancora compressa."""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT count(*), COALESCE(sum(COALESCE(pg_column_size(timeline_json), 0) "
+        "+ COALESCE(pg_column_size(payload_json), 0)), 0) "
+        "FROM gaze_browser_sessions WHERE timeline_blob IS NULL"
+    )
+    n, byte = cur.fetchone()
+    conn.commit()
+    cur.close()
+    return int(n), int(byte)
+
+
+def main(argv: list[str]) -> int:
+    ap = argparse.ArgumentParser(description="Timeline gaze JSONB -> timeline_blob")
+    ap.add_argument("--lotto", type=int, default=200, help="righe per commit")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    dry_run = os.getenv("DRY_RUN", "").strip().lower() in ("1", "true", "yes", "y")
+
+    url = _database_url(_load_secrets_toml())
+    if not url:
+        logger.error("ERRORE: DATABASE_URL non trovato (env o [db].DATABASE_URL nei secrets).")
+        return 2
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+
+    import psycopg2
+    from modules.gaze_tracking.db_gaze_tracking import (
+        compact_browser_gaze_timelines, init_gaze_tracking_db,
+    )
+    try:
+        conn = psycopg2.connect(url, connect_timeout=15)
+        cur = conn.cursor()
+        cur.execute("SELECT set_config('app.current_studio', %s, false)", (os.getenv("STUDIO", "1"),))
+        conn.commit()
+        init_gaze_tracking_db(conn)
+    except Exception as e:
+        logger.error("ERRORE connessione DB / schema: %s", e)
+        return 2
+
+    t0 = time.perf_counter()
+    try:
+        n, byte = da_convertire(conn)
+        if dry_run:
+            logger.info("%d sessioni da convertire (%.1f MB di JSONB) (DRY RUN)", n, byte / 1e6)
+            return 0
+        fatte = compact_browser_gaze_timelines(conn, batch=max(1, args.lotto))
+    except Exception as e:
+        logger.error("ERRORE conversione: %s: %s", type(e).__name__, e)
+        return 1
+    finally:
+        conn.close()
+    logger.info("%d sessioni convertite (%.1f MB di JSONB prima) in %.1f s",
+                fatte, byte / 1e6, time.perf_counter() - t0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
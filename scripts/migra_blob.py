@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/migra_blob.py
+
+Sposta i payload binari in linea (BYTEA) nel blob store content-addressed
+(modules/blob_store) e lascia nella stessa colonna il riferimento corto
+b"blobref:v1:sha256:<hex>:<byte>". Colonne gestite: vedi COLONNE.
+
+Per ogni riga: legge il valore, lo carica nel blob store (dedup per sha256:
+file già presenti non si ricaricano), verifica che l'oggetto esista e poi
+aggiorna la riga SOLO se il contenuto non è cambiato nel frattempo (md5 di
+controllo). Commit riga per riga: si può interrompere e rilanciare, riparte
+da dove era rimasto. Lo spazio nel database torna disponibile dopo VACUUM
+(al sistema operativo solo con VACUUM FULL).
+
+IMPORTANTE: migrare solo quando la versione dell'app che risolve i
+riferimenti (blob_store.risolvi) è già in produzione e punta allo stesso
+blob store.
+
+Le credenziali (DB + [storage]) vengono lette da .streamlit/secrets.toml o
+dalle variabili d'ambiente (DATABASE_URL, BLOB_STORE, BLOB_STORE_DIR, S3_*),
+che hanno la precedenza. STUDIO (default 1) imposta app.current_studio per
+la RLS, come fa l'app.
+
+Uso:
+    python scripts/migra_blob.py                     # migra tutte le colonne
+    DRY_RUN=1 python scripts/migra_blob.py           # conta righe e byte, non scrive
+    python scripts/migra_blob.py --tabella documenti_clinici --limite 100
+    python scripts/migra_blob.py verifica [--profonda]   # riferimenti -> oggetti presenti (e sha256)
+    python scripts/migra_blob.py ripristina          # riporta i bytes in linea
+    DRY_RUN=1 python scripts/migra_blob.py pulisci   # blob non più referenziati
+    python scripts/migra_blob.py pulisci [--eta-minima-ore 24]   # ... e li cancella
+
+pulisci: cancellare una riga (documento, foto, consenso) non cancella il suo
+blob, che può servire anche ad altre righe. pulisci raccoglie i riferimenti
+di tutte le colonne di COLONNE e di RIFERIMENTI (tutti gli studi: serve un
+ruolo che non sia soggetto alla RLS, altrimenti si ferma), elenca il blob
+store e cancella i blob non referenziati più vecchi di --eta-minima-ore
+(un upload appena fatto può non avere ancora la sua riga). Prima di
+cancellare rilegge i riferimenti e, blob per blob, l'ora dell'ultima
+scrittura (un upload che trova il blob già presente la rinfresca): un blob
+tornato in uso nel frattempo resta. Meglio lanciarlo in un momento di poco
+traffico.
+
+Exit code:
+    0  -> ok
+    1  -> righe non migrate / riferimenti rotti
+    2  -> errore di configurazione / connessione DB
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from modules.blob_store import (
+    _CHIAVI_ENV, _RIF_MAX, RIF_PREFISSO, blob_store_da_config, leggi_riferimento, riferimento, risolvi,
+)
+
+SECRETS_PATH = os.path.join(ROOT, ".streamlit", "secrets.toml")
+
+# (tabella, chiave primaria, colonna BYTEA): solo colonne i cui lettori
+# passano da blob_store.risolvi
+COLONNE = (
+    ("documenti_clinici", "id", "dati"),
+    ("documenti_clinici", "id", "anteprima"),
+    ("photoref_captures", "id", "image_bytes"),
+    ("photoref_captures", "id", "annotated_image_bytes"),
+    ("photoref_captures", "id", "image_preview"),
+    ("photoref_captures", "id", "annotated_preview"),
+    ("consensi_privacy", "id", "firma_blob"),
+    ("consensi_privacy", "id", "pdf_blob"),
+    ("documenti", "id", "blob"),
+    ("professionisti_timbri", "username", "timbro_png"),
+)
+
+# colonne BYTEA che contengono riferimenti scritti direttamente dai moduli
+# (non migrate da questo script): contano per pulisci
+RIFERIMENTI = (
+    ("render_job_files", "data"),
+)
+
+_LOTTO = 200
+
+logger = logging.getLogger("migra_blob")
+
+
+def _load_secrets_toml() -> dict:
+    if not os.path.exists(SECRETS_PATH):
+        return {}
+    try:
+        import tomllib
+        with open(SECRETS_PATH, "rb") as f:
+            return tomllib.load(f)
+    except Exception as e:
+        logger.warning("ATTENZIONE: lettura secrets.toml non riuscita: %s", e)
+        return {}
+
+
+def _database_url(secrets: dict) -> str:
+    env = (os.getenv("DATABASE_URL") or "").strip()
+    if env:
+        return env
+    db = secrets.get("db", {})
+    if isinstance(db, dict):
+        for k in ("DATABASE_URL", "database_url", "url", "URL"):
+            v = db.get(k)
+            if v:
+                return str(v).strip().strip('"').strip("'")
+    for k in ("DATABASE_URL", "database_url"):
+        v = secrets.get(k)
+        if v:
+            return str(v).strip().strip('"').strip("'")
+    return ""
+
+
+def _storage_cfg(secrets: dict) -> dict:
+    cfg = dict(secrets.get("storage", {}) or {})
+    for k in _CHIAVI_ENV:
+        if os.getenv(k):
+            cfg[k] = os.getenv(k)
+    return cfg
+
+
+def _esiste(cur, tabella: str, colonna: str) -> bool:
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = ANY (current_schemas(false)) AND table_name=%s AND column_name=%s",
+        (tabella, colonna),
+    )
+    return cur.fetchone() is not None
+
+
+def _chiavi(cur, tabella, chiave, colonna, riferimenti: bool, dopo, n: int):
+    """Lotto di (chiave, byte) in ordine di chiave; riferimenti=True per le
+    righe già migrate, False per quelle ancora in linea."""
+    cond = "=" if riferimenti else "<>"
+    sql = (f"SELECT {chiave}, octet_length({colonna}) FROM {tabella} "
+           f"WHERE {colonna} IS NOT NULL AND octet_length({colonna}) > 0 "
+           f"AND substring({colonna} from 1 for %s) {cond} %s")
+    params = [len(RIF_PREFISSO), RIF_PREFISSO]
+    if dopo is not None:
+        sql += f" AND {chiave} > %s"
+        params.append(dopo)
+    sql += f" ORDER BY {chiave} LIMIT %s"
+    params.append(n)
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def migra_colonna(conn, store, tabella, chiave, colonna, dry_run: bool, limite: int) -> dict:
+    cur = conn.cursor()
+    st = {"righe": 0, "byte": 0, "gia_presenti": 0, "saltate": 0}
+    dopo = None
+    while not limite or st["righe"] < limite:
+        lotto = _chiavi(cur, tabella, chiave, colonna, False, dopo, _LOTTO)
+        conn.commit()
+        if not lotto:
+            break
+        for k, n in lotto:
+            dopo = k
+            if limite and st["righe"] >= limite:
+                break
+            if dry_run:
+                st["righe"] += 1
+                st["byte"] += int(n)
+                continue
+            cur.execute(f"SELECT {colonna} FROM {tabella} WHERE {chiave}=%s", (k,))
+            r = cur.fetchone()
+            conn.commit()
+            if r is None or r[0] is None:
+                continue
+            dati = bytes(r[0])
+            sha = hashlib.sha256(dati).hexdigest()
+            if store.exists(sha):
+                st["gia_presenti"] += 1
+            else:
+                store.put_bytes(dati)
+                if not store.exists(sha):
+                    raise RuntimeError(f"{tabella}.{colonna} {chiave}={k}: oggetto assente dopo l'upload")
+            cur.execute(
+                f"UPDATE {tabella} SET {colonna}=%s WHERE {chiave}=%s AND md5({colonna})=%s",
+                (riferimento(sha, len(dati)), k, hashlib.md5(dati).hexdigest()),
+            )
+            if cur.rowcount == 1:
+                st["righe"] += 1
+                st["byte"] += len(dati)
+            else:
+                st["saltate"] += 1   # riga cambiata o cancellata nel frattempo
+            conn.commit()
+    cur.close()
+    return st
+
+
+def verifica_colonna(conn, store, tabella, chiave, colonna, profonda: bool) -> dict:
+    cur = conn.cursor()
+    st = {"riferimenti": 0, "rotti": 0, "in_linea": 0}
+    dopo = None
+    while True:
+        lotto = _chiavi(cur, tabella, chiave, colonna, True, dopo, _LOTTO)
+        if not lotto:
+            break
+        dopo = lotto[-1][0]
+        for k, _n in lotto:
+            cur.execute(f"SELECT {colonna} FROM {tabella} WHERE {chiave}=%s", (k,))
+            rif = leggi_riferimento(bytes(cur.fetchone()[0]))
+            st["riferimenti"] += 1
+            try:
+                ok = rif is not None and store.exists(rif[0])
+                if ok and profonda:
+                    ok = len(store.get_bytes(rif[0])) == rif[1]
+            except Exception:
+                ok = False
+            if not ok:
+                st["rotti"] += 1
+                logger.warning("  ROTTO %s.%s %s=%s", tabella, colonna, chiave, k)
+    cur.execute(
+        f"SELECT count(*) FROM {tabella} WHERE {colonna} IS NOT NULL AND octet_length({colonna}) > 0 "
+        f"AND substring({colonna} from 1 for %s) <> %s",
+        (len(RIF_PREFISSO), RIF_PREFISSO),
+    )
+    st["in_linea"] = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return st
+
+
+def ripristina_colonna(conn, store, tabella, chiave, colonna, limite: int) -> dict:
+    cur = conn.cursor()
+    st = {"righe": 0, "byte": 0}
+    while not limite or st["righe"] < limite:
+        lotto = _chiavi(cur, tabella, chiave, colonna, True, None, _LOTTO)
+        conn.commit()
+        if not lotto:
+            break
+        fatte = 0
+        for k, _n in lotto:
+            if limite and st["righe"] >= limite:
+                break
+            cur.execute(f"SELECT {colonna} FROM {tabella} WHERE {chiave}=%s", (k,))
+            rif = bytes(cur.fetchone()[0])
+            dati = risolvi(rif, store)
+            cur.execute(f"UPDATE {tabella} SET {colonna}=%s WHERE {chiave}=%s AND {colonna}=%s",
+                        (dati, k, rif))
+            conn.commit()
+            if cur.rowcount == 1:
+                st["righe"] += 1
+                st["byte"] += len(dati)
+                fatte += 1
+        if not fatte:
+            break
+    cur.close()
+    return st
+
+
+def _sha_referenziati(conn) -> set:
+    """sha256 di tutti i riferimenti presenti nelle colonne note."""
+    cur = conn.cursor()
+    colonne = [(t, c) for t, _k, c in COLONNE] + list(RIFERIMENTI)
+    sha = set()
+    for tabella, colonna in dict.fromkeys(colonne):
+        if not _esiste(cur, tabella, colonna):
+            continue
+        cur.execute(
+            f"SELECT substring({colonna} from 1 for %s) FROM {tabella} "
+            f"WHERE substring({colonna} from 1 for %s) = %s",
+            (_RIF_MAX, len(RIF_PREFISSO), RIF_PREFISSO),
+        )
+        for (v,) in cur.fetchall():
+            rif = leggi_riferimento(bytes(v))
+            if rif is not None:
+                sha.add(rif[0])
+    conn.commit()
+    cur.close()
+    return sha
+
+
+def _vede_tutto(conn) -> bool:
+    """True se la connessione vede le righe di tutti gli studi: superuser o
+    BYPASSRLS, oppure nessuna RLS attiva sulle tabelle con riferimenti."""
+    cur = conn.cursor()
+    cur.execute("SELECT rolsuper OR rolbypassrls FROM pg_roles WHERE rolname = current_user")
+    r = cur.fetchone()
+    ok = bool(r and r[0])
+    if not ok:
+        tabelle = sorted({t for t, _k, _c in COLONNE} | {t for t, _c in RIFERIMENTI})
+        cur.execute("SELECT count(*) FROM pg_class WHERE relrowsecurity "
+                    "AND relname = ANY(%s) AND pg_table_is_visible(oid)", (tabelle,))
+        ok = cur.fetchone()[0] == 0
+    conn.commit()
+    cur.close()
+    return ok
+
+
+def pulisci(conn, store, dry_run: bool, eta_minima_ore: float) -> dict:
+    """Cancella i blob non referenziati più vecchi di eta_minima_ore."""
+    st = {"blob": 0, "referenziati": 0, "recenti": 0, "orfani": 0, "byte": 0, "tornati": 0}
+    usati = _sha_referenziati(conn)
+    limite = time.time() - eta_minima_ore * 3600
+    orfani = []
+    for sha, n, quando in store.iter_blobs():
+        st["blob"] += 1
+        if sha in usati:
+            st["referenziati"] += 1
+        elif quando > limite:
+            st["recenti"] += 1
+        else:
+            orfani.append((sha, n))
+    if orfani and not dry_run:
+        # riferimenti riletti: righe scritte durante l'elenco del blob store
+        usati = _sha_referenziati(conn)
+    for sha, n in orfani:
+        if sha in usati:
+            st["tornati"] += 1
+            continue
+        # l'età letta nell'elenco può essere vecchia: delete la ricontrolla
+        if not dry_run and not store.delete(sha, prima_di=limite):
+            st["tornati"] += 1
+            continue
+        st["orfani"] += 1
+        st["byte"] += n
+    return st
+
+
+def main(argv: list[str]) -> int:
+    ap = argparse.ArgumentParser(description="Migrazione BYTEA -> blob store")
+    ap.add_argument("azione", nargs="?", default="migra",
+                    choices=("migra", "verifica", "ripristina", "pulisci"))
+    ap.add_argument("--tabella", help="solo questa tabella")
+    ap.add_argument("--limite", type=int, default=0, help="massimo righe per colonna (0 = tutte)")
+    ap.add_argument("--profonda", action="store_true", help="verifica: rilegge e controlla sha256")
+    ap.add_argument("--eta-minima-ore", type=float, default=24.0,
+                    help="pulisci: non cancella blob scritti da meno di queste ore")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.azione == "pulisci" and args.tabella:
+        logger.error("ERRORE: pulisci lavora su tutte le colonne, --tabella non è ammesso.")
+        return 2
+    dry_run = os.getenv("DRY_RUN", "").strip().lower() in ("1", "true", "yes", "y")
+
+    secrets = _load_secrets_toml()
+    url = _database_url(secrets)
+    if not url:
+        logger.error("ERRORE: DATABASE_URL non trovato (env o [db].DATABASE_URL nei secrets).")
+        return 2
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    try:
+        store = blob_store_da_config(_storage_cfg(secrets))
+    except Exception as e:
+        logger.error("ERRORE configurazione blob store: %s", e)
+        return 2
+    if store is None:
+        logger.error("ERRORE: blob store non configurato (BLOB_STORE=fs|s3).")
+        return 2
+
+    import psycopg2
+    try:
+        conn = psycopg2.connect(url, connect_timeout=15)
+        cur = conn.cursor()
+        cur.execute("SELECT set_config('app.current_studio', %s, false)", (os.getenv("STUDIO", "1"),))
+        conn.commit()
+    except Exception as e:
+        logger.error("ERRORE connessione DB: %s", e)
+        return 2
+
+    logger.info("blob store: %s · azione: %s%s", store.nome, args.azione,
+                " (DRY RUN)" if dry_run else "")
+    esito = 0
+    t0 = time.perf_counter()
+    if args.azione == "pulisci":
+        if not _vede_tutto(conn):
+            logger.error("ERRORE: il ruolo è soggetto alla RLS e non vede i riferimenti di "
+                         "tutti gli studi; pulisci va lanciato con un ruolo BYPASSRLS.")
+            conn.close()
+            return 2
+        try:
+            st = pulisci(conn, store, dry_run, args.eta_minima_ore)
+        except Exception as e:
+            try: conn.rollback()
+            except Exception: pass
+            logger.error("ERRORE pulisci: %s: %s", type(e).__name__, e)
+            conn.close()
+            return 1
+        conn.close()
+        verbo = "da cancellare" if dry_run else "cancellati"
+        logger.info("%d blob: %d referenziati, %d recenti (< %g h), %d non referenziati %s "
+                    "(%.1f MB)%s", st["blob"], st["referenziati"], st["recenti"],
+                    args.eta_minima_ore, st["orfani"], verbo, st["byte"] / 1e6,
+                    f", {st['tornati']} tornati in uso" if st["tornati"] else "")
+        logger.info("fatto in %.1f s", time.perf_counter() - t0)
+        return 0
+    for tabella, chiave, colonna in COLONNE:
+        if args.tabella and tabella != args.tabella:
+            continue
+        if not _esiste(cur, tabella, colonna):
+            conn.commit()
+            logger.info("%s.%s: assente, salto", tabella, colonna)
+            continue
+        conn.commit()
+        nome = f"{tabella}.{colonna}"
+        try:
+            if args.azione == "migra":
+                st = migra_colonna(conn, store, tabella, chiave, colonna, dry_run, args.limite)
+                verbo = "da migrare" if dry_run else "migrate"
+                logger.info(f"{nome}: {st['righe']} righe {verbo}, {st['byte'] / 1e6:.1f} MB"
+                            + (f", {st['gia_presenti']} già nel blob store" if st["gia_presenti"] else "")
+                            + (f", {st['saltate']} cambiate durante la migrazione" if st["saltate"] else ""))
+                if st["saltate"]:
+                    esito = 1
+            elif args.azione == "verifica":
+                st = verifica_colonna(conn, store, tabella, chiave, colonna, args.profonda)
+                logger.info(f"{nome}: {st['riferimenti']} riferimenti, {st['rotti']} rotti, "
+                            f"{st['in_linea']} ancora in linea")
+                if st["rotti"]:
+                    esito = 1
+            else:
+                st = ripristina_colonna(conn, store, tabella, chiave, colonna, args.limite)
+                logger.info(f"{nome}: {st['righe']} righe riportate in linea, {st['byte'] / 1e6:.1f} MB")
+        except Exception as e:
+            try: conn.rollback()
+            except Exception: pass
+            logger.error("ERRORE %s: %s: %s", nome, type(e).__name__, e)
+            esito = 1
+    conn.close()
+    logger.info("fatto in %.1f s", time.perf_counter() - t0)
+    if args.azione == "migra" and not dry_run:
+        logger.info("Per restituire lo spazio: VACUUM (ANALYZE) sulle tabelle migrate "
+                    "(VACUUM FULL per liberarlo anche sul disco).")
+    return esito
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scripts/render_worker.py
+
+Worker AUTONOMO della coda render_jobs (stimolazione uditiva).
+La UI crea i JOB (status queued) e torna subito libera; questo processo li
+prende con SELECT ... FOR UPDATE SKIP LOCKED, li renderizza in streaming (render_stream),
+aggiorna render_jobs.progress mentre lavora e salva gli output in
+render_job_files, da cui la UI li offre in download.
+
+N worker in parallelo (anche su macchine diverse) non prendono mai lo stesso
+job. All'avvio i job rimasti running senza heartbeat (worker morto) tornano
+in coda.
+
+Le credenziali vengono lette da .streamlit/secrets.toml ([db] DATABASE_URL),
+come gli altri script, oppure dalla variabile d'ambiente DATABASE_URL.
+
+Uso:
+    python scripts/render_worker.py                 # 1 worker, resta in ascolto
+    python scripts/render_worker.py --workers 4     # 4 processi paralleli
+    python scripts/render_worker.py --once          # svuota la coda ed esce
+    STIMOLAZIONE_INPUT_DIR=/srv/dropbox python scripts/render_worker.py
+    STIMOLAZIONE_CACHE_DIR=/srv/render_cache STIMOLAZIONE_CACHE_MB=8192 python scripts/render_worker.py
+
+Exit code:
+    0  -> ok
+    1  -> almeno un job è finito in errore (solo con --once)
+    2  -> errore di configurazione / connessione DB
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import signal
+import socket
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SECRETS_PATH = os.path.join(ROOT, ".streamlit", "secrets.toml")
+
+
+def _load_secrets_toml() -> dict:
+    try:
+        import tomllib  # stdlib da Python 3.11
+    except Exception:
+        return {}
+    if not os.path.exists(SECRETS_PATH):
+        return {}
+    try:
+        with open(SECRETS_PATH, "rb") as f:
+            return tomllib.load(f)
+    except Exception as e:
+        print(f"ERRORE lettura secrets.toml: {e}", flush=True)
+        return {}
+
+
+def _database_url(secrets: dict) -> str:
+    db = secrets.get("db", {}) if isinstance(secrets, dict) else {}
+    if isinstance(db, dict):
+        for k in ("DATABASE_URL", "database_url", "url", "URL"):
+            v = db.get(k)
+            if v:
+                return str(v).strip().strip('"').strip("'")
+    for k in ("DATABASE_URL", "database_url"):
+        v = secrets.get(k)
+        if v:
+            return str(v).strip().strip('"').strip("'")
+    return (os.getenv("DATABASE_URL") or "").strip()
+
+
+def _connect(url: str):
+    import psycopg2
+    conn = psycopg2.connect(url, connect_timeout=15)
+    conn.autocommit = False  # db_jobs fa commit espliciti
+    return conn
+
+
+def _worker_main(url: str, name: str, once: bool, poll_s: float, q) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    stop = {"flag": False}
+
+    def _term(_sig, _frm):
+        # finisce il job in corso, poi esce
+        stop["flag"] = True
+
+    signal.signal(signal.SIGTERM, _term)
+    signal.signal(signal.SIGINT, _term)
+
+    from modules.stimolazione_uditiva.render_worker import run_worker
+    stats = run_worker(lambda: _connect(url), name, once=once, poll_s=poll_s,
+                       should_stop=lambda: stop["flag"])
+    q.put(stats)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Worker coda render_jobs")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("RENDER_WORKERS", "1")))
+    ap.add_argument("--once", action="store_true", help="svuota la coda ed esce")
+    ap.add_argument("--poll", type=float, default=5.0, help="secondi fra due controlli a coda vuota")
+    ap.add_argument("--stale-minutes", type=float, default=15.0,
+                    help="job running senza heartbeat da più di N minuti tornano in coda")
+    args = ap.parse_args()
+
+    url = _database_url(_load_secrets_toml())
+    if not url:
+        print("ERRORE: DATABASE_URL non trovato (secrets [db] DATABASE_URL o env).", flush=True)
+        return 2
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+
+    try:
+        from modules.stimolazione_uditiva.db_jobs import ensure_jobs_schema, requeue_stale_jobs
+        conn = _connect(url)
+        ensure_jobs_schema(conn)
+        n = requeue_stale_jobs(conn, stale_minutes=args.stale_minutes)
+        conn.close()
+    except Exception as e:
+        print(f"ERRORE connessione DB / schema: {e}", flush=True)
+        return 2
+    if n:
+        print(f"Rimessi in coda {n} job interrotti.", flush=True)
+
+    n_workers = max(1, int(args.workers))
+    host = socket.gethostname()
+    q: mp.Queue = mp.Queue()
+    procs = [
+        mp.Process(
+            target=_worker_main,
+            args=(url, f"{host}:{os.getpid()}/{i}", args.once, args.poll, q),
+            daemon=False,
+        )
+        for i in range(n_workers)
+    ]
+    print(f"Avvio {n_workers} worker{' (--once)' if args.once else ''}...", flush=True)
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+    done = errors = 0
+    while not q.empty():
+        s = q.get()
+        done += s.get("done", 0)
+        errors += s.get("error", 0)
+    print(f"RENDER_RESULT completati={done} errori={errors}", flush=True)
+    return 1 if (args.once and errors) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())